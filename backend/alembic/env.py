@@ -0,0 +1,75 @@
+"""
+Alembic migration environment.
+
+Migrations run synchronously over psycopg2 using core_config.DATABASE_URI; the API
+itself uses the asyncpg driver (see webservices.database.session).
+"""
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import engine_from_config
+from sqlalchemy import pool
+from webservices.core.config import core_config
+from webservices.database import Base
+from webservices.database import models  # noqa: F401 register tables on Base
+from webservices.database.frames import CAN_FRAMES_TABLE
+
+config = context.config
+config.set_main_option("sqlalchemy.url", str(core_config.DATABASE_URI))
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+
+def include_name(a_name, a_type, a_parent_names) -> bool:
+    """
+    Leave the can_frames partitions created during ingest (see
+    webservices.database.frames) out of autogenerate comparisons
+    """
+    if a_type == "table":
+        return not a_name.startswith(f"{CAN_FRAMES_TABLE}_")
+    return True
+
+
+def run_migrations_offline() -> None:
+    """
+    Emit the migration SQL without connecting to the database
+    """
+    context.configure(
+        url=config.get_main_option("sqlalchemy.url"),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        compare_type=True,
+        include_name=include_name,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    """
+    Apply the migrations over a dedicated, unpooled connection
+    """
+    l_engine = engine_from_config(
+        config.get_section(config.config_ini_section),
+        prefix="sqlalchemy.",
+        poolclass=pool.NullPool,
+    )
+    with l_engine.connect() as l_connection:
+        context.configure(
+            connection=l_connection,
+            target_metadata=target_metadata,
+            compare_type=True,
+            include_name=include_name,
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
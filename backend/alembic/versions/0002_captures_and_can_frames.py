@@ -0,0 +1,71 @@
+"""captures and partitioned can_frames
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "captures",
+        sa.Column("id", sa.BigInteger(), nullable=False),
+        sa.Column("digest", sa.String(length=64), nullable=True),
+        sa.Column("frame_count", sa.BigInteger(), server_default="0", nullable=False),
+        sa.Column("rows_per_second", sa.Float(), server_default="0", nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_captures")),
+    )
+    op.create_index(op.f("ix_captures_digest"), "captures", ["digest"], unique=False)
+    op.create_table(
+        "can_frames",
+        sa.Column("capture_id", sa.BigInteger(), nullable=False),
+        sa.Column("captured_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("interface", sa.CHAR(length=16), nullable=False),
+        sa.Column("arbitration_id", sa.Integer(), nullable=False),
+        sa.Column("is_extended", sa.Boolean(), nullable=False),
+        sa.Column("is_fd", sa.Boolean(), nullable=False),
+        sa.Column("is_remote", sa.Boolean(), nullable=False),
+        sa.Column("dlc", sa.SmallInteger(), nullable=False),
+        sa.Column("payload", sa.LargeBinary(), nullable=False),
+        postgresql_partition_by="LIST (capture_id)",
+    )
+    op.add_column(
+        "ingest_records", sa.Column("capture_id", sa.BigInteger(), nullable=True)
+    )
+    op.create_foreign_key(
+        op.f("fk_ingest_records_capture_id_captures"),
+        "ingest_records",
+        "captures",
+        ["capture_id"],
+        ["id"],
+        ondelete="SET NULL",
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint(
+        op.f("fk_ingest_records_capture_id_captures"),
+        "ingest_records",
+        type_="foreignkey",
+    )
+    op.drop_column("ingest_records", "capture_id")
+    # Also drops every capture and day partition
+    op.drop_table("can_frames")
+    op.drop_index(op.f("ix_captures_digest"), table_name="captures")
+    op.drop_table("captures")
@@ -1,6 +1,9 @@
+import gc
+import glob
 import json
 import multiprocessing
 import os
+import shutil
 
 workers_per_core_str = os.getenv("WORKERS_PER_CORE", "1")
 max_workers_str = os.getenv("MAX_WORKERS")
@@ -35,6 +38,15 @@ use_errorlog = errorlog_var or None
 graceful_timeout_str = os.getenv("GRACEFUL_TIMEOUT", "240")
 timeout_str = os.getenv("TIMEOUT", "240")
 keepalive_str = os.getenv("KEEP_ALIVE", "5")
+preload_app_str = os.getenv("PRELOAD_APP", "true")
+autoscale_str = os.getenv("AUTOSCALE", "false")
+autoscale_min_workers_str = os.getenv("AUTOSCALE_MIN_WORKERS")
+autoscale_max_workers_str = os.getenv("AUTOSCALE_MAX_WORKERS")
+autoscale_interval_str = os.getenv("AUTOSCALE_INTERVAL", "2")
+autoscale_lag_high_ms_str = os.getenv("AUTOSCALE_LAG_HIGH_MS", "50")
+autoscale_lag_low_ms_str = os.getenv("AUTOSCALE_LAG_LOW_MS", "5")
+autoscale_in_flight_high_str = os.getenv("AUTOSCALE_IN_FLIGHT_HIGH", "16")
+autoscale_scale_down_delay_str = os.getenv("AUTOSCALE_SCALE_DOWN_DELAY", "120")
 
 # Gunicorn config variables
 loglevel = use_loglevel
@@ -46,6 +58,123 @@ accesslog = use_accesslog
 graceful_timeout = int(graceful_timeout_str)
 timeout = int(timeout_str)
 keepalive = int(keepalive_str)
+# Import the app once in the master and fork the workers from it. See
+# webservices.core.worker_state
+preload_app = preload_app_str.lower() in ("1", "true", "yes")
+
+if preload_app:
+    # Python's cycle collector writes to every tracked object it visits, which would
+    # copy the pages the workers share with the master. Hold it off until the app is
+    # loaded and everything created so far is frozen out of its reach in when_ready().
+    gc.disable()
+
+# Vary the number of workers between the bounds with the load the workers report
+# through files in worker_tmp_dir. See webservices.core.autoscale
+autoscale = autoscale_str.lower() in ("1", "true", "yes")
+if autoscale_min_workers_str:
+    autoscale_min_workers = int(autoscale_min_workers_str)
+else:
+    autoscale_min_workers = web_concurrency
+if autoscale_max_workers_str:
+    autoscale_max_workers = int(autoscale_max_workers_str)
+else:
+    autoscale_max_workers = max(autoscale_min_workers, 2 * web_concurrency)
+assert 0 < autoscale_min_workers <= autoscale_max_workers
+if autoscale:
+    workers = min(max(workers, autoscale_min_workers), autoscale_max_workers)
+load_stats_dir = os.path.join(worker_tmp_dir, f"webservices-load-{os.getpid()}")
+autoscaler = None
+
+# Every worker writes its Prometheus metrics to files here which /metrics merges. It is
+# read by prometheus_client when imported, so it's set before the app is loaded, and
+# its metric files are removed so counters don't carry over from a previous run. Only
+# a directory created here is removed on exit; one given in PROMETHEUS_MULTIPROC_DIR
+# is the operator's.
+metrics_dir_str = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+metrics_dir = metrics_dir_str or os.path.join(
+    worker_tmp_dir, f"webservices-metrics-{os.getpid()}"
+)
+os.makedirs(metrics_dir, exist_ok=True)
+for metrics_file in glob.glob(os.path.join(metrics_dir, "*.db")):
+    os.remove(metrics_file)
+os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+
+
+def when_ready(server):
+    """
+    Runs in the master once the app is loaded, before the first worker is forked
+    """
+    global autoscaler
+    if autoscale:
+        from pathlib import Path
+
+        from webservices.core.autoscale import AutoscalePolicy
+        from webservices.core.autoscale import Autoscaler
+
+        autoscaler = Autoscaler(
+            AutoscalePolicy(
+                min_workers=autoscale_min_workers,
+                max_workers=autoscale_max_workers,
+                lag_high_ms=float(autoscale_lag_high_ms_str),
+                lag_low_ms=float(autoscale_lag_low_ms_str),
+                in_flight_high=float(autoscale_in_flight_high_str),
+                scale_down_delay=float(autoscale_scale_down_delay_str),
+            ),
+            Path(load_stats_dir),
+            lambda: server.num_workers,
+            server.pid,
+            a_interval=float(autoscale_interval_str),
+        )
+        autoscaler.start()
+    if preload_app:
+        from webservices.core import worker_state
+
+        server.log.info(f"Preloaded: {', '.join(worker_state.preload()) or 'nothing'}")
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    """
+    Runs in each worker right after it was forked from the master
+    """
+    if preload_app:
+        from webservices.core import worker_state
+
+        worker_state.reset_after_fork()
+        gc.enable()
+    if autoscale:
+        from pathlib import Path
+
+        from webservices.core.loadstats import load_monitor
+
+        load_monitor.publish_to(Path(load_stats_dir))
+
+
+def child_exit(server, worker):
+    """
+    Runs in the master after a worker exited
+    """
+    from prometheus_client import multiprocess
+
+    # Drops the worker's in-flight gauge; its counters keep counting towards the total
+    multiprocess.mark_process_dead(worker.pid, metrics_dir)
+    if autoscale:
+        from pathlib import Path
+
+        from webservices.core.loadstats import remove_stats
+
+        remove_stats(Path(load_stats_dir), worker.pid)
+
+
+def on_exit(server):
+    """
+    Runs in the master just before gunicorn exits
+    """
+    if autoscaler is not None:
+        autoscaler.stop()
+    shutil.rmtree(load_stats_dir, ignore_errors=True)
+    if not metrics_dir_str:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
 
 
 # For debugging and testing
@@ -56,6 +185,11 @@ log_data = {
     "graceful_timeout": graceful_timeout,
     "timeout": timeout,
     "keepalive": keepalive,
+    "preload_app": preload_app,
+    "autoscale": autoscale,
+    "autoscale_min_workers": autoscale_min_workers,
+    "autoscale_max_workers": autoscale_max_workers,
+    "metrics_dir": metrics_dir,
     "errorlog": errorlog,
     "accesslog": accesslog,
     # Additional, non-gunicorn variables
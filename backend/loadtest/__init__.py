@@ -0,0 +1,5 @@
+"""
+Load tests of the API running under gunicorn against a Keycloak stand-in.
+
+    python -m loadtest --help
+"""
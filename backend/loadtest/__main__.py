@@ -0,0 +1,154 @@
+"""
+Load test CLI. Run from backend/ with the API's usual environment (e.g. .test.env
+settings exported), for example:
+
+    python -m loadtest --workers 1 --workers 4 --concurrency 16 --concurrency 64
+    python -m loadtest --target http://127.0.0.1:8883 --keycloak-password ...
+"""
+import asyncio
+import json
+from pathlib import Path
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import click
+from loadtest.matrix import DEFAULT_WORKER_CLASS
+from loadtest.matrix import format_report
+from loadtest.matrix import MatrixResult
+from loadtest.matrix import run_matrix
+from loadtest.scenario import Scenario
+from loadtest.scenario import ScenarioRunner
+
+
+@click.command()
+@click.option(
+    "--worker-class",
+    "worker_classes",
+    multiple=True,
+    default=[DEFAULT_WORKER_CLASS],
+    show_default=True,
+    help="gunicorn worker class. Repeat to compare several.",
+)
+@click.option(
+    "--workers",
+    "worker_counts",
+    multiple=True,
+    type=int,
+    default=[1, 2, 4],
+    show_default=True,
+    help="Number of gunicorn workers. Repeat to compare several.",
+)
+@click.option(
+    "--concurrency",
+    multiple=True,
+    type=int,
+    default=[16, 64],
+    show_default=True,
+    help="Number of concurrent virtual clients. Repeat to compare several.",
+)
+@click.option("--duration", default=30.0, show_default=True, help="Seconds measured.")
+@click.option(
+    "--warmup", default=5.0, show_default=True, help="Seconds of load not measured."
+)
+@click.option(
+    "--mix",
+    default="login=1,auth=8,upload=1",
+    show_default=True,
+    help="Relative weights of the login, auth, and upload operations.",
+)
+@click.option(
+    "--users", default=50, show_default=True, help="Number of distinct users."
+)
+@click.option(
+    "--upload-kb", default=64, show_default=True, help="Size of each upload in KiB."
+)
+@click.option(
+    "--keycloak-latency-ms",
+    default=0.0,
+    show_default=True,
+    help="Delay the Keycloak stand-in adds to each response.",
+)
+@click.option(
+    "--keycloak-password",
+    default="loadtest",
+    show_default=True,
+    help="Password the users log in with.",
+)
+@click.option(
+    "--target",
+    default=None,
+    help="Load an already running API at this URL instead of starting gunicorn. "
+    "Its Keycloak must accept the users loadtest-00000 etc. with the password.",
+)
+@click.option(
+    "--log-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Directory for the servers' logs. A temporary one by default.",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="Also write the results to this JSON file.",
+)
+def main(
+    worker_classes: Tuple[str, ...],
+    worker_counts: Tuple[int, ...],
+    concurrency: Tuple[int, ...],
+    duration: float,
+    warmup: float,
+    mix: str,
+    users: int,
+    upload_kb: int,
+    keycloak_latency_ms: float,
+    keycloak_password: str,
+    target: Optional[str],
+    log_dir: Optional[Path],
+    output: Optional[Path],
+) -> None:
+    """
+    Report the API's throughput and latency per worker class and worker count
+    """
+    try:
+        l_weights = Scenario.parse_mix(mix)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--mix")
+    l_scenario = Scenario(
+        weights=l_weights,
+        users=users,
+        password=keycloak_password,
+        upload_bytes=upload_kb * 1024,
+    )
+    l_results: List[MatrixResult] = []
+    if target:
+        l_runner = ScenarioRunner(target, l_scenario)
+        for l_concurrency in concurrency:
+            l_results.append(
+                MatrixResult(
+                    target,
+                    0,
+                    asyncio.run(l_runner.run(l_concurrency, duration, warmup)),
+                )
+            )
+    else:
+        l_results = run_matrix(
+            l_scenario,
+            worker_classes,
+            worker_counts,
+            concurrency,
+            duration,
+            warmup,
+            a_keycloak_latency_ms=keycloak_latency_ms,
+            a_log_dir=log_dir,
+        )
+    click.echo(format_report(l_results))
+    if output is not None:
+        output.write_text(
+            json.dumps([l_result.to_dict() for l_result in l_results], indent=2)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+Stand-in for the Keycloak realm the API authenticates against.
+
+Serves the endpoints the API calls (the realm's public key, OpenID discovery document,
+JWKS, the token endpoint's password and refresh_token grants, and logout) and signs
+tokens with an RSA key generated at startup. Any username is accepted with the
+configured password, so a load test can log in as many distinct users as it likes. An
+optional delay emulates the latency of a real Keycloak.
+
+    python -m loadtest.fake_keycloak --port 57444 --latency-ms 20
+
+Point the API at it with KEYCLOAK_URL=http://127.0.0.1:57444.
+"""
+import asyncio
+from base64 import b64encode
+from time import time
+from typing import Any
+from typing import Dict
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from uuid import NAMESPACE_URL
+from uuid import uuid4
+from uuid import uuid5
+
+import click
+import uvicorn
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI
+from fastapi import Form
+from fastapi import Request
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from jose import jwk
+from jose import jwt
+from jose.exceptions import JWTError
+
+SIGNING_KID: str = "loadtest-key"
+DEFAULT_PASSWORD: str = "loadtest"
+
+
+class FakeRealm:
+    """
+    Signing key, users, and token issuance of the stand-in realm
+    """
+
+    def __init__(
+        self,
+        a_issuer: str,
+        a_client_id: str = "webservices_api",
+        a_client_secret: Optional[str] = None,
+        a_password: str = DEFAULT_PASSWORD,
+        a_token_lifespan: int = 300,
+        a_latency_ms: float = 0.0,
+    ):
+        """
+        :param a_issuer: The realm URL written to the tokens' iss claim
+        :param a_client_id: The client allowed to request tokens
+        :param a_client_secret: The client's secret. Not checked if None.
+        :param a_password: Password accepted for every username
+        :param a_token_lifespan: Seconds an access token is valid
+        :param a_latency_ms: Delay added to every response
+        """
+        self.issuer: str = a_issuer
+        self.client_id: str = a_client_id
+        self.client_secret: Optional[str] = a_client_secret
+        self.password: str = a_password
+        self.token_lifespan: int = a_token_lifespan
+        self.latency: float = a_latency_ms / 1000
+        l_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.private_key: str = l_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ).decode()
+        l_public_der: bytes = l_key.public_key().public_bytes(
+            serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        self.public_key: str = b64encode(l_public_der).decode()
+        l_jwk: Dict[str, Any] = jwk.construct(
+            l_key.public_key().public_bytes(
+                serialization.Encoding.PEM,
+                serialization.PublicFormat.SubjectPublicKeyInfo,
+            ),
+            "RS256",
+        ).to_dict()
+        l_jwk.update(kid=SIGNING_KID, use="sig", alg="RS256")
+        self.jwks: Dict[str, Any] = {"keys": [l_jwk]}
+        # Signing takes about a millisecond; a user's tokens are reused until half
+        # their lifetime is over, like a client holding on to its token would
+        self._issued: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        # Sessions ended by logout, whose refresh tokens are rejected
+        self._ended: Set[str] = set()
+
+    def _sign(self, a_claims: Dict[str, Any]) -> str:
+        return jwt.encode(
+            a_claims, self.private_key, algorithm="RS256", headers={"kid": SIGNING_KID}
+        )
+
+    def issue(self, a_username: str) -> Dict[str, Any]:
+        """
+        :param a_username: The authenticated user
+        :return: A token endpoint response for the user
+        """
+        l_now: float = time()
+        l_cached = self._issued.get(a_username)
+        if l_cached is not None and l_cached[0] > l_now:
+            return l_cached[1]
+        l_iat: int = int(l_now)
+        l_session: str = str(uuid4())
+        l_claims: Dict[str, Any] = {
+            "exp": l_iat + self.token_lifespan,
+            "iat": l_iat,
+            "jti": str(uuid4()),
+            "iss": self.issuer,
+            "aud": "account",
+            "sub": str(uuid5(NAMESPACE_URL, f"{self.issuer}/{a_username}")),
+            "typ": "Bearer",
+            "azp": self.client_id,
+            "session_state": l_session,
+            "acr": "1",
+            "allowed-origins": [],
+            "realm_access": {"roles": ["offline_access", "uma_authorization"]},
+            "resource_access": {"account": {"roles": ["view-profile"]}},
+            "scope": "openid email profile",
+            "sid": l_session,
+            "email_verified": True,
+            "name": f"Load Test {a_username}",
+            "preferred_username": a_username,
+            "given_name": "Load",
+            "family_name": "Test",
+            "email": f"{a_username}@loadtest.webservices.com",
+        }
+        l_refresh_claims: Dict[str, Any] = {
+            "exp": l_iat + 2 * self.token_lifespan,
+            "iat": l_iat,
+            "jti": str(uuid4()),
+            "iss": self.issuer,
+            "aud": self.issuer,
+            "sub": l_claims["sub"],
+            "typ": "Refresh",
+            "azp": self.client_id,
+            "session_state": l_session,
+            "scope": l_claims["scope"],
+            "sid": l_session,
+            "preferred_username": a_username,
+        }
+        l_response: Dict[str, Any] = {
+            "access_token": self._sign(l_claims),
+            "expires_in": self.token_lifespan,
+            "refresh_expires_in": 2 * self.token_lifespan,
+            "refresh_token": self._sign(l_refresh_claims),
+            "token_type": "Bearer",
+            "id_token": self._sign({**l_claims, "typ": "ID", "aud": self.client_id}),
+            "not-before-policy": 0,
+            "session_state": l_session,
+            "scope": l_claims["scope"],
+        }
+        self._issued[a_username] = (l_now + self.token_lifespan / 2, l_response)
+        return l_response
+
+    def _refresh_claims(self, a_refresh_token: str) -> Optional[Dict[str, Any]]:
+        try:
+            l_claims: Dict[str, Any] = jwt.decode(
+                a_refresh_token,
+                self.jwks["keys"][0],
+                algorithms=["RS256"],
+                options={"verify_aud": False},
+            )
+        except JWTError:
+            return None
+        if l_claims.get("typ") != "Refresh" or l_claims["sid"] in self._ended:
+            return None
+        return l_claims
+
+    def refresh(self, a_refresh_token: str) -> Optional[Dict[str, Any]]:
+        """
+        :param a_refresh_token: A refresh token issued by this realm
+        :return: A token endpoint response; None if the refresh token isn't valid
+        """
+        l_claims: Optional[Dict[str, Any]] = self._refresh_claims(a_refresh_token)
+        if l_claims is None:
+            return None
+        self._issued.pop(l_claims["preferred_username"], None)
+        return self.issue(l_claims["preferred_username"])
+
+    def logout(self, a_refresh_token: str) -> bool:
+        """
+        :param a_refresh_token: A refresh token issued by this realm
+        :return: True if its session was ended; False if the refresh token isn't valid
+        """
+        l_claims: Optional[Dict[str, Any]] = self._refresh_claims(a_refresh_token)
+        if l_claims is None:
+            return False
+        self._ended.add(l_claims["sid"])
+        self._issued.pop(l_claims["preferred_username"], None)
+        return True
+
+
+def _error(a_status: int, a_error: str, a_description: str) -> JSONResponse:
+    return JSONResponse(
+        {"error": a_error, "error_description": a_description}, status_code=a_status
+    )
+
+
+def get_application(a_realm: FakeRealm, a_realm_name: str = "WebServices") -> FastAPI:
+    """
+    :param a_realm: The realm served
+    :param a_realm_name: Name of the realm in the URL paths
+    :return: An ASGI app serving the realm's endpoints
+    """
+    _app = FastAPI(title="Keycloak stand-in", openapi_url=None)
+    l_prefix: str = f"/realms/{a_realm_name}"
+
+    @_app.middleware("http")
+    async def add_latency(request: Request, call_next):
+        if a_realm.latency:
+            await asyncio.sleep(a_realm.latency)
+        return await call_next(request)
+
+    @_app.get(l_prefix)
+    async def realm_info() -> Dict[str, Any]:
+        return {"realm": a_realm_name, "public_key": a_realm.public_key}
+
+    @_app.get(f"{l_prefix}/.well-known/openid-configuration")
+    async def well_known() -> Dict[str, Any]:
+        l_endpoint: str = f"{a_realm.issuer}/protocol/openid-connect"
+        return {
+            "issuer": a_realm.issuer,
+            "authorization_endpoint": f"{l_endpoint}/auth",
+            "token_endpoint": f"{l_endpoint}/token",
+            "userinfo_endpoint": f"{l_endpoint}/userinfo",
+            "end_session_endpoint": f"{l_endpoint}/logout",
+            "jwks_uri": f"{l_endpoint}/certs",
+            "grant_types_supported": ["password", "refresh_token"],
+            "response_types_supported": ["code", "id_token", "token"],
+            "id_token_signing_alg_values_supported": ["RS256"],
+        }
+
+    @_app.get(f"{l_prefix}/protocol/openid-connect/certs")
+    async def certs() -> Dict[str, Any]:
+        return a_realm.jwks
+
+    @_app.post(f"{l_prefix}/protocol/openid-connect/token")
+    async def token(
+        grant_type: str = Form(...),
+        client_id: str = Form(...),
+        client_secret: Optional[str] = Form(None),
+        username: Optional[str] = Form(None),
+        password: Optional[str] = Form(None),
+        refresh_token: Optional[str] = Form(None),
+    ):
+        if client_id != a_realm.client_id or (
+            a_realm.client_secret is not None and client_secret != a_realm.client_secret
+        ):
+            return _error(401, "unauthorized_client", "Invalid client credentials")
+        if grant_type == "password":
+            if not username or password != a_realm.password:
+                return _error(401, "invalid_grant", "Invalid user credentials")
+            return a_realm.issue(username)
+        if grant_type == "refresh_token":
+            l_response = a_realm.refresh(refresh_token or "")
+            if l_response is None:
+                return _error(400, "invalid_grant", "Invalid refresh token")
+            return l_response
+        return _error(400, "unsupported_grant_type", f"{grant_type} isn't supported")
+
+    @_app.post(f"{l_prefix}/protocol/openid-connect/logout")
+    async def logout(
+        client_id: str = Form(...),
+        client_secret: Optional[str] = Form(None),
+        refresh_token: str = Form(...),
+    ):
+        if client_id != a_realm.client_id or (
+            a_realm.client_secret is not None and client_secret != a_realm.client_secret
+        ):
+            return _error(401, "unauthorized_client", "Invalid client credentials")
+        if not a_realm.logout(refresh_token):
+            return _error(400, "invalid_grant", "Invalid refresh token")
+        return Response(status_code=204)
+
+    return _app
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=57444, show_default=True)
+@click.option("--realm", default="WebServices", show_default=True)
+@click.option("--client-id", default="webservices_api", show_default=True)
+@click.option(
+    "--client-secret",
+    default=None,
+    help="Reject token requests with another secret. Not checked by default.",
+)
+@click.option("--password", default=DEFAULT_PASSWORD, show_default=True)
+@click.option("--token-lifespan", default=300, show_default=True)
+@click.option(
+    "--latency-ms",
+    default=0.0,
+    show_default=True,
+    help="Delay added to every response, emulating a real Keycloak.",
+)
+def main(
+    host: str,
+    port: int,
+    realm: str,
+    client_id: str,
+    client_secret: Optional[str],
+    password: str,
+    token_lifespan: int,
+    latency_ms: float,
+) -> None:
+    """
+    Serve a Keycloak stand-in for load tests
+    """
+    l_realm = FakeRealm(
+        f"http://{host}:{port}/realms/{realm}",
+        a_client_id=client_id,
+        a_client_secret=client_secret,
+        a_password=password,
+        a_token_lifespan=token_lifespan,
+        a_latency_ms=latency_ms,
+    )
+    uvicorn.run(
+        get_application(l_realm, realm),
+        host=host,
+        port=port,
+        log_level="warning",
+        access_log=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
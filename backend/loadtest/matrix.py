@@ -0,0 +1,309 @@
+"""
+Run a load test scenario against the API under gunicorn, once for every combination of
+worker class and worker count.
+
+The API is started the way start.sh starts it (gunicorn -k WORKER_CLASS -c
+gunicorn_conf.py webservices.main:app) with WEB_CONCURRENCY set to the worker count and
+KEYCLOAK_URL pointing at a Keycloak stand-in (see loadtest.fake_keycloak). The
+rest of the configuration, e.g. the database, comes from the environment as usual, and
+the database must already be migrated (start.sh's prestart.sh isn't run).
+"""
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+from dataclasses import asdict
+from dataclasses import dataclass
+from pathlib import Path
+from tempfile import mkdtemp
+from time import monotonic
+from time import sleep
+from typing import Any
+from typing import Dict
+from typing import IO
+from typing import List
+from typing import Optional
+from typing import Sequence
+
+import httpx
+from loadtest.scenario import RunResult
+from loadtest.scenario import Scenario
+from loadtest.scenario import ScenarioRunner
+
+BACKEND_DIR: Path = Path(__file__).resolve().parents[2]
+DEFAULT_WORKER_CLASS: str = "uvicorn.workers.UvicornWorker"
+
+
+def free_port() -> int:
+    """
+    :return: A TCP port on the loopback interface nothing listens on
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as l_socket:
+        l_socket.bind(("127.0.0.1", 0))
+        return l_socket.getsockname()[1]
+
+
+class ManagedProcess:
+    """
+    A server started for the duration of a with block, its output going to a log file
+    """
+
+    def __init__(
+        self,
+        a_name: str,
+        a_command: Sequence[str],
+        a_url: str,
+        a_log_dir: Path,
+        a_env: Optional[Dict[str, str]] = None,
+        a_ready_path: str = "/",
+        a_ready_count: int = 1,
+        a_timeout: float = 60.0,
+    ):
+        """
+        :param a_name: Name of the log file and of the process in error messages
+        :param a_command: The command line
+        :param a_url: The server's base URL
+        :param a_log_dir: Directory of the log file
+        :param a_env: Environment variables of the process
+        :param a_ready_path: Polled until it answers 200
+        :param a_ready_count: Consecutive 200 responses required, e.g. one per worker
+        :param a_timeout: Seconds to wait for the server to become ready
+        """
+        self.name: str = a_name
+        self.command: List[str] = list(a_command)
+        self.url: str = a_url
+        self.log_path: Path = a_log_dir / f"{a_name}.log"
+        self.env: Optional[Dict[str, str]] = a_env
+        self.ready_path: str = a_ready_path
+        self.ready_count: int = a_ready_count
+        self.timeout: float = a_timeout
+        self._process: Optional[subprocess.Popen] = None
+        self._log: Optional[IO[bytes]] = None
+
+    def _wait_ready(self) -> None:
+        l_deadline: float = monotonic() + self.timeout
+        l_successes: int = 0
+        with httpx.Client(base_url=self.url, timeout=5.0) as l_client:
+            while l_successes < self.ready_count:
+                if self._process.poll() is not None:
+                    raise RuntimeError(
+                        f"{self.name} exited with {self._process.returncode}, "
+                        f"see {self.log_path}"
+                    )
+                if monotonic() > l_deadline:
+                    raise RuntimeError(
+                        f"{self.name} wasn't ready after {self.timeout}s, "
+                        f"see {self.log_path}"
+                    )
+                try:
+                    l_ok: bool = l_client.get(self.ready_path).status_code == 200
+                except httpx.HTTPError:
+                    l_ok = False
+                l_successes = l_successes + 1 if l_ok else 0
+                if not l_ok:
+                    sleep(0.2)
+
+    def __enter__(self) -> "ManagedProcess":
+        self._log = open(self.log_path, "ab")
+        self._process = subprocess.Popen(
+            self.command,
+            cwd=BACKEND_DIR,
+            env=self.env,
+            stdout=self._log,
+            stderr=subprocess.STDOUT,
+        )
+        try:
+            self._wait_ready()
+        except BaseException:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, *a_exc_info: Any) -> None:
+        if self._process is not None and self._process.poll() is None:
+            self._process.send_signal(signal.SIGTERM)
+            try:
+                self._process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        if self._log is not None:
+            self._log.close()
+        self._process = None
+        self._log = None
+
+
+def fake_keycloak(
+    a_port: int, a_log_dir: Path, a_latency_ms: float, a_password: str
+) -> ManagedProcess:
+    """
+    :param a_port: Port to serve the Keycloak stand-in on
+    :param a_log_dir: Directory of its log file
+    :param a_latency_ms: Delay added to each of its responses
+    :param a_password: Password it accepts for every user
+    :return: The stand-in's process, started when entered
+    """
+    return ManagedProcess(
+        "fake_keycloak",
+        [
+            sys.executable,
+            "-m",
+            "loadtest.fake_keycloak",
+            "--port",
+            str(a_port),
+            "--latency-ms",
+            str(a_latency_ms),
+            "--password",
+            a_password,
+        ],
+        f"http://127.0.0.1:{a_port}",
+        a_log_dir,
+        a_ready_path="/realms/WebServices",
+    )
+
+
+def gunicorn_api(
+    a_worker_class: str,
+    a_workers: int,
+    a_port: int,
+    a_keycloak_url: str,
+    a_log_dir: Path,
+) -> ManagedProcess:
+    """
+    :param a_worker_class: gunicorn worker class, e.g. uvicorn.workers.UvicornWorker
+    :param a_workers: Number of workers
+    :param a_port: Port the API binds to
+    :param a_keycloak_url: URL of the Keycloak stand-in
+    :param a_log_dir: Directory of the log file and of the shared signing key cache
+    :return: The API's process, started when entered
+    """
+    l_env: Dict[str, str] = {
+        # Every virtual client shares one IP and a few users; the environment can
+        # still set limits to measure them
+        "RATE_LIMIT_LOGIN_PER_MIN": "0",
+        "RATE_LIMIT_UPLOAD_PER_MIN": "0",
+        "UPLOAD_MAX_CONCURRENT_PER_USER": "0",
+        **os.environ,
+        "WEB_CONCURRENCY": str(a_workers),
+        "HOST": "127.0.0.1",
+        "PORT": str(a_port),
+        "BIND": "",
+        "AUTOSCALE": "false",
+        "KEYCLOAK_URL": a_keycloak_url,
+        # Keys of an earlier stand-in mustn't be reused
+        "KEYCLOAK_KEY_CACHE_PATH": str(a_log_dir / "jwks.json"),
+        "PYTHONPATH": str(BACKEND_DIR),
+    }
+    l_env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    l_name: str = f"api-{a_worker_class.rsplit('.', 1)[-1]}-{a_workers}"
+    return ManagedProcess(
+        l_name,
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-k",
+            a_worker_class,
+            "-c",
+            os.getenv("GUNICORN_CONF", "gunicorn_conf.py"),
+            "--forwarded-allow-ips",
+            "*",
+            os.getenv("APP_MODULE", "webservices.main:app"),
+        ],
+        f"http://127.0.0.1:{a_port}",
+        a_log_dir,
+        a_env=l_env,
+        a_ready_path="/v1/health/ready",
+        a_ready_count=2 * a_workers,
+        a_timeout=120.0,
+    )
+
+
+@dataclass
+class MatrixResult:
+    """
+    Outcome of one worker class, worker count, and concurrency combination
+    """
+
+    worker_class: str
+    workers: int
+    run: RunResult
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        :return: The result as a JSON serializable dictionary
+        """
+        return {
+            "worker_class": self.worker_class,
+            "workers": self.workers,
+            **asdict(self.run),
+        }
+
+
+def run_matrix(
+    a_scenario: Scenario,
+    a_worker_classes: Sequence[str],
+    a_worker_counts: Sequence[int],
+    a_concurrency: Sequence[int],
+    a_duration: float,
+    a_warmup: float,
+    a_keycloak_latency_ms: float = 0.0,
+    a_log_dir: Optional[Path] = None,
+) -> List[MatrixResult]:
+    """
+    :param a_scenario: What the virtual clients send
+    :param a_worker_classes: gunicorn worker classes to compare
+    :param a_worker_counts: Worker counts to compare
+    :param a_concurrency: Numbers of virtual clients each stack is loaded with
+    :param a_duration: Seconds measured per concurrency level
+    :param a_warmup: Seconds of load before measuring
+    :param a_keycloak_latency_ms: Delay added by the Keycloak stand-in
+    :param a_log_dir: Directory for the servers' logs; a new temporary one if None
+    :return: One result per combination
+    """
+    l_log_dir: Path = a_log_dir or Path(mkdtemp(prefix="webservices-loadtest-"))
+    l_log_dir.mkdir(parents=True, exist_ok=True)
+    l_results: List[MatrixResult] = []
+    l_keycloak_port: int = free_port()
+    with fake_keycloak(
+        l_keycloak_port, l_log_dir, a_keycloak_latency_ms, a_scenario.password
+    ) as l_keycloak:
+        for l_worker_class in a_worker_classes:
+            for l_workers in a_worker_counts:
+                with gunicorn_api(
+                    l_worker_class, l_workers, free_port(), l_keycloak.url, l_log_dir
+                ) as l_api:
+                    l_runner = ScenarioRunner(l_api.url, a_scenario)
+                    for l_concurrency in a_concurrency:
+                        l_run: RunResult = asyncio.run(
+                            l_runner.run(l_concurrency, a_duration, a_warmup)
+                        )
+                        l_results.append(MatrixResult(l_worker_class, l_workers, l_run))
+    return l_results
+
+
+def format_report(a_results: Sequence[MatrixResult]) -> str:
+    """
+    :param a_results: Results of run_matrix
+    :return: A table with a row per operation of every combination
+    """
+    l_header: str = (
+        f"{'worker class':<32} {'workers':>7} {'clients':>7} {'operation':<9} "
+        f"{'req/s':>9} {'mean ms':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} "
+        f"{'max ms':>9} {'errors':>7}"
+    )
+    l_lines: List[str] = [l_header, "-" * len(l_header)]
+    for l_result in a_results:
+        for l_stats in l_result.run.operations:
+            l_lines.append(
+                f"{l_result.worker_class:<32} {l_result.workers:>7} "
+                f"{l_result.run.concurrency:>7} {l_stats.operation:<9} "
+                f"{l_stats.requests_per_second:>9.1f} {l_stats.mean_ms:>9.2f} "
+                f"{l_stats.p50_ms:>9.2f} {l_stats.p90_ms:>9.2f} "
+                f"{l_stats.p99_ms:>9.2f} {l_stats.max_ms:>9.2f} {l_stats.errors:>7}"
+            )
+        for l_failure, l_count in sorted(l_result.run.failures.items()):
+            l_lines.append(f"{'':<58}failed: {l_failure} x{l_count}")
+    return "\n".join(l_lines)
@@ -0,0 +1,290 @@
+"""
+Closed-loop load generator for the API.
+
+A fixed number of virtual clients share a connection pool. Each one repeatedly picks
+an operation at random by its weight, sends it, and records its latency once the
+warmup is over:
+
+    login   POST /v1/login/token with a username and password (goes to Keycloak)
+    auth    POST /v1/keycloak/auth_landing with a bearer token (token verification and
+            user resolution only)
+    upload  POST /v1/upload/upload with a generated candump log
+
+The bearer tokens come from logging every simulated user in once before the run.
+"""
+import asyncio
+import random
+from dataclasses import dataclass
+from dataclasses import field
+from time import perf_counter
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import httpx
+
+# A classic CAN frame as written by candump -l
+CANDUMP_LINE: bytes = b"(1436509052.249713) vcan0 044#2A366C2BBA000000\n"
+OPERATIONS: List[str] = ["login", "auth", "upload"]
+
+
+@dataclass
+class Scenario:
+    """
+    What the virtual clients send
+    """
+
+    # Relative frequency of each operation
+    weights: Dict[str, float] = field(
+        default_factory=lambda: {"login": 1.0, "auth": 8.0, "upload": 1.0}
+    )
+    # Number of distinct users logged in and cycled through
+    users: int = 50
+    password: str = "loadtest"
+    upload_bytes: int = 64 * 1024
+
+    @classmethod
+    def parse_mix(cls, a_mix: str) -> Dict[str, float]:
+        """
+        :param a_mix: Weights like "login=1,auth=8,upload=1"
+        :return: The weight of each operation
+        :raises ValueError: If an operation is unknown or a weight isn't a number
+        """
+        l_weights: Dict[str, float] = {}
+        for l_item in a_mix.split(","):
+            l_name, _, l_weight = l_item.partition("=")
+            l_name = l_name.strip()
+            if l_name not in OPERATIONS:
+                raise ValueError(f"Unknown operation {l_name}, expected {OPERATIONS}")
+            l_weights[l_name] = float(l_weight)
+        return l_weights
+
+
+@dataclass
+class OperationStats:
+    """
+    Latency and throughput of one operation during a run
+    """
+
+    operation: str
+    count: int
+    errors: int
+    requests_per_second: float
+    mean_ms: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    max_ms: float
+
+
+@dataclass
+class RunResult:
+    """
+    Outcome of running a scenario at one concurrency level
+    """
+
+    concurrency: int
+    duration_seconds: float
+    operations: List[OperationStats]
+    # Status codes (or exception names) of failed requests and how often they occurred
+    failures: Dict[str, int]
+
+    @property
+    def total(self) -> OperationStats:
+        """
+        :return: Combined statistics of all operations
+        """
+        return self.operations[-1]
+
+
+def percentile(a_sorted: List[float], a_percent: float) -> float:
+    """
+    :param a_sorted: Ascending samples
+    :param a_percent: 0 to 100
+    :return: The nearest-rank percentile; 0 without samples
+    """
+    if not a_sorted:
+        return 0.0
+    l_rank: int = max(int(round(a_percent / 100 * len(a_sorted) + 0.5)) - 1, 0)
+    return a_sorted[min(l_rank, len(a_sorted) - 1)]
+
+
+def summarize(
+    a_operation: str, a_latencies: List[float], a_errors: int, a_seconds: float
+) -> OperationStats:
+    """
+    :param a_operation: Name of the operation
+    :param a_latencies: Seconds taken by each successful request
+    :param a_errors: Number of failed requests
+    :param a_seconds: Length of the measurement
+    :return: The operation's statistics in milliseconds
+    """
+    l_sorted: List[float] = sorted(l_latency * 1000 for l_latency in a_latencies)
+    l_count: int = len(l_sorted)
+    return OperationStats(
+        operation=a_operation,
+        count=l_count,
+        errors=a_errors,
+        requests_per_second=l_count / a_seconds if a_seconds else 0.0,
+        mean_ms=sum(l_sorted) / l_count if l_count else 0.0,
+        p50_ms=percentile(l_sorted, 50),
+        p90_ms=percentile(l_sorted, 90),
+        p99_ms=percentile(l_sorted, 99),
+        max_ms=l_sorted[-1] if l_sorted else 0.0,
+    )
+
+
+class ScenarioRunner:
+    """
+    Drives a Scenario against a running API
+    """
+
+    def __init__(self, a_base_url: str, a_scenario: Scenario):
+        """
+        :param a_base_url: The API's URL, e.g. http://127.0.0.1:8883
+        :param a_scenario: What to send
+        """
+        self.base_url: str = a_base_url
+        self.scenario: Scenario = a_scenario
+        l_lines: int = max(a_scenario.upload_bytes // len(CANDUMP_LINE), 1)
+        self._upload_body: bytes = CANDUMP_LINE * l_lines
+        self._tokens: List[str] = []
+
+    def _username(self, a_index: int) -> str:
+        return f"loadtest-{a_index % self.scenario.users:05d}"
+
+    async def _login(self, a_client: httpx.AsyncClient, a_index: int) -> httpx.Response:
+        return await a_client.post(
+            "/v1/login/token",
+            data={
+                "username": self._username(a_index),
+                "password": self.scenario.password,
+            },
+        )
+
+    async def _auth(self, a_client: httpx.AsyncClient, a_index: int) -> httpx.Response:
+        return await a_client.post(
+            "/v1/keycloak/auth_landing",
+            headers={
+                "Authorization": f"Bearer {self._tokens[a_index % len(self._tokens)]}"
+            },
+        )
+
+    async def _upload(
+        self, a_client: httpx.AsyncClient, a_index: int
+    ) -> httpx.Response:
+        return await a_client.post(
+            "/v1/upload/upload",
+            params={"filename": "loadtest.log"},
+            headers={
+                "Authorization": f"Bearer {self._tokens[a_index % len(self._tokens)]}",
+                "Content-Type": "application/octet-stream",
+            },
+            content=self._upload_body,
+        )
+
+    async def login_users(self, a_client: httpx.AsyncClient) -> None:
+        """
+        Log every simulated user in once and keep their access tokens
+        :param a_client: Client of the API
+        :raises RuntimeError: If a login fails
+        """
+        l_responses: List[httpx.Response] = await asyncio.gather(
+            *(self._login(a_client, l_index) for l_index in range(self.scenario.users))
+        )
+        self._tokens = []
+        for l_response in l_responses:
+            if l_response.status_code != 200:
+                raise RuntimeError(
+                    f"Login failed with {l_response.status_code}: {l_response.text}"
+                )
+            self._tokens.append(l_response.json()["access_token"])
+
+    async def run(
+        self, a_concurrency: int, a_duration: float, a_warmup: float = 5.0
+    ) -> RunResult:
+        """
+        :param a_concurrency: Number of virtual clients
+        :param a_duration: Seconds measured after the warmup
+        :param a_warmup: Seconds of load before measuring
+        :return: The statistics of the measured period
+        """
+        l_operations: Dict[
+            str, Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]]
+        ] = {"login": self._login, "auth": self._auth, "upload": self._upload}
+        l_names: List[str] = [
+            l_name
+            for l_name in OPERATIONS
+            if self.scenario.weights.get(l_name, 0.0) > 0
+        ]
+        l_weights: List[float] = [self.scenario.weights[l_name] for l_name in l_names]
+        l_latencies: Dict[str, List[float]] = {l_name: [] for l_name in l_names}
+        l_errors: Dict[str, int] = {l_name: 0 for l_name in l_names}
+        l_failures: Dict[str, int] = {}
+        # Set once the users are logged in
+        l_measure_from: float = 0.0
+        l_end: float = 0.0
+
+        async def _client_loop(a_client: httpx.AsyncClient, a_seed: int) -> None:
+            l_random = random.Random(a_seed)
+            l_index: int = a_seed
+            while True:
+                l_name: str = l_random.choices(l_names, l_weights)[0]
+                l_index += 1
+                l_sent: float = perf_counter()
+                if l_sent >= l_end:
+                    return
+                l_failure: Optional[str] = None
+                try:
+                    l_response = await l_operations[l_name](a_client, l_index)
+                    if l_response.status_code >= 400:
+                        l_failure = str(l_response.status_code)
+                except httpx.HTTPError as e:
+                    l_failure = type(e).__name__
+                l_done: float = perf_counter()
+                if l_sent < l_measure_from or l_done > l_end:
+                    continue
+                if l_failure is None:
+                    l_latencies[l_name].append(l_done - l_sent)
+                else:
+                    l_errors[l_name] += 1
+                    l_key: str = f"{l_name} {l_failure}"
+                    l_failures[l_key] = l_failures.get(l_key, 0) + 1
+
+        async with self.client(a_concurrency) as l_client:
+            if not self._tokens:
+                await self.login_users(l_client)
+            l_measure_from = perf_counter() + a_warmup
+            l_end = l_measure_from + a_duration
+            await asyncio.gather(
+                *(_client_loop(l_client, l_seed) for l_seed in range(a_concurrency))
+            )
+
+        l_stats: List[OperationStats] = [
+            summarize(l_name, l_latencies[l_name], l_errors[l_name], a_duration)
+            for l_name in l_names
+        ]
+        l_stats.append(
+            summarize(
+                "total",
+                [l_latency for l_name in l_names for l_latency in l_latencies[l_name]],
+                sum(l_errors.values()),
+                a_duration,
+            )
+        )
+        return RunResult(a_concurrency, a_duration, l_stats, l_failures)
+
+    def client(self, a_concurrency: int) -> httpx.AsyncClient:
+        """
+        :param a_concurrency: Number of virtual clients
+        :return: A client with a keep-alive connection per virtual client
+        """
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(60.0),
+            limits=httpx.Limits(
+                max_connections=a_concurrency, max_keepalive_connections=a_concurrency
+            ),
+        )
@@ -4,7 +4,6 @@ set -e
 # uvicorn will execute after this script runs
 echo "Beginning FastAPI container pre-start"
 echo "DEBUG environmental variable is: ${DEBUG}"
-#echo "Running Alembic migration"
-#(exec alembic upgrade head)
-#sleep 0.1
+echo "Running Alembic migration"
+alembic upgrade head
 echo "FastAPI container pre-start complete."
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""
+Tests of the background job routes
+"""
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from webservices.api.v1.routes import route_jobs
+from webservices.api.v1.routes.route_login import get_current_user_from_token
+from webservices.schemas.users import UserSchema
+
+OWNER: str = "owner@example.com"
+RESULT: Dict[str, Any] = {
+    "digest": "0" * 64,
+    "filename": "capture.log",
+    "user_email": OWNER,
+    "byte_count": 100,
+    "line_count": 2,
+    "frame_count": 2,
+    "rejected_line_count": 0,
+    "elapsed_seconds": 0.1,
+}
+
+
+class FakeResult:
+    """
+    The parts of a Celery AsyncResult the routes use, for jobs held in JOBS
+    """
+
+    def __init__(self, a_job_id: str, app: Any = None):
+        l_job: Dict[str, Any] = JOBS.get(a_job_id, {"state": "PENDING"})
+        self.state: str = l_job["state"]
+        # Kept with the state by result_extended: file path, filename, user email
+        self.args: Optional[List[Any]] = l_job.get("args")
+        self.result: Any = l_job.get("result")
+        self.info: Any = self.result
+
+    def ready(self) -> bool:
+        return self.state in ("SUCCESS", "FAILURE")
+
+    def successful(self) -> bool:
+        return self.state == "SUCCESS"
+
+
+JOBS: Dict[str, Dict[str, Any]] = {
+    "done": {
+        "state": "SUCCESS",
+        "args": ["/store/ab/cd/abcd", "capture.log", OWNER],
+        "result": RESULT,
+    },
+    "failed": {
+        "state": "FAILURE",
+        "args": ["/store/ab/cd/abcd", "capture.log", OWNER],
+        "result": ValueError("Corrupt file"),
+    },
+    "running": {
+        "state": "PROGRESS",
+        "args": ["/store/ab/cd/abcd", "capture.log", OWNER],
+        "result": {"line_count": 1},
+    },
+    # Stored before arguments were kept with the state
+    "legacy": {"state": "SUCCESS", "result": RESULT},
+}
+
+
+@pytest.fixture
+def user() -> List[UserSchema]:
+    return [UserSchema(id=1, username="owner", email=OWNER)]
+
+
+@pytest.fixture
+def client(monkeypatch, user: List[UserSchema]) -> TestClient:
+    monkeypatch.setattr(route_jobs, "AsyncResult", FakeResult)
+    l_app = FastAPI()
+    l_app.include_router(route_jobs.router)
+    l_app.dependency_overrides[get_current_user_from_token] = lambda: user[0]
+    return TestClient(l_app)
+
+
+def test_owner_sees_job(client: TestClient):
+    l_response = client.get("/running")
+    assert l_response.status_code == 200
+    assert l_response.json()["progress"] == {"line_count": 1}
+    for l_job_id in ["done", "legacy"]:
+        l_response = client.get(f"/{l_job_id}/result")
+        assert l_response.status_code == 200
+        assert l_response.json()["line_count"] == 2
+    assert client.get("/running/result").status_code == 409
+    assert client.get("/failed/result").status_code == 424
+
+
+@pytest.mark.parametrize("a_job_id", ["done", "failed", "running", "legacy"])
+def test_other_users_job_not_found(
+    client: TestClient, user: List[UserSchema], a_job_id: str
+):
+    user[0] = UserSchema(id=2, username="other", email="other@example.com")
+    for l_path in [f"/{a_job_id}", f"/{a_job_id}/result"]:
+        l_response = client.get(l_path)
+        assert l_response.status_code == 404
+        # Neither the state nor the failure is revealed
+        assert l_response.json() == {"detail": f"Job {a_job_id} not found"}
+
+
+def test_pending_job(client: TestClient):
+    l_response = client.get("/queued")
+    assert l_response.status_code == 200
+    assert l_response.json()["state"] == "PENDING"
+    assert client.get("/queued/result").status_code == 409
@@ -0,0 +1,63 @@
+"""
+Tests of the Keycloak document routes
+"""
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from webservices.api.v1.routes import route_keycloak
+from webservices.core.discovery import CachedDocument
+
+from keycloak import KeycloakGetError
+
+DOCUMENT: dict = {"issuer": "https://localhost/realms/test"}
+
+
+@pytest.fixture
+def client() -> TestClient:
+    l_app = FastAPI()
+    l_app.include_router(route_keycloak.router)
+    return TestClient(l_app)
+
+
+@pytest.fixture
+def fetch_error(monkeypatch) -> list:
+    l_error: list = []
+
+    async def fetch() -> dict:
+        if l_error:
+            raise l_error[0]
+        return DOCUMENT
+
+    monkeypatch.setattr(
+        route_keycloak, "discovery_document", CachedDocument("discovery", fetch)
+    )
+    return l_error
+
+
+@pytest.mark.parametrize("a_path", ["/test", "/openid-configuration"])
+def test_conditional_get(client: TestClient, fetch_error: list, a_path: str):
+    l_response = client.get(a_path)
+    assert l_response.status_code == 200
+    assert l_response.json() == DOCUMENT
+    l_etag: str = l_response.headers["etag"]
+    assert "max-age=" in l_response.headers["cache-control"]
+
+    l_response = client.get(a_path, headers={"If-None-Match": f"W/{l_etag}"})
+    assert l_response.status_code == 304
+    assert l_response.headers["etag"] == l_etag
+    assert not l_response.content
+
+
+def test_post_is_not_conditional(client: TestClient, fetch_error: list):
+    l_etag: str = client.post("/test").headers["etag"]
+    l_response = client.post("/test", headers={"If-None-Match": l_etag})
+    assert l_response.status_code == 200
+    assert l_response.json() == DOCUMENT
+
+
+@pytest.mark.parametrize("a_method", ["GET", "POST"])
+def test_keycloak_failure(client: TestClient, fetch_error: list, a_method: str):
+    fetch_error.append(KeycloakGetError("Server error", response_code=503))
+    l_response = client.request(a_method, "/test")
+    assert l_response.status_code == 400
+    assert client.get("/openid-configuration").status_code == 424
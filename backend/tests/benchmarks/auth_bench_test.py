@@ -0,0 +1,123 @@
+"""
+Benchmarks of authenticating a request: token verification, claim parsing, user
+validation, password hashing, and encoding the response
+"""
+import asyncio
+from typing import Any
+from typing import Callable
+from typing import Dict
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pytest_benchmark.fixture import BenchmarkFixture
+from webservices.api.utils import FastJSONResponse
+from webservices.api.v1.routes.route_login import get_current_user_from_token
+from webservices.core.hashing import Hasher
+from webservices.schemas import render_safe_email
+from webservices.schemas.keycloak import KeycloakTokenDecoded
+from webservices.schemas.users import UserSchema
+
+
+def test_current_user_first_seen(
+    benchmark: BenchmarkFixture,
+    event_loop: asyncio.AbstractEventLoop,
+    access_token: str,
+    stub_db: Any,
+    clear_auth_caches: Callable[[], None],
+):
+    """
+    A token and user the worker hasn't seen: signature check, claim parsing, user
+    validation, and upsert
+    """
+    l_user: UserSchema = benchmark.pedantic(
+        lambda: event_loop.run_until_complete(
+            get_current_user_from_token(access_token, stub_db)
+        ),
+        setup=clear_auth_caches,
+        rounds=200,
+        warmup_rounds=5,
+    )
+    assert l_user.id == 1
+
+
+def test_current_user_cached(
+    benchmark: BenchmarkFixture,
+    event_loop: asyncio.AbstractEventLoop,
+    access_token: str,
+    stub_db: Any,
+    clear_auth_caches: Callable[[], None],
+):
+    """
+    Repeat requests of a known user, served from the token and user caches
+    """
+    event_loop.run_until_complete(get_current_user_from_token(access_token, stub_db))
+    l_user: UserSchema = benchmark(
+        lambda: event_loop.run_until_complete(
+            get_current_user_from_token(access_token, stub_db)
+        )
+    )
+    assert l_user.id == 1
+
+
+def test_token_claims_parse(benchmark: BenchmarkFixture, claims: Dict[str, Any]):
+    l_token: KeycloakTokenDecoded = benchmark(lambda: KeycloakTokenDecoded(**claims))
+    assert l_token.sub == claims["sub"]
+
+
+def test_user_schema(benchmark: BenchmarkFixture, claims: Dict[str, Any]):
+    l_user: UserSchema = benchmark(
+        UserSchema, username=claims["preferred_username"], email=claims["email"]
+    )
+    assert l_user.email == render_safe_email(claims["email"])
+
+
+def test_render_safe_email(benchmark: BenchmarkFixture, claims: Dict[str, Any]):
+    assert benchmark(render_safe_email, claims["email"])
+
+
+@pytest.mark.parametrize(
+    "a_render",
+    [
+        # What FastAPI does with a returned dict by default
+        pytest.param(
+            lambda a_claims: JSONResponse(jsonable_encoder(a_claims)), id="stdlib"
+        ),
+        pytest.param(FastJSONResponse, id="ujson"),
+    ],
+)
+def test_claims_response(
+    benchmark: BenchmarkFixture,
+    claims: Dict[str, Any],
+    a_render: Callable[[Dict[str, Any]], JSONResponse],
+):
+    assert benchmark(a_render, claims).body
+
+
+@pytest.fixture(scope="module")
+def password_hash() -> str:
+    return Hasher.get_password_hash("correct horse battery staple")
+
+
+def test_verify_password(benchmark: BenchmarkFixture, password_hash: str):
+    assert benchmark.pedantic(
+        Hasher.verify_password,
+        args=("correct horse battery staple", password_hash),
+        rounds=5,
+        warmup_rounds=1,
+    )
+
+
+def test_verify_password_async(
+    benchmark: BenchmarkFixture,
+    event_loop: asyncio.AbstractEventLoop,
+    password_hash: str,
+):
+    # Includes the round trip to the hashing pool; the first round starts the pool
+    assert benchmark.pedantic(
+        lambda: event_loop.run_until_complete(
+            Hasher.verify_password_async("correct horse battery staple", password_hash)
+        ),
+        rounds=5,
+        warmup_rounds=1,
+    )
@@ -0,0 +1,227 @@
+"""
+Fixtures of the hot path benchmarks.
+
+Keycloak is replaced by a local RSA key pair: its public half is loaded into the JWKS
+key store and access tokens are signed with the private half, so token verification
+runs exactly as in production without a server. The database session is a stand-in
+whose upsert returns a fixed row, so the benchmarks measure the API rather than
+Postgres.
+
+Run from backend/ and save the results as a JSON baseline:
+    pytest tests/benchmarks --benchmark-autosave
+Compare a later run against the latest saved baseline, failing on regressions:
+    pytest tests/benchmarks --benchmark-compare --benchmark-compare-fail=mean:10%
+Baselines are stored per machine under .benchmarks/. The 500 MB upload only runs with
+--benchmark-large.
+"""
+import asyncio
+import os
+from tempfile import gettempdir
+from time import time
+from typing import Any
+from typing import AsyncIterator
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+# Settings the benchmarks depend on override any .test.env. The rest default in
+# tests/conftest.py.
+os.environ.update(
+    {
+        "INGEST_USE_CELERY": "false",
+        "INGEST_PERSIST_FRAMES": "false",
+        # Measures a single worker's caches
+        "AUTH_CACHE_REDIS": "false",
+        # Rounds repeat the same requests far faster than any client would
+        "RATE_LIMIT_LOGIN_PER_MIN": "0",
+        "RATE_LIMIT_UPLOAD_PER_MIN": "0",
+        "TRACE_FILE_PATH": "",
+        "TRACE_OTLP_ENDPOINT": "",
+        "KEYCLOAK_KEY_CACHE_PATH": os.path.join(
+            gettempdir(), "webservices-benchmarks", "jwks.json"
+        ),
+        "LOG_LEVEL": "warning",
+    }
+)
+
+from jose import jwk  # noqa: E402
+from jose import jwt  # noqa: E402
+from webservices.core.jwks import jwks_key_store  # noqa: E402
+from webservices.core.jwks import token_verifier  # noqa: E402
+from webservices.core.user_cache import user_cache  # noqa: E402
+from webservices.database import repository  # noqa: E402
+from webservices.database.models import User  # noqa: E402
+
+SIGNING_KID: str = "benchmark-key"
+SUBJECT: str = "0f0e0d0c-0b0a-0908-0706-050403020100"
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    parser.addoption(
+        "--benchmark-large",
+        action="store_true",
+        default=False,
+        help="Also run the benchmarks of very large (500 MB) uploads",
+    )
+
+
+def pytest_collection_modifyitems(
+    config: pytest.Config, items: List[pytest.Item]
+) -> None:
+    if config.getoption("--benchmark-large"):
+        return
+    l_skip = pytest.mark.skip(reason="needs --benchmark-large")
+    for l_item in items:
+        if "large" in l_item.keywords:
+            l_item.add_marker(l_skip)
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    config.addinivalue_line("markers", "large: benchmark of a very large upload")
+
+
+@pytest.fixture(scope="session")
+def signing_key() -> str:
+    """
+    :return: PEM encoded private key of the stand-in realm. Its public key is loaded
+        into the JWKS key store.
+    """
+    l_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    l_public: str = (
+        l_key.public_key()
+        .public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        .decode()
+    )
+    l_jwk: Dict[str, Any] = jwk.construct(l_public, "RS256").to_dict()
+    l_jwk.update(kid=SIGNING_KID, use="sig", alg="RS256")
+    jwks_key_store.load({"keys": [l_jwk]})
+    return l_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+
+
+@pytest.fixture(scope="session")
+def claims() -> Dict[str, Any]:
+    """
+    :return: Claims of a Keycloak access token for the benchmark user
+    """
+    l_now: int = int(time())
+    return {
+        "exp": l_now + 3600,
+        "iat": l_now,
+        "jti": "5b9b7c2e-4f65-4d4a-9d3b-2a8f0c1e7d6a",
+        "iss": "https://localhost:57444/realms/WebServices",
+        "aud": "account",
+        "sub": SUBJECT,
+        "typ": "Bearer",
+        "azp": "webservices_api",
+        "session_state": "e3b0c442-98fc-1c14-9afb-f4c8996fb924",
+        "acr": "1",
+        "allowed-origins": ["https://localhost:443"],
+        "realm_access": {"roles": ["offline_access", "uma_authorization"]},
+        "resource_access": {"account": {"roles": ["manage-account", "view-profile"]}},
+        "scope": "openid email profile",
+        "sid": "e3b0c442-98fc-1c14-9afb-f4c8996fb924",
+        "email_verified": True,
+        "name": "Bench Mark",
+        "preferred_username": "benchmark",
+        "given_name": "Bench",
+        "family_name": "Mark",
+        "email": "Bench.Mark@WebServices.com",
+    }
+
+
+@pytest.fixture(scope="session")
+def access_token(signing_key: str, claims: Dict[str, Any]) -> str:
+    """
+    :return: An access token signed by the stand-in realm
+    """
+    return jwt.encode(
+        claims, signing_key, algorithm="RS256", headers={"kid": SIGNING_KID}
+    )
+
+
+@pytest.fixture
+def clear_auth_caches() -> Iterator[Callable[[], None]]:
+    """
+    :return: Forgets every verified token and resolved user, so the next request takes
+        the first-seen path
+    """
+
+    def _clear() -> None:
+        token_verifier.cache.clear()
+        user_cache.cache.clear()
+
+    _clear()
+    yield _clear
+    _clear()
+
+
+class StubSession:
+    """
+    Stands in for the request's AsyncSession. Writes are discarded.
+    """
+
+    class _Transaction:
+        async def __aenter__(self) -> "StubSession._Transaction":
+            return self
+
+        async def __aexit__(self, *a_exc_info: Any) -> None:
+            pass
+
+    def begin_nested(self) -> "StubSession._Transaction":
+        return self._Transaction()
+
+    def add(self, a_instance: Any) -> None:
+        pass
+
+    async def commit(self) -> None:
+        pass
+
+    async def rollback(self) -> None:
+        pass
+
+
+@pytest.fixture
+def stub_db(monkeypatch: pytest.MonkeyPatch) -> StubSession:
+    """
+    :return: A stand-in database session. Upserts return a fixed users row.
+    """
+    l_row = User(id=1, subject=SUBJECT, is_active=True, is_superuser=False)
+
+    async def _upsert_user(*a_args: Any) -> User:
+        return l_row
+
+    monkeypatch.setattr(repository, "upsert_user", _upsert_user)
+    return StubSession()
+
+
+@pytest.fixture
+def stub_get_db(stub_db: StubSession) -> Callable[[], AsyncIterator[StubSession]]:
+    """
+    :return: Replacement of the get_db dependency yielding the stand-in session
+    """
+
+    async def _get_db() -> AsyncIterator[StubSession]:
+        yield stub_db
+
+    return _get_db
+
+
+@pytest.fixture(scope="session")
+def event_loop() -> Iterator[asyncio.AbstractEventLoop]:
+    """
+    :return: The loop coroutines are benchmarked in with run_until_complete
+    """
+    l_loop = asyncio.new_event_loop()
+    yield l_loop
+    l_loop.close()
@@ -0,0 +1,146 @@
+"""
+Benchmarks of /v1/upload/upload through an in-process ASGI client. The body is
+generated while it's sent, so even the largest upload isn't held in memory.
+"""
+import asyncio
+import gzip
+import lzma
+from typing import Any
+from typing import AsyncIterator
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+
+import httpx
+import pytest
+import zstandard
+from fastapi import FastAPI
+from pytest_benchmark.fixture import BenchmarkFixture
+from webservices.database.session import get_db
+from webservices.main import app
+
+# A classic CAN frame as written by candump -l
+CANDUMP_LINE: bytes = b"(1436509052.249713) vcan0 044#2A366C2BBA000000\n"
+CHUNK_BYTES: int = 1024 * 1024
+_CHUNK: bytes = CANDUMP_LINE * (CHUNK_BYTES // len(CANDUMP_LINE))
+
+KB: int = 1024
+MB: int = 1024 * KB
+
+
+async def candump_body(a_size: int) -> AsyncIterator[bytes]:
+    """
+    :param a_size: Approximate upload size in bytes, rounded down to whole lines
+    :return: Chunks of candump lines
+    """
+    l_remaining: int = a_size
+    while l_remaining >= len(_CHUNK):
+        yield _CHUNK
+        l_remaining -= len(_CHUNK)
+    l_tail: int = l_remaining // len(CANDUMP_LINE)
+    if l_tail:
+        yield CANDUMP_LINE * l_tail
+
+
+@pytest.fixture
+def upload_app(stub_get_db: Callable[[], Any]) -> Iterator[FastAPI]:
+    """
+    :return: The app with the database replaced by the stand-in session
+    """
+    app.dependency_overrides[get_db] = stub_get_db
+    yield app
+    app.dependency_overrides.pop(get_db, None)
+
+
+@pytest.mark.parametrize(
+    "a_size",
+    [
+        pytest.param(1 * KB, id="1KB"),
+        pytest.param(10 * MB, id="10MB"),
+        pytest.param(500 * MB, id="500MB", marks=pytest.mark.large),
+    ],
+)
+def test_upload(
+    benchmark: BenchmarkFixture,
+    event_loop: asyncio.AbstractEventLoop,
+    upload_app: FastAPI,
+    access_token: str,
+    a_size: int,
+):
+    async def _upload() -> httpx.Response:
+        async with httpx.AsyncClient(
+            app=upload_app, base_url="http://benchmark"
+        ) as l_client:
+            return await l_client.post(
+                "/v1/upload/upload",
+                params={"filename": "benchmark.log"},
+                headers={
+                    "Authorization": f"Bearer {access_token}",
+                    "Content-Type": "application/octet-stream",
+                },
+                content=candump_body(a_size),
+            )
+
+    # Large uploads take seconds each; a few rounds are plenty
+    l_rounds: int = 100 if a_size < MB else 5 if a_size < 100 * MB else 1
+    l_response: httpx.Response = benchmark.pedantic(
+        lambda: event_loop.run_until_complete(_upload()),
+        rounds=l_rounds,
+        warmup_rounds=1 if a_size < 100 * MB else 0,
+    )
+    assert l_response.status_code == 201, l_response.text
+    l_bytes: int = l_response.json()["byte_count"]
+    benchmark.extra_info["byte_count"] = l_bytes
+    # No stats are collected with --benchmark-disable
+    if benchmark.stats is not None:
+        benchmark.extra_info["megabytes_per_second"] = (
+            l_bytes / MB / benchmark.stats.stats.mean
+        )
+
+
+_COMPRESSORS: Dict[str, Callable[[bytes], bytes]] = {
+    "gzip": gzip.compress,
+    "xz": lzma.compress,
+    "zstd": zstandard.ZstdCompressor().compress,
+}
+
+
+@pytest.mark.parametrize("a_encoding", list(_COMPRESSORS))
+def test_upload_compressed(
+    benchmark: BenchmarkFixture,
+    event_loop: asyncio.AbstractEventLoop,
+    upload_app: FastAPI,
+    access_token: str,
+    a_encoding: str,
+):
+    # Compressed once up front so only decompression is measured
+    l_body: bytes = _COMPRESSORS[a_encoding](_CHUNK * 10)
+
+    async def _upload() -> httpx.Response:
+        async with httpx.AsyncClient(
+            app=upload_app, base_url="http://benchmark"
+        ) as l_client:
+            return await l_client.post(
+                "/v1/upload/upload",
+                params={"filename": "benchmark.log"},
+                headers={
+                    "Authorization": f"Bearer {access_token}",
+                    "Content-Type": "application/octet-stream",
+                    "Content-Encoding": a_encoding,
+                },
+                content=l_body,
+            )
+
+    l_response: httpx.Response = benchmark.pedantic(
+        lambda: event_loop.run_until_complete(_upload()), rounds=5, warmup_rounds=1
+    )
+    assert l_response.status_code == 201, l_response.text
+    assert l_response.json()["content_encoding"] == a_encoding
+    l_bytes: int = l_response.json()["byte_count"]
+    benchmark.extra_info["byte_count"] = l_bytes
+    benchmark.extra_info["compressed_byte_count"] = len(l_body)
+    # No stats are collected with --benchmark-disable
+    if benchmark.stats is not None:
+        benchmark.extra_info["megabytes_per_second"] = (
+            l_bytes / MB / benchmark.stats.stats.mean
+        )
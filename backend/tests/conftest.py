@@ -0,0 +1,31 @@
+"""
+Settings every test needs to import webservices. They only default, so a .test.env
+(loaded by pytest-dotenv) or the environment takes precedence and the suite runs
+without either.
+"""
+import os
+
+for l_name, l_value in {
+    "DEBUG": "true",
+    "LOG_LEVEL": "info",
+    "PROJECT_NAME": "WebServices",
+    "PROJECT_VERSION": "0.2.0",
+    "DEFAULT_USERNAME": "webservices",
+    "DEFAULT_USER_PASS": "test",
+    "DEFAULT_EMAIL": "contact@webservices.com",
+    "SECRET_KEY": "test",
+    "HASH_ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "10080",
+    "BACKEND_CORS_ORIGINS": '["https://localhost:443"]',
+    "KC_HTTPS_PORT": "57444",
+    "KEYCLOAK_HOSTNAME": "localhost",
+    "KEYCLOAK_CLIENT_SECRET_KEY": "test",
+    "POSTGRES_SERVER": "localhost",
+    "POSTGRES_USER": "webservices",
+    "POSTGRES_PASSWORD": "test",
+    "POSTGRES_DB": "webservices_test",
+    "POSTGRES_PORT": "57074",
+    "CELERY_BROKER_URL": "redis://localhost/0",
+    "CELERY_RESULT_BACKEND": "redis://localhost/0",
+}.items():
+    os.environ.setdefault(l_name, l_value)
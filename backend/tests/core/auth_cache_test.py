@@ -0,0 +1,229 @@
+"""
+Tests of the Redis backed cache of verified tokens and users shared by the workers
+"""
+import asyncio
+from time import time
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import pytest
+from jose import JWTError
+from redis.exceptions import ConnectionError
+from webservices.core.auth_cache import SharedAuthCache
+from webservices.core.jwks import TokenVerifier
+from webservices.core.redis_client import FailSoftRedis
+from webservices.core.user_cache import UserCache
+from webservices.schemas.users import UserSchema
+
+DIGEST: bytes = TokenVerifier.token_digest("token")
+
+
+class FakeRedis:
+    """
+    In-memory stand-in for the commands the shared auth cache sends
+    """
+
+    def __init__(self):
+        # Key -> value and expiry (epoch seconds)
+        self.data: Dict[bytes, Tuple[bytes, float]] = {}
+        self.subscribers: List["FakePubSub"] = []
+        self.error: Optional[Exception] = None
+
+    def _live(self, a_key: bytes) -> Optional[Tuple[bytes, float]]:
+        l_entry = self.data.get(a_key)
+        if l_entry is not None and l_entry[1] <= time():
+            del self.data[a_key]
+            return None
+        return l_entry
+
+    def get(self, a_key: bytes) -> Optional[bytes]:
+        l_entry = self._live(a_key)
+        return None if l_entry is None else l_entry[0]
+
+    def exists(self, a_key: bytes) -> int:
+        return int(self._live(a_key) is not None)
+
+    def pttl(self, a_key: bytes) -> int:
+        l_entry = self._live(a_key)
+        return -2 if l_entry is None else int((l_entry[1] - time()) * 1000)
+
+    def set(self, a_key: bytes, a_value: bytes, px: int) -> bool:
+        self.data[a_key] = (a_value, time() + px / 1000)
+        return True
+
+    def delete(self, a_key: bytes) -> int:
+        return int(self.data.pop(a_key, None) is not None)
+
+    def publish(self, a_channel: bytes, a_message: bytes) -> int:
+        for l_subscriber in self.subscribers:
+            if a_channel in l_subscriber.channels:
+                l_subscriber.messages.put_nowait({"data": a_message})
+        return len(self.subscribers)
+
+    def pipeline(self, transaction: bool) -> "FakePipeline":
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, a_redis: FakeRedis):
+        self._redis: FakeRedis = a_redis
+        self._commands: List[Tuple[str, tuple, dict]] = []
+
+    async def __aenter__(self) -> "FakePipeline":
+        return self
+
+    async def __aexit__(self, *a_args: Any) -> None:
+        pass
+
+    def __getattr__(self, a_name: str):
+        def queue(*a_args: Any, **a_kwargs: Any) -> "FakePipeline":
+            self._commands.append((a_name, a_args, a_kwargs))
+            return self
+
+        return queue
+
+    async def execute(self) -> list:
+        if self._redis.error is not None:
+            raise self._redis.error
+        return [
+            getattr(self._redis, l_name)(*l_args, **l_kwargs)
+            for l_name, l_args, l_kwargs in self._commands
+        ]
+
+
+class FakePubSub:
+    def __init__(self, a_redis: FakeRedis):
+        self.channels: List[bytes] = []
+        self.messages: "asyncio.Queue[dict]" = asyncio.Queue()
+        a_redis.subscribers.append(self)
+
+    async def subscribe(self, a_channel: bytes) -> None:
+        self.channels.append(a_channel)
+
+    async def get_message(
+        self, ignore_subscribe_messages: bool, timeout: float
+    ) -> Optional[dict]:
+        try:
+            return await asyncio.wait_for(self.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class FakeFailSoftRedis(FailSoftRedis):
+    def __init__(self, a_redis: FakeRedis):
+        super().__init__("Test cache", "redis://fake", a_retry_interval=0.05)
+        self._redis = a_redis
+
+
+@pytest.fixture
+def redis() -> FakeRedis:
+    return FakeRedis()
+
+
+def _worker(a_redis: FakeRedis) -> SharedAuthCache:
+    """
+    :return: One worker's shared auth cache, with caches of its own
+    """
+    return SharedAuthCache(
+        FakeFailSoftRedis(a_redis), TokenVerifier(None, {}), UserCache()
+    )
+
+
+def _claims(a_lifetime: float = 60.0) -> Dict[str, Any]:
+    return {"sub": "subject", "exp": int(time() + a_lifetime)}
+
+
+def _user() -> UserSchema:
+    return UserSchema(id=3, username="a", email="a@example.com")
+
+
+async def test_claims_shared(redis: FakeRedis):
+    l_worker, l_other = _worker(redis), _worker(redis)
+    assert await l_other.get_claims(DIGEST) is None
+
+    l_claims: Dict[str, Any] = _claims()
+    await l_worker.set_claims(DIGEST, l_claims)
+    assert await l_other.get_claims(DIGEST) == l_claims
+    # Kept in the other worker's own cache from then on
+    assert l_other.verifier.cache.get(DIGEST) == l_claims
+
+
+async def test_expired_claims_not_shared(redis: FakeRedis):
+    await _worker(redis).set_claims(DIGEST, _claims(-1))
+    assert redis.data == {}
+
+
+async def test_users_shared(redis: FakeRedis):
+    l_worker, l_other = _worker(redis), _worker(redis)
+    await l_worker.set_user("subject", _user(), time() + 60)
+    l_user: Optional[UserSchema] = await l_other.get_user("subject")
+    assert l_user == _user()
+    assert l_other.users.get("subject") == _user()
+    assert await l_other.get_user(None) is None
+
+    # Users without a row aren't shared
+    await l_worker.set_user("other", UserSchema(username="b", email="b@example.com"), 0)
+    assert await l_other.get_user("other") is None
+
+
+async def test_revoked_token_rejected_by_other_workers(redis: FakeRedis):
+    l_worker, l_other = _worker(redis), _worker(redis)
+    l_claims: Dict[str, Any] = _claims()
+    await l_worker.set_claims(DIGEST, l_claims)
+    await l_worker.set_user("subject", _user(), l_claims["exp"])
+    l_worker.verifier.cache.set(DIGEST, l_claims, l_claims["exp"])
+    l_worker.users.cache.set("subject", _user())
+
+    assert await l_worker.revoke(DIGEST, l_claims)
+    assert l_worker.verifier.cache.get(DIGEST) is None
+    assert l_worker.users.get("subject") is None
+    with pytest.raises(JWTError):
+        await l_other.get_claims(DIGEST)
+    assert await l_other.get_user("subject") is None
+
+
+async def test_subscription_forgets_revoked_tokens(redis: FakeRedis):
+    l_worker, l_other = _worker(redis), _worker(redis)
+    l_claims: Dict[str, Any] = _claims()
+    l_other.verifier.cache.set(DIGEST, l_claims, l_claims["exp"])
+    l_other.users.cache.set("subject", _user())
+
+    l_pubsub = FakePubSub(redis)
+    l_task = asyncio.get_running_loop().create_task(l_other._subscribe(l_pubsub))
+    await asyncio.sleep(0)
+    # Revocations missed while not subscribed are covered by forgetting everything
+    assert l_pubsub.channels == [l_other.channel]
+    assert l_other.verifier.cache.get(DIGEST) is None
+    assert l_other.users.get("subject") is None
+
+    l_other.verifier.cache.set(DIGEST, l_claims, l_claims["exp"])
+    l_other.users.cache.set("subject", _user())
+    l_other.users.cache.set("someone else", _user())
+    await l_worker.revoke(DIGEST, l_claims)
+    await asyncio.sleep(0.01)
+    assert l_other.verifier.cache.get(DIGEST) is None
+    assert l_other.users.get("subject") is None
+    assert l_other.users.get("someone else") is not None
+    assert redis.exists(l_worker._revoked_key(DIGEST))
+
+    l_task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await l_task
+
+
+async def test_redis_failure_skipped(redis: FakeRedis):
+    l_worker: SharedAuthCache = _worker(redis)
+    l_claims: Dict[str, Any] = _claims()
+    await l_worker.set_claims(DIGEST, l_claims)
+    redis.error = ConnectionError("down")
+    assert await l_worker.get_claims(DIGEST) is None
+    # Skipped without being asked for the retry interval
+    redis.error = None
+    assert l_worker.redis.client() is None
+    assert not await l_worker.revoke(DIGEST, l_claims)
+
+    await asyncio.sleep(0.06)
+    assert await l_worker.get_claims(DIGEST) == l_claims
@@ -0,0 +1,129 @@
+"""
+Tests of the content-addressed store for uploaded files
+"""
+from hashlib import sha256
+from pathlib import Path
+from typing import AsyncIterator
+
+import pytest
+from webservices.core.blobstore import ContentStore
+from webservices.core.blobstore import ContentStoreSink
+from webservices.core.blobstore import DigestSink
+from webservices.core.ingest import ingest_stream
+from webservices.core.ingest import IngestError
+from webservices.core.ingest import IngestSink
+
+TEXT: bytes = b"(1436509052.249713) vcan0 044#2A366C2BBA\n" * 100
+DIGEST: str = sha256(TEXT).hexdigest()
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> ContentStore:
+    l_staging: Path = tmp_path / "staging"
+    l_staging.mkdir()
+    return ContentStore(tmp_path / "store", l_staging)
+
+
+async def _chunks(a_data: bytes) -> AsyncIterator[bytes]:
+    for l_start in range(0, len(a_data), 1000):
+        yield a_data[l_start : l_start + 1000]
+
+
+def _staged(a_store: ContentStore, a_name: str, a_data: bytes = TEXT) -> Path:
+    l_path: Path = a_store.staging_dir / a_name
+    l_path.write_bytes(a_data)
+    return l_path
+
+
+def test_path_for(store: ContentStore):
+    assert store.path_for(DIGEST) == store.root / DIGEST[:2] / DIGEST[2:4] / DIGEST
+    assert store.record_path_for(DIGEST).name == f"{DIGEST}.json"
+    for l_digest in ["../etc/passwd", DIGEST.upper(), DIGEST[:-1]]:
+        with pytest.raises(ValueError):
+            store.path_for(l_digest)
+
+
+def test_commit_dedup(store: ContentStore):
+    assert not store.contains(DIGEST)
+    assert store.commit(_staged(store, "first"), DIGEST)
+    assert store.contains(DIGEST)
+    assert store.path_for(DIGEST).read_bytes() == TEXT
+
+    # A second copy isn't stored, and neither copy is left in staging
+    assert not store.commit(_staged(store, "second"), DIGEST)
+    assert list(store.staging_dir.iterdir()) == []
+
+
+def test_records(store: ContentStore):
+    store.commit(_staged(store, "first"), DIGEST)
+    assert store.read_record(DIGEST) is None
+    store.write_record(DIGEST, {"job_id": "1"})
+    store.write_record(DIGEST, {"job_id": "1", "result": {"line_count": 100}})
+    assert store.read_record(DIGEST) == {"job_id": "1", "result": {"line_count": 100}}
+    # Written in place, without leaving partial files behind
+    assert sorted(
+        l_path.name for l_path in store.path_for(DIGEST).parent.iterdir()
+    ) == [
+        DIGEST,
+        f"{DIGEST}.json",
+    ]
+
+    store.record_path_for(DIGEST).write_text("{")
+    assert store.read_record(DIGEST) is None
+    store.discard(DIGEST)
+    assert not store.contains(DIGEST)
+    assert not store.record_path_for(DIGEST).exists()
+
+
+async def test_sink(store: ContentStore):
+    l_sink: ContentStoreSink = store.sink()
+    await ingest_stream(_chunks(TEXT), [l_sink])
+    assert l_sink.digest == DIGEST
+    assert not l_sink.dedup_hit
+    assert store.path_for(DIGEST).read_bytes() == TEXT
+
+    l_sink = store.sink()
+    await ingest_stream(_chunks(TEXT), [l_sink])
+    assert l_sink.dedup_hit
+    assert list(store.staging_dir.iterdir()) == []
+
+
+async def _failing(a_data: bytes) -> AsyncIterator[bytes]:
+    async for l_chunk in _chunks(a_data):
+        yield l_chunk
+    raise IngestError("Client went away")
+
+
+async def test_failed_upload_not_stored(store: ContentStore):
+    l_sink: ContentStoreSink = store.sink()
+    with pytest.raises(IngestError):
+        await ingest_stream(_failing(TEXT), [l_sink])
+    assert not store.contains(DIGEST)
+    assert list(store.staging_dir.iterdir()) == []
+
+
+class FailingSink(IngestSink):
+    async def write_chunk(self, a_chunk: bytes) -> None:
+        pass
+
+    async def close(self) -> None:
+        raise IngestError("Frames not stored")
+
+
+async def test_file_withdrawn_when_another_sink_fails(store: ContentStore):
+    l_sink: ContentStoreSink = store.sink()
+    with pytest.raises(IngestError):
+        await ingest_stream(_chunks(TEXT), [l_sink, FailingSink()])
+    assert not store.contains(DIGEST)
+
+    # A file stored by an earlier upload stays
+    await ingest_stream(_chunks(TEXT), [store.sink()])
+    with pytest.raises(IngestError):
+        await ingest_stream(_chunks(TEXT), [store.sink(), FailingSink()])
+    assert store.contains(DIGEST)
+
+
+async def test_digest_sink():
+    l_sink = DigestSink()
+    await ingest_stream(_chunks(TEXT), [l_sink])
+    assert l_sink.digest == DIGEST
@@ -0,0 +1,98 @@
+"""
+Tests of the vectorized candump parser
+"""
+from typing import List
+
+import numpy as np
+import pytest
+from webservices.core.candump import CandumpParser
+from webservices.core.candump import CanFrameBatch
+from webservices.core.candump import parse_candump_lines
+from webservices.core.candump import PAYLOAD_WIDTH_FD
+
+LINES: List[bytes] = [
+    b"(1436509052.249713) vcan0 044#2A366C2BBA",
+    b"(1436509052.250000) vcan0 00000123#DEADBEEF",
+    b"(1436509052.251000) can1 1ABCDEF0#R",
+    b"(1436509052.252000) can1 7FF#",
+]
+
+
+def test_standard_and_extended_ids():
+    l_batch: CanFrameBatch = parse_candump_lines(LINES)
+    assert len(l_batch) == 4
+    assert l_batch.rejected == 0
+    assert l_batch.arbitration_id.tolist() == [0x044, 0x123, 0x1ABCDEF0, 0x7FF]
+    # Extended identifiers are told apart by their width, not their value
+    assert l_batch.is_extended_id.tolist() == [False, True, True, False]
+
+
+def test_fields():
+    l_batch: CanFrameBatch = parse_candump_lines(LINES)
+    assert l_batch.timestamp.tolist() == pytest.approx(
+        [1436509052.249713, 1436509052.25, 1436509052.251, 1436509052.252]
+    )
+    assert l_batch.interface.tolist() == [b"vcan0", b"vcan0", b"can1", b"can1"]
+    assert l_batch.dlc.tolist() == [5, 4, 0, 0]
+    assert l_batch.payload[0].tolist() == [0x2A, 0x36, 0x6C, 0x2B, 0xBA, 0, 0, 0]
+    assert l_batch.payload[1, :4].tobytes() == b"\xde\xad\xbe\xef"
+    assert l_batch.is_remote.tolist() == [False, False, True, False]
+    assert not l_batch.is_fd.any()
+
+
+def test_fd_frame():
+    l_line: bytes = b"(1.5) can0 123##1" + b"AB" * 12
+    assert parse_candump_lines([l_line]).rejected == 1
+
+    l_batch: CanFrameBatch = parse_candump_lines([l_line], PAYLOAD_WIDTH_FD)
+    assert l_batch.is_fd.tolist() == [True]
+    assert l_batch.dlc.tolist() == [12]
+    assert l_batch.payload.shape == (1, PAYLOAD_WIDTH_FD)
+    assert l_batch.payload[0, :12].tobytes() == b"\xab" * 12
+
+
+@pytest.mark.parametrize(
+    "a_line",
+    [
+        pytest.param(b"", id="empty"),
+        pytest.param(b"1436509052.249713 vcan0 044#00", id="no parentheses"),
+        pytest.param(b"(1.0.0) vcan0 044#00", id="two dots"),
+        pytest.param(b"() vcan0 044#00", id="no timestamp"),
+        pytest.param(b"(1.0) vcan0 044", id="no hash"),
+        pytest.param(b"(1.0) vcan0 #00", id="no identifier"),
+        pytest.param(b"(1.0) vcan0 123456789#00", id="identifier too long"),
+        pytest.param(b"(1.0) vcan0 04G#00", id="identifier not hex"),
+        pytest.param(b"(1.0) vcan0 044#0", id="odd payload"),
+        pytest.param(b"(1.0) vcan0 044#XY", id="payload not hex"),
+        pytest.param(b"(1.0) vcan0 044#" + b"00" * 9, id="payload too long"),
+        pytest.param(b"(1.0) averyverylonginterface 044#00", id="interface too long"),
+    ],
+)
+def test_rejected_lines(a_line: bytes):
+    l_batch: CanFrameBatch = parse_candump_lines([LINES[0], a_line, LINES[1]])
+    assert l_batch.rejected == 1
+    assert l_batch.arbitration_id.tolist() == [0x044, 0x123]
+    assert l_batch.is_extended_id.tolist() == [False, True]
+
+
+def test_all_rejected():
+    l_batch: CanFrameBatch = parse_candump_lines([b"garbage", b"(1.0) x"])
+    assert len(l_batch) == 0
+    assert l_batch.rejected == 2
+    assert l_batch.is_extended_id.dtype == bool
+
+
+def test_batches_of_split_chunks():
+    l_text: bytes = b"\n".join(LINES * 3) + b"\n" + b"not a frame\n"
+    l_parser = CandumpParser(a_batch_lines=5)
+    # Chunks split lines at arbitrary points
+    l_chunks: List[bytes] = [l_text[i : i + 7] for i in range(0, len(l_text), 7)]
+    l_batches: List[CanFrameBatch] = list(l_parser.parse_chunks(l_chunks))
+    assert [len(b) + b.rejected for b in l_batches] == [5, 5, 3]
+
+    l_all: CanFrameBatch = CanFrameBatch.concatenate(l_batches)
+    assert l_all.rejected == 1
+    assert np.array_equal(
+        l_all.is_extended_id, parse_candump_lines(LINES * 3).is_extended_id
+    )
+    assert l_all.arbitration_id.tolist() == [0x044, 0x123, 0x1ABCDEF0, 0x7FF] * 3
@@ -0,0 +1,147 @@
+"""
+Tests of the cached Keycloak discovery and JWKS documents
+"""
+import asyncio
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import pytest
+from webservices.core import discovery
+from webservices.core.discovery import CachedDocument
+from webservices.schemas import dumps
+
+from keycloak import KeycloakError
+from keycloak import KeycloakGetError
+
+
+class FakeKeycloak:
+    """
+    Serves a document, or fails, counting the fetches
+    """
+
+    def __init__(self):
+        self.document: Dict[str, Any] = {"issuer": "https://localhost/realms/test"}
+        self.error: Optional[KeycloakError] = None
+        self.fetch_count: int = 0
+        self.gate: Optional[asyncio.Event] = None
+
+    async def fetch(self) -> Dict[str, Any]:
+        self.fetch_count += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.error is not None:
+            raise self.error
+        return dict(self.document)
+
+
+@pytest.fixture
+def clock(monkeypatch) -> List[float]:
+    l_now: List[float] = [1000.0]
+    monkeypatch.setattr(discovery, "monotonic", lambda: l_now[0])
+    return l_now
+
+
+@pytest.fixture
+def keycloak() -> FakeKeycloak:
+    return FakeKeycloak()
+
+
+@pytest.fixture
+def document(keycloak: FakeKeycloak) -> CachedDocument:
+    return CachedDocument("test", keycloak.fetch, a_ttl=60.0, a_retry_interval=5.0)
+
+
+async def _settle(a_document: CachedDocument) -> None:
+    if a_document._task is not None:
+        await a_document._task
+
+
+async def test_first_load(
+    clock: List[float], keycloak: FakeKeycloak, document: CachedDocument
+):
+    assert not document.loaded
+    await document.load()
+    assert document.body == dumps(keycloak.document).encode()
+    assert document.etag.startswith('"') and document.etag.endswith('"')
+    assert document.max_age() == 60
+
+    clock[0] += 45
+    await document.load()
+    assert keycloak.fetch_count == 1
+    assert document.max_age() == 15
+
+
+async def test_etag_follows_content(keycloak: FakeKeycloak, document: CachedDocument):
+    document.store(keycloak.document)
+    l_etag: str = document.etag
+    document.store(keycloak.document)
+    assert document.etag == l_etag
+    document.store({"issuer": "elsewhere"})
+    assert document.etag != l_etag
+
+
+async def test_concurrent_first_loads_share_a_fetch(
+    keycloak: FakeKeycloak, document: CachedDocument
+):
+    keycloak.gate = asyncio.Event()
+    l_loads = asyncio.gather(*(document.load() for _ in range(5)))
+    await asyncio.sleep(0)
+    keycloak.gate.set()
+    await l_loads
+    assert keycloak.fetch_count == 1
+
+
+async def test_stale_copy_served_while_revalidated(
+    clock: List[float], keycloak: FakeKeycloak, document: CachedDocument
+):
+    await document.load()
+    l_body: bytes = document.body
+    keycloak.document["issuer"] = "changed"
+    keycloak.gate = asyncio.Event()
+
+    clock[0] += 61
+    await document.load()
+    # Answered from the stale copy without waiting for Keycloak
+    assert document.body == l_body
+    assert document.max_age() == 0
+    keycloak.gate.set()
+    await _settle(document)
+    assert keycloak.fetch_count == 2
+    assert document.body == dumps(keycloak.document).encode()
+    assert document.max_age() == 60
+
+
+async def test_failed_revalidation_keeps_copy(
+    clock: List[float], keycloak: FakeKeycloak, document: CachedDocument
+):
+    await document.load()
+    l_body: bytes = document.body
+    keycloak.error = KeycloakGetError("Server error", response_code=503)
+
+    clock[0] += 61
+    await document.load()
+    await _settle(document)
+    assert document.body == l_body
+    # Not retried before the retry interval passed
+    clock[0] += 4
+    await document.load()
+    await _settle(document)
+    assert keycloak.fetch_count == 2
+
+    keycloak.error = None
+    clock[0] += 1
+    await document.load()
+    await _settle(document)
+    assert keycloak.fetch_count == 3
+    assert document.max_age() == 60
+
+
+async def test_unreachable_without_copy(
+    keycloak: FakeKeycloak, document: CachedDocument
+):
+    keycloak.error = KeycloakGetError("Server error", response_code=503)
+    with pytest.raises(KeycloakError):
+        await document.load()
+    assert not document.loaded
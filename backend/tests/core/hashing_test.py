@@ -0,0 +1,67 @@
+"""
+Tests of password hashing in the bounded per-worker process pool
+"""
+from typing import Iterator
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from webservices.core import hashing
+from webservices.core.hashing import Hasher
+from webservices.core.hashing import HashingPool
+from webservices.core.hashing import HashingPoolBusy
+from webservices.main import hashing_pool_busy_handler
+
+
+@pytest.fixture
+def pool(monkeypatch) -> Iterator[HashingPool]:
+    l_pool = HashingPool(a_workers=1, a_max_pending=2)
+    monkeypatch.setattr(hashing, "hashing_pool", l_pool)
+    yield l_pool
+    if l_pool._executor is not None:
+        l_pool._executor.shutdown()
+
+
+async def test_hash_in_pool(pool: HashingPool):
+    l_hash: str = await Hasher.get_password_hash_async("secret")
+    assert l_hash.startswith("$2b$")
+    assert await Hasher.verify_password_async("secret", l_hash)
+    assert not await Hasher.verify_password_async("wrong", l_hash)
+    assert Hasher.verify_password("secret", l_hash)
+    assert await Hasher.get_password_hash_async(None) is None
+    assert pool.pending == 0
+    # The average follows the measured duration of bcrypt in the pool process
+    assert pool.call_seconds != 0.25
+
+
+async def test_saturated_pool_rejects(pool: HashingPool):
+    pool.pending = 2
+    pool.call_seconds = 0.7
+    with pytest.raises(HashingPoolBusy) as l_info:
+        await Hasher.verify_password_async("secret", "$2b$12$invalid")
+    assert l_info.value.retry_after == 2
+    pool.pending = 0
+
+
+def test_busy_answered_with_429(pool: HashingPool):
+    pool.pending = 2
+    l_app = FastAPI()
+    l_app.add_exception_handler(HashingPoolBusy, hashing_pool_busy_handler)
+
+    @l_app.post("/login")
+    async def login() -> dict:
+        await Hasher.verify_password_async("secret", "$2b$12$invalid")
+        return {}
+
+    l_response = TestClient(l_app).post("/login")
+    assert l_response.status_code == 429
+    assert l_response.headers["retry-after"] == "1"
+    pool.pending = 0
+
+
+def test_retry_after_estimate():
+    l_pool = HashingPool(a_workers=4, a_max_pending=64)
+    assert l_pool.retry_after() == 1
+    l_pool.pending = 40
+    l_pool.call_seconds = 0.3
+    assert l_pool.retry_after() == 3
@@ -0,0 +1,172 @@
+"""
+Tests of the streaming ingest pipeline
+"""
+import gzip
+import lzma
+from typing import AsyncIterator
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import pytest
+import zstandard
+from webservices.core.ingest import bounded_chunks
+from webservices.core.ingest import DecompressedTooLarge
+from webservices.core.ingest import DecompressingStream
+from webservices.core.ingest import ingest_stream
+from webservices.core.ingest import IngestError
+from webservices.core.ingest import IngestSink
+from webservices.core.ingest import IngestStats
+from webservices.core.ingest import LineFramer
+from webservices.core.ingest import UnsupportedEncoding
+
+TEXT: bytes = b"(1436509052.249713) vcan0 044#2A366C2BBA\n" * 500
+
+
+class RecordingSink(IngestSink):
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.lines: List[bytes] = []
+        self.closed: bool = False
+
+    async def write_chunk(self, a_chunk: bytes) -> None:
+        self.chunks.append(a_chunk)
+
+    async def write_lines(self, a_lines: List[bytes]) -> None:
+        self.lines.extend(a_lines)
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+async def _chunks(a_data: bytes, a_size: int) -> AsyncIterator[bytes]:
+    for l_start in range(0, len(a_data), a_size):
+        yield a_data[l_start : l_start + a_size]
+
+
+def test_framer_split_lines():
+    l_framer = LineFramer(16)
+    assert l_framer.feed(b"one\r\ntw") == [b"one"]
+    assert l_framer.feed(b"o\n\n  \nthr") == [b"two"]
+    assert l_framer.feed(b"ee") == []
+    assert l_framer.flush() == [b"three"]
+    assert l_framer.flush() == []
+
+
+@pytest.mark.parametrize(
+    "a_chunks",
+    [
+        pytest.param([b"short\n" + b"x" * 17 + b"\nshort\n"], id="within a chunk"),
+        pytest.param([b"short\n" + b"x" * 10, b"x" * 7 + b"\n"], id="across chunks"),
+        pytest.param([b"x" * 17], id="unfinished"),
+    ],
+)
+def test_framer_line_too_long(a_chunks: List[bytes]):
+    l_framer = LineFramer(16)
+    with pytest.raises(IngestError, match="maximum length of 16 bytes"):
+        for l_chunk in a_chunks:
+            l_framer.feed(l_chunk)
+
+
+def test_framer_longest_line():
+    l_line: bytes = b"x" * 16
+    assert LineFramer(16).feed(l_line + b"\n" + l_line) == [l_line]
+
+
+async def test_bounded_chunks():
+    l_out: List[bytes] = [
+        l_chunk async for l_chunk in bounded_chunks(_chunks(TEXT, 5000), 1024)
+    ]
+    assert max(len(l_chunk) for l_chunk in l_out) == 1024
+    assert b"".join(l_out) == TEXT
+
+
+async def test_ingest_stream():
+    l_sinks: List[RecordingSink] = [RecordingSink(), RecordingSink()]
+    l_stats: IngestStats = await ingest_stream(_chunks(TEXT + b"tail", 100), l_sinks)
+    assert l_stats.byte_count == len(TEXT) + 4
+    assert l_stats.line_count == 501
+    for l_sink in l_sinks:
+        assert b"".join(l_sink.chunks) == TEXT + b"tail"
+        assert l_sink.lines == TEXT.splitlines() + [b"tail"]
+        assert l_sink.closed
+
+
+COMPRESSORS: Dict[str, Callable[[bytes], bytes]] = {
+    "gzip": gzip.compress,
+    "xz": lzma.compress,
+    "zstd": lambda a_data: zstandard.ZstdCompressor().compress(a_data),
+}
+
+
+async def _read(
+    a_data: bytes,
+    a_content_encoding: Optional[str],
+    a_max_bytes: int = 1 << 20,
+    a_size: int = 100,
+) -> bytes:
+    l_stream = DecompressingStream(
+        _chunks(a_data, a_size), a_content_encoding, a_max_bytes, a_chunk_size=1000
+    )
+    l_pieces: List[bytes] = []
+    async for l_piece in l_stream:
+        assert len(l_piece) <= 1000
+        l_pieces.append(l_piece)
+    assert l_stream.compressed_byte_count == len(a_data)
+    assert l_stream.byte_count == sum(len(l_piece) for l_piece in l_pieces)
+    return b"".join(l_pieces)
+
+
+@pytest.mark.parametrize("a_format", COMPRESSORS)
+@pytest.mark.parametrize("a_declared", [True, False], ids=["declared", "detected"])
+async def test_round_trip(a_format: str, a_declared: bool):
+    l_data: bytes = COMPRESSORS[a_format](TEXT)
+    assert await _read(l_data, a_format if a_declared else None) == TEXT
+
+
+@pytest.mark.parametrize("a_format", COMPRESSORS)
+async def test_multiple_members(a_format: str):
+    l_compress: Callable[[bytes], bytes] = COMPRESSORS[a_format]
+    l_data: bytes = l_compress(TEXT) + l_compress(b"") + l_compress(TEXT)
+    assert await _read(l_data, a_format) == TEXT * 2
+
+
+@pytest.mark.parametrize("a_format", COMPRESSORS)
+@pytest.mark.parametrize("a_padding", [1, 100, 512])
+async def test_nul_padding(a_format: str, a_padding: int):
+    l_data: bytes = COMPRESSORS[a_format](TEXT) + b"\0" * a_padding
+    assert await _read(l_data, None) == TEXT
+
+
+async def test_garbage_after_member():
+    l_data: bytes = gzip.compress(TEXT) + b"\0\0garbage"
+    with pytest.raises(IngestError, match="Corrupt gzip data"):
+        await _read(l_data, "gzip")
+
+
+@pytest.mark.parametrize("a_format", COMPRESSORS)
+async def test_truncated(a_format: str):
+    l_data: bytes = COMPRESSORS[a_format](TEXT)
+    with pytest.raises(IngestError, match=f"Truncated {a_format} data"):
+        await _read(l_data[:-10], a_format)
+
+
+@pytest.mark.parametrize("a_format", COMPRESSORS)
+async def test_size_cap(a_format: str):
+    l_data: bytes = COMPRESSORS[a_format](TEXT)
+    assert await _read(l_data, a_format, a_max_bytes=len(TEXT)) == TEXT
+    with pytest.raises(DecompressedTooLarge):
+        await _read(l_data, a_format, a_max_bytes=len(TEXT) - 1)
+
+
+async def test_identity():
+    assert await _read(TEXT, "identity", a_max_bytes=1) == TEXT
+    # Undeclared data that isn't compressed passes through, however short
+    assert await _read(TEXT, None, a_size=1) == TEXT
+    assert await _read(b"\x1f", None) == b"\x1f"
+
+
+def test_unsupported_encoding():
+    with pytest.raises(UnsupportedEncoding):
+        DecompressingStream(_chunks(TEXT, 100), "br", 1 << 20)
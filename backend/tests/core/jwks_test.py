@@ -0,0 +1,267 @@
+"""
+Tests of the kid indexed signing key store and the verified-token cache
+"""
+import asyncio
+from time import time
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk
+from jose import jwt
+from jose import JWTError
+from webservices.core import jwks
+from webservices.core.jwks import JWKSKeyStore
+from webservices.core.jwks import TokenVerifier
+
+from keycloak import KeycloakGetError
+
+
+class FakeKeycloak:
+    """
+    Serves a JWK Set, or fails, counting the fetches
+    """
+
+    def __init__(self, a_jwks: Dict[str, Any]):
+        self.jwks: Dict[str, Any] = a_jwks
+        self.error: bool = False
+        self.fetch_count: int = 0
+
+    def certs(self) -> Dict[str, Any]:
+        self.fetch_count += 1
+        if self.error:
+            raise KeycloakGetError("Server error", response_code=503)
+        return self.jwks
+
+    async def certs_async(self) -> Dict[str, Any]:
+        return self.certs()
+
+
+def _signing_key(a_kid: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    :return: A PEM encoded private key and its public JWK
+    """
+    l_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    l_public: str = (
+        l_key.public_key()
+        .public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        .decode()
+    )
+    l_jwk: Dict[str, Any] = jwk.construct(l_public, "RS256").to_dict()
+    l_jwk.update(kid=a_kid, use="sig", alg="RS256")
+    l_private: str = l_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    return l_private, l_jwk
+
+
+@pytest.fixture(scope="module")
+def signing_keys() -> Dict[str, Tuple[str, Dict[str, Any]]]:
+    """
+    :return: The realm's current key and the one it rotates to, by kid
+    """
+    return {l_kid: _signing_key(l_kid) for l_kid in ["current", "next"]}
+
+
+@pytest.fixture
+def clock(monkeypatch) -> List[float]:
+    l_now: List[float] = [1000.0]
+    monkeypatch.setattr(jwks, "monotonic", lambda: l_now[0])
+    return l_now
+
+
+@pytest.fixture
+def keycloak(signing_keys) -> FakeKeycloak:
+    return FakeKeycloak({"keys": [signing_keys["current"][1]]})
+
+
+@pytest.fixture
+def key_store(clock: List[float], keycloak: FakeKeycloak) -> JWKSKeyStore:
+    return JWKSKeyStore(
+        keycloak.certs, keycloak.certs_async, a_min_refetch_interval=10.0
+    )
+
+
+def _token(a_signing_keys, a_kid: str, a_lifetime: float = 60.0) -> str:
+    return jwt.encode(
+        {"sub": "subject", "exp": int(time() + a_lifetime)},
+        a_signing_keys[a_kid][0],
+        algorithm="RS256",
+        headers={"kid": a_kid},
+    )
+
+
+def test_load_skips_unusable_keys(signing_keys, key_store: JWKSKeyStore):
+    l_jwk: Dict[str, Any] = signing_keys["current"][1]
+    assert not key_store.ready
+    l_count: int = key_store.load(
+        {
+            "keys": [
+                l_jwk,
+                {**l_jwk, "kid": "encryption", "use": "enc"},
+                {**l_jwk, "kid": None},
+                {"kid": "broken", "kty": "RSA", "n": "", "e": ""},
+            ]
+        }
+    )
+    assert l_count == 1
+    assert key_store.ready
+    assert key_store.get_key("current")[1] == "RS256"
+
+
+def test_kid_lookup(keycloak: FakeKeycloak, key_store: JWKSKeyStore):
+    assert key_store.get_key("current") is not None
+    assert keycloak.fetch_count == 1
+    # Known kids are answered without fetching
+    assert key_store.get_key("current") is not None
+    assert keycloak.fetch_count == 1
+
+
+def test_unknown_kid_refetch_rate_limited(
+    signing_keys,
+    clock: List[float],
+    keycloak: FakeKeycloak,
+    key_store: JWKSKeyStore,
+):
+    key_store.get_key("current")
+    keycloak.jwks = {"keys": [l_key[1] for l_key in signing_keys.values()]}
+    clock[0] += 5
+    assert key_store.get_key("next") is None
+    assert keycloak.fetch_count == 1
+
+    # The rotated key is picked up once the minimum interval passed
+    clock[0] += 5
+    assert key_store.get_key("next") is not None
+    assert keycloak.fetch_count == 2
+    assert key_store.get_key("bogus") is None
+    assert keycloak.fetch_count == 2
+    assert key_store.refresh(a_force=True)
+    assert keycloak.fetch_count == 3
+
+
+def test_failed_refresh_keeps_keys(
+    clock: List[float], keycloak: FakeKeycloak, key_store: JWKSKeyStore
+):
+    assert key_store.refresh()
+    keycloak.error = True
+    clock[0] += 10
+    assert not key_store.refresh()
+    assert key_store.get_key("current") is not None
+
+
+def test_verify_cached(signing_keys, keycloak: FakeKeycloak, key_store: JWKSKeyStore):
+    l_verifier = TokenVerifier(key_store, {"verify_aud": False})
+    l_token: str = _token(signing_keys, "current")
+    assert l_verifier.cached(l_token) is None
+    l_claims: Dict[str, Any] = l_verifier.verify(l_token)
+    assert l_claims["sub"] == "subject"
+    assert l_verifier.cached(l_token) is l_claims
+    assert l_verifier.verify(l_token) is l_claims
+
+
+def test_verify_rejects(signing_keys, keycloak: FakeKeycloak, key_store: JWKSKeyStore):
+    l_verifier = TokenVerifier(key_store, {"verify_aud": False})
+    with pytest.raises(JWTError):
+        l_verifier.verify(_token(signing_keys, "current", a_lifetime=-60))
+    # Signed by a key the realm doesn't publish
+    l_forged: str = _token({"current": signing_keys["next"]}, "current")
+    with pytest.raises(JWTError):
+        l_verifier.verify(l_forged)
+    with pytest.raises(JWTError, match="Unknown signing key"):
+        l_verifier.verify(_token(signing_keys, "next"))
+    assert len(l_verifier.cache) == 0
+
+
+def _shared_store(a_keycloak: FakeKeycloak, a_cache_path) -> JWKSKeyStore:
+    return JWKSKeyStore(
+        a_keycloak.certs,
+        a_keycloak.certs_async,
+        a_refresh_interval=0.0,
+        a_retry_interval=0.01,
+        a_cache_path=str(a_cache_path),
+    )
+
+
+def test_keys_shared_through_cache_file(keycloak: FakeKeycloak, tmp_path):
+    l_cache_path = tmp_path / "keys" / "jwks.json"
+    l_worker: JWKSKeyStore = _shared_store(keycloak, l_cache_path)
+    l_other: JWKSKeyStore = _shared_store(keycloak, l_cache_path)
+    assert not l_other.load_cache()
+
+    assert l_worker.refresh()
+    assert l_other.load_cache()
+    assert l_other.fetched_at == l_worker.fetched_at
+    assert l_other.get_key("current") is not None
+    assert keycloak.fetch_count == 1
+    # Not loaded again until a newer copy is saved
+    assert not l_other.load_cache()
+
+
+def test_unknown_kid_loaded_from_cache_file(
+    signing_keys, clock: List[float], keycloak: FakeKeycloak, tmp_path
+):
+    l_cache_path = tmp_path / "jwks.json"
+    l_worker: JWKSKeyStore = _shared_store(keycloak, l_cache_path)
+    l_other: JWKSKeyStore = _shared_store(keycloak, l_cache_path)
+    l_worker.refresh()
+    l_other.load_cache()
+
+    keycloak.jwks = {"keys": [l_key[1] for l_key in signing_keys.values()]}
+    clock[0] += 10
+    l_worker.refresh()
+    assert l_other.get_key("next") is not None
+    assert keycloak.fetch_count == 2
+
+
+def test_unreadable_cache_file_ignored(keycloak: FakeKeycloak, tmp_path):
+    l_cache_path = tmp_path / "jwks.json"
+    l_cache_path.write_text('{"fetched_at": "soon"}')
+    l_store: JWKSKeyStore = _shared_store(keycloak, l_cache_path)
+    assert not l_store.load_cache()
+    assert l_store.get_key("current") is not None
+    assert keycloak.fetch_count == 1
+
+
+async def test_background_fetch_retries(keycloak: FakeKeycloak, tmp_path):
+    l_store: JWKSKeyStore = _shared_store(keycloak, tmp_path / "jwks.json")
+    keycloak.error = True
+    await l_store.start()
+    await asyncio.sleep(0.05)
+    assert not l_store.ready
+    assert keycloak.fetch_count > 1
+
+    keycloak.error = False
+    await asyncio.wait_for(l_store._task, 1.0)
+    assert l_store.ready
+    await l_store.stop()
+
+
+async def test_background_refresh(keycloak: FakeKeycloak, monkeypatch, tmp_path):
+    l_store: JWKSKeyStore = _shared_store(keycloak, tmp_path / "jwks.json")
+    l_store.refresh_interval = 300.0
+    l_now: List[float] = [time()]
+    monkeypatch.setattr(jwks, "time", lambda: l_now[0])
+    l_sleeps: List[float] = []
+    l_yield = asyncio.sleep
+
+    async def sleep(a_seconds: float) -> None:
+        l_sleeps.append(a_seconds)
+        l_now[0] += a_seconds
+        await l_yield(0)
+
+    monkeypatch.setattr(jwks.asyncio, "sleep", sleep)
+    await l_store.start()
+    while keycloak.fetch_count < 3:
+        await l_yield(0)
+    await l_store.stop()
+    # Fetched at once, then once per refresh interval plus jitter
+    assert len(l_sleeps) >= 2
+    assert all(l_sleep == pytest.approx(300.0, abs=0.1) for l_sleep in l_sleeps)
@@ -0,0 +1,207 @@
+"""
+Tests of the rate limits and upload admission control
+"""
+from typing import List
+
+import pytest
+from starlette.types import Message
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+from webservices.core import ratelimit
+from webservices.core.ratelimit import BucketSpec
+from webservices.core.ratelimit import RateLimited
+from webservices.core.ratelimit import RateLimiter
+from webservices.core.ratelimit import RateLimitMiddleware
+from webservices.core.ratelimit import TokenBuckets
+from webservices.core.ratelimit import UploadAdmission
+from webservices.core.ratelimit import UploadLease
+from webservices.core.redis_client import FailSoftRedis
+
+# Each worker keeps its own state while Redis is disabled
+NO_REDIS: FailSoftRedis = FailSoftRedis("Test store", None)
+
+
+@pytest.fixture
+def clock(monkeypatch) -> List[float]:
+    l_now: List[float] = [1000.0]
+    monkeypatch.setattr(ratelimit, "monotonic", lambda: l_now[0])
+    return l_now
+
+
+def _admission(a_max_per_user: int = 2, a_max_bytes: int = 100) -> UploadAdmission:
+    return UploadAdmission(
+        NO_REDIS,
+        a_max_per_user=a_max_per_user,
+        a_max_bytes=a_max_bytes,
+        a_unknown_length_bytes=40,
+        a_retry_after=2.5,
+    )
+
+
+def test_bucket_spec():
+    assert BucketSpec.per_minute(0, 5) is None
+    assert BucketSpec.per_minute(30, 0) == BucketSpec(0.5, 1)
+
+
+def test_bucket_refill(clock: List[float]):
+    l_buckets = TokenBuckets()
+    l_spec = BucketSpec(rate=2.0, burst=3)
+    for _ in range(3):
+        assert l_buckets.take("a", l_spec) == 0
+    assert l_buckets.take("a", l_spec) == pytest.approx(0.5)
+    # Another key has a bucket of its own
+    assert l_buckets.take("b", l_spec) == 0
+
+    clock[0] += 0.25
+    assert l_buckets.take("a", l_spec) == pytest.approx(0.25)
+    clock[0] += 0.25
+    assert l_buckets.take("a", l_spec) == 0
+    # Refilled no further than the burst
+    clock[0] += 60
+    assert l_buckets.take("a", l_spec, a_cost=3) == 0
+    assert l_buckets.take("a", l_spec, a_cost=2) == pytest.approx(1.0)
+
+
+def test_least_recently_used_bucket_dropped(clock: List[float]):
+    l_buckets = TokenBuckets(a_max_keys=2)
+    l_spec = BucketSpec(rate=1.0, burst=1)
+    l_buckets.take("a", l_spec)
+    l_buckets.take("b", l_spec)
+    l_buckets.take("a", l_spec)
+    l_buckets.take("c", l_spec)
+    assert list(l_buckets._buckets) == ["a", "c"]
+
+
+async def test_rate_limiter(clock: List[float]):
+    l_limiter = RateLimiter(
+        NO_REDIS, {"login": BucketSpec(rate=0.1, burst=1), "upload": None}
+    )
+    await l_limiter.check("login", "10.0.0.1")
+    with pytest.raises(RateLimited) as l_info:
+        await l_limiter.check("login", "10.0.0.1")
+    assert l_info.value.limit == "login"
+    assert l_info.value.retry_after == 10
+    await l_limiter.check("login", "10.0.0.2")
+    # Disabled and unknown buckets don't limit
+    for _ in range(5):
+        await l_limiter.check("upload", "10.0.0.1")
+        await l_limiter.check("other", "10.0.0.1")
+
+
+def test_retry_after_rounded_up():
+    assert RateLimited("login", 0.01, "").retry_after == 1
+    assert RateLimited("login", 2.5, "").retry_after == 3
+
+
+async def test_bytes_in_flight():
+    l_admission: UploadAdmission = _admission(a_max_per_user=0)
+    l_lease: UploadLease = await l_admission.acquire("a", 60)
+    with pytest.raises(RateLimited) as l_info:
+        await l_admission.acquire("b", 41)
+    assert l_info.value.limit == "upload_bytes"
+    assert l_info.value.retry_after == 3
+    # A body without Content-Length counts as UPLOAD_UNKNOWN_LENGTH_BYTES
+    l_unknown: UploadLease = await l_admission.acquire("b", None)
+    assert l_admission.bytes_in_flight == 100
+    await l_admission.release(l_lease)
+    await l_admission.release(l_unknown)
+    assert l_admission.bytes_in_flight == 0
+
+
+async def test_oversize_upload_admitted_only_when_idle():
+    l_admission: UploadAdmission = _admission(a_max_per_user=0)
+    l_large: UploadLease = await l_admission.acquire("a", 500)
+    with pytest.raises(RateLimited):
+        await l_admission.acquire("b", 1)
+    await l_admission.release(l_large)
+
+    l_small: UploadLease = await l_admission.acquire("b", 1)
+    with pytest.raises(RateLimited):
+        await l_admission.acquire("a", 500)
+    await l_admission.release(l_small)
+    assert l_admission.bytes_in_flight == 0
+
+
+async def test_uploads_per_user():
+    l_admission: UploadAdmission = _admission()
+    l_leases: List[UploadLease] = [
+        await l_admission.acquire("a", 10),
+        await l_admission.acquire("a", 10),
+    ]
+    with pytest.raises(RateLimited) as l_info:
+        await l_admission.acquire("a", 10)
+    assert l_info.value.limit == "upload_concurrency"
+    # The rejected upload's bytes aren't kept
+    assert l_admission.bytes_in_flight == 20
+    await l_admission.acquire("b", 10)
+
+    await l_admission.release(l_leases[0])
+    await l_admission.acquire("a", 10)
+
+
+async def test_admission_released_on_exception():
+    l_admission: UploadAdmission = _admission(a_max_per_user=1)
+    with pytest.raises(ValueError):
+        async with l_admission.admit("a", 50):
+            assert l_admission._local_counts == {"a": 1}
+            raise ValueError("upload failed")
+    assert l_admission._local_counts == {}
+    assert l_admission.bytes_in_flight == 0
+    async with l_admission.admit("a", 50):
+        pass
+
+
+class App:
+    """
+    Records whether the middleware passed a request on
+    """
+
+    def __init__(self):
+        self.called: int = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.called += 1
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+
+async def _request(a_middleware: RateLimitMiddleware, a_path: str) -> List[Message]:
+    l_sent: List[Message] = []
+
+    async def receive() -> Message:
+        raise AssertionError("Body read")
+
+    async def send(a_message: Message) -> None:
+        l_sent.append(a_message)
+
+    l_scope: Scope = {
+        "type": "http",
+        "method": "POST",
+        "path": a_path,
+        "headers": [],
+        "client": ("10.0.0.1", 5000),
+    }
+    await a_middleware(l_scope, receive, send)
+    return l_sent
+
+
+async def test_middleware(clock: List[float]):
+    l_app = App()
+    l_middleware = RateLimitMiddleware(
+        l_app,
+        RateLimiter(NO_REDIS, {"login": BucketSpec(rate=0.5, burst=1)}),
+        {"/login": "login"},
+    )
+    l_sent: List[Message] = await _request(l_middleware, "/login")
+    assert l_sent[0]["status"] == 200
+
+    l_sent = await _request(l_middleware, "/login")
+    assert l_app.called == 1
+    assert l_sent[0]["status"] == 429
+    assert (b"retry-after", b"2") in l_sent[0]["headers"]
+
+    # Other paths aren't limited
+    for _ in range(3):
+        l_sent = await _request(l_middleware, "/health")
+        assert l_sent[0]["status"] == 200
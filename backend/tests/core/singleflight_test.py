@@ -0,0 +1,75 @@
+"""
+Tests of the coalescing of identical concurrent calls
+"""
+import asyncio
+from typing import List
+
+import pytest
+from webservices.core.singleflight import SingleFlight
+
+
+class Dependency:
+    """
+    Answers once released, counting the calls
+    """
+
+    def __init__(self):
+        self.calls: List[str] = []
+        self.release: asyncio.Event = asyncio.Event()
+
+    async def call(self, a_key: str) -> str:
+        self.calls.append(a_key)
+        l_number: int = len(self.calls)
+        await self.release.wait()
+        if a_key == "bad":
+            raise ValueError("rejected")
+        return f"{a_key} {l_number}"
+
+
+async def test_identical_calls_coalesced():
+    l_flight: SingleFlight[str] = SingleFlight("test")
+    l_dependency = Dependency()
+    l_calls = asyncio.gather(
+        *(
+            l_flight.do(l_key, lambda l_key=l_key: l_dependency.call(l_key))
+            for l_key in ["a", "a", "b", "a"]
+        )
+    )
+    await asyncio.sleep(0)
+    l_dependency.release.set()
+    assert await l_calls == ["a 1", "a 1", "b 2", "a 1"]
+    assert l_dependency.calls == ["a", "b"]
+
+    # Nothing is cached once the call completed
+    assert await l_flight.do("a", lambda: l_dependency.call("a")) == "a 3"
+    assert l_flight._calls == {}
+
+
+async def test_exception_shared():
+    l_flight: SingleFlight[str] = SingleFlight("test")
+    l_dependency = Dependency()
+    l_calls = asyncio.gather(
+        *(l_flight.do("bad", lambda: l_dependency.call("bad")) for _ in range(3)),
+        return_exceptions=True,
+    )
+    await asyncio.sleep(0)
+    l_dependency.release.set()
+    l_results: list = await l_calls
+    assert all(isinstance(l_result, ValueError) for l_result in l_results)
+    assert l_dependency.calls == ["bad"]
+
+
+async def test_caller_cancelled():
+    l_flight: SingleFlight[str] = SingleFlight("test")
+    l_dependency = Dependency()
+    l_gone = asyncio.ensure_future(l_flight.do("a", lambda: l_dependency.call("a")))
+    l_waiting = asyncio.ensure_future(l_flight.do("a", lambda: l_dependency.call("a")))
+    await asyncio.sleep(0)
+    l_gone.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await l_gone
+
+    # The call goes on for the caller still waiting
+    l_dependency.release.set()
+    assert await l_waiting == "a 1"
+    assert l_dependency.calls == ["a"]
@@ -0,0 +1,64 @@
+"""
+Tests of resumable upload sessions
+"""
+from pathlib import Path
+from typing import AsyncIterator
+from typing import List
+
+import pytest
+from webservices.core.ingest import IngestError
+from webservices.core.upload_sessions import UploadSession
+from webservices.core.upload_sessions import UploadSessionNotFound
+from webservices.core.upload_sessions import UploadSessionStore
+
+
+async def _chunks(*a_chunks: bytes) -> AsyncIterator[bytes]:
+    for l_chunk in a_chunks:
+        yield l_chunk
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> UploadSessionStore:
+    return UploadSessionStore(tmp_path / "sessions", 3600, 10)
+
+
+async def test_parts(store: UploadSessionStore):
+    l_session: UploadSession = store.create("a@example.com", "x.log")
+    assert await store.write_part(l_session, 2, _chunks(b"cc", b"dd")) == 4
+    assert await store.write_part(l_session, 1, _chunks(b"aa")) == 2
+    # Sending a part again replaces it
+    assert await store.write_part(l_session, 1, _chunks(b"a")) == 1
+    with pytest.raises(IngestError):
+        await store.write_part(l_session, 11, _chunks(b"x"))
+
+    l_session = store.get(l_session.session_id, "a@example.com")
+    assert l_session.parts == {1: 1, 2: 4}
+    assert l_session.offset == 5
+    assert l_session.missing_parts() == []
+    assert store.get(l_session.session_id, "b@example.com") is None
+
+
+async def test_read_parts_copy(store: UploadSessionStore, tmp_path: Path):
+    l_session: UploadSession = store.create("a@example.com", "x.log")
+    await store.write_part(l_session, 1, _chunks(b"first\n"))
+    await store.write_part(l_session, 2, _chunks(b"second\n" * 10))
+    l_session = store.get(l_session.session_id, "a@example.com")
+
+    l_copy: Path = tmp_path / "staging" / "assembled"
+    l_read: List[bytes] = []
+    async for l_chunk in store.read_parts(l_session, 8, l_copy):
+        assert len(l_chunk) <= 8
+        l_read.append(l_chunk)
+        if len(l_read) == 2:
+            # Part 2 sent again while it's read changes neither the rest read nor
+            # the copy
+            await store.write_part(l_session, 2, _chunks(b"replaced\n"))
+    assert b"".join(l_read) == b"first\n" + b"second\n" * 10
+    assert l_copy.read_bytes() == b"".join(l_read)
+
+
+async def test_write_part_to_removed_session(store: UploadSessionStore):
+    l_session: UploadSession = store.create("a@example.com", "x.log")
+    store.delete(l_session)
+    with pytest.raises(UploadSessionNotFound):
+        await store.write_part(l_session, 1, _chunks(b"late"))
@@ -0,0 +1,107 @@
+"""
+Tests of the per-worker cache of authenticated users
+"""
+from contextlib import asynccontextmanager
+from typing import Any
+from typing import List
+from typing import Optional
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+from webservices.core.user_cache import UserCache
+from webservices.database import repository
+from webservices.database.models import User
+from webservices.schemas.users import UserSchema
+
+
+class FakeSession:
+    """
+    Just enough of an AsyncSession for UserCache.store
+    """
+
+    def __init__(self):
+        self.commits: int = 0
+        self.rollbacks: int = 0
+
+    @asynccontextmanager
+    async def begin_nested(self):
+        yield
+
+    async def commit(self) -> None:
+        self.commits += 1
+
+    async def rollback(self) -> None:
+        self.rollbacks += 1
+
+
+class FakeRepository:
+    """
+    A users table holding a single user under an earlier subject
+    """
+
+    def __init__(self):
+        self.row = User(
+            id=7,
+            subject="old",
+            username="a",
+            email="a@example.com",
+            is_active=True,
+            is_superuser=False,
+        )
+        self.claims: List[str] = []
+
+    async def upsert_user(self, a_db: Any, a_subject: str, *a_args: Any) -> User:
+        if a_subject != self.row.subject:
+            raise IntegrityError("INSERT INTO users", {}, Exception("email taken"))
+        return self.row
+
+    async def claim_user(self, a_db: Any, a_subject: str, *a_args: Any) -> User:
+        self.claims.append(a_subject)
+        self.row.subject = a_subject
+        return self.row
+
+
+@pytest.fixture
+def users(monkeypatch) -> FakeRepository:
+    l_users = FakeRepository()
+    monkeypatch.setattr(repository, "upsert_user", l_users.upsert_user)
+    monkeypatch.setattr(repository, "claim_user", l_users.claim_user)
+    return l_users
+
+
+def _user() -> UserSchema:
+    return UserSchema(username="a", email="a@example.com")
+
+
+async def test_store_and_get(users: FakeRepository):
+    l_cache = UserCache()
+    l_db = FakeSession()
+    l_user: UserSchema = await l_cache.store(l_db, "old", _user())
+    assert l_user.id == 7
+    assert l_db.commits == 1
+    assert l_cache.get("old") is l_user
+    assert l_cache.get(None) is None
+
+    l_cache.invalidate("old")
+    assert l_cache.get("old") is None
+
+
+async def test_unverified_email_doesnt_claim_user(users: FakeRepository):
+    l_cache = UserCache()
+    l_db = FakeSession()
+    with pytest.raises(IntegrityError):
+        await l_cache.store(l_db, "new", _user(), a_email_verified=False)
+    assert users.claims == []
+    assert users.row.subject == "old"
+    assert l_db.rollbacks == 1
+    assert l_cache.get("new") is None
+
+
+async def test_verified_email_claims_user(users: FakeRepository):
+    l_cache = UserCache()
+    l_user: Optional[UserSchema] = await l_cache.store(
+        FakeSession(), "new", _user(), a_email_verified=True
+    )
+    assert users.claims == ["new"]
+    assert l_user.id == 7
+    assert l_cache.get("new") is l_user
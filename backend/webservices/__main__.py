@@ -1,4 +1,54 @@
 """
 CLI or script entrypoint
+
+    python -m webservices                    import the app (e.g. as a smoke test)
+    python -m webservices --profile-startup  report the app's import cost
 """
-from webservices.main import app  # noqa: F401
+import sys
+
+import click
+
+
+@click.command()
+@click.option(
+    "--profile-startup",
+    is_flag=True,
+    help="Report per-module import times and network calls made while importing "
+    "the app in a fresh interpreter, i.e. what each worker pays when it starts.",
+)
+@click.option(
+    "--module",
+    default="webservices.main",
+    show_default=True,
+    help="Module to import.",
+)
+@click.option(
+    "--min-ms",
+    default=1.0,
+    show_default=True,
+    help="Leave modules whose cumulative import took less out of the tree.",
+)
+@click.option(
+    "--top",
+    default=20,
+    show_default=True,
+    help="Number of modules listed by their own import time.",
+)
+def main(profile_startup: bool, module: str, min_ms: float, top: int) -> None:
+    """
+    Web Services API
+    """
+    if not profile_startup:
+        __import__(module)
+        return
+    from webservices.core.import_profile import format_profile
+    from webservices.core.import_profile import profile_imports
+
+    l_profile = profile_imports(module)
+    click.echo(format_profile(l_profile, a_min_ms=min_ms, a_top=top))
+    if l_profile.error:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
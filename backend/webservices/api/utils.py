@@ -1,3 +1,4 @@
+from typing import Any
 from typing import Dict
 from typing import Optional
 
@@ -5,9 +6,26 @@ from fastapi import HTTPException
 from fastapi import Request
 from fastapi import status
 from fastapi.openapi.models import OAuthFlows as OAuthFlowsModel
+from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2
 from fastapi.security.utils import get_authorization_scheme_param
 from webservices.core.config import core_logger as logger
+from webservices.core.tracing import span
+from webservices.schemas import dumps
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    The app's default response class, encoding with ujson instead of the stdlib.
+
+    FastAPI re-validates a route's return value against its response_model and walks
+    it with jsonable_encoder before it gets here. A route whose result is already valid
+    can skip both by returning FastJSONResponse(result) itself, where result may also
+    be a schema instance. Headers set on an injected Response don't apply then.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content, allow_nan=False).encode("utf-8")
 
 
 class OAuth2PasswordBearerWithCookie(OAuth2):
@@ -32,9 +50,9 @@ class OAuth2PasswordBearerWithCookie(OAuth2):
         # authorization: str = request.cookies.get(
         #     "access_token"
         # )  # changed to accept access token from httpOnly Cookie
-        authorization: str = request.headers.get("Authorization")
-
-        scheme, param = get_authorization_scheme_param(authorization)
+        with span("auth.bearer_parse"):
+            authorization: str = request.headers.get("Authorization")
+            scheme, param = get_authorization_scheme_param(authorization)
         if not authorization or scheme.lower() != "bearer":
             if self.auto_error:
                 logger.debug(
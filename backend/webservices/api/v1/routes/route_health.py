@@ -0,0 +1,76 @@
+"""
+Service health and resource usage
+"""
+from asyncio import TimeoutError as AsyncTimeoutError
+from os import getpid
+from time import perf_counter
+from time import time
+
+from fastapi import APIRouter
+from fastapi import Response
+from fastapi import status
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from webservices.core.config import core_logger as logger
+from webservices.core.jwks import jwks_key_store
+from webservices.database.session import database
+from webservices.schemas.health import DatabasePoolStatus
+from webservices.schemas.health import ReadinessStatus
+
+router = APIRouter()
+
+
+@router.get(
+    "/ready",
+    response_model=ReadinessStatus,
+    status_code=status.HTTP_200_OK,
+    responses={
+        status.HTTP_503_SERVICE_UNAVAILABLE: {
+            "model": ReadinessStatus,
+            "description": "The realm signing keys aren't loaded yet",
+        }
+    },
+)
+async def get_readiness(a_response: Response) -> ReadinessStatus:
+    """
+    Report whether the worker process handling this request can authenticate
+    requests. Workers answer as soon as they're bound while the realm signing keys are
+    fetched in the background; until then this returns 503.
+    """
+    l_ready: bool = jwks_key_store.ready
+    if not l_ready:
+        a_response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    l_fetched_at = jwks_key_store.fetched_at
+    return ReadinessStatus(
+        pid=getpid(),
+        ready=l_ready,
+        signing_key_count=jwks_key_store.key_count,
+        signing_keys_age_seconds=None
+        if l_fetched_at is None
+        else time() - l_fetched_at,
+    )
+
+
+@router.get(
+    "/database",
+    response_model=DatabasePoolStatus,
+    status_code=status.HTTP_200_OK,
+)
+async def get_database_health() -> DatabasePoolStatus:
+    """
+    Check that the database answers and report the connection pool of the worker
+    process handling this request
+    """
+    l_reachable: bool = False
+    l_latency_ms = None
+    l_start: float = perf_counter()
+    try:
+        async with database.engine.connect() as l_connection:
+            await l_connection.execute(text("SELECT 1"))
+        l_reachable = True
+        l_latency_ms = (perf_counter() - l_start) * 1000.0
+    except (SQLAlchemyError, OSError, AsyncTimeoutError) as e:
+        logger.warning(f"Database health check failed: {e}")
+    return DatabasePoolStatus(
+        reachable=l_reachable, latency_ms=l_latency_ms, **database.pool_status()
+    )
@@ -0,0 +1,89 @@
+"""
+Background job status and results
+"""
+from celery.result import AsyncResult
+from fastapi import APIRouter
+from fastapi import Depends
+from fastapi import HTTPException
+from fastapi import status
+from webservices.api.v1.routes.route_login import get_current_user_from_token
+from webservices.schemas.jobs import IngestJobResult
+from webservices.schemas.jobs import IngestJobStatus
+from webservices.schemas.users import UserSchema
+from webservices.worker.celery_app import celery_app
+from webservices.worker.tasks import job_owner
+
+router = APIRouter()
+
+
+def _get_owned_job(a_job_id: str, a_user: UserSchema) -> AsyncResult:
+    """
+    :param a_job_id: The job_id returned by the upload route
+    :param a_user: The authenticated user
+    :return: The job; HTTP exception if it belongs to another user
+    """
+    l_result = AsyncResult(a_job_id, app=celery_app)
+    # A queued job hasn't stored its state, nor its owner, yet. It reports PENDING
+    # just like an unknown job_id, which reveals nothing about it.
+    if l_result.state != "PENDING" and job_owner(l_result) != a_user.email:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Job {a_job_id} not found",
+        )
+    return l_result
+
+
+# NOTE: These routes are intentionally synchronous. Result backend lookups are blocking
+# Redis calls so FastAPI runs them in its threadpool instead of the event loop.
+@router.get(
+    "/{job_id}",
+    response_model=IngestJobStatus,
+    status_code=status.HTTP_200_OK,
+)
+def get_job_status(
+    job_id: str,
+    a_user: UserSchema = Depends(get_current_user_from_token),
+) -> IngestJobStatus:
+    """
+    Report the state of a background job. Unknown job IDs report PENDING.
+    :param job_id: The job_id returned by the upload route
+    :param a_user: The authenticated user
+    :return: The job's current state; HTTP exception if not owned
+    """
+    l_result = _get_owned_job(job_id, a_user)
+    l_state: str = l_result.state
+    return IngestJobStatus(
+        job_id=job_id,
+        state=l_state,
+        ready=l_result.ready(),
+        progress=l_result.info if l_state == "PROGRESS" else None,
+    )
+
+
+@router.get(
+    "/{job_id}/result",
+    response_model=IngestJobResult,
+    status_code=status.HTTP_200_OK,
+)
+def get_job_result(
+    job_id: str,
+    a_user: UserSchema = Depends(get_current_user_from_token),
+) -> IngestJobResult:
+    """
+    Retrieve the outcome of a finished background job
+    :param job_id: The job_id returned by the upload route
+    :param a_user: The authenticated user
+    :return: The job's result; HTTP exception if unfinished, failed, or not owned
+    """
+    l_result = _get_owned_job(job_id, a_user)
+    if not l_result.ready():
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Job {job_id} has not finished. Current state: {l_result.state}",
+        )
+    if not l_result.successful():
+        raise HTTPException(
+            status_code=status.HTTP_424_FAILED_DEPENDENCY,
+            detail=f"Job {job_id} failed: {l_result.result}",
+        )
+    return IngestJobResult(job_id=job_id, **l_result.result)
@@ -1,27 +1,84 @@
 """
 Keycloak client routes
 """
+from typing import Dict
+from typing import Optional
+
 from fastapi import APIRouter
 from fastapi import Depends
 from fastapi import HTTPException
+from fastapi import Request
+from fastapi import Response
 from fastapi import status
 from jose.exceptions import JWTError
+from starlette.concurrency import run_in_threadpool
+from webservices.api.utils import FastJSONResponse
 from webservices.api.v1.routes.route_login import get_current_user_from_token
-from webservices.core.config import core_config
-from webservices.core.config import keycloak_client
+from webservices.core.discovery import CachedDocument
+from webservices.core.discovery import discovery_document
+from webservices.core.discovery import jwks_document
+from webservices.core.jwks import token_verifier
+from webservices.schemas.users import UserSchema
 
 from keycloak import KeycloakConnectionError
+from keycloak import KeycloakError
 
 router = APIRouter()
 
+cached_document_responses: dict = {
+    status.HTTP_200_OK: {"content": {"application/json": {}}},
+    status.HTTP_304_NOT_MODIFIED: {
+        "description": "The copy named in If-None-Match is current"
+    },
+}
+
+
+def _etag_matches(a_if_none_match: Optional[str], a_etag: str) -> bool:
+    """
+    :param a_if_none_match: The request's If-None-Match header if any
+    :param a_etag: The current ETag
+    :return: True if the header names the current ETag (weakly compared) or is *
+    """
+    if not a_if_none_match:
+        return False
+    for l_tag in a_if_none_match.split(","):
+        l_tag = l_tag.strip()
+        if l_tag == "*" or l_tag.removeprefix("W/") == a_etag:
+            return True
+    return False
+
+
+async def _document_response(
+    a_request: Request, a_document: CachedDocument
+) -> Response:
+    """
+    :param a_request: The request for the document
+    :param a_document: The cached document
+    :return: The document with its ETag and Cache-Control, or 304 if the client's
+        copy is current
+    :raises KeycloakError: If no copy was fetched yet and Keycloak couldn't be reached
+    """
+    await a_document.load()
+    l_headers: Dict[str, str] = {
+        "ETag": a_document.etag,
+        "Cache-Control": f"public, max-age={a_document.max_age()}, "
+        f"stale-while-revalidate={int(a_document.ttl)}",
+    }
+    if a_request.method in ("GET", "HEAD") and _etag_matches(
+        a_request.headers.get("if-none-match"), a_document.etag
+    ):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=l_headers)
+    return Response(a_document.body, media_type="application/json", headers=l_headers)
+
 
 @router.post(
     "/auth_landing",
     status_code=status.HTTP_200_OK,
+    response_model=UserSchema,
 )
 async def get_keycloak_auth_redirect(
-    user_info=Depends(get_current_user_from_token),
-) -> dict:
+    user_info: UserSchema = Depends(get_current_user_from_token),
+) -> FastJSONResponse:
     """
     Return the Keycloak webapp adaptor config JSON. This config was retrieved from the
     Keycloak admin interface under the WebServices realm > webservices_webapp > Action > download
@@ -32,14 +89,15 @@ async def get_keycloak_auth_redirect(
 
     :return: A keycloak adaptor config
     """
-    return user_info
+    # Already validated; skip FastAPI's response_model validation
+    return FastJSONResponse(user_info)
 
 
 @router.post(
     "/test_token",
     status_code=status.HTTP_200_OK,
 )
-async def get_keycloak_config(access_token: str) -> dict:
+async def get_keycloak_config(access_token: str) -> FastJSONResponse:
     """
     Return the Keycloak webapp adaptor config JSON. This config was retrieved from the
     Keycloak admin interface under the WebServices realm > webservices_webapp > Action > download
@@ -56,10 +114,10 @@ async def get_keycloak_config(access_token: str) -> dict:
             detail="Did not received an Authorization bearer header",
         )
     try:
-        return keycloak_client.decode_token(
-            access_token,
-            key=core_config.KEYCLOAK_PUBLIC_KEY,
-            options=core_config.KEYCLOAK_DECRYPT_OPTIONS,
+        # Verifying may read the key cache or fetch keys from keycloak, which blocks.
+        # The decoded claims are plain JSON types already.
+        return FastJSONResponse(
+            await run_in_threadpool(token_verifier.verify, access_token)
         )
     except KeycloakConnectionError:
         raise HTTPException(
@@ -73,16 +131,59 @@ async def get_keycloak_config(access_token: str) -> dict:
         )
 
 
-@router.post(
+@router.api_route(
     "/test",
+    methods=["GET", "POST"],
     status_code=status.HTTP_200_OK,
+    responses=cached_document_responses,
 )
-async def test_keycloak() -> dict:
+async def test_keycloak(a_request: Request) -> Response:
     """
-    Attempt to connect to keycloak and return info
-    :return: A dictionary of info if successful; raise HTTPException otherwise.
+    Return keycloak's OpenID Connect discovery document, as cached by this worker (see
+    webservices.core.discovery). Poll it with GET and If-None-Match to get 304 while
+    it's unchanged; POST is kept for existing clients.
+    :return: The discovery document if it could be fetched; raise HTTPException
+    otherwise.
     """
     try:
-        return keycloak_client.well_known()
-    except KeycloakConnectionError as e:
+        return await _document_response(a_request, discovery_document)
+    except KeycloakError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{e}")
+
+
+@router.get(
+    "/openid-configuration",
+    status_code=status.HTTP_200_OK,
+    responses=cached_document_responses,
+)
+async def get_openid_configuration(a_request: Request) -> Response:
+    """
+    Keycloak's OpenID Connect discovery document, served from this worker's cache with
+    an ETag; send it back in If-None-Match to get 304 while it's unchanged.
+    """
+    try:
+        return await _document_response(a_request, discovery_document)
+    except KeycloakError:
+        raise HTTPException(
+            status_code=status.HTTP_424_FAILED_DEPENDENCY,
+            detail="Failed to establish connection to authentication server",
+        )
+
+
+@router.get(
+    "/certs",
+    status_code=status.HTTP_200_OK,
+    responses=cached_document_responses,
+)
+async def get_signing_keys(a_request: Request) -> Response:
+    """
+    The realm's public signing keys (JWKS), served from this worker's cache with an
+    ETag; send it back in If-None-Match to get 304 while it's unchanged.
+    """
+    try:
+        return await _document_response(a_request, jwks_document)
+    except KeycloakError:
+        raise HTTPException(
+            status_code=status.HTTP_424_FAILED_DEPENDENCY,
+            detail="Failed to establish connection to authentication server",
+        )
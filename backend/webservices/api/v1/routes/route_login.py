@@ -1,26 +1,46 @@
 """
 Login routes and JWT logic
 """
+from hashlib import sha256
+from typing import Any
+from typing import Awaitable
 from typing import Dict
+from typing import Optional
+from typing import Union
 
 from fastapi import APIRouter
+from fastapi import Cookie
 from fastapi import Depends
 from fastapi import HTTPException
 from fastapi import Response
 from fastapi import status
+from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from jose import JWTError
 from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from webservices.api.utils import OAuth2PasswordBearerWithCookie
+from webservices.core import worker_state
+from webservices.core.auth_cache import shared_auth_cache
 from webservices.core.config import core_config
 from webservices.core.config import core_logger as logger
-from webservices.core.config import keycloak_client
+from webservices.core.jwks import token_verifier
+from webservices.core.keycloak_async import keycloak_async_client
+from webservices.core.metrics import track_dependency
+from webservices.core.singleflight import SingleFlight
+from webservices.core.tracing import span
+from webservices.core.user_cache import user_cache
+from webservices.database.session import get_db
 from webservices.schemas.keycloak import KeycloakTokenDecoded
 from webservices.schemas.keycloak import KeycloakTokenResponse
 from webservices.schemas.users import UserSchema
 
 from keycloak import KeycloakAuthenticationError
 from keycloak import KeycloakConnectionError
+from keycloak import KeycloakOperationError
+from keycloak import KeycloakPostError
 
 router = APIRouter()
 
@@ -34,9 +54,43 @@ credentials_exception = HTTPException(
     detail="Invalid user credentials",
 )
 
+# The refresh token is only sent back to the login routes, i.e. refresh and logout
+refresh_cookie: str = "refresh_token"
+refresh_cookie_path: str = "/v1/login"
+
+# Identical logins and refreshes in flight at once, e.g. clients reconnecting after a
+# deploy, share one keycloak call
+password_grants: SingleFlight[KeycloakTokenResponse] = SingleFlight("login")
+refresh_grants: SingleFlight[KeycloakTokenResponse] = SingleFlight("refresh")
+worker_state.register_after_fork("login calls", password_grants.reset_after_fork)
+worker_state.register_after_fork("refresh calls", refresh_grants.reset_after_fork)
+
+
+async def _parse_token_response(
+    a_response: Awaitable[Dict[str, Any]]
+) -> KeycloakTokenResponse:
+    return KeycloakTokenResponse(**await a_response)
+
+
+def _set_token_cookies(a_response: Response, a_creds: KeycloakTokenResponse) -> None:
+    # The access_token cookie is what will be expected to be provided by clients in
+    # the future when attempting to access 'protected' routes.
+    a_response.set_cookie(
+        key="access_token", value=f"Bearer {a_creds.access_token}", httponly=True
+    )
+    a_response.set_cookie(
+        key=refresh_cookie,
+        value=a_creds.refresh_token,
+        # keycloak reports 0 for refresh tokens that don't expire
+        max_age=a_creds.refresh_expires_in or None,
+        path=refresh_cookie_path,
+        httponly=True,
+        samesite="strict",
+    )
+
 
 @router.post("/token")
-def login_for_access_token(
+async def login_for_access_token(
     response: Response,
     form_data: OAuth2PasswordRequestForm = Depends(),
 ) -> Dict[str, str]:
@@ -52,9 +106,12 @@ def login_for_access_token(
     form_data.grant_type = "oauth"
     logger.info(f"login attempt for: {form_data.username}")
     try:
-        l_response: dict = keycloak_client.token(form_data.username, form_data.password)
-        logger.info("Got keycloak response...")
-        l_parsed_creds = KeycloakTokenResponse(**l_response)
+        l_parsed_creds: KeycloakTokenResponse = await password_grants.do(
+            sha256(f"{form_data.username}\0{form_data.password}".encode()).digest(),
+            lambda: _parse_token_response(
+                keycloak_async_client.token(form_data.username, form_data.password)
+            ),
+        )
         logger.info("Parsed keycloak response...")
     except KeycloakConnectionError:
         raise HTTPException(
@@ -69,11 +126,7 @@ def login_for_access_token(
     except KeycloakAuthenticationError:
         raise credentials_exception
 
-    # This cookie is what will be expected to be provided by clients in the future when
-    # attempting to access 'protected' routes.
-    response.set_cookie(
-        key="access_token", value=f"Bearer {l_parsed_creds.access_token}", httponly=True
-    )
+    _set_token_cookies(response, l_parsed_creds)
 
     l_return: Dict[str, str] = {
         "access_token": l_parsed_creds.access_token,
@@ -83,12 +136,94 @@ def login_for_access_token(
     return l_return
 
 
-def get_current_user_from_token(
+@router.post("/refresh")
+async def refresh_access_token(
+    response: Response,
+    refresh_token: Optional[str] = Cookie(None),
+) -> Union[Dict[str, str], Response]:
+    """
+    Route exchanging the refresh_token cookie set at login for a new access token
+    without the user's credentials. The refresh_token cookie is renewed as well.
+    :param response: An HTTP response object
+    :param refresh_token: The refresh_token cookie
+    :return: A new access_token for the user
+    """
+    if not refresh_token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Missing refresh token. Please log in.",
+        )
+    try:
+        l_parsed_creds: KeycloakTokenResponse = await refresh_grants.do(
+            sha256(refresh_token.encode()).digest(),
+            lambda: _parse_token_response(
+                keycloak_async_client.refresh_token(refresh_token)
+            ),
+        )
+    except KeycloakConnectionError:
+        raise HTTPException(
+            status_code=status.HTTP_424_FAILED_DEPENDENCY,
+            detail="Failed to establish connection to authentication server",
+        )
+    except ValidationError:
+        raise HTTPException(
+            status_code=status.HTTP_424_FAILED_DEPENDENCY,
+            detail="Failed to de-serialize authentication payload. Please contact the system admins.",
+        )
+    except (KeycloakAuthenticationError, KeycloakPostError) as e:
+        if e.response_code >= 500:
+            raise HTTPException(
+                status_code=status.HTTP_424_FAILED_DEPENDENCY,
+                detail="The authentication server failed to refresh the session",
+            )
+        # Expired, revoked, or from an ended session; the cookie is of no further use
+        l_rejected = JSONResponse(
+            {"detail": "Refresh token invalid or expired. Please log in."},
+            status_code=status.HTTP_401_UNAUTHORIZED,
+        )
+        l_rejected.delete_cookie(refresh_cookie, path=refresh_cookie_path)
+        return l_rejected
+
+    _set_token_cookies(response, l_parsed_creds)
+    return {
+        "access_token": l_parsed_creds.access_token,
+        "token_type": "bearer",
+    }
+
+
+async def verified_claims(a_token: str) -> Dict[str, Any]:
+    """
+    Claims of an access token verified by this worker or shared by another
+
+    NOTE: The returned dict is shared with the caches and must not be mutated.
+    :param a_token: An encoded JWT
+    :return: The verified claims
+    :raises JWTError: If the token is malformed, expired, revoked, or fails verification
+    :raises KeycloakConnectionError: If the signing keys couldn't be loaded yet
+    """
+    l_claims: Optional[Dict[str, Any]] = token_verifier.cached(a_token)
+    if l_claims is not None:
+        return l_claims
+    l_digest: bytes = token_verifier.token_digest(a_token)
+    l_claims = await shared_auth_cache.get_claims(l_digest)
+    if l_claims is None:
+        # Signatures are only checked the first time any worker sees a token. That
+        # check may need to fetch keys from keycloak so it runs in the threadpool.
+        with track_dependency("token_verify"):
+            l_claims = await run_in_threadpool(token_verifier.verify, a_token)
+        await shared_auth_cache.set_claims(l_digest, l_claims)
+    return l_claims
+
+
+async def get_current_user_from_token(
     token: str = Depends(oauth2_schema),
+    a_db: AsyncSession = Depends(get_db),
 ) -> UserSchema:
     """
     Function to take a provided JWT and attempt to retrieve user information
     :param token: A JWT passed in from a REST endpoint
+    :param a_db: The request's database session, only used the first time a user is
+    seen by this worker
     :return: User information if valid; HTTP exception otherwise
     """
     if token is None:
@@ -97,16 +232,19 @@ def get_current_user_from_token(
             detail="Did not received an Authorization Bearer header with access token",
         )
     try:
-        l_token = keycloak_client.decode_token(
-            token,
-            key=core_config.KEYCLOAK_PUBLIC_KEY,
-            options=core_config.KEYCLOAK_DECRYPT_OPTIONS,
-        )
+        l_token: Dict[str, Any] = await verified_claims(token)
+        # Repeat requests of a known user skip the parsing and validation below
+        l_user: Optional[UserSchema] = user_cache.get(l_token.get("sub"))
+        if l_user is None:
+            l_user = await shared_auth_cache.get_user(l_token.get("sub"))
+        if l_user is not None:
+            return l_user
         try:
             logger.info(f"Login for {l_token['email']}")
         except KeyError:
             logger.warn(f"Unexpected keycloak token format: {l_token}")
-        l_token_parsed = KeycloakTokenDecoded(**l_token)
+        with span("auth.claims_parse"):
+            l_token_parsed = KeycloakTokenDecoded(**l_token)
     except KeycloakConnectionError:
         raise HTTPException(
             status_code=status.HTTP_418_IM_A_TEAPOT,
@@ -125,12 +263,63 @@ def get_current_user_from_token(
         )
     # Ensure valid tokens generate a User table entry if one doesn't already exist.
     try:
-        return UserSchema(
-            username=l_token_parsed.preferred_username,
-            email=l_token_parsed.email,
-        )
-    except (HTTPException, ValidationError):
+        with span("auth.user_validate"):
+            l_user = UserSchema(
+                username=l_token_parsed.preferred_username,
+                email=l_token_parsed.email,
+            )
+        with span("db.user_store"):
+            l_user = await user_cache.store(
+                a_db, l_token_parsed.sub, l_user, l_token_parsed.email_verified
+            )
+        await shared_auth_cache.set_user(l_token_parsed.sub, l_user, l_token_parsed.exp)
+        return l_user
+    except (HTTPException, ValidationError, IntegrityError):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Invalid login.",
         )
+
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT, response_class=Response)
+async def logout(
+    token: str = Depends(oauth2_schema),
+    refresh_token: Optional[str] = Cookie(None),
+) -> Response:
+    """
+    Revoke the access token on every worker and node, end the keycloak session of the
+    refresh_token cookie, and clear both cookies. Without the shared auth cache
+    (AUTH_CACHE_REDIS=false) the access token isn't revoked, only its cookie cleared.
+    :param token: The JWT being logged out
+    :param refresh_token: The refresh_token cookie, if any
+    :return: An empty response
+    """
+    try:
+        l_claims: Dict[str, Any] = await verified_claims(token)
+    except KeycloakConnectionError:
+        raise HTTPException(
+            status_code=status.HTTP_418_IM_A_TEAPOT,
+            detail="Couldn't connect to keycloak",
+        )
+    except JWTError:
+        raise credentials_exception
+    l_revoked: bool = await shared_auth_cache.revoke(
+        token_verifier.token_digest(token), l_claims
+    )
+    if shared_auth_cache.enabled and not l_revoked:
+        # The token would remain valid; let the client retry rather than believe it's
+        # logged out
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Logout couldn't be recorded. Please try again.",
+        )
+    if refresh_token:
+        try:
+            await keycloak_async_client.logout(refresh_token)
+        except (KeycloakConnectionError, KeycloakOperationError) as e:
+            # The cookie is cleared regardless; the session ends when it expires
+            logger.warning(f"Couldn't end the keycloak session on logout: {e!r}")
+    l_response = Response(status_code=status.HTTP_204_NO_CONTENT)
+    l_response.delete_cookie("access_token")
+    l_response.delete_cookie(refresh_cookie, path=refresh_cookie_path)
+    return l_response
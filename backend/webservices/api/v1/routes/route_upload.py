@@ -1,48 +1,652 @@
-"""
-Batch data ingest
-"""
-from datetime import datetime
-
-from fastapi import APIRouter
-from fastapi import BackgroundTasks
-from fastapi import Depends
-from fastapi import File
-from fastapi import status
-from fastapi import UploadFile
-from webservices.api.v1.routes.route_login import get_current_user_from_token
-from webservices.core.config import core_logger as logger
-from webservices.schemas.files import IngestFileResponse
-from webservices.schemas.users import UserSchema
-
-router = APIRouter()
-
-
-@router.post(
-    "/upload",
-    response_model=IngestFileResponse,
-    status_code=status.HTTP_201_CREATED,
-)
-async def ingest_file(
-        background_tasks: BackgroundTasks,
-        a_file: UploadFile = File(),
-        a_user: UserSchema = Depends(get_current_user_from_token),
-):
-    """
-    Batch file ingest route.
-
-    UploadFile has the following parts:
-    1. filename: A str with the original file name that was uploaded (e.g. myimage.jpg).
-    2. content_type: A str with the content type (MIME type / media type)
-        (e.g. image/jpeg).
-    3. file: A SpooledTemporaryFile (a file-like object). This is the actual Python file
-        that you can pass directly to other functions or libraries that expect a
-        "file-like" object.
-
-    """
-    # Do cyber-tastic stuff with a_file
-    logger.info(f"{a_file.filename} uploaded by {a_user.email}")
-    return IngestFileResponse(
-        timestamp=datetime.now(),
-        filename=a_file.filename,
-        user_email=a_user.email,
-    )
+"""
+Batch data ingest
+"""
+from asyncio import TimeoutError as AsyncTimeoutError
+from datetime import datetime
+from pathlib import Path as FilePath
+from time import perf_counter
+from typing import Any
+from typing import AsyncIterator
+from typing import Dict
+from typing import List
+from typing import Optional
+from uuid import UUID
+from uuid import uuid4
+
+from fastapi import APIRouter
+from fastapi import Depends
+from fastapi import HTTPException
+from fastapi import Path
+from fastapi import Query
+from fastapi import Request
+from fastapi import Response
+from fastapi import status
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from webservices.api.v1.routes.route_login import get_current_user_from_token
+from webservices.core.blobstore import content_store
+from webservices.core.blobstore import ContentStore
+from webservices.core.blobstore import ContentStoreSink
+from webservices.core.blobstore import DigestSink
+from webservices.core.candump import CandumpParser
+from webservices.core.candump import CandumpSink
+from webservices.core.config import core_config
+from webservices.core.config import core_logger as logger
+from webservices.core.ingest import bounded_chunks
+from webservices.core.ingest import DecompressedTooLarge
+from webservices.core.ingest import DecompressingStream
+from webservices.core.ingest import ingest_stream
+from webservices.core.ingest import IngestError
+from webservices.core.ingest import IngestSink
+from webservices.core.ingest import IngestStats
+from webservices.core.ingest import MultipartFileStream
+from webservices.core.ingest import UnsupportedEncoding
+from webservices.core.metrics import track_dependency
+from webservices.core.ratelimit import rate_limiter
+from webservices.core.ratelimit import upload_admission
+from webservices.core.upload_sessions import upload_session_store
+from webservices.core.upload_sessions import UploadSession
+from webservices.core.upload_sessions import UploadSessionNotFound
+from webservices.core.upload_sessions import UploadSessionStore
+from webservices.database import repository
+from webservices.database.frames import FrameCopyError
+from webservices.database.frames import FrameCopySink
+from webservices.database.frames import FrameCopyWriter
+from webservices.database.session import get_db
+from webservices.schemas.files import IngestFileResponse
+from webservices.schemas.files import UploadPartResponse
+from webservices.schemas.files import UploadSessionResponse
+from webservices.schemas.users import UserSchema
+from webservices.worker.tasks import ingest_stored_file
+
+router = APIRouter()
+
+# Name of the form field carrying the file in multipart/form-data uploads
+upload_field_name: str = "a_file"
+
+part_request_body: dict = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/octet-stream": {
+                "schema": {"type": "string", "format": "binary"}
+            }
+        },
+    }
+}
+
+upload_request_body: dict = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/octet-stream": {
+                "schema": {"type": "string", "format": "binary"}
+            },
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        upload_field_name: {"type": "string", "format": "binary"}
+                    },
+                    "required": [upload_field_name],
+                }
+            },
+        },
+    }
+}
+
+
+def get_candump_sink() -> CandumpSink:
+    """
+    Dependency providing the parser turning uploaded lines into columnar frame batches.
+    With INGEST_PERSIST_FRAMES the batches are also copied into the can_frames table,
+    unless INGEST_USE_CELERY hands that to the ingest job.
+    :return: A CandumpSink, fresh for each upload
+    """
+    l_parser: CandumpParser = CandumpParser.from_config(core_config)
+    if core_config.INGEST_PERSIST_FRAMES and not core_config.INGEST_USE_CELERY:
+        return FrameCopySink(l_parser, FrameCopyWriter.from_config(core_config))
+    return CandumpSink(l_parser)
+
+
+def get_content_store() -> ContentStore:
+    """
+    Dependency providing the content-addressed store uploads are deduplicated in
+    :return: The shared ContentStore
+    """
+    return content_store
+
+
+def get_upload_session_store() -> UploadSessionStore:
+    """
+    Dependency providing the store of resumable upload sessions
+    :return: The shared UploadSessionStore
+    """
+    return upload_session_store
+
+
+def get_ingest_sinks() -> List[IngestSink]:
+    """
+    Dependency providing additional destinations for uploaded data. Override this
+    dependency to plug in other sinks.
+    :return: A list of IngestSink instances, fresh for each upload
+    """
+    return []
+
+
+async def limit_upload_rate(
+    a_user: UserSchema = Depends(get_current_user_from_token),
+) -> None:
+    """
+    Dependency taking a token from the user's upload rate limit bucket
+    :param a_user: The uploading user
+    :raises RateLimited: If the user started too many uploads lately
+    """
+    await rate_limiter.check("upload", a_user.email)
+
+
+async def admit_upload(
+    a_request: Request, a_user: UserSchema = Depends(get_current_user_from_token)
+) -> AsyncIterator[None]:
+    """
+    Dependency holding the upload's share of the concurrent upload limits, from before
+    its body is read until the response is sent
+    :param a_request: The upload, whose Content-Length is reserved
+    :param a_user: The uploading user
+    :raises RateLimited: If the user or the worker has too many uploads in flight
+    """
+    l_length: Optional[int] = None
+    try:
+        l_length = int(a_request.headers["content-length"])
+    except (KeyError, ValueError):
+        pass
+    async with upload_admission.admit(a_user.email, l_length):
+        yield
+
+
+ingest_responses: dict = {
+    status.HTTP_200_OK: {
+        "model": IngestFileResponse,
+        "description": "An identical file was already uploaded; nothing was queued",
+    },
+    status.HTTP_202_ACCEPTED: {
+        "model": IngestFileResponse,
+        "description": "File received and queued for background ingest",
+    },
+}
+
+
+@router.post(
+    "/upload",
+    response_model=IngestFileResponse,
+    status_code=status.HTTP_201_CREATED,
+    openapi_extra=upload_request_body,
+    responses=ingest_responses,
+    dependencies=[Depends(limit_upload_rate), Depends(admit_upload)],
+)
+async def ingest_file(
+    a_request: Request,
+    a_response: Response,
+    filename: Optional[str] = Query(
+        None, description="Name of the uploaded file for raw (non-form) bodies"
+    ),
+    a_candump: CandumpSink = Depends(get_candump_sink),
+    a_store: ContentStore = Depends(get_content_store),
+    a_sinks: List[IngestSink] = Depends(get_ingest_sinks),
+    a_db: AsyncSession = Depends(get_db),
+    a_user: UserSchema = Depends(get_current_user_from_token),
+):
+    """
+    Batch file ingest route.
+
+    The body is either the raw file (e.g. application/octet-stream with the name in
+    the filename query parameter) or a multipart/form-data form with the file in the
+    'a_file' field. Either way it is read directly from the connection in bounded size
+    chunks, framed into lines, and streamed into the ingest sinks without being spooled
+    to disk or buffered in memory.
+
+    The file may be compressed with gzip, xz, or zstd, either declared with the
+    Content-Encoding header (raw bodies only) or recognized by its leading bytes. It's
+    decompressed as it streams in and rejected with 413 if it expands beyond
+    INGEST_MAX_DECOMPRESSED_BYTES. The response reports the format and the compressed
+    size; all other counts are of the decompressed file.
+
+    When INGEST_USE_CELERY is set the file is hashed while it's written once to the
+    content-addressed store (see webservices.core.blobstore), an ingest job is queued,
+    and 202 is returned with the job_id to poll at /v1/jobs/{job_id}. If the store
+    already held an identical file nothing is queued and 200 is returned with
+    dedup_hit set. Otherwise lines are parsed inline into columnar CAN frame batches
+    (see webservices.core.candump) and 201 is returned with the frame counts.
+
+    With INGEST_PERSIST_FRAMES the parsed frames are copied into the can_frames table
+    (see webservices.database.frames), by the job or inline, and capture_id and
+    rows_per_second are reported with the frame counts.
+    """
+    l_store_sink: Optional[ContentStoreSink] = None
+    l_primary_sink: IngestSink = a_candump
+    if core_config.INGEST_USE_CELERY:
+        l_store_sink = a_store.sink()
+        l_primary_sink = l_store_sink
+
+    l_chunks: AsyncIterator[bytes] = a_request.stream()
+    l_form_stream: Optional[MultipartFileStream] = None
+    l_content_encoding: Optional[str] = a_request.headers.get("content-encoding")
+    try:
+        l_content_type: str = a_request.headers.get("content-type", "")
+        if l_content_type.startswith("multipart/form-data"):
+            if l_content_encoding:
+                raise UnsupportedEncoding(
+                    "Compress the file rather than the multipart/form-data body"
+                )
+            l_form_stream = MultipartFileStream(
+                l_chunks, l_content_type, upload_field_name
+            )
+            l_chunks = l_form_stream.__aiter__()
+        l_decompressing = DecompressingStream(
+            l_chunks,
+            l_content_encoding,
+            core_config.INGEST_MAX_DECOMPRESSED_BYTES,
+            core_config.INGEST_CHUNK_SIZE_BYTES,
+        )
+        l_stats: IngestStats = await ingest_stream(
+            bounded_chunks(
+                l_decompressing.__aiter__(), core_config.INGEST_CHUNK_SIZE_BYTES
+            ),
+            [l_primary_sink, *a_sinks],
+            a_max_line_length=core_config.INGEST_MAX_LINE_BYTES,
+        )
+    except UnsupportedEncoding as e:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=f"{e}"
+        )
+    except DecompressedTooLarge as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"{e}"
+        )
+    except IngestError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{e}")
+    except FrameCopyError as e:
+        logger.error(f"Unable to persist uploaded frames: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Unable to store the uploaded frames. Try again later.",
+        )
+    l_filename: Optional[str] = filename
+    if l_form_stream is not None and l_form_stream.filename:
+        l_filename = l_form_stream.filename
+
+    l_filename = l_filename or "upload"
+
+    l_response: IngestFileResponse = IngestFileResponse(
+        timestamp=datetime.now(),
+        filename=l_filename,
+        user_email=a_user.email,
+        byte_count=l_stats.byte_count,
+        line_count=l_stats.line_count,
+        elapsed_seconds=l_stats.elapsed_seconds,
+        frame_count=a_candump.frame_count,
+        rejected_line_count=a_candump.rejected_count,
+    )
+    if l_decompressing.encoding is not None:
+        l_response.content_encoding = l_decompressing.encoding
+        l_response.compressed_byte_count = l_decompressing.compressed_byte_count
+    _report_capture(a_candump, l_response)
+    if l_store_sink is not None:
+        await _hand_off_stored_file(
+            a_store, l_store_sink.digest, l_store_sink.dedup_hit, l_response, a_response
+        )
+
+    logger.info(
+        f"{l_filename} uploaded by {a_user.email}: {l_stats.byte_count} bytes "
+        f"({l_response.content_encoding or 'uncompressed'}), "
+        f"{l_stats.line_count} lines in {l_stats.elapsed_seconds:.3f}s. "
+        f"digest: {l_response.digest} dedup_hit: {l_response.dedup_hit} "
+        f"job_id: {l_response.job_id}"
+    )
+    await _record_ingest(a_db, l_response, a_user)
+    return l_response
+
+
+@router.post(
+    "/sessions",
+    response_model=UploadSessionResponse,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(limit_upload_rate)],
+)
+async def create_upload_session(
+    filename: str = Query(..., description="Name of the file being uploaded"),
+    a_sessions: UploadSessionStore = Depends(get_upload_session_store),
+    a_user: UserSchema = Depends(get_current_user_from_token),
+) -> UploadSessionResponse:
+    """
+    Start a resumable upload.
+
+    Upload the file as parts numbered from 1 with PUT /sessions/{session_id}/parts/N.
+    Parts can be sent in any order and in parallel; a failed part is simply sent
+    again. GET /sessions/{session_id} reports the received parts and the contiguous
+    offset. POST /sessions/{session_id}/complete ingests the parts concatenated in
+    order, exactly like a single /upload of the whole file. Unfinished sessions
+    expire after INGEST_SESSION_TTL_SEC.
+    """
+    l_session: UploadSession = await run_in_threadpool(
+        a_sessions.create, a_user.email, filename
+    )
+    return _session_response(l_session)
+
+
+@router.get(
+    "/sessions/{session_id}",
+    response_model=UploadSessionResponse,
+    status_code=status.HTTP_200_OK,
+)
+async def get_upload_session(
+    session_id: UUID,
+    a_sessions: UploadSessionStore = Depends(get_upload_session_store),
+    a_user: UserSchema = Depends(get_current_user_from_token),
+) -> UploadSessionResponse:
+    """
+    Report the parts received for a resumable upload
+    """
+    l_session: UploadSession = await _get_session(a_sessions, session_id, a_user)
+    return _session_response(l_session)
+
+
+@router.put(
+    "/sessions/{session_id}/parts/{part_number}",
+    response_model=UploadPartResponse,
+    status_code=status.HTTP_200_OK,
+    openapi_extra=part_request_body,
+    dependencies=[Depends(admit_upload)],
+)
+async def upload_session_part(
+    a_request: Request,
+    session_id: UUID,
+    part_number: int = Path(..., ge=1),
+    a_sessions: UploadSessionStore = Depends(get_upload_session_store),
+    a_user: UserSchema = Depends(get_current_user_from_token),
+) -> UploadPartResponse:
+    """
+    Upload one part of a resumable upload as the raw request body. Sending a part
+    number again replaces the part.
+    """
+    l_session: UploadSession = await _get_session(a_sessions, session_id, a_user)
+    try:
+        l_size: int = await a_sessions.write_part(
+            l_session,
+            part_number,
+            bounded_chunks(a_request.stream(), core_config.INGEST_CHUNK_SIZE_BYTES),
+        )
+    except UploadSessionNotFound as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{e}")
+    except IngestError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{e}")
+    return UploadPartResponse(part_number=part_number, size=l_size)
+
+
+@router.delete(
+    "/sessions/{session_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    response_class=Response,
+)
+async def delete_upload_session(
+    session_id: UUID,
+    a_sessions: UploadSessionStore = Depends(get_upload_session_store),
+    a_user: UserSchema = Depends(get_current_user_from_token),
+):
+    """
+    Abandon a resumable upload and discard its parts
+    """
+    l_session: UploadSession = await _get_session(a_sessions, session_id, a_user)
+    await run_in_threadpool(a_sessions.delete, l_session)
+
+
+@router.post(
+    "/sessions/{session_id}/complete",
+    response_model=IngestFileResponse,
+    status_code=status.HTTP_201_CREATED,
+    responses=ingest_responses,
+)
+async def complete_upload_session(
+    a_response: Response,
+    session_id: UUID,
+    a_candump: CandumpSink = Depends(get_candump_sink),
+    a_store: ContentStore = Depends(get_content_store),
+    a_sessions: UploadSessionStore = Depends(get_upload_session_store),
+    a_sinks: List[IngestSink] = Depends(get_ingest_sinks),
+    a_db: AsyncSession = Depends(get_db),
+    a_user: UserSchema = Depends(get_current_user_from_token),
+):
+    """
+    Ingest a resumable upload once all its parts were received. Responds like /upload.
+
+    When INGEST_USE_CELERY is set the parts are read once to count lines and hash them,
+    concatenated in the kernel (copy_file_range) into the content-addressed store, and
+    handed to a background job. Otherwise they're streamed through the inline parser.
+    """
+    l_session: UploadSession = await _get_session(a_sessions, session_id, a_user)
+    l_missing: List[int] = l_session.missing_parts()
+    if not l_session.parts or l_missing:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Upload session is missing parts: {l_missing or [1]}",
+        )
+
+    l_start: float = perf_counter()
+    # Framed even without any line oriented sink so line_count is reported
+    l_sinks: List[IngestSink] = list(a_sinks)
+    l_digest_sink: Optional[DigestSink] = None
+    l_staged: Optional[FilePath] = None
+    if core_config.INGEST_USE_CELERY:
+        # Hashed as the parts are read so the assembled file is never read back
+        l_digest_sink = DigestSink()
+        l_sinks.insert(0, l_digest_sink)
+        l_staged = a_store.staging_dir / uuid4().hex
+    else:
+        l_sinks.insert(0, a_candump)
+    try:
+        l_stats: IngestStats = await ingest_stream(
+            a_sessions.read_parts(
+                l_session, core_config.INGEST_CHUNK_SIZE_BYTES, l_staged
+            ),
+            l_sinks,
+            a_max_line_length=core_config.INGEST_MAX_LINE_BYTES,
+        )
+        if l_digest_sink is not None:
+            l_stored: bool = await run_in_threadpool(
+                a_store.commit, l_staged, l_digest_sink.digest
+            )
+    except IngestError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{e}")
+    except FrameCopyError as e:
+        logger.error(f"Unable to persist uploaded frames: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Unable to store the uploaded frames. Try again later.",
+        )
+    finally:
+        # Already gone once committed
+        if l_staged is not None:
+            l_staged.unlink(missing_ok=True)
+    l_stats.elapsed_seconds = perf_counter() - l_start
+
+    l_response: IngestFileResponse = IngestFileResponse(
+        timestamp=datetime.now(),
+        filename=l_session.filename,
+        user_email=a_user.email,
+        byte_count=l_stats.byte_count,
+        line_count=l_stats.line_count,
+        elapsed_seconds=l_stats.elapsed_seconds,
+        frame_count=a_candump.frame_count,
+        rejected_line_count=a_candump.rejected_count,
+    )
+    _report_capture(a_candump, l_response)
+    if l_digest_sink is not None:
+        await _hand_off_stored_file(
+            a_store, l_digest_sink.digest, not l_stored, l_response, a_response
+        )
+    # Kept until here so a failed completion can be retried
+    await run_in_threadpool(a_sessions.delete, l_session)
+
+    logger.info(
+        f"{l_session.filename} assembled from {len(l_session.parts)} parts for "
+        f"{a_user.email}: {l_stats.byte_count} bytes in "
+        f"{l_stats.elapsed_seconds:.3f}s. digest: {l_response.digest} "
+        f"dedup_hit: {l_response.dedup_hit} job_id: {l_response.job_id}"
+    )
+    await _record_ingest(a_db, l_response, a_user)
+    return l_response
+
+
+async def _record_ingest(
+    a_db: AsyncSession, a_ingest: IngestFileResponse, a_user: UserSchema
+) -> None:
+    """
+    Store the upload's metadata. The file was already accepted at this point, so a
+    database outage is logged rather than failing the upload.
+    :param a_db: The request's database session
+    :param a_ingest: The upload response to record
+    :param a_user: The uploading user
+    """
+    try:
+        with track_dependency("database"):
+            repository.add_ingest_record(a_db, a_ingest, a_user.id)
+            await a_db.commit()
+    except (SQLAlchemyError, OSError, AsyncTimeoutError) as e:
+        logger.error(f"Unable to record ingest of {a_ingest.filename}: {e}")
+
+
+async def _get_session(
+    a_sessions: UploadSessionStore, a_session_id: UUID, a_user: UserSchema
+) -> UploadSession:
+    """
+    :param a_sessions: The upload session store
+    :param a_session_id: The requested session
+    :param a_user: The authenticated user
+    :return: The session; HTTP exception if it doesn't exist or isn't the user's
+    """
+    l_session: Optional[UploadSession] = await run_in_threadpool(
+        a_sessions.get, a_session_id.hex, a_user.email
+    )
+    if l_session is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Upload session {a_session_id.hex} not found",
+        )
+    return l_session
+
+
+def _session_response(a_session: UploadSession) -> UploadSessionResponse:
+    """
+    :param a_session: An upload session
+    :return: The session's response schema
+    """
+    return UploadSessionResponse(
+        session_id=a_session.session_id,
+        filename=a_session.filename,
+        created_at=datetime.fromtimestamp(a_session.created_at),
+        expires_at=datetime.fromtimestamp(a_session.expires_at),
+        offset=a_session.offset,
+        byte_count=a_session.byte_count,
+        parts=[
+            UploadPartResponse(part_number=n, size=a_session.parts[n])
+            for n in sorted(a_session.parts)
+        ],
+        missing_parts=a_session.missing_parts(),
+    )
+
+
+async def _hand_off_stored_file(
+    a_store: ContentStore,
+    a_digest: str,
+    a_dedup_hit: bool,
+    a_ingest_response: IngestFileResponse,
+    a_response: Response,
+) -> None:
+    """
+    Queue background ingest of a file added to the content store, or report the
+    results of the original upload if the store already had it
+    :param a_store: The content store holding the file
+    :param a_digest: The file's content digest
+    :param a_dedup_hit: True if the store already had the file
+    :param a_ingest_response: The upload response to update
+    :param a_response: The HTTP response to set the status code on
+    """
+    a_ingest_response.digest = a_digest
+    a_ingest_response.dedup_hit = a_dedup_hit
+    if a_dedup_hit:
+        await _report_dedup_hit(a_store, a_ingest_response)
+        a_response.status_code = status.HTTP_200_OK
+    else:
+        a_ingest_response.job_id = await _queue_ingest_job(a_store, a_ingest_response)
+        a_response.status_code = status.HTTP_202_ACCEPTED
+
+
+async def _queue_ingest_job(
+    a_store: ContentStore, a_ingest_response: IngestFileResponse
+) -> str:
+    """
+    Queue background ingest of a file newly added to the content store
+    :param a_store: The content store holding the file
+    :param a_ingest_response: The upload response
+    :return: The queued job's ID
+    """
+    l_job_id: str = str(uuid4())
+    l_digest: str = a_ingest_response.digest
+    try:
+        # Recording the job and publishing to the broker are blocking calls
+        await run_in_threadpool(
+            a_store.write_record,
+            l_digest,
+            {"job_id": l_job_id, "user_email": a_ingest_response.user_email},
+        )
+        await run_in_threadpool(
+            ingest_stored_file.apply_async,
+            args=(l_digest, a_ingest_response.filename, a_ingest_response.user_email),
+            task_id=l_job_id,
+        )
+    except Exception as e:
+        logger.error(f"Unable to queue ingest job {l_job_id}: {e}")
+        # Withdraw the file so it isn't mistaken for a processed one
+        await run_in_threadpool(a_store.discard, l_digest)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Unable to queue the ingest job. Try again later.",
+        )
+    return l_job_id
+
+
+async def _report_dedup_hit(
+    a_store: ContentStore, a_ingest_response: IngestFileResponse
+) -> None:
+    """
+    Fill in the results, if available, of the upload a dedup hit matched, and its job
+    if the same user queued it. Only that user can read the job at /v1/jobs.
+    :param a_store: The content store holding the file
+    :param a_ingest_response: The upload response to update
+    """
+    l_record: Dict[str, Any] = (
+        await run_in_threadpool(a_store.read_record, a_ingest_response.digest) or {}
+    )
+    l_result: Dict[str, Any] = l_record.get("result") or {}
+    l_owner: Optional[str] = l_record.get("user_email") or l_result.get("user_email")
+    if l_owner == a_ingest_response.user_email:
+        a_ingest_response.job_id = l_record.get("job_id")
+    a_ingest_response.frame_count = l_result.get("frame_count", 0)
+    a_ingest_response.rejected_line_count = l_result.get("rejected_line_count", 0)
+    a_ingest_response.capture_id = l_result.get("capture_id")
+    a_ingest_response.rows_per_second = l_result.get("rows_per_second")
+
+
+def _report_capture(
+    a_candump: CandumpSink, a_ingest_response: IngestFileResponse
+) -> None:
+    """
+    Fill in the capture the upload's frames were persisted in, if any
+    :param a_candump: The upload's parser sink
+    :param a_ingest_response: The upload response to update
+    """
+    if not isinstance(a_candump, FrameCopySink) or a_candump.writer.stats is None:
+        return
+    a_ingest_response.capture_id = a_candump.writer.stats.capture_id
+    a_ingest_response.rows_per_second = a_candump.writer.stats.rows_per_second
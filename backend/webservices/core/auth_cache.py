@@ -0,0 +1,280 @@
+"""
+Redis backed second level of the per-worker token and user caches, shared by every
+worker and node.
+
+A token verified by one worker, and the user resolved from it, are written to Redis so
+other workers skip the signature check, claim parsing, and database round trip the
+first time they see the token too. Entries are msgpack encoded and expire with the
+token ('exp'); users also after USER_CACHE_TTL_SEC.
+
+Revoking a token (e.g. on logout) stores a marker until the token expires, so no
+worker accepts it again once it's gone from their own cache, and publishes it on the
+invalidation channel so every worker drops it from its own cache right away. Messages
+published while a worker isn't subscribed are lost, so a worker clears its own caches
+whenever it (re)subscribes.
+
+Redis being slow or down never fails a request: commands give up after
+AUTH_CACHE_REDIS_TIMEOUT_SEC and Redis is then skipped for AUTH_CACHE_REDIS_RETRY_SEC,
+tokens being verified by each worker alone. Revocations aren't shared during that time.
+"""
+import asyncio
+from time import time
+from typing import Any
+from typing import Dict
+from typing import Optional
+
+import msgpack
+from jose import JWTError
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+from redis.asyncio.client import PubSub
+from webservices.core import worker_state
+from webservices.core.config import core_config
+from webservices.core.config import core_logger as logger
+from webservices.core.jwks import token_verifier
+from webservices.core.jwks import TokenVerifier
+from webservices.core.redis_client import FailSoftRedis
+from webservices.core.redis_client import REDIS_ERRORS
+from webservices.core.user_cache import user_cache
+from webservices.core.user_cache import UserCache
+from webservices.schemas.users import UserSchema
+
+
+class SharedAuthCache:
+    """
+    Verified token claims and resolved users in Redis, behind a TokenVerifier's and a
+    UserCache's own caches
+    """
+
+    def __init__(
+        self,
+        a_redis: FailSoftRedis,
+        a_verifier: TokenVerifier,
+        a_users: UserCache,
+        a_user_ttl: float = 300.0,
+        a_prefix: str = "webservices:auth:1",
+    ):
+        """
+        :param a_redis: The Redis server shared by the workers
+        :param a_verifier: Holds the worker's verified tokens
+        :param a_users: Holds the worker's resolved users
+        :param a_user_ttl: Maximum seconds a user is kept
+        :param a_prefix: Prepended to the keys and the channel. The trailing version
+            is bumped when the encoding of the entries changes.
+        """
+        self.redis: FailSoftRedis = a_redis
+        self.verifier: TokenVerifier = a_verifier
+        self.users: UserCache = a_users
+        self.user_ttl: float = a_user_ttl
+        self.prefix: bytes = a_prefix.encode()
+        self.channel: bytes = self.prefix + b":invalidate"
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        """
+        :return: True if a Redis server is configured
+        """
+        return self.redis.enabled
+
+    def _token_key(self, a_digest: bytes) -> bytes:
+        return self.prefix + b":token:" + a_digest
+
+    def _revoked_key(self, a_digest: bytes) -> bytes:
+        return self.prefix + b":revoked:" + a_digest
+
+    def _user_key(self, a_subject: str) -> bytes:
+        return self.prefix + b":user:" + a_subject.encode()
+
+    async def get_claims(self, a_digest: bytes) -> Optional[Dict[str, Any]]:
+        """
+        Look up a token another worker verified, and remember it in this worker's
+        cache if found.
+
+        NOTE: The returned dict is shared with the cache and must not be mutated.
+        :param a_digest: The token's TokenVerifier.token_digest()
+        :return: The token's claims; None if not found
+        :raises JWTError: If the token was revoked
+        """
+        l_results = await self.redis.execute(
+            "look up a token",
+            lambda a_pipe: a_pipe.get(self._token_key(a_digest)).exists(
+                self._revoked_key(a_digest)
+            ),
+        )
+        if l_results is None:
+            return None
+        l_packed, l_revoked = l_results
+        if l_revoked:
+            raise JWTError("Access token revoked")
+        if l_packed is None:
+            return None
+        l_claims: Dict[str, Any] = msgpack.unpackb(l_packed)
+        self.verifier.cache.set(a_digest, l_claims, float(l_claims["exp"]))
+        return l_claims
+
+    async def set_claims(self, a_digest: bytes, a_claims: Dict[str, Any]) -> None:
+        """
+        Share a token this worker verified until it expires
+        :param a_digest: The token's TokenVerifier.token_digest()
+        :param a_claims: Its verified claims
+        """
+        l_ttl_ms: int = int((float(a_claims.get("exp", 0)) - time()) * 1000)
+        if l_ttl_ms > 0:
+            await self.redis.execute(
+                "share a token",
+                lambda a_pipe: a_pipe.set(
+                    self._token_key(a_digest), msgpack.packb(a_claims), px=l_ttl_ms
+                ),
+            )
+
+    async def get_user(self, a_subject: Optional[str]) -> Optional[UserSchema]:
+        """
+        Look up a user another worker resolved, and remember it in this worker's cache
+        if found.
+
+        NOTE: The returned UserSchema is shared with the cache and must not be mutated.
+        :param a_subject: The token's 'sub' claim
+        :return: The user; None if not found
+        """
+        if a_subject is None:
+            return None
+        l_key: bytes = self._user_key(a_subject)
+        l_results = await self.redis.execute(
+            "look up a user", lambda a_pipe: a_pipe.get(l_key).pttl(l_key)
+        )
+        if l_results is None or l_results[0] is None:
+            return None
+        # Validated before it was shared
+        l_user: UserSchema = UserSchema.construct(**msgpack.unpackb(l_results[0]))
+        self.users.cache.set(a_subject, l_user, time() + max(l_results[1], 0) / 1000)
+        return l_user
+
+    async def set_user(
+        self, a_subject: str, a_user: UserSchema, a_expires_at: float
+    ) -> None:
+        """
+        Share a user this worker resolved
+        :param a_subject: The token's 'sub' claim
+        :param a_user: The user, recorded in the users table
+        :param a_expires_at: The token's expiry (epoch seconds)
+        """
+        l_ttl_ms: int = int(min(a_expires_at - time(), self.user_ttl) * 1000)
+        if a_user.id is not None and l_ttl_ms > 0:
+            await self.redis.execute(
+                "share a user",
+                lambda a_pipe: a_pipe.set(
+                    self._user_key(a_subject), msgpack.packb(a_user.dict()), px=l_ttl_ms
+                ),
+            )
+
+    async def revoke(self, a_digest: bytes, a_claims: Dict[str, Any]) -> bool:
+        """
+        Reject a token everywhere from now on and have every worker forget it and its
+        user. This worker forgets them even if Redis can't be reached.
+        :param a_digest: The token's TokenVerifier.token_digest()
+        :param a_claims: Its verified claims
+        :return: True if other workers were told; False if Redis is disabled or failed
+        """
+        l_subject: Optional[str] = a_claims.get("sub")
+        self._forget(a_digest, l_subject)
+        l_ttl_ms: int = int((float(a_claims.get("exp", 0)) - time()) * 1000)
+
+        def _queue(a_pipe: Pipeline) -> None:
+            if l_ttl_ms > 0:
+                a_pipe.set(self._revoked_key(a_digest), b"1", px=l_ttl_ms)
+            a_pipe.delete(self._token_key(a_digest))
+            if l_subject is not None:
+                a_pipe.delete(self._user_key(l_subject))
+            # Sent last so no worker can re-read what's deleted above
+            a_pipe.publish(self.channel, msgpack.packb([a_digest, l_subject]))
+
+        return await self.redis.execute("revoke a token", _queue) is not None
+
+    def _forget(self, a_digest: Optional[bytes], a_subject: Optional[str]) -> None:
+        if a_digest is not None:
+            self.verifier.cache.pop(a_digest)
+        if a_subject is not None:
+            self.users.invalidate(a_subject)
+
+    def _forget_all(self) -> None:
+        self.verifier.cache.clear()
+        self.users.cache.clear()
+
+    async def _subscribe(self, a_pubsub: PubSub) -> None:
+        await a_pubsub.subscribe(self.channel)
+        # Revocations published while this worker wasn't subscribed were missed
+        self._forget_all()
+        while True:
+            l_message = await a_pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=self.redis.retry_interval
+            )
+            if l_message is not None:
+                l_digest, l_subject = msgpack.unpackb(l_message["data"])
+                self._forget(l_digest, l_subject)
+
+    async def _listen_loop(self) -> None:
+        while True:
+            # No socket timeout: the connection idles until a message is published,
+            # and the periodic health check notices if it's dead
+            l_redis = Redis.from_url(
+                self.redis.url,
+                socket_connect_timeout=self.redis.timeout,
+                health_check_interval=max(self.redis.retry_interval, 1.0),
+            )
+            l_pubsub: PubSub = l_redis.pubsub()
+            try:
+                await self._subscribe(l_pubsub)
+            except REDIS_ERRORS as e:
+                logger.warning(f"Shared auth cache invalidations interrupted: {e!r}")
+            finally:
+                await l_pubsub.close()
+                await l_redis.close()
+            await asyncio.sleep(self.redis.retry_interval)
+
+    async def start(self) -> None:
+        """
+        Startup handler: follow the invalidations published by other workers
+        """
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(
+                self._listen_loop(), name="auth-cache-invalidations"
+            )
+
+    async def stop(self) -> None:
+        """
+        Shutdown handler: stop following invalidations and close the connections
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        await self.redis.close()
+
+    def reset_after_fork(self) -> None:
+        """
+        Drop the connections and the task inherited from the parent process
+        """
+        self.redis.reset_after_fork()
+        self._task = None
+
+
+shared_auth_cache = SharedAuthCache(
+    FailSoftRedis(
+        "Shared auth cache",
+        (core_config.AUTH_CACHE_REDIS_URL or core_config.CELERY_BROKER_URL)
+        if core_config.AUTH_CACHE_REDIS
+        else None,
+        a_timeout=core_config.AUTH_CACHE_REDIS_TIMEOUT_SEC,
+        a_retry_interval=core_config.AUTH_CACHE_REDIS_RETRY_SEC,
+    ),
+    token_verifier,
+    user_cache,
+    a_user_ttl=core_config.USER_CACHE_TTL_SEC,
+)
+worker_state.register_after_fork(
+    "shared auth cache", shared_auth_cache.reset_after_fork
+)
@@ -0,0 +1,176 @@
+"""
+Adjust the number of gunicorn workers to the load they report.
+
+A thread in the gunicorn master periodically reads the statistics every worker
+publishes (see webservices.core.loadstats) and sends the master SIGTTIN to add a worker
+or SIGTTOU to remove one, within configured bounds. Capacity is added as soon as the
+workers' event loops fall behind or they hold many requests at once, and removed only
+after the load stayed low for a while, so bursts of uploads get workers quickly without
+the pool flapping.
+"""
+import os
+import signal
+from dataclasses import dataclass
+from logging import getLogger
+from pathlib import Path
+from statistics import mean
+from threading import Event
+from threading import Thread
+from time import monotonic
+from time import time
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from webservices.core.loadstats import read_all
+from webservices.core.loadstats import WorkerLoad
+
+logger = getLogger(__name__)
+
+
+@dataclass
+class AutoscalePolicy:
+    """
+    Bounds and thresholds of the autoscaler
+    """
+
+    min_workers: int
+    max_workers: int
+    # Average event loop lag above which a worker is added
+    lag_high_ms: float = 50.0
+    # Every worker's lag must be below this for a worker to be removed
+    lag_low_ms: float = 5.0
+    # Average concurrent requests per worker above which a worker is added
+    in_flight_high: float = 16.0
+    # Seconds after any change before the next one. Gives a new worker time to boot
+    # and take its share of the load.
+    scale_up_cooldown: float = 15.0
+    # Seconds the load must stay low before a worker is removed
+    scale_down_delay: float = 120.0
+    # Samples older than this many seconds are ignored
+    stale_after: float = 10.0
+
+
+class Autoscaler:
+    """
+    Decides on and requests changes to the number of workers
+    """
+
+    def __init__(
+        self,
+        a_policy: AutoscalePolicy,
+        a_stats_dir: Path,
+        a_worker_count: Callable[[], int],
+        a_master_pid: int,
+        a_interval: float = 2.0,
+    ):
+        """
+        :param a_policy: Bounds and thresholds
+        :param a_stats_dir: The directory the workers publish their statistics to
+        :param a_worker_count: Returns the master's current target number of workers
+        :param a_master_pid: Process the TTIN and TTOU signals are sent to
+        :param a_interval: Seconds between two decisions
+        """
+        self.policy: AutoscalePolicy = a_policy
+        self.stats_dir: Path = a_stats_dir
+        self._worker_count: Callable[[], int] = a_worker_count
+        self.master_pid: int = a_master_pid
+        self.interval: float = a_interval
+        self._last_change: float = monotonic()
+        self._idle_since: Optional[float] = None
+        self._stop: Event = Event()
+        self._thread: Optional[Thread] = None
+
+    def decide(self, a_loads: Dict[int, WorkerLoad], a_workers: int) -> int:
+        """
+        :param a_loads: The latest sample of every worker, keyed by pid
+        :param a_workers: The current target number of workers
+        :return: 1 to add a worker, -1 to remove one, 0 to keep the current count
+        """
+        l_policy: AutoscalePolicy = self.policy
+        if a_workers < l_policy.min_workers:
+            return 1
+        if a_workers > l_policy.max_workers:
+            return -1
+
+        l_now: float = monotonic()
+        l_oldest: float = time() - l_policy.stale_after
+        l_fresh: List[WorkerLoad] = [
+            l_load for l_load in a_loads.values() if l_load.updated_at >= l_oldest
+        ]
+        if not l_fresh:
+            self._idle_since = None
+            return 0
+        l_lag_ms: float = mean(
+            max(l_load.lag_ms, l_load.lag_last_ms) for l_load in l_fresh
+        )
+        l_in_flight: int = sum(l_load.in_flight_peak for l_load in l_fresh)
+        l_cooled_down: bool = l_now - self._last_change >= l_policy.scale_up_cooldown
+
+        if l_lag_ms >= l_policy.lag_high_ms or (
+            l_in_flight >= l_policy.in_flight_high * a_workers
+        ):
+            self._idle_since = None
+            if a_workers < l_policy.max_workers and l_cooled_down:
+                return 1
+            return 0
+
+        # Only shrink if the remaining workers would at most be half as busy as the
+        # threshold for growing again
+        if max(l_load.lag_ms for l_load in l_fresh) > l_policy.lag_low_ms or (
+            l_in_flight > l_policy.in_flight_high * (a_workers - 1) / 2
+        ):
+            self._idle_since = None
+            return 0
+        if self._idle_since is None:
+            self._idle_since = l_now
+        if (
+            a_workers > l_policy.min_workers
+            and l_cooled_down
+            and l_now - self._idle_since >= l_policy.scale_down_delay
+        ):
+            # Another full delay must pass before the next worker is removed
+            self._idle_since = l_now
+            return -1
+        return 0
+
+    def step(self) -> int:
+        """
+        Make a decision and signal the master accordingly
+        :return: The change requested, see decide()
+        """
+        l_workers: int = self._worker_count()
+        l_change: int = self.decide(read_all(self.stats_dir), l_workers)
+        if l_change:
+            logger.info(
+                f"Autoscaling from {l_workers} to {l_workers + l_change} workers"
+            )
+            self._last_change = monotonic()
+            os.kill(self.master_pid, signal.SIGTTIN if l_change > 0 else signal.SIGTTOU)
+        return l_change
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.step()
+            except Exception as e:
+                logger.error(f"Autoscaler step failed: {e}")
+
+    def start(self) -> None:
+        """
+        Start deciding in a background thread
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = Thread(target=self._run, name="autoscaler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background thread
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+        self._thread = None
@@ -0,0 +1,182 @@
+"""
+Content-addressed store for uploaded files.
+
+Files are stored once under the hex SHA-256 digest of their content at
+<root>/ab/cd/<digest> (the first two byte pairs of the digest fan the files out over
+directories). The digest is computed while the upload streams in, so a file that's
+uploaded again is recognized without reading it back, and neither stored nor
+processed a second time.
+
+Each stored file has a <digest>.json record next to it holding the ID of the job that
+processed it, the email of the user who uploaded it first, and, once that job
+finished, its result.
+"""
+import json
+import re
+from hashlib import sha256
+from os import link
+from os import replace
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Optional
+from uuid import uuid4
+
+from starlette.concurrency import run_in_threadpool
+from webservices.core.config import core_config
+from webservices.core.ingest import IngestSink
+from webservices.core.ingest import StagingFileSink
+
+_DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ContentStore:
+    """
+    Directory of files named by the digest of their content
+    """
+
+    def __init__(self, a_root: Path, a_staging_dir: Path):
+        """
+        :param a_root: Top level directory of the store
+        :param a_staging_dir: Directory for files still being received. Must be on the
+        same filesystem as a_root.
+        """
+        self.root: Path = a_root
+        self.staging_dir: Path = a_staging_dir
+
+    def path_for(self, a_digest: str) -> Path:
+        """
+        :param a_digest: Hex SHA-256 digest of a file's content
+        :return: Location of the file in the store
+        :raises ValueError: If a_digest isn't a hex SHA-256 digest
+        """
+        if not _DIGEST_PATTERN.match(a_digest):
+            raise ValueError(f"Invalid content digest: {a_digest}")
+        return self.root / a_digest[0:2] / a_digest[2:4] / a_digest
+
+    def record_path_for(self, a_digest: str) -> Path:
+        """
+        :param a_digest: Hex SHA-256 digest of a file's content
+        :return: Location of the file's processing record
+        """
+        return self.path_for(a_digest).with_suffix(".json")
+
+    def contains(self, a_digest: str) -> bool:
+        """
+        :param a_digest: Hex SHA-256 digest of a file's content
+        :return: True if a file with this digest is stored
+        """
+        return self.path_for(a_digest).is_file()
+
+    def commit(self, a_path: Path, a_digest: str) -> bool:
+        """
+        Move a completely received file into the store. The file is hard linked into
+        place so exactly one of several concurrent uploads of the same content wins.
+        :param a_path: The received file. Removed in any case.
+        :param a_digest: Hex SHA-256 digest of the file's content
+        :return: True if the file was stored, False if it was already present
+        """
+        l_blob: Path = self.path_for(a_digest)
+        l_blob.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            link(a_path, l_blob)
+        except FileExistsError:
+            return False
+        finally:
+            a_path.unlink(missing_ok=True)
+        return True
+
+    def discard(self, a_digest: str) -> None:
+        """
+        Remove a file and its record so the next upload of it is processed again
+        :param a_digest: Hex SHA-256 digest of the file's content
+        """
+        self.record_path_for(a_digest).unlink(missing_ok=True)
+        self.path_for(a_digest).unlink(missing_ok=True)
+
+    def read_record(self, a_digest: str) -> Optional[Dict[str, Any]]:
+        """
+        :param a_digest: Hex SHA-256 digest of a file's content
+        :return: The file's processing record or None if there isn't one (yet)
+        """
+        try:
+            with open(self.record_path_for(a_digest), "rb") as l_file:
+                return json.load(l_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def write_record(self, a_digest: str, a_record: Dict[str, Any]) -> None:
+        """
+        Atomically replace a file's processing record
+        :param a_digest: Hex SHA-256 digest of the file's content
+        :param a_record: JSON serializable record
+        """
+        l_path: Path = self.record_path_for(a_digest)
+        l_partial: Path = l_path.with_name(f"{l_path.name}.{uuid4().hex}.part")
+        with open(l_partial, "w") as l_file:
+            json.dump(a_record, l_file)
+        replace(l_partial, l_path)
+
+    def sink(self) -> "ContentStoreSink":
+        """
+        :return: An IngestSink adding an upload to this store
+        """
+        return ContentStoreSink(self)
+
+
+class DigestSink(IngestSink):
+    """
+    Hash an upload as it streams through, for content that reaches the store by other
+    means (see ContentStore.commit). After close() digest holds the content digest.
+    """
+
+    def __init__(self):
+        self._hash = sha256()
+        self.digest: Optional[str] = None
+
+    async def write_chunk(self, a_chunk: bytes) -> None:
+        self._hash.update(a_chunk)
+
+    async def close(self) -> None:
+        self.digest = self._hash.hexdigest()
+
+
+class ContentStoreSink(StagingFileSink):
+    """
+    Stage an upload while hashing it, then commit it to a ContentStore. After close()
+    digest holds the content digest and dedup_hit tells whether the store already
+    had the file.
+    """
+
+    def __init__(self, a_store: ContentStore):
+        """
+        :param a_store: The store receiving the upload
+        """
+        super().__init__(a_store.staging_dir / uuid4().hex)
+        self._store: ContentStore = a_store
+        self._hash = sha256()
+        self.digest: Optional[str] = None
+        self.dedup_hit: bool = False
+
+    async def write_chunk(self, a_chunk: bytes) -> None:
+        self._hash.update(a_chunk)
+        await super().write_chunk(a_chunk)
+
+    async def close(self) -> None:
+        await super().close()
+        self.digest = self._hash.hexdigest()
+        l_stored: bool = await run_in_threadpool(
+            self._store.commit, self.path, self.digest
+        )
+        self.dedup_hit = not l_stored
+
+    async def abort(self) -> None:
+        await super().abort()
+        # Withdraw a file this upload added so it isn't mistaken for a processed one
+        if self.digest is not None and not self.dedup_hit:
+            await run_in_threadpool(self._store.discard, self.digest)
+
+
+content_store = ContentStore(
+    Path(core_config.INGEST_STORE_DIR), Path(core_config.INGEST_STAGING_DIR)
+)
@@ -0,0 +1,106 @@
+"""
+Small in-process caching primitives shared by the API layer.
+
+These caches are per-process. Under gunicorn each worker keeps its own copy.
+"""
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from typing import Generic
+from typing import Hashable
+from typing import Optional
+from typing import Tuple
+from typing import TypeVar
+
+T = TypeVar("T")
+
+
+class TTLCache(Generic[T]):
+    """
+    Thread safe, size bounded LRU cache where every entry carries its own absolute
+    expiry timestamp (seconds since epoch).
+    """
+
+    def __init__(self, max_size: int = 4096, default_ttl: float = 300.0):
+        """
+        :param max_size: Maximum number of entries kept before evicting the least
+            recently used entry
+        :param default_ttl: Lifetime in seconds used when set() isn't given an explicit
+            expiry
+        """
+        self.max_size: int = max(int(max_size), 1)
+        self.default_ttl: float = default_ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, T]]" = OrderedDict()
+        self._lock: Lock = Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, a_key: Hashable) -> Optional[T]:
+        """
+        Retrieve a cached value
+        :param a_key: The cache key
+        :return: The cached value if present and not expired; None otherwise
+        """
+        with self._lock:
+            l_entry = self._entries.get(a_key)
+            if l_entry is None:
+                self.misses += 1
+                return None
+            l_expires_at, l_value = l_entry
+            if l_expires_at <= time():
+                del self._entries[a_key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(a_key)
+            self.hits += 1
+            return l_value
+
+    def set(
+        self, a_key: Hashable, a_value: T, a_expires_at: Optional[float] = None
+    ) -> None:
+        """
+        Store a value
+        :param a_key: The cache key
+        :param a_value: The value to store
+        :param a_expires_at: Absolute expiry (epoch seconds). Defaults to now plus
+            default_ttl
+        """
+        if a_expires_at is None:
+            a_expires_at = time() + self.default_ttl
+        if a_expires_at <= time():
+            return
+        with self._lock:
+            self._entries[a_key] = (a_expires_at, a_value)
+            self._entries.move_to_end(a_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, a_key: Hashable) -> Optional[T]:
+        """
+        Remove an entry
+        :param a_key: The cache key
+        :return: The removed value if it was present; None otherwise
+        """
+        with self._lock:
+            l_entry = self._entries.pop(a_key, None)
+        return None if l_entry is None else l_entry[1]
+
+    def clear(self) -> None:
+        """
+        Drop every entry and reset the hit/miss counters
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def reset_after_fork(self) -> None:
+        """
+        Drop the entries and the lock inherited from the parent process, which another
+        thread may have held at the time of the fork
+        """
+        self._lock = Lock()
+        self.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,424 @@
+"""
+Vectorized parser for SocketCAN candump log files.
+
+candump -l writes one frame per line:
+
+    (1436509052.249713) vcan0 044#2A366C2BBA     classic CAN frame
+    (1436509052.250000) vcan0 12345678#R         remote transmission request
+    (1436509052.251000) can1 123##1001122334455  CAN FD frame (## + flags nibble)
+
+Rather than building a Python object per frame, a batch of lines is parsed into a
+structure-of-arrays CanFrameBatch using NumPy. Every field is located and decoded with
+array operations over the batch's bytes so the cost per frame is a handful of machine
+instructions instead of several Python object allocations.
+"""
+from dataclasses import dataclass
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+
+import numpy as np
+from pydantic import BaseSettings
+from starlette.concurrency import run_in_threadpool
+from webservices.core.ingest import IngestSink
+from webservices.core.ingest import LineFramer
+
+# Payload matrix widths for classic CAN and CAN FD frames
+PAYLOAD_WIDTH_CLASSIC: int = 8
+PAYLOAD_WIDTH_FD: int = 64
+# Linux limits interface names to 15 characters plus the terminating null
+INTERFACE_WIDTH: int = 16
+# Standard and extended identifiers are at most 8 hex digits. candump writes standard
+# (11 bit) identifiers with 3 digits and extended (29 bit) ones with 8.
+ARBITRATION_ID_DIGITS: int = 8
+STANDARD_ID_DIGITS: int = 3
+# Longest accepted timestamp text, e.g. 1436509052.249713 is 17 characters
+TIMESTAMP_MAX_DIGITS: int = 32
+
+# Lookup table from ASCII byte to hex nibble value. 0xFF marks non-hex characters.
+_HEX_LUT: np.ndarray = np.full(256, 0xFF, dtype=np.uint8)
+_HEX_LUT[np.frombuffer(b"0123456789", dtype=np.uint8)] = np.arange(10)
+_HEX_LUT[np.frombuffer(b"ABCDEF", dtype=np.uint8)] = np.arange(10, 16)
+_HEX_LUT[np.frombuffer(b"abcdef", dtype=np.uint8)] = np.arange(10, 16)
+# Characters allowed in a timestamp. Null is the padding used by _gather.
+_DECIMAL_LUT: np.ndarray = np.zeros(256, dtype=bool)
+_DECIMAL_LUT[np.frombuffer(b"\x000123456789.", dtype=np.uint8)] = True
+
+
+@dataclass(frozen=True)
+class CanFrameBatch:
+    """
+    Columnar batch of CAN frames. Row i of every array describes the same frame.
+    """
+
+    # Capture time in seconds since epoch
+    timestamp: np.ndarray  # float64 (n,)
+    arbitration_id: np.ndarray  # uint32 (n,)
+    # Payload length in bytes (python-can's Message.dlc convention)
+    dlc: np.ndarray  # uint8 (n,)
+    # Payload bytes, zero padded beyond dlc
+    payload: np.ndarray  # uint8 (n, width)
+    interface: np.ndarray  # S16 (n,)
+    is_fd: np.ndarray  # bool (n,)
+    is_remote: np.ndarray  # bool (n,)
+    # 29 bit identifier, i.e. written with more than STANDARD_ID_DIGITS digits. The
+    # value alone can't tell, e.g. 00000123 is an extended identifier.
+    is_extended_id: np.ndarray  # bool (n,)
+    # Lines in the source batch that weren't valid candump records
+    rejected: int = 0
+
+    def __len__(self) -> int:
+        return int(self.timestamp.shape[0])
+
+    @classmethod
+    def empty(
+        cls, a_payload_width: int = PAYLOAD_WIDTH_CLASSIC, a_rejected: int = 0
+    ) -> "CanFrameBatch":
+        """
+        :param a_payload_width: Number of payload columns
+        :param a_rejected: Rejected line count to carry
+        :return: A batch with zero frames
+        """
+        return cls(
+            timestamp=np.empty(0, dtype=np.float64),
+            arbitration_id=np.empty(0, dtype=np.uint32),
+            dlc=np.empty(0, dtype=np.uint8),
+            payload=np.empty((0, a_payload_width), dtype=np.uint8),
+            interface=np.empty(0, dtype=f"S{INTERFACE_WIDTH}"),
+            is_fd=np.empty(0, dtype=bool),
+            is_remote=np.empty(0, dtype=bool),
+            is_extended_id=np.empty(0, dtype=bool),
+            rejected=a_rejected,
+        )
+
+    @classmethod
+    def concatenate(cls, a_batches: Sequence["CanFrameBatch"]) -> "CanFrameBatch":
+        """
+        :param a_batches: Batches sharing the same payload width
+        :return: A single batch holding every frame in order
+        """
+        if not a_batches:
+            return cls.empty()
+        return cls(
+            timestamp=np.concatenate([b.timestamp for b in a_batches]),
+            arbitration_id=np.concatenate([b.arbitration_id for b in a_batches]),
+            dlc=np.concatenate([b.dlc for b in a_batches]),
+            payload=np.concatenate([b.payload for b in a_batches]),
+            interface=np.concatenate([b.interface for b in a_batches]),
+            is_fd=np.concatenate([b.is_fd for b in a_batches]),
+            is_remote=np.concatenate([b.is_remote for b in a_batches]),
+            is_extended_id=np.concatenate([b.is_extended_id for b in a_batches]),
+            rejected=sum(b.rejected for b in a_batches),
+        )
+
+
+def _first_per_line(
+    a_positions: np.ndarray, a_line_starts: np.ndarray, a_line_count: int
+) -> np.ndarray:
+    """
+    :param a_positions: Sorted buffer offsets of a character
+    :param a_line_starts: Buffer offset of each line's first byte
+    :param a_line_count: Number of lines
+    :return: int64 (lines,) offset of the first occurrence in each line; -1 if none
+    """
+    l_first: np.ndarray = np.full(a_line_count, -1, dtype=np.int64)
+    if a_positions.size:
+        l_lines: np.ndarray = np.searchsorted(a_line_starts, a_positions, "right") - 1
+        # Reversed assignment lets the earliest occurrence in each line win
+        l_first[l_lines[::-1]] = a_positions[::-1]
+    return l_first
+
+
+def _gather(
+    a_buffer: np.ndarray, a_start: np.ndarray, a_end: np.ndarray, a_width: int
+) -> np.ndarray:
+    """
+    Copy a variable length span of every row into a fixed width matrix
+    :param a_buffer: uint8 source buffer
+    :param a_start: First offset of each span (inclusive)
+    :param a_end: Last offset of each span (exclusive)
+    :param a_width: Matrix width. Spans are truncated to this length.
+    :return: uint8 (rows, width) matrix, zero filled past each span's end
+    """
+    l_rows: int = a_start.shape[0]
+    # Only materialize the columns some row actually uses
+    l_used: int = min(a_width, max(int((a_end - a_start).max(initial=0)), 0))
+    l_values: np.ndarray = np.zeros((l_rows, a_width), dtype=np.uint8)
+    if not l_used:
+        return l_values
+    l_index: np.ndarray = a_start.astype(np.int32)[:, None] + np.arange(
+        l_used, dtype=np.int32
+    )
+    l_inside: np.ndarray = l_index < a_end.astype(np.int32)[:, None]
+    np.clip(l_index, 0, a_buffer.size - 1, out=l_index)
+    np.multiply(a_buffer[l_index], l_inside, out=l_values[:, :l_used])
+    return l_values
+
+
+def parse_candump_lines(
+    a_lines: Sequence[bytes], a_payload_width: int = PAYLOAD_WIDTH_CLASSIC
+) -> CanFrameBatch:
+    """
+    Parse a batch of candump log lines
+    :param a_lines: Lines without their line terminators
+    :param a_payload_width: Payload matrix width. Frames with longer payloads (CAN FD
+        frames when using PAYLOAD_WIDTH_CLASSIC) are rejected.
+    :return: The parsed frames. Malformed lines are counted in CanFrameBatch.rejected.
+    """
+    l_line_count: int = len(a_lines)
+    if not l_line_count:
+        return CanFrameBatch.empty(a_payload_width)
+
+    l_buffer: np.ndarray = np.frombuffer(b"\n".join(a_lines) + b"\n", dtype=np.uint8)
+    l_ends: np.ndarray = np.flatnonzero(l_buffer == ord("\n"))
+    if l_ends.size != l_line_count:
+        # A line contained an embedded newline; frame it properly and retry
+        return parse_candump_lines(b"\n".join(a_lines).splitlines(), a_payload_width)
+    l_starts: np.ndarray = np.concatenate(([0], l_ends[:-1] + 1))
+
+    # Locate the field delimiters of every line at once
+    l_close: np.ndarray = _first_per_line(
+        np.flatnonzero(l_buffer == ord(")")), l_starts, l_line_count
+    )
+    l_hash: np.ndarray = _first_per_line(
+        np.flatnonzero(l_buffer == ord("#")), l_starts, l_line_count
+    )
+    l_spaces: np.ndarray = np.flatnonzero(l_buffer == ord(" "))
+    l_space_lines: np.ndarray = np.searchsorted(l_starts, l_spaces, "right") - 1
+    # The interface name ends at the first space after the one following ')'
+    l_spaces = l_spaces[l_spaces > l_close[l_space_lines] + 1]
+    l_space: np.ndarray = _first_per_line(l_spaces, l_starts, l_line_count)
+
+    l_last: int = l_buffer.size - 1
+    l_ts_length: np.ndarray = l_close - l_starts - 1
+    l_valid: np.ndarray = (
+        (l_buffer[l_starts] == ord("("))
+        & (l_ts_length > 0)
+        & (l_ts_length <= TIMESTAMP_MAX_DIGITS)
+        & (l_buffer[np.minimum(l_close + 1, l_last)] == ord(" "))
+        & (l_space > l_close + 2)
+        & (l_space - l_close - 2 <= INTERFACE_WIDTH)
+        & (l_hash > l_space + 1)
+        & (l_hash - l_space - 1 <= ARBITRATION_ID_DIGITS)
+    )
+    l_is_extended_id: np.ndarray = l_hash - l_space - 1 > STANDARD_ID_DIGITS
+
+    # Timestamps must be plain decimals with at least one digit
+    l_ts_chars: np.ndarray = _gather(
+        l_buffer, l_starts + 1, l_close, TIMESTAMP_MAX_DIGITS
+    )
+    l_dots: np.ndarray = (l_ts_chars == ord(".")).sum(axis=1)
+    l_valid &= (
+        _DECIMAL_LUT[l_ts_chars].all(axis=1) & (l_dots <= 1) & (l_ts_length > l_dots)
+    )
+
+    # Frame type markers following the first '#'
+    l_marker: np.ndarray = l_buffer[np.minimum(l_hash + 1, l_last)]
+    l_is_fd: np.ndarray = l_marker == ord("#")
+    l_is_remote: np.ndarray = l_marker == ord("R")
+    l_data_start: np.ndarray = l_hash + 1 + np.where(l_is_fd, 2, 0)
+    l_data_length: np.ndarray = np.where(l_is_remote, 0, l_ends - l_data_start)
+    l_valid &= (
+        (l_data_length >= 0)
+        & (l_data_length % 2 == 0)
+        & (l_data_length <= 2 * a_payload_width)
+    )
+
+    # Arbitration ID: right align the hex digits in an 8 column matrix
+    l_id_nibbles: np.ndarray = _HEX_LUT[
+        _gather(
+            l_buffer,
+            l_hash - ARBITRATION_ID_DIGITS,
+            l_hash,
+            ARBITRATION_ID_DIGITS,
+        )
+    ]
+    l_id_nibbles[
+        (l_hash[:, None] - ARBITRATION_ID_DIGITS + np.arange(ARBITRATION_ID_DIGITS))
+        <= l_space[:, None]
+    ] = 0
+    l_valid &= ~(l_id_nibbles == 0xFF).any(axis=1)
+
+    # Payload: pairs of hex digits into bytes
+    l_data_nibbles: np.ndarray = _HEX_LUT[
+        _gather(
+            l_buffer,
+            l_data_start,
+            l_data_start + l_data_length,
+            2 * a_payload_width,
+        )
+    ]
+    l_data_nibbles[np.arange(2 * a_payload_width) >= l_data_length[:, None]] = 0
+    l_valid &= ~(l_data_nibbles == 0xFF).any(axis=1)
+
+    l_rows: np.ndarray = np.flatnonzero(l_valid)
+    l_rejected: int = l_line_count - l_rows.size
+    if not l_rows.size:
+        return CanFrameBatch.empty(a_payload_width, l_rejected)
+
+    l_shifts: np.ndarray = np.arange(
+        4 * (ARBITRATION_ID_DIGITS - 1), -1, -4, dtype=np.uint32
+    )
+    l_arbitration_id: np.ndarray = (
+        l_id_nibbles[l_rows].astype(np.uint32) << l_shifts
+    ).sum(axis=1, dtype=np.uint32)
+
+    l_pairs: np.ndarray = l_data_nibbles[l_rows].reshape(-1, a_payload_width, 2)
+    l_payload: np.ndarray = (l_pairs[:, :, 0] << 4) | l_pairs[:, :, 1]
+
+    l_timestamp: np.ndarray = (
+        l_ts_chars[l_rows].view(f"S{TIMESTAMP_MAX_DIGITS}").ravel().astype(np.float64)
+    )
+
+    l_interface: np.ndarray = (
+        _gather(l_buffer, l_close[l_rows] + 2, l_space[l_rows], INTERFACE_WIDTH)
+        .view(f"S{INTERFACE_WIDTH}")
+        .ravel()
+    )
+
+    return CanFrameBatch(
+        timestamp=l_timestamp,
+        arbitration_id=l_arbitration_id,
+        dlc=(l_data_length[l_rows] // 2).astype(np.uint8),
+        payload=np.ascontiguousarray(l_payload, dtype=np.uint8),
+        interface=l_interface,
+        is_fd=l_is_fd[l_rows],
+        is_remote=l_is_remote[l_rows],
+        is_extended_id=l_is_extended_id[l_rows],
+        rejected=l_rejected,
+    )
+
+
+class CandumpParser:
+    """
+    Parse candump text arriving as arbitrarily split chunks into CanFrameBatch objects
+    """
+
+    def __init__(
+        self,
+        a_payload_width: int = PAYLOAD_WIDTH_CLASSIC,
+        a_batch_lines: int = 65536,
+        a_max_line_length: int = 4096,
+    ):
+        """
+        :param a_payload_width: Payload matrix width passed to parse_candump_lines
+        :param a_batch_lines: Number of lines accumulated before a batch is parsed
+        :param a_max_line_length: Longest accepted line in bytes
+        """
+        self.payload_width: int = a_payload_width
+        self.batch_lines: int = a_batch_lines
+        self._framer: LineFramer = LineFramer(a_max_line_length)
+        self._pending: List[bytes] = []
+
+    @classmethod
+    def from_config(cls, a_config: BaseSettings) -> "CandumpParser":
+        """
+        :param a_config: Settings providing the INGEST_* parser options
+        :return: A parser configured like the rest of the ingest pipeline
+        """
+        return cls(
+            a_payload_width=PAYLOAD_WIDTH_FD
+            if a_config.INGEST_CAN_FD
+            else PAYLOAD_WIDTH_CLASSIC,
+            a_batch_lines=a_config.INGEST_PARSE_BATCH_LINES,
+            a_max_line_length=a_config.INGEST_MAX_LINE_BYTES,
+        )
+
+    def extend(self, a_lines: Sequence[bytes]) -> None:
+        """
+        Queue complete lines without parsing them
+        :param a_lines: Complete lines
+        """
+        self._pending.extend(a_lines)
+
+    @property
+    def batch_ready(self) -> bool:
+        """
+        :return: True once at least a_batch_lines lines are queued
+        """
+        return len(self._pending) >= self.batch_lines
+
+    def drain(self) -> Iterator[CanFrameBatch]:
+        """
+        :return: A batch for every full a_batch_lines lines queued
+        """
+        while self.batch_ready:
+            l_batch = self._pending[: self.batch_lines]
+            del self._pending[: self.batch_lines]
+            yield parse_candump_lines(l_batch, self.payload_width)
+
+    def feed_lines(self, a_lines: Sequence[bytes]) -> Iterator[CanFrameBatch]:
+        """
+        :param a_lines: Complete lines
+        :return: A batch for every a_batch_lines lines accumulated so far
+        """
+        self.extend(a_lines)
+        return self.drain()
+
+    def feed(self, a_chunk: bytes) -> Iterator[CanFrameBatch]:
+        """
+        :param a_chunk: The next raw slice of a candump log
+        :return: Any batches completed by this chunk
+        """
+        return self.feed_lines(self._framer.feed(a_chunk))
+
+    def flush(self) -> Optional[CanFrameBatch]:
+        """
+        :return: A batch of every remaining line; None if there are none
+        """
+        self._pending.extend(self._framer.flush())
+        if not self._pending:
+            return None
+        l_batch, self._pending = self._pending, []
+        return parse_candump_lines(l_batch, self.payload_width)
+
+    def parse_chunks(self, a_chunks: Iterable[bytes]) -> Iterator[CanFrameBatch]:
+        """
+        :param a_chunks: Raw slices of a candump log, e.g. reads from a file
+        :return: Every batch in the log
+        """
+        for l_chunk in a_chunks:
+            yield from self.feed(l_chunk)
+        l_last: Optional[CanFrameBatch] = self.flush()
+        if l_last is not None:
+            yield l_last
+
+
+class CandumpSink(IngestSink):
+    """
+    IngestSink parsing framed lines into CanFrameBatch objects. Batches are parsed in
+    the threadpool so a large upload doesn't stall the event loop.
+    """
+
+    def __init__(self, a_parser: Optional[CandumpParser] = None):
+        """
+        :param a_parser: Parser to use. A classic CAN parser by default.
+        """
+        self.parser: CandumpParser = a_parser or CandumpParser()
+        self.frame_count: int = 0
+        self.rejected_count: int = 0
+
+    async def on_batch(self, a_batch: CanFrameBatch) -> None:
+        """
+        Hook for downstream consumers of each parsed batch
+        :param a_batch: The newly parsed frames
+        """
+
+    async def _consume(self, a_batch: CanFrameBatch) -> None:
+        self.frame_count += len(a_batch)
+        self.rejected_count += a_batch.rejected
+        await self.on_batch(a_batch)
+
+    async def write_lines(self, a_lines: List[bytes]) -> None:
+        self.parser.extend(a_lines)
+        if not self.parser.batch_ready:
+            return
+        for l_batch in await run_in_threadpool(list, self.parser.drain()):
+            await self._consume(l_batch)
+
+    async def close(self) -> None:
+        l_batch: Optional[CanFrameBatch] = await run_in_threadpool(self.parser.flush)
+        if l_batch is not None:
+            await self._consume(l_batch)
@@ -12,7 +12,6 @@ from logging import warning
 from logging.config import dictConfig
 from os import environ
 from os import getenv
-from time import sleep
 from typing import Any
 from typing import Dict
 from typing import List
@@ -33,7 +32,6 @@ from pydantic import SecretStr
 from pydantic import ValidationError
 from pydantic import validator
 
-from keycloak import KeycloakError
 from keycloak import KeycloakOpenID
 
 
@@ -119,16 +117,62 @@ class CoreConfig(BaseSettings):
 
     KC_HTTPS_PORT: str = Field(..., env="KC_HTTPS_PORT")
     KEYCLOAK_HOSTNAME: str = Field(..., env="KEYCLOAK_HOSTNAME")
-    KEYCLOAK_URL: Optional[str] = None
+    # Overrides the https://KEYCLOAK_HOSTNAME:KC_HTTPS_PORT URL, e.g. to point the API
+    # at the load test's Keycloak stand-in
+    KEYCLOAK_URL: Optional[str] = Field(None, env="KEYCLOAK_URL")
+    KEYCLOAK_REALM: str = Field("WebServices", env="KEYCLOAK_REALM")
+    KEYCLOAK_CLIENT_ID: str = Field("webservices_api", env="KEYCLOAK_CLIENT_ID")
     KEYCLOAK_CLIENT_SECRET_KEY: str = Field(..., env="KEYCLOAK_CLIENT_SECRET_KEY")
+    # PEM realm public key for tokens without a kid. Normally unset; tokens are verified
+    # with the realm JWKS (see webservices.core.jwks).
     KEYCLOAK_PUBLIC_KEY: Optional[str] = None
     KEYCLOAK_DECRYPT_OPTIONS: Dict[str, bool] = {
         "verify_signature": True,
         "verify_aud": False,
         "verify_exp": True,
     }
-    KEYCLOAK_LOGIN_WAIT_SEC: int = Field(..., env="KEYCLOAK_LOGIN_WAIT_SEC")
-    KEYCLOAK_LOGIN_RETRY_COUNT: int = Field(..., env="KEYCLOAK_LOGIN_RETRY_COUNT")
+    # Seconds between attempts to fetch the realm signing keys while Keycloak isn't
+    # reachable. Workers keep serving (and /v1/health/ready reports 503) meanwhile.
+    KEYCLOAK_LOGIN_WAIT_SEC: float = Field(3, env="KEYCLOAK_LOGIN_WAIT_SEC", gt=0)
+    # File the fetched signing keys are shared through by the workers on a host. An
+    # empty value disables the cache.
+    KEYCLOAK_KEY_CACHE_PATH: str = Field(
+        "/tmp/webservices/jwks.json", env="KEYCLOAK_KEY_CACHE_PATH"
+    )
+    # Background refresh period and on-demand (unknown kid) re-fetch rate limit for the
+    # realm JWKS used to verify access tokens locally
+    KEYCLOAK_JWKS_REFRESH_SEC: int = Field(300, env="KEYCLOAK_JWKS_REFRESH_SEC", ge=0)
+    KEYCLOAK_JWKS_MIN_REFETCH_SEC: int = Field(
+        10, env="KEYCLOAK_JWKS_MIN_REFETCH_SEC", ge=0
+    )
+    # Seconds the discovery document and JWKS served by /v1/keycloak are fresh. Older
+    # copies are served while they're re-fetched (see webservices.core.discovery).
+    KEYCLOAK_DISCOVERY_TTL_SEC: int = Field(300, env="KEYCLOAK_DISCOVERY_TTL_SEC", gt=0)
+    # Maximum number of verified access tokens remembered per worker
+    TOKEN_CACHE_MAX_SIZE: int = Field(4096, env="TOKEN_CACHE_MAX_SIZE", gt=0)
+    # Users resolved from token subjects remembered per worker and for how long before
+    # the users table is consulted (and last_seen_at refreshed) again
+    USER_CACHE_MAX_SIZE: int = Field(4096, env="USER_CACHE_MAX_SIZE", gt=0)
+    USER_CACHE_TTL_SEC: int = Field(300, env="USER_CACHE_TTL_SEC", gt=0)
+    # Verified tokens and resolved users are shared between workers and nodes through
+    # Redis at AUTH_CACHE_REDIS_URL (CELERY_BROKER_URL if unset), as are logouts. Redis
+    # is skipped for AUTH_CACHE_REDIS_RETRY_SEC after a command fails or takes longer
+    # than AUTH_CACHE_REDIS_TIMEOUT_SEC.
+    AUTH_CACHE_REDIS: bool = Field(True, env="AUTH_CACHE_REDIS")
+    AUTH_CACHE_REDIS_URL: Optional[RedisDsn] = Field(None, env="AUTH_CACHE_REDIS_URL")
+    AUTH_CACHE_REDIS_TIMEOUT_SEC: float = Field(
+        0.25, env="AUTH_CACHE_REDIS_TIMEOUT_SEC", gt=0
+    )
+    AUTH_CACHE_REDIS_RETRY_SEC: float = Field(
+        5.0, env="AUTH_CACHE_REDIS_RETRY_SEC", gt=0
+    )
+    # Per worker connection pool and timeout of the async (httpx) keycloak client
+    KEYCLOAK_HTTP_MAX_CONNECTIONS: int = Field(
+        100, env="KEYCLOAK_HTTP_MAX_CONNECTIONS", gt=0
+    )
+    KEYCLOAK_HTTP_TIMEOUT_SEC: float = Field(
+        10.0, env="KEYCLOAK_HTTP_TIMEOUT_SEC", gt=0
+    )
 
     # Note: Pydantic's BaseSettings class will automatically pull in environmental
     # values when setting the 'env' flag in Field
@@ -143,25 +187,135 @@ class CoreConfig(BaseSettings):
     DATABASE_URI: Optional[PostgresDsn] = None
     DATABASE_URI_GENERIC: Optional[PostgresDsn] = None
     DATABASE_URI_HIDDEN_PASS: Optional[str] = None
+    # Per worker process connection pool of the async SQLAlchemy engine. At most
+    # DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW connections are open per worker;
+    # requests wait up to DATABASE_POOL_TIMEOUT_SEC for one. Connections are replaced
+    # after DATABASE_POOL_RECYCLE_SEC and, with DATABASE_POOL_PRE_PING, tested before
+    # being handed out so restarts of Postgres don't surface as request errors. Opening
+    # a new connection fails after DATABASE_CONNECT_TIMEOUT_SEC.
+    DATABASE_POOL_SIZE: int = Field(10, env="DATABASE_POOL_SIZE", ge=1)
+    DATABASE_MAX_OVERFLOW: int = Field(10, env="DATABASE_MAX_OVERFLOW", ge=0)
+    DATABASE_POOL_TIMEOUT_SEC: float = Field(
+        30.0, env="DATABASE_POOL_TIMEOUT_SEC", gt=0
+    )
+    DATABASE_POOL_RECYCLE_SEC: int = Field(1800, env="DATABASE_POOL_RECYCLE_SEC", gt=0)
+    DATABASE_POOL_PRE_PING: bool = Field(True, env="DATABASE_POOL_PRE_PING")
+    DATABASE_CONNECT_TIMEOUT_SEC: float = Field(
+        10.0, env="DATABASE_CONNECT_TIMEOUT_SEC", gt=0
+    )
+
+    # Upload bodies are processed in chunks of at most INGEST_CHUNK_SIZE_BYTES and
+    # rejected if a single line exceeds INGEST_MAX_LINE_BYTES
+    INGEST_CHUNK_SIZE_BYTES: int = Field(65536, env="INGEST_CHUNK_SIZE_BYTES", gt=0)
+    INGEST_MAX_LINE_BYTES: int = Field(4096, env="INGEST_MAX_LINE_BYTES", gt=0)
+    # Compressed uploads (gzip, xz, zstd) are rejected with 413 once they decompress to
+    # more than INGEST_MAX_DECOMPRESSED_BYTES
+    INGEST_MAX_DECOMPRESSED_BYTES: int = Field(
+        8589934592, env="INGEST_MAX_DECOMPRESSED_BYTES", gt=0
+    )
+    # Number of candump lines parsed together into a columnar frame batch and whether
+    # to size payload buffers for CAN FD (64 byte) frames instead of classic CAN
+    INGEST_PARSE_BATCH_LINES: int = Field(65536, env="INGEST_PARSE_BATCH_LINES", gt=0)
+    INGEST_CAN_FD: bool = Field(False, env="INGEST_CAN_FD")
+    # Stage uploads to a directory shared with the Celery workers and parse them there
+    # instead of inside the API worker
+    INGEST_USE_CELERY: bool = Field(True, env="INGEST_USE_CELERY")
+    INGEST_STAGING_DIR: str = Field(
+        "/webservices/ingest/staging", env="INGEST_STAGING_DIR"
+    )
+    # Content-addressed store of staged uploads. Must be on the same filesystem as
+    # INGEST_STAGING_DIR so completed uploads can be hard linked into place.
+    INGEST_STORE_DIR: str = Field("/webservices/ingest/store", env="INGEST_STORE_DIR")
+    # Resumable upload sessions: where received parts are kept (on the same filesystem
+    # as INGEST_STAGING_DIR), how long an unfinished session lives, and the highest
+    # part number accepted
+    INGEST_SESSION_DIR: str = Field(
+        "/webservices/ingest/sessions", env="INGEST_SESSION_DIR"
+    )
+    INGEST_SESSION_TTL_SEC: int = Field(86400, env="INGEST_SESSION_TTL_SEC", gt=0)
+    INGEST_SESSION_MAX_PARTS: int = Field(10000, env="INGEST_SESSION_MAX_PARTS", gt=0)
+    # Persist parsed frames into the can_frames table with COPY. Each capture gets up
+    # to INGEST_MAX_PARTITION_DAYS daily partitions; later days share one partition.
+    # Creating a partition waits at most INGEST_PARTITION_LOCK_TIMEOUT_SEC for the
+    # locks it needs on the parent tables.
+    INGEST_PERSIST_FRAMES: bool = Field(True, env="INGEST_PERSIST_FRAMES")
+    INGEST_MAX_PARTITION_DAYS: int = Field(31, env="INGEST_MAX_PARTITION_DAYS", gt=0)
+    INGEST_PARTITION_LOCK_TIMEOUT_SEC: float = Field(
+        30.0, env="INGEST_PARTITION_LOCK_TIMEOUT_SEC", gt=0
+    )
+    # Request tracing. A fraction of requests is sampled up front and, if
+    # TRACE_SLOW_MS is set, every request taking longer is exported as well. Spans are
+    # written as JSON lines to TRACE_FILE_PATH and/or sent to the OTLP/HTTP collector
+    # at TRACE_OTLP_ENDPOINT (e.g. http://otel-collector:4318/v1/traces). Tracing is
+    # off unless an exporter is set.
+    TRACE_SAMPLE_RATE: float = Field(0.01, env="TRACE_SAMPLE_RATE", ge=0, le=1)
+    TRACE_SLOW_MS: float = Field(0.0, env="TRACE_SLOW_MS", ge=0)
+    TRACE_FILE_PATH: str = Field("", env="TRACE_FILE_PATH")
+    TRACE_OTLP_ENDPOINT: str = Field("", env="TRACE_OTLP_ENDPOINT")
+    # bcrypt runs in a pool of HASH_POOL_WORKERS processes per worker. Once
+    # HASH_POOL_MAX_PENDING calls are running or waiting, further ones get a 429.
+    HASH_POOL_WORKERS: int = Field(2, env="HASH_POOL_WORKERS", gt=0)
+    HASH_POOL_MAX_PENDING: int = Field(16, env="HASH_POOL_MAX_PENDING", gt=0)
+    # Token bucket rate limits: logins per client IP and uploads per user, each a
+    # sustained rate per minute (0 disables the limit) and a burst size
+    RATE_LIMIT_LOGIN_PER_MIN: float = Field(30.0, env="RATE_LIMIT_LOGIN_PER_MIN", ge=0)
+    RATE_LIMIT_LOGIN_BURST: int = Field(10, env="RATE_LIMIT_LOGIN_BURST", gt=0)
+    RATE_LIMIT_UPLOAD_PER_MIN: float = Field(
+        60.0, env="RATE_LIMIT_UPLOAD_PER_MIN", ge=0
+    )
+    RATE_LIMIT_UPLOAD_BURST: int = Field(20, env="RATE_LIMIT_UPLOAD_BURST", gt=0)
+    # Rate limits and concurrent uploads per user are counted in Redis at
+    # RATE_LIMIT_REDIS_URL (CELERY_BROKER_URL if unset) rather than per worker, using
+    # the AUTH_CACHE_REDIS_TIMEOUT_SEC and AUTH_CACHE_REDIS_RETRY_SEC fallbacks
+    RATE_LIMIT_REDIS: bool = Field(False, env="RATE_LIMIT_REDIS")
+    RATE_LIMIT_REDIS_URL: Optional[RedisDsn] = Field(None, env="RATE_LIMIT_REDIS_URL")
+    # Uploads are admitted before their body is read: at most
+    # UPLOAD_MAX_CONCURRENT_PER_USER at once per user (0 is unlimited), and at most
+    # UPLOAD_MAX_BYTES_IN_FLIGHT announced bytes at once per worker, a body without
+    # Content-Length counting UPLOAD_UNKNOWN_LENGTH_BYTES. Rejected uploads get a 429
+    # telling the client to retry after UPLOAD_RETRY_AFTER_SEC.
+    UPLOAD_MAX_CONCURRENT_PER_USER: int = Field(
+        2, env="UPLOAD_MAX_CONCURRENT_PER_USER", ge=0
+    )
+    UPLOAD_MAX_BYTES_IN_FLIGHT: int = Field(
+        2147483648, env="UPLOAD_MAX_BYTES_IN_FLIGHT", gt=0
+    )
+    UPLOAD_UNKNOWN_LENGTH_BYTES: int = Field(
+        67108864, env="UPLOAD_UNKNOWN_LENGTH_BYTES", ge=0
+    )
+    UPLOAD_RETRY_AFTER_SEC: float = Field(10.0, env="UPLOAD_RETRY_AFTER_SEC", gt=0)
 
     CELERY_BROKER_URL: RedisDsn = Field(..., env="CELERY_BROKER_URL")
     CELERY_RESULT_BACKEND: RedisDsn = Field(..., env="CELERY_RESULT_BACKEND")
+    CELERY_RESULT_EXPIRE_SEC: int = Field(86400, env="CELERY_RESULT_EXPIRE_SEC", gt=0)
     celery_concurrency_count: int = 0
     celery_worker_count: int = 0
 
     @validator("KEYCLOAK_URL")
     def generate_keycloak_url(cls, v: Optional[str], values: Dict[str, Any]) -> str:
         """
-        Dynamically generate the Keycloak internal HTTPS URL
-        :param v: Unused
+        Dynamically generate the Keycloak internal HTTPS URL unless one was provided
+        :param v: The KEYCLOAK_URL environment variable if set
         :param values: Dictionary of current BaseSettings attributes
         :return: The formatted URL
         """
+        if v:
+            return v.rstrip("/")
         return (
             f"https://{values.get('KEYCLOAK_HOSTNAME')}:{values.get('KC_HTTPS_PORT')}"
             # f"https://{values.get('KEYCLOAK_HOSTNAME')}"
         )
 
+    @validator("AUTH_CACHE_REDIS_URL", "RATE_LIMIT_REDIS_URL", pre=True)
+    def empty_redis_url_none(cls, v: Any) -> Any:
+        """
+        Treat an empty Redis URL, e.g. from docker-compose, as unset
+        :param v: The AUTH_CACHE_REDIS_URL or RATE_LIMIT_REDIS_URL environment variable
+            if set
+        :return: None if empty; the value otherwise
+        """
+        return v or None
+
     @validator("LOG_LEVEL", pre=True)
     def uppercase_log_level(cls, v: Any) -> LogLevel:
         """
@@ -382,34 +536,8 @@ core_logger.info(f"Database URI being used: {core_config.DATABASE_URI_HIDDEN_PAS
 # if there are issues with the SSL layer.
 keycloak_client = KeycloakOpenID(
     server_url=core_config.KEYCLOAK_URL,
-    realm_name="WebServices",
-    client_id="webservices_api",
+    realm_name=core_config.KEYCLOAK_REALM,
+    client_id=core_config.KEYCLOAK_CLIENT_ID,
     client_secret_key=core_config.KEYCLOAK_CLIENT_SECRET_KEY,
     verify=True,
 )
-
-# Ensure we have a working connection to keycloak
-for i in range(core_config.KEYCLOAK_LOGIN_RETRY_COUNT):
-    try:
-        # An alternative could be reading from the local copy of the certificate.
-        # This callout provides a convenient check to ensure the connection to keycloak
-        # is working.
-        core_config.KEYCLOAK_PUBLIC_KEY = (
-            "-----BEGIN PUBLIC KEY-----\n"
-            + keycloak_client.public_key()
-            + "\n-----END PUBLIC KEY-----"
-        )
-        core_logger.info("Successfully connected to keycloak.")
-        break
-    except KeycloakError as e:
-        core_logger.warning(
-            f"Failed to connect to keycloak at {core_config.KEYCLOAK_URL}"
-        )
-        core_logger.warning(f"{e}")
-        core_logger.warning(
-            f"\t{core_config.KEYCLOAK_LOGIN_RETRY_COUNT-i} retries pending..."
-        )
-        sleep(core_config.KEYCLOAK_LOGIN_WAIT_SEC)
-if core_config.KEYCLOAK_PUBLIC_KEY is None:
-    core_logger.error("Failed to connect to keycloak. Exiting...")
-    exit(-1)
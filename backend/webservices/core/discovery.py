@@ -0,0 +1,175 @@
+"""
+Keycloak documents served from memory: the realm's OpenID Connect discovery document and
+its public signing keys (JWKS).
+
+Clients poll these, and they rarely change, so each worker fetches a document once and
+serves the copy, encoded once, with an ETag and Cache-Control headers; a client
+revalidating an unchanged copy gets 304. A copy older than KEYCLOAK_DISCOVERY_TTL_SEC
+is still served while a single background fetch replaces it, so requests never wait on
+Keycloak once the first fetch succeeded. While Keycloak is unreachable the stale copy
+is served and a fetch is retried at most every KEYCLOAK_LOGIN_WAIT_SEC.
+"""
+import asyncio
+from hashlib import sha256
+from time import monotonic
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Optional
+
+from webservices.core import worker_state
+from webservices.core.config import core_config
+from webservices.core.config import core_logger as logger
+from webservices.core.keycloak_async import keycloak_async_client
+from webservices.core.singleflight import SingleFlight
+from webservices.schemas import dumps
+
+from keycloak import KeycloakError
+
+
+class CachedDocument:
+    """
+    A JSON document fetched from Keycloak, kept encoded and revalidated in the
+    background once stale
+    """
+
+    def __init__(
+        self,
+        a_name: str,
+        a_fetch: Callable[[], Awaitable[Any]],
+        a_ttl: float = 300.0,
+        a_retry_interval: float = 3.0,
+    ):
+        """
+        :param a_name: What the document is, for the log and metrics, e.g. discovery
+        :param a_fetch: Coroutine function fetching the document, e.g.
+            keycloak_async_client.well_known
+        :param a_ttl: Seconds a fetched copy is fresh
+        :param a_retry_interval: Minimum seconds between background fetches of a stale
+            copy, i.e. while Keycloak keeps failing
+        """
+        self.name: str = a_name
+        self._fetch = a_fetch
+        self.ttl: float = a_ttl
+        self.retry_interval: float = a_retry_interval
+        # The document as sent to clients, and its ETag
+        self.body: bytes = b""
+        self.etag: str = ""
+        # When the copy was fetched (monotonic seconds)
+        self.fetched_at: float = 0.0
+        self._next_attempt: float = 0.0
+        self._fetches: SingleFlight[None] = SingleFlight(a_name)
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def loaded(self) -> bool:
+        """
+        :return: True once a copy was fetched
+        """
+        return bool(self.body)
+
+    def max_age(self) -> int:
+        """
+        :return: Seconds the copy remains fresh
+        """
+        return max(int(self.fetched_at + self.ttl - monotonic()), 0)
+
+    def store(self, a_document: Any) -> None:
+        """
+        Replace the copy
+        :param a_document: The document fetched
+        """
+        l_body: bytes = dumps(a_document).encode()
+        if l_body != self.body:
+            self.body = l_body
+            self.etag = f'"{sha256(l_body).hexdigest()[:32]}"'
+        self.fetched_at = monotonic()
+
+    async def _fetch_and_store(self) -> None:
+        self.store(await self._fetch())
+
+    async def refresh(self) -> None:
+        """
+        Fetch the document now, or wait for a fetch already in flight
+        :raises KeycloakError: If Keycloak couldn't be reached or refused
+        """
+        self._next_attempt = monotonic() + self.retry_interval
+        await self._fetches.do(None, self._fetch_and_store)
+
+    async def _refresh_in_background(self) -> None:
+        try:
+            await self.refresh()
+        except KeycloakError as e:
+            logger.warning(
+                f"Failed to fetch keycloak {self.name}, serving any stale copy: {e}"
+            )
+
+    async def load(self) -> None:
+        """
+        Make sure a copy is available: fetch one if there's none, and have a stale one
+        refreshed in the background
+        :raises KeycloakError: If there's no copy yet and Keycloak couldn't be reached
+        """
+        if not self.loaded:
+            await self.refresh()
+            return
+        l_now: float = monotonic()
+        if (
+            l_now - self.fetched_at >= self.ttl
+            and l_now >= self._next_attempt
+            and (self._task is None or self._task.done())
+        ):
+            self._next_attempt = l_now + self.retry_interval
+            self._task = asyncio.get_running_loop().create_task(
+                self._refresh_in_background(), name=f"{self.name}-refresh"
+            )
+
+    async def start(self) -> None:
+        """
+        Startup handler: fetch the document in the background so the first client
+        doesn't wait for Keycloak
+        """
+        if not self.loaded and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(
+                self._refresh_in_background(), name=f"{self.name}-refresh"
+            )
+
+    async def stop(self) -> None:
+        """
+        Shutdown handler: cancel a fetch in progress
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    def reset_after_fork(self) -> None:
+        """
+        Keep the copy fetched by the parent process but drop its task, which belongs to
+        the parent's event loop
+        """
+        self._task = None
+        self._fetches.reset_after_fork()
+
+
+discovery_document = CachedDocument(
+    "discovery",
+    keycloak_async_client.well_known,
+    a_ttl=core_config.KEYCLOAK_DISCOVERY_TTL_SEC,
+    a_retry_interval=core_config.KEYCLOAK_LOGIN_WAIT_SEC,
+)
+jwks_document = CachedDocument(
+    "jwks",
+    keycloak_async_client.certs,
+    a_ttl=core_config.KEYCLOAK_DISCOVERY_TTL_SEC,
+    a_retry_interval=core_config.KEYCLOAK_LOGIN_WAIT_SEC,
+)
+worker_state.register_after_fork(
+    "keycloak discovery document", discovery_document.reset_after_fork
+)
+worker_state.register_after_fork(
+    "keycloak jwks document", jwks_document.reset_after_fork
+)
@@ -1,11 +1,170 @@
 """
 Password hashing and comparison functions
+
+passlib is imported the first time a password is hashed or verified rather than when
+this module is imported, since only the login schema needs it and the schemas are
+imported by every worker at startup.
+
+bcrypt is deliberately slow (100-300ms per call), so code running on the event loop
+must use the async Hasher methods. They run bcrypt in a small per-worker process pool
+and admit at most HASH_POOL_MAX_PENDING calls at once; beyond that HashingPoolBusy is
+raised, which the app answers with 429 and a Retry-After estimate, instead of queueing
+logins for longer than clients wait. The pool's processes only import this module.
 """
+import multiprocessing
+import os
+from asyncio import get_running_loop
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from math import ceil
+from time import perf_counter
+from typing import Any
+from typing import Callable
 from typing import Optional
+from typing import Tuple
+from typing import TYPE_CHECKING
+
+from webservices.core import worker_state
+
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
+
+
+@lru_cache(maxsize=None)
+def pwd_context() -> "CryptContext":
+    """
+    :return: The process wide password hashing context
+    """
+    from passlib.context import CryptContext
 
-from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def _timed(a_function: Callable[..., Any], *a_args: Any) -> Tuple[Any, float]:
+    # Runs in a pool process; the duration excludes waiting for a free process
+    l_start: float = perf_counter()
+    l_result: Any = a_function(*a_args)
+    return l_result, perf_counter() - l_start
+
+
+class HashingPoolBusy(RuntimeError):
+    """
+    Raised when the hashing pool already holds its maximum of pending calls
+    """
+
+    def __init__(self, a_retry_after: int):
+        """
+        :param a_retry_after: Seconds after which the pool has likely caught up
+        """
+        super().__init__(f"Password hashing is saturated, retry in {a_retry_after}s")
+        self.retry_after: int = a_retry_after
+
+
+class HashingPool:
+    """
+    Bounded process pool running bcrypt off the event loop
+    """
+
+    def __init__(
+        self,
+        a_workers: Optional[int] = None,
+        a_max_pending: Optional[int] = None,
+        a_smoothing: float = 0.2,
+    ):
+        """
+        :param a_workers: Processes hashing in parallel. HASH_POOL_WORKERS if None.
+        :param a_max_pending: Calls running or waiting for a process before new ones
+            are rejected. HASH_POOL_MAX_PENDING if None.
+        :param a_smoothing: Weight of the newest call in the average call duration
+        """
+        self.workers: Optional[int] = a_workers
+        self.max_pending: Optional[int] = a_max_pending
+        self.smoothing: float = a_smoothing
+        self.pending: int = 0
+        # Moving average of the seconds a pool process spends on a call
+        self.call_seconds: float = 0.25
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+
+    def _configure(self) -> None:
+        # The configuration is read on first use so the pool's processes, which import
+        # this module, don't load it
+        from webservices.core.config import core_config
+
+        if self.workers is None:
+            self.workers = core_config.HASH_POOL_WORKERS
+        if self.max_pending is None:
+            self.max_pending = core_config.HASH_POOL_MAX_PENDING
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """
+        Lazily start the worker's process pool. Processes are spawned rather than
+        forked from a worker running threads.
+        :return: The worker's ProcessPoolExecutor
+        """
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._configure()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=pwd_context,
+            )
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def retry_after(self) -> int:
+        """
+        :return: Seconds until the calls pending now are likely done
+        """
+        return max(ceil(self.pending * self.call_seconds / (self.workers or 1)), 1)
+
+    async def run(self, a_function: Callable[..., Any], *a_args: Any) -> Any:
+        """
+        :param a_function: A module level function to call in a pool process
+        :param a_args: Its picklable arguments
+        :return: The function's result
+        :raises HashingPoolBusy: If HASH_POOL_MAX_PENDING calls are already pending
+        """
+        l_executor: ProcessPoolExecutor = self.executor
+        if self.pending >= self.max_pending:
+            raise HashingPoolBusy(self.retry_after())
+        self.pending += 1
+        try:
+            l_result, l_seconds = await get_running_loop().run_in_executor(
+                l_executor, _timed, a_function, *a_args
+            )
+        except BrokenProcessPool:
+            # A pool process died, e.g. killed for memory; start a new pool next call
+            if self._executor is l_executor:
+                self._executor = None
+            raise
+        finally:
+            self.pending -= 1
+        self.call_seconds += self.smoothing * (l_seconds - self.call_seconds)
+        return l_result
+
+    def reset_after_fork(self) -> None:
+        """
+        Forget a pool inherited from the parent process without shutting it down
+        """
+        self._executor = None
+        self._executor_pid = None
+        self.pending = 0
+
+    async def shutdown(self) -> None:
+        """
+        Shutdown handler: stop the worker's pool processes
+        """
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._executor_pid = None
+
+
+hashing_pool = HashingPool()
+worker_state.register_after_fork("hashing pool", hashing_pool.reset_after_fork)
 
 
 class Hasher:
@@ -16,20 +175,47 @@ class Hasher:
     @staticmethod
     def verify_password(plain_password, hashed_password):
         """
-        Verify that a hashing a plantext password matches an expected hash
+        Verify that a hashing a plantext password matches an expected hash. Blocks for
+        the duration of bcrypt; use verify_password_async on the event loop.
         :param plain_password: A plaintext version of the password
         :param hashed_password: The reference hash
         :return: True if they match, False otherwise
         """
-        return pwd_context.verify(plain_password, hashed_password)
+        return pwd_context().verify(plain_password, hashed_password)
 
     @staticmethod
     def get_password_hash(plain_password) -> Optional[str]:
         """
-        Convert a plaintext password into a hashed representation
+        Convert a plaintext password into a hashed representation. Blocks for the
+        duration of bcrypt; use get_password_hash_async on the event loop.
+        :param plain_password: Input plaintext password
+        :return: A hashed representation; else, None if input was None
+        """
+        if plain_password is None:
+            return None
+        return pwd_context().hash(plain_password)
+
+    @staticmethod
+    async def verify_password_async(plain_password, hashed_password) -> bool:
+        """
+        verify_password run in the hashing pool
+        :param plain_password: A plaintext version of the password
+        :param hashed_password: The reference hash
+        :return: True if they match, False otherwise
+        :raises HashingPoolBusy: If the pool is saturated
+        """
+        return await hashing_pool.run(
+            Hasher.verify_password, plain_password, hashed_password
+        )
+
+    @staticmethod
+    async def get_password_hash_async(plain_password) -> Optional[str]:
+        """
+        get_password_hash run in the hashing pool
         :param plain_password: Input plaintext password
         :return: A hashed representation; else, None if input was None
+        :raises HashingPoolBusy: If the pool is saturated
         """
         if plain_password is None:
             return None
-        return pwd_context.hash(plain_password)
+        return await hashing_pool.run(Hasher.get_password_hash, plain_password)
@@ -0,0 +1,303 @@
+"""
+Startup profiler: time spent importing each module of an app and in network calls
+made while doing so.
+
+The target module is imported in a fresh interpreter started with `-X importtime`, so
+nothing already imported by the caller skews the numbers and the report matches what
+each gunicorn worker pays. The interpreter's socket connect, name resolution, and TLS
+handshake calls are wrapped to record where the import blocked on the network.
+"""
+import json
+import re
+import subprocess
+import sys
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+# Prefixes the child's result line on stdout, which the app's logging also writes to
+RESULT_MARKER: str = "@@webservices-import-profile@@"
+# Written to stderr around the target's import; only -X importtime lines in between
+# belong to it
+START_MARKER: str = "@@webservices-import-start@@"
+END_MARKER: str = "@@webservices-import-end@@"
+
+# `import time: self [us] | cumulative | imported package` lines on stderr
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S.*)$")
+
+# The child imports nothing the target might import itself before timing it, or the
+# target wouldn't be charged for it. socket and ssl are wrapped when the target first
+# imports them, and json is only imported to report the result.
+_CHILD_SCRIPT: str = """
+import sys
+from time import perf_counter
+
+calls = []
+
+def _timed(a_kind, a_function, a_describe):
+    def wrapper(*args, **kwargs):
+        l_start = perf_counter()
+        l_error = None
+        try:
+            return a_function(*args, **kwargs)
+        except BaseException as e:
+            l_error = repr(e)
+            raise
+        finally:
+            calls.append(
+                {
+                    "kind": a_kind,
+                    "target": a_describe(*args),
+                    "seconds": perf_counter() - l_start,
+                    "error": l_error,
+                }
+            )
+    return wrapper
+
+def _wrap_socket(socket):
+    socket.getaddrinfo = _timed(
+        "resolve", socket.getaddrinfo, lambda host, port, *a: f"{host}:{port}"
+    )
+    socket.socket.connect = _timed(
+        "connect", socket.socket.connect, lambda sock, address: str(address)
+    )
+    socket.socket.connect_ex = _timed(
+        "connect", socket.socket.connect_ex, lambda sock, address: str(address)
+    )
+
+def _wrap_ssl(ssl):
+    ssl.SSLSocket.do_handshake = _timed(
+        "tls", ssl.SSLSocket.do_handshake, lambda sock, *a: str(sock.server_hostname)
+    )
+
+_WRAPPERS = {"socket": _wrap_socket, "ssl": _wrap_ssl}
+
+class _WrappingFinder:
+    @classmethod
+    def find_spec(cls, a_name, a_path=None, a_target=None):
+        if a_name not in _WRAPPERS:
+            return None
+        for l_finder in sys.meta_path:
+            l_find = getattr(l_finder, "find_spec", None)
+            if l_finder is cls or l_find is None:
+                continue
+            l_spec = l_find(a_name, a_path, a_target)
+            if l_spec is not None:
+                break
+        else:
+            return None
+        l_exec_module = l_spec.loader.exec_module
+
+        def exec_module(a_module):
+            l_exec_module(a_module)
+            _WRAPPERS[a_name](a_module)
+
+        l_spec.loader.exec_module = exec_module
+        return l_spec
+
+sys.meta_path.insert(0, _WrappingFinder)
+
+print(START_MARKER, file=sys.stderr, flush=True)
+l_start = perf_counter()
+l_error = None
+try:
+    __import__(sys.argv[1])
+except BaseException as e:
+    l_error = repr(e)
+l_seconds = perf_counter() - l_start
+print(END_MARKER, file=sys.stderr, flush=True)
+
+import json
+
+sys.stdout.flush()
+print(
+    MARKER + json.dumps({"seconds": l_seconds, "error": l_error, "network": calls}),
+    flush=True,
+)
+"""
+
+
+@dataclass
+class ImportRecord:
+    """
+    One module's import, as reported by -X importtime
+    """
+
+    name: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+    children: List["ImportRecord"] = field(default_factory=list)
+
+
+@dataclass
+class NetworkCall:
+    """
+    A blocking network operation performed during the import
+    """
+
+    kind: str
+    target: str
+    seconds: float
+    error: Optional[str] = None
+
+
+@dataclass
+class ImportProfile:
+    """
+    Result of profiling the import of a module
+    """
+
+    module: str
+    # Wall time of the import including interpreter overhead of -X importtime
+    seconds: float
+    roots: List[ImportRecord]
+    network: List[NetworkCall]
+    error: Optional[str] = None
+
+    def walk(self) -> Iterator[ImportRecord]:
+        """
+        :return: Every imported module, depth first
+        """
+        l_stack: List[ImportRecord] = list(reversed(self.roots))
+        while l_stack:
+            l_record: ImportRecord = l_stack.pop()
+            yield l_record
+            l_stack.extend(reversed(l_record.children))
+
+    @property
+    def module_count(self) -> int:
+        """
+        :return: Number of modules imported
+        """
+        return sum(1 for _ in self.walk())
+
+    @property
+    def network_seconds(self) -> float:
+        """
+        :return: Time spent blocked on the network
+        """
+        return sum(l_call.seconds for l_call in self.network)
+
+
+def parse_importtime(a_lines: List[str]) -> List[ImportRecord]:
+    """
+    Rebuild the import tree from -X importtime output. A module's line is printed once
+    its import finished, after the lines of everything it imported, and is indented
+    two spaces per nesting level.
+    :param a_lines: stderr lines of the profiled interpreter
+    :return: The top level imports with their nested imports as children
+    """
+    l_pending: Dict[int, List[ImportRecord]] = {}
+    l_roots: List[ImportRecord] = []
+    for l_line in a_lines:
+        l_match = _IMPORTTIME_LINE.match(l_line.rstrip("\n"))
+        if l_match is None:
+            continue
+        l_self, l_cumulative, l_indent, l_name = l_match.groups()
+        l_depth: int = (len(l_indent) - 1) // 2
+        l_record = ImportRecord(
+            name=l_name.strip(),
+            self_us=int(l_self),
+            cumulative_us=int(l_cumulative),
+            depth=l_depth,
+            children=l_pending.pop(l_depth + 1, []),
+        )
+        if l_depth == 0:
+            l_roots.append(l_record)
+        else:
+            l_pending.setdefault(l_depth, []).append(l_record)
+    return l_roots
+
+
+def profile_imports(a_module: str, a_timeout: float = 300.0) -> ImportProfile:
+    """
+    Import a module in a fresh interpreter and report what it cost
+    :param a_module: Dotted module name, e.g. webservices.main
+    :param a_timeout: Seconds to wait for the import
+    :return: The import tree and network calls
+    """
+    l_process = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"MARKER = {RESULT_MARKER!r}\nSTART_MARKER = {START_MARKER!r}\n"
+            f"END_MARKER = {END_MARKER!r}\n{_CHILD_SCRIPT}",
+            a_module,
+        ],
+        capture_output=True,
+        text=True,
+        timeout=a_timeout,
+    )
+    l_result: Dict[str, Any] = {"seconds": 0.0, "network": [], "error": None}
+    for l_line in l_process.stdout.splitlines():
+        if l_line.startswith(RESULT_MARKER):
+            l_result = json.loads(l_line[len(RESULT_MARKER) :])
+    if l_process.returncode and l_result["error"] is None:
+        l_result["error"] = f"exit status {l_process.returncode}"
+    # Leave out the interpreter's startup and the child's own imports
+    l_stderr: List[str] = l_process.stderr.splitlines()
+    if START_MARKER in l_stderr:
+        l_stderr = l_stderr[l_stderr.index(START_MARKER) + 1 :]
+    if END_MARKER in l_stderr:
+        l_stderr = l_stderr[: l_stderr.index(END_MARKER)]
+    return ImportProfile(
+        module=a_module,
+        seconds=l_result["seconds"],
+        roots=parse_importtime(l_stderr),
+        network=[NetworkCall(**l_call) for l_call in l_result["network"]],
+        error=l_result["error"],
+    )
+
+
+def format_profile(
+    a_profile: ImportProfile, a_min_ms: float = 1.0, a_top: int = 20
+) -> str:
+    """
+    :param a_profile: A profile from profile_imports()
+    :param a_min_ms: Leave out modules whose cumulative import took less
+    :param a_top: Number of modules listed by their own (self) import time
+    :return: A human readable report
+    """
+    l_lines: List[str] = [
+        f"Import of {a_profile.module}: {a_profile.seconds * 1000:.1f} ms, "
+        f"{a_profile.module_count} modules, "
+        f"{a_profile.network_seconds * 1000:.1f} ms in {len(a_profile.network)} "
+        "network call(s)",
+    ]
+    if a_profile.error:
+        l_lines.append(f"Import failed: {a_profile.error}")
+
+    l_lines += ["", f"{'cumulative ms':>13} {'self ms':>9}  module (>= {a_min_ms} ms)"]
+    l_stack: List[ImportRecord] = sorted(a_profile.roots, key=lambda r: r.cumulative_us)
+    while l_stack:
+        l_record: ImportRecord = l_stack.pop()
+        if l_record.cumulative_us < a_min_ms * 1000:
+            continue
+        l_lines.append(
+            f"{l_record.cumulative_us / 1000:>13.1f} {l_record.self_us / 1000:>9.1f}  "
+            f"{'  ' * l_record.depth}{l_record.name}"
+        )
+        l_stack.extend(sorted(l_record.children, key=lambda r: r.cumulative_us))
+
+    l_lines += ["", f"Top {a_top} modules by self time", f"{'self ms':>9}  module"]
+    for l_record in sorted(a_profile.walk(), key=lambda r: r.self_us, reverse=True)[
+        :a_top
+    ]:
+        l_lines.append(f"{l_record.self_us / 1000:>9.1f}  {l_record.name}")
+
+    l_lines += ["", "Network calls"]
+    for l_call in a_profile.network:
+        l_lines.append(
+            f"{l_call.seconds * 1000:>9.1f}  {l_call.kind:<8} {l_call.target}"
+            + (f"  ({l_call.error})" if l_call.error else "")
+        )
+    if not a_profile.network:
+        l_lines.append("     none")
+    return "\n".join(l_lines)
@@ -0,0 +1,523 @@
+"""
+Streaming ingest pipeline for uploaded candump logs.
+
+The request body is consumed straight from the ASGI receive channel as bounded size
+chunks. Each chunk is handed to the configured sinks as-is and is also split into
+complete lines by a LineFramer so line oriented sinks never see a partial record.
+The whole upload is never held in memory and is written to disk at most once (by a
+StagingFileSink handing the file to a background worker, see also
+webservices.core.blobstore).
+
+Compressed uploads (gzip, xz, or zstd) are decompressed as they stream in by a
+DecompressingStream, so the framing stage and the sinks only ever see plain lines.
+"""
+import lzma
+import zlib
+from abc import ABC
+from dataclasses import dataclass
+from os import replace
+from pathlib import Path
+from time import perf_counter
+from typing import Any
+from typing import AsyncIterator
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import aiofiles
+import zstandard
+from aiofiles.threadpool.binary import AsyncBufferedIOBase
+from multipart.multipart import MultipartParser
+from multipart.multipart import parse_options_header
+from webservices.core.tracing import span
+
+
+class IngestError(ValueError):
+    """
+    Raised when an upload can't be framed, e.g. a line exceeds the maximum length
+    """
+
+
+class UnsupportedEncoding(IngestError):
+    """
+    Raised when an upload's Content-Encoding can't be decompressed
+    """
+
+
+class DecompressedTooLarge(IngestError):
+    """
+    Raised when a compressed upload expands beyond the decompressed size cap
+    """
+
+
+@dataclass
+class IngestStats:
+    """
+    Running totals for a single upload
+    """
+
+    byte_count: int = 0
+    line_count: int = 0
+    elapsed_seconds: float = 0.0
+    # Part of elapsed_seconds spent waiting for the next chunk, e.g. on the client
+    read_seconds: float = 0.0
+
+
+class IngestSink(ABC):
+    """
+    Destination for an upload flowing through the ingest pipeline.
+
+    Every method is optional. Sinks that need the exact bytes (hashing, storage)
+    override write_chunk; sinks that work on records override write_lines.
+    """
+
+    async def write_chunk(self, a_chunk: bytes) -> None:
+        """
+        :param a_chunk: The next raw slice of the upload
+        """
+
+    async def write_lines(self, a_lines: List[bytes]) -> None:
+        """
+        :param a_lines: The next batch of complete lines without line terminators
+        """
+
+    async def close(self) -> None:
+        """
+        Called once after the final chunk and lines were delivered
+        """
+
+    async def abort(self) -> None:
+        """
+        Called instead of close() if the upload failed part way through
+        """
+
+
+class StagingFileSink(IngestSink):
+    """
+    Write the upload's bytes to a file so another process (e.g. a Celery worker) can
+    pick it up. The file only appears under its final name once the upload completed.
+    """
+
+    def __init__(self, a_path: Path):
+        """
+        :param a_path: Final location of the staged file
+        """
+        self.path: Path = a_path
+        self._partial: Path = a_path.with_name(f"{a_path.name}.part")
+        self._file: Optional[AsyncBufferedIOBase] = None
+
+    async def _open(self) -> AsyncBufferedIOBase:
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = await aiofiles.open(self._partial, "wb")
+        return self._file
+
+    async def write_chunk(self, a_chunk: bytes) -> None:
+        await (await self._open()).write(a_chunk)
+
+    async def close(self) -> None:
+        await (await self._open()).close()
+        replace(self._partial, self.path)
+
+    async def abort(self) -> None:
+        # Also reached after close() when the staged file can't be handed off
+        if self._file is not None:
+            await self._file.close()
+        self._partial.unlink(missing_ok=True)
+        self.path.unlink(missing_ok=True)
+
+
+class LineFramer:
+    """
+    Reassemble newline delimited records from arbitrarily split chunks
+    """
+
+    def __init__(self, a_max_line_length: int = 4096):
+        """
+        :param a_max_line_length: Longest accepted line in bytes
+        """
+        self.max_line_length: int = a_max_line_length
+        self._carry: bytes = b""
+
+    def feed(self, a_chunk: bytes) -> List[bytes]:
+        """
+        :param a_chunk: The next slice of the stream
+        :return: Every line completed by this chunk. Blank lines are dropped.
+        """
+        l_lines: List[bytes] = (self._carry + a_chunk).split(b"\n")
+        self._carry = l_lines.pop()
+        # The unfinished line is checked too so it can't grow without bound
+        l_longest: int = max(map(len, l_lines), default=0)
+        if max(l_longest, len(self._carry)) > self.max_line_length:
+            raise IngestError(
+                f"Line exceeds the maximum length of {self.max_line_length} bytes"
+            )
+        return [l_line.rstrip(b"\r") for l_line in l_lines if l_line.strip()]
+
+    def flush(self) -> List[bytes]:
+        """
+        :return: The trailing line if the stream didn't end with a newline
+        """
+        l_carry, self._carry = self._carry.rstrip(b"\r"), b""
+        return [l_carry] if l_carry.strip() else []
+
+
+async def bounded_chunks(
+    a_stream: AsyncIterator[bytes], a_chunk_size: int
+) -> AsyncIterator[bytes]:
+    """
+    Re-slice a byte stream so no chunk exceeds a_chunk_size bytes
+    :param a_stream: Source of byte chunks, e.g. Request.stream()
+    :param a_chunk_size: Maximum chunk size in bytes
+    :return: An async iterator of non-empty chunks
+    """
+    async for l_chunk in a_stream:
+        if len(l_chunk) <= a_chunk_size:
+            if l_chunk:
+                yield l_chunk
+            continue
+        l_view = memoryview(l_chunk)
+        for l_offset in range(0, len(l_chunk), a_chunk_size):
+            yield bytes(l_view[l_offset : l_offset + a_chunk_size])
+
+
+class MultipartFileStream:
+    """
+    Incrementally extract a single file field from a multipart/form-data body so form
+    uploads stream through the pipeline the same way raw bodies do.
+    """
+
+    def __init__(
+        self, a_stream: AsyncIterator[bytes], a_content_type: str, a_field_name: str
+    ):
+        """
+        :param a_stream: The raw request body
+        :param a_content_type: The request's Content-Type header
+        :param a_field_name: Name of the form field holding the file
+        :raises IngestError: If the Content-Type lacks a boundary
+        """
+        _, l_params = parse_options_header(a_content_type)
+        l_boundary: Optional[bytes] = l_params.get(b"boundary")
+        if not l_boundary:
+            raise IngestError("multipart/form-data upload without a boundary")
+        self.field_name: bytes = a_field_name.encode()
+        self.filename: Optional[str] = None
+        self._stream: AsyncIterator[bytes] = a_stream
+        self._pending: List[bytes] = []
+        self._in_file: bool = False
+        self._header_field: bytes = b""
+        self._header_value: bytes = b""
+        self._headers: Dict[bytes, bytes] = {}
+        self._parser = MultipartParser(
+            l_boundary,
+            {
+                "on_part_begin": self._on_part_begin,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+            },
+        )
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_field(self, a_data: bytes, a_start: int, a_end: int) -> None:
+        self._header_field += a_data[a_start:a_end]
+
+    def _on_header_value(self, a_data: bytes, a_start: int, a_end: int) -> None:
+        self._header_value += a_data[a_start:a_end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, l_options = parse_options_header(
+            self._headers.get(b"content-disposition", b"")
+        )
+        self._in_file = l_options.get(b"name") == self.field_name
+        if self._in_file and b"filename" in l_options:
+            self.filename = l_options[b"filename"].decode("utf-8", "replace")
+
+    def _on_part_data(self, a_data: bytes, a_start: int, a_end: int) -> None:
+        if self._in_file:
+            self._pending.append(a_data[a_start:a_end])
+
+    def _on_part_end(self) -> None:
+        self._in_file = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for l_chunk in self._stream:
+            self._parser.write(l_chunk)
+            if self._pending:
+                l_data, self._pending = b"".join(self._pending), []
+                yield l_data
+        self._parser.finalize()
+        if self._pending:
+            l_data, self._pending = b"".join(self._pending), []
+            yield l_data
+
+
+# Content-Encoding values of compressed uploads and the format each denotes
+CONTENT_ENCODINGS: Dict[str, str] = {
+    "gzip": "gzip",
+    "x-gzip": "gzip",
+    "xz": "xz",
+    "zstd": "zstd",
+}
+# Leading bytes of each format, recognized when the encoding isn't declared
+_MAGIC_NUMBERS: Tuple[Tuple[bytes, str], ...] = (
+    (b"\x1f\x8b", "gzip"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+)
+_MAGIC_LENGTH: int = max(len(l_magic) for l_magic, _ in _MAGIC_NUMBERS)
+# zstd can't bound a call's output, so its input is fed in slices this small and the
+# output split up afterwards. A slice expands to at most ~32 MiB (a 4 byte RLE block
+# per 128 KiB).
+_ZSTD_INPUT_SLICE: int = 1024
+
+
+class _Decoder:
+    """
+    Incremental decompression of one format, the output of each call bounded. Streams
+    concatenated after the end of one (e.g. gzip members) are decompressed in turn, and
+    NUL padding after the last is dropped.
+    """
+
+    def __init__(self, a_format: str, a_max_length: int):
+        """
+        :param a_format: gzip, xz, or zstd
+        :param a_max_length: Bytes of output a single step may produce
+        """
+        self.format: str = a_format
+        self.max_length: int = a_max_length
+        self._decompressor: Any = self._new()
+        # Data fed to the current stream since it started
+        self._started: bool = False
+
+    def _new(self) -> Any:
+        if self.format == "gzip":
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self.format == "xz":
+            return lzma.LZMADecompressor(lzma.FORMAT_XZ)
+        return zstandard.ZstdDecompressor().decompressobj()
+
+    def _step(self, a_data: bytes) -> Tuple[bytes, bytes, bool]:
+        """
+        :param a_data: Compressed input
+        :return: Output, input left over, and whether output is pending without more
+            input
+        """
+        l_decompressor = self._decompressor
+        if self.format == "gzip":
+            l_out: bytes = l_decompressor.decompress(a_data, self.max_length)
+            if l_decompressor.eof:
+                return l_out, l_decompressor.unused_data, False
+            return (
+                l_out,
+                l_decompressor.unconsumed_tail,
+                len(l_out) == self.max_length,
+            )
+        if self.format == "xz":
+            l_out = l_decompressor.decompress(a_data, self.max_length)
+            if l_decompressor.eof:
+                return l_out, l_decompressor.unused_data, False
+            return l_out, b"", not l_decompressor.needs_input
+        l_out = l_decompressor.decompress(a_data[:_ZSTD_INPUT_SLICE])
+        l_rest: bytes = a_data[_ZSTD_INPUT_SLICE:]
+        if l_decompressor.eof:
+            l_rest = l_decompressor.unused_data + l_rest
+        return l_out, l_rest, False
+
+    @property
+    def _ended(self) -> bool:
+        return self._decompressor.eof
+
+    def feed(self, a_data: bytes) -> Iterator[bytes]:
+        """
+        :param a_data: The next compressed bytes
+        :return: An iterator of decompressed pieces
+        :raises IngestError: If the data is corrupt
+        """
+        l_pending: bool = False
+        while a_data or l_pending:
+            if self._ended:
+                # Archives padded out to a block size end in NULs, which gzip -dc
+                # also ignores, rather than in another stream
+                if not a_data.strip(b"\0"):
+                    break
+                self._decompressor = self._new()
+                self._started = False
+            self._started = self._started or bool(a_data)
+            try:
+                l_out, a_data, l_pending = self._step(a_data)
+            except (zlib.error, lzma.LZMAError, zstandard.ZstdError) as e:
+                raise IngestError(f"Corrupt {self.format} data: {e}")
+            for l_start in range(0, len(l_out), self.max_length):
+                yield l_out[l_start : l_start + self.max_length]
+
+    def finish(self) -> None:
+        """
+        :raises IngestError: If the last stream was cut short
+        """
+        if self._started and not self._ended:
+            raise IngestError(f"Truncated {self.format} data")
+
+
+class DecompressingStream:
+    """
+    Decompress an upload as it streams in, bounding the memory used per chunk and the
+    upload's total decompressed size
+    """
+
+    def __init__(
+        self,
+        a_stream: AsyncIterator[bytes],
+        a_content_encoding: Optional[str],
+        a_max_bytes: int,
+        a_chunk_size: int = 65536,
+    ):
+        """
+        :param a_stream: The upload as received
+        :param a_content_encoding: The upload's declared Content-Encoding if any. The
+            format is recognized by its leading bytes if not declared.
+        :param a_max_bytes: Most bytes a compressed upload may expand to
+        :param a_chunk_size: Most bytes decompressed at once
+        :raises UnsupportedEncoding: If the Content-Encoding isn't supported
+        """
+        self.encoding: Optional[str] = None
+        if a_content_encoding and a_content_encoding.lower() != "identity":
+            self.encoding = CONTENT_ENCODINGS.get(a_content_encoding.strip().lower())
+            if self.encoding is None:
+                raise UnsupportedEncoding(
+                    f"Unsupported Content-Encoding {a_content_encoding}, use one of "
+                    f"{', '.join(CONTENT_ENCODINGS)}"
+                )
+        self.max_bytes: int = a_max_bytes
+        self.chunk_size: int = a_chunk_size
+        # Bytes received and bytes after decompression
+        self.compressed_byte_count: int = 0
+        self.byte_count: int = 0
+        self._stream: AsyncIterator[bytes] = a_stream
+        self._detect: bool = a_content_encoding is None
+
+    @staticmethod
+    def detect(a_head: bytes) -> Optional[str]:
+        """
+        :param a_head: The first bytes of an upload
+        :return: The compression format they start with; None if uncompressed
+        """
+        for l_magic, l_format in _MAGIC_NUMBERS:
+            if a_head.startswith(l_magic):
+                return l_format
+        return None
+
+    def _decompressed(self, a_decoder: _Decoder, a_data: bytes) -> Iterator[bytes]:
+        for l_out in a_decoder.feed(a_data):
+            self.byte_count += len(l_out)
+            if self.byte_count > self.max_bytes:
+                raise DecompressedTooLarge(
+                    f"Upload decompresses to more than {self.max_bytes} bytes"
+                )
+            yield l_out
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        l_head: bytes = b""
+        l_decoder: Optional[_Decoder] = None
+        l_identity: bool = False
+        if self.encoding is not None:
+            l_decoder = _Decoder(self.encoding, self.chunk_size)
+        elif not self._detect:
+            l_identity = True
+        async for l_chunk in self._stream:
+            self.compressed_byte_count += len(l_chunk)
+            if l_identity:
+                self.byte_count += len(l_chunk)
+                yield l_chunk
+                continue
+            if l_decoder is None:
+                # Wait for enough bytes to recognize a format
+                l_head += l_chunk
+                if len(l_head) < _MAGIC_LENGTH:
+                    continue
+                l_chunk, l_head = l_head, b""
+                self.encoding = self.detect(l_chunk)
+                if self.encoding is None:
+                    l_identity = True
+                    self.byte_count += len(l_chunk)
+                    yield l_chunk
+                    continue
+                l_decoder = _Decoder(self.encoding, self.chunk_size)
+            for l_out in self._decompressed(l_decoder, l_chunk):
+                yield l_out
+        if l_head:
+            # Shorter than any magic number
+            self.encoding = self.detect(l_head)
+            if self.encoding is None:
+                self.byte_count += len(l_head)
+                yield l_head
+                return
+            l_decoder = _Decoder(self.encoding, self.chunk_size)
+            for l_out in self._decompressed(l_decoder, l_head):
+                yield l_out
+        if l_decoder is not None:
+            l_decoder.finish()
+
+
+async def ingest_stream(
+    a_chunks: AsyncIterator[bytes],
+    a_sinks: Sequence[IngestSink],
+    a_max_line_length: int = 4096,
+) -> IngestStats:
+    """
+    Drive an upload through the framing stage into every sink
+    :param a_chunks: Bounded size chunks of the upload
+    :param a_sinks: Destinations for the chunks and framed lines
+    :param a_max_line_length: Longest accepted line in bytes
+    :return: Totals for the upload
+    """
+    l_stats = IngestStats()
+    l_framer = LineFramer(a_max_line_length)
+    l_start: float = perf_counter()
+    with span("upload.ingest") as l_span:
+        try:
+            while True:
+                l_read_start: float = perf_counter()
+                try:
+                    l_chunk: bytes = await a_chunks.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    l_stats.read_seconds += perf_counter() - l_read_start
+                l_stats.byte_count += len(l_chunk)
+                l_lines: List[bytes] = l_framer.feed(l_chunk)
+                l_stats.line_count += len(l_lines)
+                for l_sink in a_sinks:
+                    await l_sink.write_chunk(l_chunk)
+                    if l_lines:
+                        await l_sink.write_lines(l_lines)
+            l_lines = l_framer.flush()
+            l_stats.line_count += len(l_lines)
+            for l_sink in a_sinks:
+                if l_lines:
+                    await l_sink.write_lines(l_lines)
+                await l_sink.close()
+        except BaseException:
+            # Includes client disconnects and cancellation
+            for l_sink in a_sinks:
+                await l_sink.abort()
+            raise
+        finally:
+            l_span.set("upload.bytes", l_stats.byte_count)
+            l_span.set("upload.lines", l_stats.line_count)
+            l_span.set("upload.read_seconds", l_stats.read_seconds)
+    l_stats.elapsed_seconds = perf_counter() - l_start
+    return l_stats
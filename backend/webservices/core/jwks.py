@@ -0,0 +1,421 @@
+"""
+Local verification of Keycloak issued JSON Web Tokens.
+
+The realm signing keys are retrieved from Keycloak's JWKS endpoint and indexed by
+their key ID (kid). Nothing is fetched at import: the app's startup handler starts a
+background task that fetches the keys (retrying until Keycloak answers) and refreshes
+them periodically, so workers bind and answer health checks immediately while
+/v1/health/ready reports whether tokens can be verified yet. Keys are also re-fetched
+on demand (rate limited) whenever a token arrives signed by a kid we haven't seen yet,
+which is what happens after a realm key rotation.
+
+Fetched keys are written to a cache file shared by the workers on the host. A worker
+starting or due for a refresh first loads a sufficiently recent copy from there, so
+Keycloak is only asked once per refresh interval instead of once per worker.
+
+Successfully verified tokens are cached by digest until their 'exp' claim so each
+worker only performs the RSA signature check once per token.
+
+When gunicorn preloads the app, the master loads the keys once before forking so the
+workers start out ready.
+"""
+import asyncio
+import json
+import os
+from asyncio import Task
+from hashlib import sha256
+from os import getpid
+from pathlib import Path
+from random import random
+from threading import Lock
+from time import monotonic
+from time import time
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+from jose import jwk
+from jose import jwt
+from jose.backends.base import Key
+from jose.exceptions import JWKError
+from jose.exceptions import JWTError
+from webservices.core import worker_state
+from webservices.core.cache import TTLCache
+from webservices.core.config import core_config
+from webservices.core.config import core_logger as logger
+from webservices.core.config import keycloak_client
+from webservices.core.keycloak_async import keycloak_async_client
+from webservices.core.tracing import span
+
+from keycloak import KeycloakConnectionError
+from keycloak import KeycloakError
+
+
+class JWKSKeyStore:
+    """
+    kid indexed store of the realm's public signing keys
+    """
+
+    def __init__(
+        self,
+        a_fetch: Callable[[], Dict[str, Any]],
+        a_fetch_async: Callable[[], Awaitable[Dict[str, Any]]],
+        a_refresh_interval: float = 300.0,
+        a_min_refetch_interval: float = 10.0,
+        a_retry_interval: float = 3.0,
+        a_cache_path: Optional[str] = None,
+    ):
+        """
+        :param a_fetch: Callable returning a JWK Set, e.g. keycloak_client.certs. Used
+            for on-demand fetches from the threadpool.
+        :param a_fetch_async: Coroutine function returning a JWK Set, e.g.
+            keycloak_async_client.certs. Used by the background refresh task.
+        :param a_refresh_interval: Seconds between background refreshes. 0 disables
+            them once the keys were loaded.
+        :param a_min_refetch_interval: Minimum seconds between two fetches. Protects
+            Keycloak from being hammered by tokens carrying bogus kid values.
+        :param a_retry_interval: Seconds between fetch attempts while no keys are
+            loaded
+        :param a_cache_path: JSON file the fetched JWK Set is shared through with the
+            other workers on the host. Disabled if empty.
+        """
+        self._fetch = a_fetch
+        self._fetch_async = a_fetch_async
+        self.refresh_interval: float = a_refresh_interval
+        self.min_refetch_interval: float = a_min_refetch_interval
+        self.retry_interval: float = a_retry_interval
+        self.cache_path: Optional[Path] = Path(a_cache_path) if a_cache_path else None
+        self._keys: Dict[str, Tuple[Key, str]] = {}
+        self._lock: Lock = Lock()
+        self._last_fetch: float = 0.0
+        # When Keycloak issued the loaded keys (epoch seconds), possibly via the cache
+        self.fetched_at: Optional[float] = None
+        self._task: Optional[Task] = None
+
+    @property
+    def ready(self) -> bool:
+        """
+        :return: True once signing keys are loaded
+        """
+        return bool(self._keys)
+
+    @property
+    def key_count(self) -> int:
+        """
+        :return: The number of loaded signing keys
+        """
+        return len(self._keys)
+
+    def load(self, a_jwks: Dict[str, Any]) -> int:
+        """
+        Replace the indexed keys with the contents of a JWK Set
+        :param a_jwks: A JWK Set like {"keys": [{"kid": ..., "kty": "RSA", ...}]}
+        :return: The number of usable signing keys loaded
+        """
+        l_keys: Dict[str, Tuple[Key, str]] = {}
+        for l_jwk in a_jwks.get("keys", []):
+            l_kid: Optional[str] = l_jwk.get("kid")
+            # Keycloak also publishes encryption keys ('use': 'enc') in the same set
+            if l_kid is None or l_jwk.get("use", "sig") != "sig":
+                continue
+            l_alg: str = l_jwk.get("alg", "RS256")
+            try:
+                l_keys[l_kid] = (jwk.construct(l_jwk, algorithm=l_alg), l_alg)
+            except (JWKError, ValueError) as e:
+                logger.warning(f"Skipping unusable JWK {l_kid}: {e}")
+        with self._lock:
+            self._keys = l_keys
+        return len(l_keys)
+
+    def load_cache(self) -> bool:
+        """
+        Load the keys from the shared cache file if it's newer than the loaded keys
+        :return: True if keys were loaded from the file
+        """
+        if self.cache_path is None:
+            return False
+        try:
+            with open(self.cache_path, "rb") as l_file:
+                l_cached: Dict[str, Any] = json.load(l_file)
+            l_fetched_at: float = float(l_cached["fetched_at"])
+            if self.fetched_at is not None and l_fetched_at <= self.fetched_at:
+                return False
+            if not self.load(l_cached["jwks"]):
+                return False
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable JWKS cache {self.cache_path}: {e}")
+            return False
+        self.fetched_at = l_fetched_at
+        return True
+
+    def _save_cache(self, a_jwks: Dict[str, Any]) -> None:
+        """
+        Atomically replace the shared cache file
+        :param a_jwks: The JWK Set just fetched
+        """
+        if self.cache_path is None:
+            return
+        l_partial: Path = self.cache_path.with_name(
+            f"{self.cache_path.name}.{getpid()}.part"
+        )
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(l_partial, "w") as l_file:
+                json.dump({"fetched_at": self.fetched_at, "jwks": a_jwks}, l_file)
+            os.replace(l_partial, self.cache_path)
+        except OSError as e:
+            logger.warning(f"Unable to write JWKS cache {self.cache_path}: {e}")
+
+    def _claim_fetch(self, a_force: bool) -> bool:
+        """
+        :param a_force: Ignore the rate limit
+        :return: True if a fetch may happen now
+        """
+        with self._lock:
+            l_now: float = monotonic()
+            if (
+                not a_force
+                and self._last_fetch
+                and l_now - self._last_fetch < self.min_refetch_interval
+            ):
+                return False
+            self._last_fetch = l_now
+        return True
+
+    def _loaded(self, a_jwks: Dict[str, Any]) -> bool:
+        l_count: int = self.load(a_jwks)
+        if not l_count:
+            logger.warning("Keycloak JWKS held no usable signing keys")
+            return False
+        self.fetched_at = time()
+        self._save_cache(a_jwks)
+        logger.info(f"Loaded {l_count} keycloak signing key(s)")
+        return True
+
+    def refresh(self, a_force: bool = False) -> bool:
+        """
+        Fetch the JWK Set from Keycloak unless a fetch happened too recently. Blocks;
+        call from the threadpool.
+        :param a_force: Ignore the rate limit
+        :return: True if a fetch was performed and succeeded; False otherwise
+        """
+        if not self._claim_fetch(a_force):
+            return False
+        try:
+            return self._loaded(self._fetch())
+        except KeycloakError as e:
+            logger.warning(f"Failed to refresh keycloak JWKS: {e}")
+            return False
+
+    async def refresh_async(self, a_force: bool = False) -> bool:
+        """
+        Non-blocking counterpart of refresh()
+        :param a_force: Ignore the rate limit
+        :return: True if a fetch was performed and succeeded; False otherwise
+        """
+        if not self._claim_fetch(a_force):
+            return False
+        try:
+            return self._loaded(await self._fetch_async())
+        except KeycloakError as e:
+            logger.warning(f"Failed to refresh keycloak JWKS: {e}")
+            return False
+
+    def get_key(self, a_kid: str) -> Optional[Tuple[Key, str]]:
+        """
+        Look up a signing key. If the kid is unknown, pick up keys another worker saved
+        in the cache file or re-fetch the JWK Set once. Blocks; call from the
+        threadpool.
+        :param a_kid: Key ID from the token header
+        :return: (key, algorithm) if known; None otherwise
+        """
+        l_key = self._keys.get(a_kid)
+        if l_key is None and (self.load_cache() or self.refresh()):
+            l_key = self._keys.get(a_kid)
+        return l_key
+
+    def _seconds_until_due(self) -> Optional[float]:
+        """
+        :return: Seconds until the keys should be refreshed; None if never
+        """
+        if not self.ready:
+            return 0.0
+        if self.refresh_interval <= 0:
+            return None
+        return self.fetched_at + self.refresh_interval - time()
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            l_due: Optional[float] = self._seconds_until_due()
+            if l_due is not None and l_due <= 0:
+                # Another worker may already have refreshed the shared cache
+                self.load_cache()
+                l_due = self._seconds_until_due()
+            if l_due is not None and l_due <= 0:
+                await self.refresh_async(a_force=True)
+                l_due = self._seconds_until_due()
+            if l_due is None:
+                return
+            if not self.ready:
+                await asyncio.sleep(self.retry_interval)
+            else:
+                # Jitter keeps the workers from all fetching at the same moment
+                await asyncio.sleep(max(l_due, 1.0) + random() * self.retry_interval)
+
+    async def start(self) -> None:
+        """
+        Startup handler: load the shared cache if present and fetch and refresh the
+        keys in the background, so the worker can serve requests right away
+        """
+        self.load_cache()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(
+                self._refresh_loop(), name="jwks-refresh"
+            )
+
+    async def stop(self) -> None:
+        """
+        Shutdown handler: stop the background refresh task
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    def reset_after_fork(self) -> None:
+        """
+        Keep the keys loaded by the parent process but drop its lock and its refresh
+        task, which belongs to the parent's event loop
+        """
+        self._lock = Lock()
+        self._task = None
+
+
+class TokenVerifier:
+    """
+    Verify access tokens against a JWKSKeyStore and remember the verified claims until
+    the token expires.
+    """
+
+    def __init__(
+        self,
+        a_key_store: JWKSKeyStore,
+        a_options: Dict[str, bool],
+        a_cache_size: int = 4096,
+    ):
+        """
+        :param a_key_store: Source of the realm signing keys
+        :param a_options: python-jose decode options
+        :param a_cache_size: Maximum number of verified tokens kept per worker
+        """
+        self.key_store: JWKSKeyStore = a_key_store
+        self.options: Dict[str, bool] = a_options
+        self.cache: TTLCache[Dict[str, Any]] = TTLCache(max_size=a_cache_size)
+
+    @staticmethod
+    def token_digest(a_token: str) -> bytes:
+        """
+        :param a_token: An encoded JWT
+        :return: The cache key for the token
+        """
+        return sha256(a_token.encode()).digest()
+
+    def cached(self, a_token: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the claims of a token verified earlier without doing any verification
+        work. Cheap enough to call on the event loop.
+
+        NOTE: The returned dict is shared with the cache and must not be mutated.
+        :param a_token: An encoded JWT
+        :return: The decoded claims if the token is cached; None otherwise
+        """
+        return self.cache.get(self.token_digest(a_token))
+
+    def verify(self, a_token: str) -> Dict[str, Any]:
+        """
+        Return the verified claims of an access token.
+
+        NOTE: The returned dict is shared with the cache and must not be mutated.
+        :param a_token: An encoded JWT
+        :return: The decoded claims
+        :raises JWTError: If the token is malformed, expired, or fails verification
+        :raises KeycloakConnectionError: If the signing keys couldn't be loaded yet
+        """
+        l_digest: bytes = self.token_digest(a_token)
+        l_claims: Optional[Dict[str, Any]] = self.cache.get(l_digest)
+        if l_claims is not None:
+            return l_claims
+
+        with span("auth.token_verify") as l_span:
+            l_kid: Optional[str] = jwt.get_unverified_header(a_token).get("kid")
+            l_key: Any = None
+            l_algorithm: str = "RS256"
+            if l_kid is not None:
+                l_entry = self.key_store.get_key(l_kid)
+                if l_entry is not None:
+                    l_key, l_algorithm = l_entry
+            if l_key is None:
+                # Tokens without a known kid fall back to the realm public key
+                l_key = core_config.KEYCLOAK_PUBLIC_KEY
+            if l_key is None and not self.key_store.ready:
+                raise KeycloakConnectionError("Realm signing keys aren't loaded yet")
+            if l_key is None:
+                raise JWTError(f"Unknown signing key: {l_kid}")
+            l_span.set("auth.kid", str(l_kid))
+            l_span.set("auth.algorithm", l_algorithm)
+
+            l_claims = jwt.decode(
+                a_token, l_key, algorithms=[l_algorithm], options=self.options
+            )
+        l_exp: Any = l_claims.get("exp")
+        if isinstance(l_exp, (int, float)) and l_exp > time():
+            self.cache.set(l_digest, l_claims, float(l_exp))
+        return l_claims
+
+
+jwks_key_store = JWKSKeyStore(
+    keycloak_client.certs,
+    keycloak_async_client.certs,
+    a_refresh_interval=core_config.KEYCLOAK_JWKS_REFRESH_SEC,
+    a_min_refetch_interval=core_config.KEYCLOAK_JWKS_MIN_REFETCH_SEC,
+    a_retry_interval=core_config.KEYCLOAK_LOGIN_WAIT_SEC,
+    a_cache_path=core_config.KEYCLOAK_KEY_CACHE_PATH,
+)
+token_verifier = TokenVerifier(
+    jwks_key_store,
+    core_config.KEYCLOAK_DECRYPT_OPTIONS,
+    a_cache_size=core_config.TOKEN_CACHE_MAX_SIZE,
+)
+
+
+def preload_signing_keys() -> None:
+    """
+    Load the signing keys in the gunicorn master, from the shared cache file if present
+    or else from Keycloak. A single attempt is made; if it fails the workers keep
+    retrying in the background as usual.
+    """
+
+    async def _fetch() -> bool:
+        try:
+            return await jwks_key_store.refresh_async(a_force=True)
+        finally:
+            # The master's pool must not be inherited by the workers
+            await keycloak_async_client.aclose()
+
+    if not jwks_key_store.load_cache() and not asyncio.run(_fetch()):
+        logger.warning("Signing keys weren't preloaded; workers will fetch them")
+
+
+worker_state.register_preload("keycloak signing keys", preload_signing_keys)
+worker_state.register_after_fork(
+    "keycloak signing keys", jwks_key_store.reset_after_fork
+)
+worker_state.register_after_fork("token cache", token_verifier.cache.reset_after_fork)
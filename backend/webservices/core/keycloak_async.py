@@ -0,0 +1,246 @@
+"""
+Non-blocking Keycloak OpenID Connect client.
+
+The python-keycloak KeycloakOpenID client is built on Requests and blocks the event
+loop for the whole HTTPS round trip. This adapter covers the subset of endpoints the
+API routes need on top of an httpx.AsyncClient with HTTP/2 enabled. A single connection
+pool is shared by every request handled by a worker process.
+
+Errors are raised as the python-keycloak exception types so callers can keep handling
+KeycloakConnectionError, KeycloakAuthenticationError, etc.
+"""
+from os import getenv
+from os import getpid
+from typing import Any
+from typing import Dict
+from typing import Optional
+from typing import Union
+
+import httpx
+from webservices.core import worker_state
+from webservices.core.config import core_config
+from webservices.core.metrics import track_dependency
+from webservices.core.tracing import span
+from webservices.core.tracing import SPAN_KIND_CLIENT
+from webservices.core.tracing import traceparent
+from webservices.core.tracing import TRACEPARENT_HEADER
+
+from keycloak import KeycloakAuthenticationError
+from keycloak import KeycloakConnectionError
+from keycloak import KeycloakGetError
+from keycloak import KeycloakPostError
+
+
+class AsyncKeycloakClient:
+    """
+    Async counterpart of keycloak.KeycloakOpenID for a single realm and client
+    """
+
+    def __init__(
+        self,
+        server_url: str,
+        realm_name: str,
+        client_id: str,
+        client_secret_key: Optional[str] = None,
+        verify: Union[bool, str] = True,
+        timeout: float = 10.0,
+        max_connections: int = 100,
+    ):
+        """
+        :param server_url: Keycloak base URL, e.g. https://keycloak:57444
+        :param realm_name: The realm to authenticate against
+        :param client_id: The confidential client used by the API
+        :param client_secret_key: The client's secret
+        :param verify: True, False, or a path to a CA bundle used for TLS verification
+        :param timeout: Per-request timeout in seconds
+        :param max_connections: Connection pool size per worker
+        """
+        self.server_url: str = server_url.rstrip("/")
+        self.realm_name: str = realm_name
+        self.client_id: str = client_id
+        self.client_secret_key: Optional[str] = client_secret_key
+        self.verify: Union[bool, str] = verify
+        self.timeout: float = timeout
+        self.max_connections: int = max_connections
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_pid: Optional[int] = None
+
+    @property
+    def realm_url(self) -> str:
+        """
+        :return: Base URL of the configured realm
+        """
+        return f"{self.server_url}/realms/{self.realm_name}"
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        Lazily create the pooled HTTP client. Sockets can't be shared across a fork so
+        each worker process gets its own pool.
+        :return: The worker's httpx.AsyncClient
+        """
+        if self._client is None or self._client_pid != getpid():
+            self._client = httpx.AsyncClient(
+                base_url=self.realm_url,
+                http2=True,
+                verify=self.verify,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+            self._client_pid = getpid()
+        return self._client
+
+    async def aclose(self) -> None:
+        """
+        Close the worker's connection pool
+        """
+        if self._client is not None and self._client_pid == getpid():
+            await self._client.aclose()
+        self._client = None
+        self._client_pid = None
+
+    def reset_after_fork(self) -> None:
+        """
+        Forget a connection pool inherited from the parent process without closing it
+        """
+        self._client = None
+        self._client_pid = None
+
+    def _add_secret_key(self, a_payload: Dict[str, Any]) -> Dict[str, Any]:
+        if self.client_secret_key:
+            a_payload["client_secret"] = self.client_secret_key
+        return a_payload
+
+    async def _request(self, a_method: str, a_path: str, **kwargs: Any) -> Any:
+        """
+        Issue a request against the realm and decode the JSON response
+        :param a_method: HTTP method
+        :param a_path: Path relative to the realm URL
+        :return: The decoded JSON body
+        """
+        try:
+            with track_dependency("keycloak"), span(
+                f"keycloak {a_method}",
+                {"http.method": a_method, "http.target": a_path},
+                SPAN_KIND_CLIENT,
+            ) as l_span:
+                l_traceparent: Optional[str] = traceparent()
+                if l_traceparent is not None:
+                    kwargs["headers"] = {
+                        **kwargs.get("headers", {}),
+                        TRACEPARENT_HEADER: l_traceparent,
+                    }
+                l_response: httpx.Response = await self.client.request(
+                    a_method, a_path, **kwargs
+                )
+                l_span.set("http.status_code", l_response.status_code)
+        except httpx.HTTPError as e:
+            raise KeycloakConnectionError(f"Can't connect to server ({e})")
+
+        if l_response.is_success:
+            return l_response.json() if l_response.content else {}
+
+        l_error_type = KeycloakGetError if a_method == "GET" else KeycloakPostError
+        if l_response.status_code == 401:
+            l_error_type = KeycloakAuthenticationError
+        try:
+            l_message: str = l_response.json().get("error_description") or ""
+        except ValueError:
+            l_message = l_response.text
+        raise l_error_type(
+            error_message=l_message or l_response.reason_phrase,
+            response_code=l_response.status_code,
+            response_body=l_response.content,
+        )
+
+    async def well_known(self) -> Dict[str, Any]:
+        """
+        :return: The realm's OpenID Connect discovery document
+        """
+        return await self._request("GET", "/.well-known/openid-configuration")
+
+    async def certs(self) -> Dict[str, Any]:
+        """
+        :return: The realm's public signing keys as a JWK Set
+        """
+        return await self._request("GET", "/protocol/openid-connect/certs")
+
+    async def public_key(self) -> str:
+        """
+        :return: The base64 encoded realm public key
+        """
+        return (await self._request("GET", ""))["public_key"]
+
+    async def token(
+        self, username: str, password: str, scope: str = "openid"
+    ) -> Dict[str, Any]:
+        """
+        Resource Owner Password Credentials grant
+        :param username: The user's login
+        :param password: The user's password
+        :param scope: Requested OAuth scopes
+        :return: Keycloak's token response
+        """
+        l_payload: Dict[str, Any] = {
+            "username": username,
+            "password": password,
+            "client_id": self.client_id,
+            "grant_type": "password",
+            "scope": scope,
+        }
+        return await self._request(
+            "POST",
+            "/protocol/openid-connect/token",
+            data=self._add_secret_key(l_payload),
+        )
+
+    async def refresh_token(self, refresh_token: str) -> Dict[str, Any]:
+        """
+        Refresh Token grant
+        :param refresh_token: A refresh token from an earlier token response
+        :return: Keycloak's token response
+        """
+        l_payload: Dict[str, Any] = {
+            "client_id": self.client_id,
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+        }
+        return await self._request(
+            "POST",
+            "/protocol/openid-connect/token",
+            data=self._add_secret_key(l_payload),
+        )
+
+    async def logout(self, refresh_token: str) -> None:
+        """
+        End the Keycloak session a refresh token belongs to, invalidating its refresh
+        tokens
+        :param refresh_token: A refresh token of the session
+        """
+        l_payload: Dict[str, Any] = {
+            "client_id": self.client_id,
+            "refresh_token": refresh_token,
+        }
+        await self._request(
+            "POST",
+            "/protocol/openid-connect/logout",
+            data=self._add_secret_key(l_payload),
+        )
+
+
+# Mirror the Requests library's CA bundle configuration used by keycloak_client
+keycloak_async_client = AsyncKeycloakClient(
+    server_url=core_config.KEYCLOAK_URL,
+    realm_name=core_config.KEYCLOAK_REALM,
+    client_id=core_config.KEYCLOAK_CLIENT_ID,
+    client_secret_key=core_config.KEYCLOAK_CLIENT_SECRET_KEY,
+    verify=getenv("REQUESTS_CA_BUNDLE") or True,
+    timeout=core_config.KEYCLOAK_HTTP_TIMEOUT_SEC,
+    max_connections=core_config.KEYCLOAK_HTTP_MAX_CONNECTIONS,
+)
+worker_state.register_after_fork(
+    "keycloak http client", keycloak_async_client.reset_after_fork
+)
@@ -0,0 +1,262 @@
+"""
+Per-worker load statistics shared with the gunicorn master through /dev/shm.
+
+Every worker measures how late its event loop wakes up from a fixed sleep (the event
+loop lag: how long a ready callback waits behind other work) and how many requests it
+is currently handling. The numbers are written to a small memory mapped file of its own
+in a directory under gunicorn's worker_tmp_dir, which the master reads to decide
+whether to add or remove workers. See webservices.core.autoscale.
+
+Each file holds a single fixed size record protected by a sequence counter: the writer
+makes it odd while updating and even again when done, and readers retry on an odd or
+changed counter. Writers never block and readers never see a torn record.
+"""
+import asyncio
+import mmap
+import os
+import struct
+from asyncio import Task
+from dataclasses import dataclass
+from pathlib import Path
+from time import time
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from starlette.types import ASGIApp
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+# seq, then the WorkerLoad fields in order
+_RECORD = struct.Struct("<QIddddIIQ")
+_FILE_PREFIX: str = "worker-"
+
+
+@dataclass
+class WorkerLoad:
+    """
+    The latest load sample published by a worker
+    """
+
+    pid: int
+    # Epoch seconds the sample was taken
+    updated_at: float
+    # Exponentially weighted moving average of the event loop lag
+    lag_ms: float
+    # Lag of the latest sample alone, reacts to a burst before the average does
+    lag_last_ms: float
+    # Seconds the worker has been publishing samples
+    uptime: float
+    in_flight: int
+    # Most requests handled at once since the previous sample
+    in_flight_peak: int
+    # Requests started since the worker booted
+    requests: int
+
+
+def stats_path(a_directory: Path, a_pid: int) -> Path:
+    """
+    :param a_directory: The directory shared by the master and its workers
+    :param a_pid: A worker's process id
+    :return: The worker's statistics file
+    """
+    return a_directory / f"{_FILE_PREFIX}{a_pid}"
+
+
+def read_stats(a_path: Path, a_retries: int = 5) -> Optional[WorkerLoad]:
+    """
+    :param a_path: A worker's statistics file
+    :param a_retries: Attempts made while the worker is updating the record
+    :return: The worker's latest sample; None if there's none or it can't be read
+    """
+    try:
+        with open(a_path, "rb") as l_file:
+            for _ in range(a_retries):
+                l_file.seek(0)
+                l_data: bytes = l_file.read(_RECORD.size)
+                if len(l_data) < _RECORD.size:
+                    return None
+                l_values = _RECORD.unpack(l_data)
+                l_file.seek(0)
+                if l_values[0] % 2 or l_file.read(8) != l_data[:8]:
+                    continue
+                return WorkerLoad(*l_values[1:])
+    except OSError:
+        pass
+    return None
+
+
+def read_all(a_directory: Path) -> Dict[int, WorkerLoad]:
+    """
+    :param a_directory: The directory shared by the master and its workers
+    :return: The latest sample of every worker with a readable file, keyed by pid
+    """
+    l_loads: Dict[int, WorkerLoad] = {}
+    try:
+        l_paths: List[Path] = list(a_directory.glob(f"{_FILE_PREFIX}*"))
+    except OSError:
+        return l_loads
+    for l_path in l_paths:
+        l_load: Optional[WorkerLoad] = read_stats(l_path)
+        if l_load is not None:
+            l_loads[l_load.pid] = l_load
+    return l_loads
+
+
+def remove_stats(a_directory: Path, a_pid: int) -> None:
+    """
+    Delete the file of a worker that exited
+    :param a_directory: The directory shared by the master and its workers
+    :param a_pid: The worker's process id
+    """
+    try:
+        stats_path(a_directory, a_pid).unlink()
+    except FileNotFoundError:
+        pass
+
+
+class LoadMonitor:
+    """
+    Samples a worker's event loop lag and in-flight requests. Only publishes once told
+    where to by publish_to(), which gunicorn's post_fork hook calls when autoscaling is
+    enabled; otherwise it only counts requests.
+    """
+
+    def __init__(self, a_interval: float = 0.5, a_smoothing: float = 0.3):
+        """
+        :param a_interval: Seconds between two samples
+        :param a_smoothing: Weight of the newest lag sample in the moving average
+        """
+        self.interval: float = a_interval
+        self.smoothing: float = a_smoothing
+        self.in_flight: int = 0
+        self.in_flight_peak: int = 0
+        self.requests: int = 0
+        self.lag_ms: float = 0.0
+        self.lag_last_ms: float = 0.0
+        self._path: Optional[Path] = None
+        self._map: Optional[mmap.mmap] = None
+        self._seq: int = 0
+        self._started_at: float = 0.0
+        self._task: Optional[Task] = None
+
+    def request_started(self) -> None:
+        """
+        Count a request the worker started handling
+        """
+        self.requests += 1
+        self.in_flight += 1
+        if self.in_flight > self.in_flight_peak:
+            self.in_flight_peak = self.in_flight
+
+    def request_finished(self) -> None:
+        """
+        Count a request the worker is done with
+        """
+        self.in_flight -= 1
+
+    def publish_to(self, a_directory: Path, a_interval: Optional[float] = None) -> None:
+        """
+        Create this worker's statistics file
+        :param a_directory: The directory shared by the master and its workers
+        :param a_interval: Overrides the seconds between two samples
+        """
+        if a_interval is not None:
+            self.interval = a_interval
+        a_directory.mkdir(parents=True, exist_ok=True)
+        self._path = stats_path(a_directory, os.getpid())
+        l_fd: int = os.open(self._path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(l_fd, _RECORD.size)
+            self._map = mmap.mmap(l_fd, _RECORD.size)
+        finally:
+            os.close(l_fd)
+        self._started_at = time()
+        self._write()
+
+    def _write(self) -> None:
+        if self._map is None:
+            return
+        l_now: float = time()
+        self._seq += 1
+        self._map[:8] = struct.pack("<Q", self._seq)
+        _RECORD.pack_into(
+            self._map,
+            0,
+            self._seq,
+            os.getpid(),
+            l_now,
+            self.lag_ms,
+            self.lag_last_ms,
+            l_now - self._started_at,
+            self.in_flight,
+            self.in_flight_peak,
+            self.requests,
+        )
+        self._seq += 1
+        self._map[:8] = struct.pack("<Q", self._seq)
+
+    async def _sample_loop(self) -> None:
+        l_loop = asyncio.get_running_loop()
+        while True:
+            l_expected: float = l_loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lag_last_ms = max(l_loop.time() - l_expected, 0.0) * 1000
+            self.lag_ms += self.smoothing * (self.lag_last_ms - self.lag_ms)
+            self._write()
+            self.in_flight_peak = self.in_flight
+
+    async def start(self) -> None:
+        """
+        Startup handler: sample in the background if publishing
+        """
+        if self._map is not None and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(
+                self._sample_loop(), name="load-monitor"
+            )
+
+    async def stop(self) -> None:
+        """
+        Shutdown handler: stop sampling and remove the statistics file
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._path is not None:
+            remove_stats(self._path.parent, os.getpid())
+            self._path = None
+
+
+class InFlightMiddleware:
+    """
+    ASGI middleware counting the HTTP requests a worker is handling
+    """
+
+    def __init__(self, app: ASGIApp, a_monitor: LoadMonitor):
+        """
+        :param app: The wrapped ASGI app
+        :param a_monitor: Receives the request counts
+        """
+        self.app: ASGIApp = app
+        self.monitor: LoadMonitor = a_monitor
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        self.monitor.request_started()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.monitor.request_finished()
+
+
+load_monitor = LoadMonitor()
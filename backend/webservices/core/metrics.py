@@ -0,0 +1,236 @@
+"""
+Prometheus metrics of the HTTP API, served at /metrics.
+
+Under gunicorn every worker records into memory mapped files in PROMETHEUS_MULTIPROC_DIR
+(set up by gunicorn_conf.py), which /metrics merges so a scrape reflects all workers no
+matter which one answers it. Without the variable, e.g. under uvicorn alone, the metrics
+are kept in process.
+
+prometheus_client picks its storage when it's imported, so the variable must be set
+before this module is first imported.
+"""
+import os
+from time import perf_counter
+from typing import Dict
+from typing import FrozenSet
+from typing import Tuple
+
+from prometheus_client import CollectorRegistry
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import generate_latest
+from prometheus_client import Histogram
+from prometheus_client import multiprocess
+from prometheus_client import REGISTRY
+from prometheus_client.context_managers import Timer
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp
+from starlette.types import Message
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+
+# Upload and ingest requests legitimately take minutes
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+
+# Route label of requests that matched no route, so bogus paths can't add label values
+UNMATCHED_ROUTE: str = "<unmatched>"
+_KNOWN_METHODS: FrozenSet[str] = frozenset(
+    {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+)
+
+http_requests = Counter(
+    "http_requests",
+    "HTTP requests handled",
+    ["method", "route", "status"],
+)
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Time from receiving a request until its response was sent",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests being handled",
+    multiprocess_mode="livesum",
+)
+http_request_body_bytes = Counter(
+    "http_request_body_bytes",
+    "Bytes received in request bodies",
+    ["method", "route"],
+)
+http_response_body_bytes = Counter(
+    "http_response_body_bytes",
+    "Bytes sent in response bodies",
+    ["method", "route"],
+)
+dependency_duration = Histogram(
+    "dependency_duration_seconds",
+    "Time requests spent waiting on a dependency",
+    ["dependency"],
+    buckets=LATENCY_BUCKETS,
+)
+rate_limited_requests = Counter(
+    "rate_limited_requests",
+    "Requests rejected with 429 by a rate limit or upload admission",
+    ["limit"],
+)
+coalesced_calls = Counter(
+    "coalesced_calls",
+    "Calls that joined an identical call already in flight instead of being made",
+    ["call"],
+)
+
+# labels() validates and locks on every call; the label sets are few and reused
+_route_children: Dict[Tuple[str, str], Tuple[Histogram, Counter, Counter]] = {}
+_status_children: Dict[Tuple[str, str, int], Counter] = {}
+_dependency_children: Dict[str, Histogram] = {}
+
+
+def track_dependency(a_dependency: str) -> Timer:
+    """
+    Time a call to a dependency, e.g.
+        with track_dependency("keycloak"):
+            await ...
+    :param a_dependency: Name of the dependency, e.g. keycloak or database
+    :return: A context manager observing its duration
+    """
+    l_child = _dependency_children.get(a_dependency)
+    if l_child is None:
+        l_child = _dependency_children.setdefault(
+            a_dependency, dependency_duration.labels(a_dependency)
+        )
+    return l_child.time()
+
+
+def route_label(a_scope: Scope) -> str:
+    """
+    :param a_scope: The ASGI scope after routing
+    :return: The matched route's path template, e.g. /v1/jobs/{job_id}
+    """
+    l_route = a_scope.get("route")
+    if l_route is not None:
+        return l_route.path
+    if "endpoint" in a_scope:
+        # Plain Starlette routes (docs, /metrics) have fixed paths
+        return a_scope["path"]
+    return UNMATCHED_ROUTE
+
+
+def _record(
+    a_method: str,
+    a_route: str,
+    a_status: int,
+    a_seconds: float,
+    a_request_bytes: int,
+    a_response_bytes: int,
+) -> None:
+    l_children = _route_children.get((a_method, a_route))
+    if l_children is None:
+        l_children = _route_children.setdefault(
+            (a_method, a_route),
+            (
+                http_request_duration.labels(a_method, a_route),
+                http_request_body_bytes.labels(a_method, a_route),
+                http_response_body_bytes.labels(a_method, a_route),
+            ),
+        )
+    l_duration, l_request_bytes, l_response_bytes = l_children
+    l_duration.observe(a_seconds)
+    if a_request_bytes:
+        l_request_bytes.inc(a_request_bytes)
+    if a_response_bytes:
+        l_response_bytes.inc(a_response_bytes)
+
+    l_key: Tuple[str, str, int] = (a_method, a_route, a_status)
+    l_requests = _status_children.get(l_key)
+    if l_requests is None:
+        l_requests = _status_children.setdefault(
+            l_key, http_requests.labels(a_method, a_route, str(a_status))
+        )
+    l_requests.inc()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request counts, latency, and body sizes per route
+    """
+
+    def __init__(self, app: ASGIApp):
+        """
+        :param app: The wrapped ASGI app
+        """
+        self.app: ASGIApp = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        l_start: float = perf_counter()
+        l_request_bytes: int = 0
+        l_response_bytes: int = 0
+        # Reported if the app fails before responding; the error middleware sends a 500
+        l_status: int = 500
+
+        async def _receive() -> Message:
+            nonlocal l_request_bytes
+            l_message: Message = await receive()
+            l_request_bytes += len(l_message.get("body", b""))
+            return l_message
+
+        async def _send(a_message: Message) -> None:
+            nonlocal l_response_bytes, l_status
+            if a_message["type"] == "http.response.start":
+                l_status = a_message["status"]
+            else:
+                l_response_bytes += len(a_message.get("body", b""))
+            await send(a_message)
+
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, _receive, _send)
+        finally:
+            http_requests_in_flight.dec()
+            l_method: str = scope["method"]
+            _record(
+                l_method if l_method in _KNOWN_METHODS else "OTHER",
+                route_label(scope),
+                l_status,
+                perf_counter() - l_start,
+                l_request_bytes,
+                l_response_bytes,
+            )
+
+
+def metrics_endpoint(request: Request) -> Response:
+    """
+    Prometheus scrape endpoint. Reading every worker's files blocks, so this is a sync
+    endpoint run in the threadpool.
+    :param request: The scrape request
+    :return: The metrics in the Prometheus text format
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        l_registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(l_registry)
+    else:
+        l_registry = REGISTRY
+    return Response(generate_latest(l_registry), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,447 @@
+"""
+Rate limits and upload admission control.
+
+Token buckets cap how often a client may call an expensive route: logins per client IP,
+each a Keycloak round trip, and uploads per user. Uploads are also admitted against a
+cap of concurrent uploads per user and a budget of bytes in flight per worker, taken
+from Content-Length, so a few huge uploads can't starve everyone else. Every check
+happens before the request body is read, and a rejected request gets 429 with a
+Retry-After estimate.
+
+Buckets and per-user upload counts are kept per worker or, with RATE_LIMIT_REDIS, in
+Redis so the limits hold across workers and nodes. While Redis is unreachable each
+worker falls back to its own state. The bytes budget protects the worker itself and is
+always local.
+"""
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from math import ceil
+from time import monotonic
+from typing import AsyncIterator
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+from uuid import uuid4
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+from webservices.core import worker_state
+from webservices.core.config import core_config
+from webservices.core.metrics import rate_limited_requests
+from webservices.core.redis_client import FailSoftRedis
+
+# Refills and takes from the bucket in KEYS[1] (ARGV: rate per second, burst, cost).
+# Returns the seconds until the cost is available, 0 if it was taken.
+_TAKE_TOKENS: str = """
+local l_now = redis.call('TIME')
+l_now = tonumber(l_now[1]) + tonumber(l_now[2]) / 1000000
+local l_rate = tonumber(ARGV[1])
+local l_burst = tonumber(ARGV[2])
+local l_cost = tonumber(ARGV[3])
+local l_state = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local l_tokens = tonumber(l_state[1]) or l_burst
+local l_at = tonumber(l_state[2]) or l_now
+l_tokens = math.min(l_burst, l_tokens + math.max(l_now - l_at, 0) * l_rate)
+local l_wait = 0
+if l_tokens >= l_cost then
+    l_tokens = l_tokens - l_cost
+else
+    l_wait = (l_cost - l_tokens) / l_rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(l_tokens), 'at', tostring(l_now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(l_burst / l_rate * 1000) + 1000)
+return tostring(l_wait)
+"""
+
+# Adds lease ARGV[2] to the leases in KEYS[1] unless ARGV[1] unexpired ones exist.
+# Leases expire after ARGV[3] milliseconds in case a worker dies holding one.
+_ACQUIRE_LEASE: str = """
+local l_now = redis.call('TIME')
+l_now = tonumber(l_now[1]) * 1000 + math.floor(tonumber(l_now[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', l_now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], l_now + tonumber(ARGV[3]), ARGV[2])
+redis.call('PEXPIRE', KEYS[1], tonumber(ARGV[3]))
+return 1
+"""
+
+
+class RateLimited(RuntimeError):
+    """
+    Raised when a request exceeds a rate limit or isn't admitted
+    """
+
+    def __init__(self, a_limit: str, a_retry_after: float, a_detail: str):
+        """
+        :param a_limit: Name of the limit, e.g. login
+        :param a_retry_after: Seconds after which the request would likely succeed
+        :param a_detail: Message for the client
+        """
+        super().__init__(a_detail)
+        self.limit: str = a_limit
+        self.retry_after: int = max(ceil(a_retry_after), 1)
+        self.detail: str = a_detail
+        rate_limited_requests.labels(a_limit).inc()
+
+
+def rate_limited_response(a_error: RateLimited) -> JSONResponse:
+    """
+    :param a_error: The rejection
+    :return: A 429 response telling the client when to retry
+    """
+    return JSONResponse(
+        {"detail": a_error.detail},
+        status_code=429,
+        headers={"Retry-After": str(a_error.retry_after)},
+    )
+
+
+@dataclass(frozen=True)
+class BucketSpec:
+    """
+    Refill rate and capacity of a token bucket
+    """
+
+    # Tokens added per second
+    rate: float
+    # Tokens a full bucket holds, i.e. the requests allowed in a burst
+    burst: float
+
+    @classmethod
+    def per_minute(cls, a_per_minute: float, a_burst: int) -> Optional["BucketSpec"]:
+        """
+        :param a_per_minute: Sustained requests per minute
+        :param a_burst: Requests allowed in a burst
+        :return: The bucket's spec; None if a_per_minute is 0, i.e. unlimited
+        """
+        if a_per_minute <= 0:
+            return None
+        return cls(a_per_minute / 60, max(a_burst, 1))
+
+
+class TokenBuckets:
+    """
+    The worker's own token buckets, the least recently used dropped beyond a maximum
+    """
+
+    def __init__(self, a_max_keys: int = 65536):
+        """
+        :param a_max_keys: Maximum number of buckets kept
+        """
+        self.max_keys: int = a_max_keys
+        # Tokens left and the monotonic time they were counted at, per bucket
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def take(self, a_key: str, a_spec: BucketSpec, a_cost: float = 1.0) -> float:
+        """
+        :param a_key: The bucket
+        :param a_spec: Its refill rate and capacity
+        :param a_cost: Tokens to take
+        :return: 0 if the tokens were taken; else the seconds until they're available
+        """
+        l_now: float = monotonic()
+        l_tokens, l_at = self._buckets.pop(a_key, (a_spec.burst, l_now))
+        l_tokens = min(a_spec.burst, l_tokens + (l_now - l_at) * a_spec.rate)
+        l_wait: float = 0.0
+        if l_tokens >= a_cost:
+            l_tokens -= a_cost
+        else:
+            l_wait = (a_cost - l_tokens) / a_spec.rate
+        self._buckets[a_key] = (l_tokens, l_now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return l_wait
+
+    def reset_after_fork(self) -> None:
+        """
+        Drop the parent process's buckets
+        """
+        self._buckets.clear()
+
+
+class RateLimiter:
+    """
+    Named token buckets, each keyed by e.g. a client IP or a user
+    """
+
+    def __init__(
+        self,
+        a_redis: FailSoftRedis,
+        a_buckets: Dict[str, Optional[BucketSpec]],
+        a_prefix: str = "webservices:ratelimit:1",
+    ):
+        """
+        :param a_redis: Holds the buckets if enabled
+        :param a_buckets: Spec of each named bucket. None disables it.
+        :param a_prefix: Prepended to the Redis keys
+        """
+        self.redis: FailSoftRedis = a_redis
+        self.buckets: Dict[str, Optional[BucketSpec]] = a_buckets
+        self.prefix: str = a_prefix
+        self.local: TokenBuckets = TokenBuckets()
+
+    async def check(self, a_bucket: str, a_key: str, a_cost: float = 1.0) -> None:
+        """
+        Take tokens from a_key's bucket
+        :param a_bucket: Name of the bucket, e.g. login
+        :param a_key: Whose bucket, e.g. the client IP
+        :param a_cost: Tokens to take
+        :raises RateLimited: If the bucket doesn't hold a_cost tokens
+        """
+        l_spec: Optional[BucketSpec] = self.buckets.get(a_bucket)
+        if l_spec is None:
+            return
+        l_key: str = f"{a_bucket}:{a_key}"
+        l_wait: Optional[float] = None
+        if self.redis.enabled:
+            l_results = await self.redis.execute(
+                f"check the {a_bucket} rate limit",
+                lambda a_pipe: a_pipe.eval(
+                    _TAKE_TOKENS,
+                    1,
+                    f"{self.prefix}:{l_key}",
+                    l_spec.rate,
+                    l_spec.burst,
+                    a_cost,
+                ),
+            )
+            if l_results is not None:
+                l_wait = float(l_results[0])
+        if l_wait is None:
+            l_wait = self.local.take(l_key, l_spec, a_cost)
+        if l_wait > 0:
+            raise RateLimited(
+                a_bucket, l_wait, "Too many requests. Please retry later."
+            )
+
+    def reset_after_fork(self) -> None:
+        """
+        Drop the parent process's buckets
+        """
+        self.local.reset_after_fork()
+
+
+@dataclass
+class UploadLease:
+    """
+    An admitted upload's share of the limits
+    """
+
+    user: str
+    # Bytes reserved from the worker's budget
+    byte_count: int
+    # The lease in Redis; None if counted by this worker
+    lease_id: Optional[str] = None
+
+
+class UploadAdmission:
+    """
+    Concurrent uploads per user and bytes in flight per worker
+    """
+
+    def __init__(
+        self,
+        a_redis: FailSoftRedis,
+        a_max_per_user: int,
+        a_max_bytes: int,
+        a_unknown_length_bytes: int,
+        a_retry_after: float,
+        a_lease_seconds: float = 900.0,
+        a_prefix: str = "webservices:uploads:1",
+    ):
+        """
+        :param a_redis: Holds the per-user counts if enabled
+        :param a_max_per_user: Uploads a user may run at once. 0 is unlimited.
+        :param a_max_bytes: Bytes the worker's uploads may announce at once. An upload
+            larger than this is admitted only while no other upload is in flight.
+        :param a_unknown_length_bytes: Bytes counted for a body without Content-Length
+        :param a_retry_after: Seconds a rejected upload is told to wait
+        :param a_lease_seconds: Seconds after which a user's upload stops counting in
+            Redis if its worker died without releasing it
+        :param a_prefix: Prepended to the Redis keys
+        """
+        self.redis: FailSoftRedis = a_redis
+        self.max_per_user: int = a_max_per_user
+        self.max_bytes: int = a_max_bytes
+        self.unknown_length_bytes: int = a_unknown_length_bytes
+        self.retry_after: float = a_retry_after
+        self.lease_seconds: float = a_lease_seconds
+        self.prefix: str = a_prefix
+        self.bytes_in_flight: int = 0
+        self._local_counts: Dict[str, int] = {}
+
+    def _reserve_bytes(self, a_byte_count: int) -> None:
+        if (
+            self.bytes_in_flight
+            and self.bytes_in_flight + a_byte_count > self.max_bytes
+        ):
+            raise RateLimited(
+                "upload_bytes",
+                self.retry_after,
+                "The server is busy with other uploads. Please retry shortly.",
+            )
+        self.bytes_in_flight += a_byte_count
+
+    async def _acquire_user(self, a_user: str) -> Tuple[bool, Optional[str]]:
+        """
+        :param a_user: The uploading user
+        :return: Whether the upload is admitted, and its lease in Redis if it holds one
+        """
+        if self.redis.enabled:
+            l_lease_id: str = uuid4().hex
+            l_results = await self.redis.execute(
+                "admit an upload",
+                lambda a_pipe: a_pipe.eval(
+                    _ACQUIRE_LEASE,
+                    1,
+                    f"{self.prefix}:{a_user}",
+                    self.max_per_user,
+                    l_lease_id,
+                    int(self.lease_seconds * 1000),
+                ),
+            )
+            if l_results is not None:
+                return bool(l_results[0]), l_lease_id
+        l_count: int = self._local_counts.get(a_user, 0)
+        if l_count >= self.max_per_user:
+            return False, None
+        self._local_counts[a_user] = l_count + 1
+        return True, None
+
+    async def acquire(self, a_user: str, a_length: Optional[int]) -> UploadLease:
+        """
+        :param a_user: The uploading user
+        :param a_length: The body's Content-Length if given
+        :return: The upload's lease, to be released when it's done
+        :raises RateLimited: If the user or the worker has too many uploads in flight
+        """
+        l_lease = UploadLease(
+            a_user, self.unknown_length_bytes if a_length is None else a_length
+        )
+        self._reserve_bytes(l_lease.byte_count)
+        if self.max_per_user <= 0:
+            return l_lease
+        try:
+            l_admitted, l_lease.lease_id = await self._acquire_user(a_user)
+        except BaseException:
+            self.bytes_in_flight -= l_lease.byte_count
+            raise
+        if not l_admitted:
+            self.bytes_in_flight -= l_lease.byte_count
+            raise RateLimited(
+                "upload_concurrency",
+                self.retry_after,
+                "Too many of your uploads are in progress "
+                f"(limit {self.max_per_user}). Please retry once one has finished.",
+            )
+        return l_lease
+
+    async def release(self, a_lease: UploadLease) -> None:
+        """
+        :param a_lease: A lease returned by acquire()
+        """
+        self.bytes_in_flight -= a_lease.byte_count
+        if self.max_per_user <= 0:
+            return
+        if a_lease.lease_id is not None:
+            await self.redis.execute(
+                "release an upload",
+                lambda a_pipe: a_pipe.zrem(
+                    f"{self.prefix}:{a_lease.user}", a_lease.lease_id
+                ),
+            )
+            return
+        l_count: int = self._local_counts.get(a_lease.user, 1) - 1
+        if l_count > 0:
+            self._local_counts[a_lease.user] = l_count
+        else:
+            self._local_counts.pop(a_lease.user, None)
+
+    @asynccontextmanager
+    async def admit(self, a_user: str, a_length: Optional[int]) -> AsyncIterator[None]:
+        """
+        Hold a lease for the duration of a with block
+        :param a_user: The uploading user
+        :param a_length: The body's Content-Length if given
+        :raises RateLimited: If the user or the worker has too many uploads in flight
+        """
+        l_lease: UploadLease = await self.acquire(a_user, a_length)
+        try:
+            yield
+        finally:
+            await self.release(l_lease)
+
+    def reset_after_fork(self) -> None:
+        """
+        Forget the parent process's uploads
+        """
+        self.bytes_in_flight = 0
+        self._local_counts.clear()
+
+
+class RateLimitMiddleware:
+    """
+    Pure ASGI middleware taking a token per request to some paths from the client IP's
+    bucket before the app sees the request, so a rejected request's body isn't read
+    """
+
+    def __init__(self, app: ASGIApp, a_limiter: RateLimiter, a_paths: Dict[str, str]):
+        """
+        :param app: The wrapped ASGI app
+        :param a_limiter: The rate limiter
+        :param a_paths: Name of the bucket for each limited path
+        """
+        self.app: ASGIApp = app
+        self.limiter: RateLimiter = a_limiter
+        self.paths: Dict[str, str] = a_paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            l_bucket: Optional[str] = self.paths.get(scope["path"])
+            if l_bucket is not None:
+                l_client = scope.get("client")
+                try:
+                    await self.limiter.check(
+                        l_bucket, l_client[0] if l_client else "unknown"
+                    )
+                except RateLimited as e:
+                    await rate_limited_response(e)(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+
+rate_limit_redis = FailSoftRedis(
+    "Rate limit store",
+    (core_config.RATE_LIMIT_REDIS_URL or core_config.CELERY_BROKER_URL)
+    if core_config.RATE_LIMIT_REDIS
+    else None,
+    a_timeout=core_config.AUTH_CACHE_REDIS_TIMEOUT_SEC,
+    a_retry_interval=core_config.AUTH_CACHE_REDIS_RETRY_SEC,
+)
+rate_limiter = RateLimiter(
+    rate_limit_redis,
+    {
+        "login": BucketSpec.per_minute(
+            core_config.RATE_LIMIT_LOGIN_PER_MIN, core_config.RATE_LIMIT_LOGIN_BURST
+        ),
+        "upload": BucketSpec.per_minute(
+            core_config.RATE_LIMIT_UPLOAD_PER_MIN, core_config.RATE_LIMIT_UPLOAD_BURST
+        ),
+    },
+)
+upload_admission = UploadAdmission(
+    rate_limit_redis,
+    a_max_per_user=core_config.UPLOAD_MAX_CONCURRENT_PER_USER,
+    a_max_bytes=core_config.UPLOAD_MAX_BYTES_IN_FLIGHT,
+    a_unknown_length_bytes=core_config.UPLOAD_UNKNOWN_LENGTH_BYTES,
+    a_retry_after=core_config.UPLOAD_RETRY_AFTER_SEC,
+)
+worker_state.register_after_fork("rate limit store", rate_limit_redis.reset_after_fork)
+worker_state.register_after_fork("rate limits", rate_limiter.reset_after_fork)
+worker_state.register_after_fork("upload admission", upload_admission.reset_after_fork)
@@ -0,0 +1,119 @@
+"""
+Per-worker Redis client for optional, shared state (the auth cache, rate limits) whose
+failures must not fail requests.
+
+Commands give up after the client's socket timeout. After a failure the client is
+skipped for a retry interval so callers fall back to their local state at once rather
+than wait on an unreachable server for every request.
+"""
+import asyncio
+from time import time
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+from redis.exceptions import RedisError
+from webservices.core.config import core_logger as logger
+from webservices.core.metrics import track_dependency
+
+# Raised by commands when Redis is unreachable or too slow
+REDIS_ERRORS = (RedisError, OSError, asyncio.TimeoutError)
+
+
+class FailSoftRedis:
+    """
+    Lazily connected Redis client that's skipped for a while after a failure
+    """
+
+    def __init__(
+        self,
+        a_name: str,
+        a_url: Optional[str],
+        a_timeout: float = 0.25,
+        a_retry_interval: float = 5.0,
+    ):
+        """
+        :param a_name: What the state is, for the log, e.g. "Shared auth cache"
+        :param a_url: URL of the Redis server, e.g. redis://redis:6379/0. Disabled if
+            None.
+        :param a_timeout: Seconds a connection attempt or command may take
+        :param a_retry_interval: Seconds Redis is skipped after a failure
+        """
+        self.name: str = a_name
+        self.url: Optional[str] = a_url
+        self.timeout: float = a_timeout
+        self.retry_interval: float = a_retry_interval
+        self._redis: Optional[Redis] = None
+        self._skip_until: float = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        """
+        :return: True if a Redis server is configured
+        """
+        return self.url is not None
+
+    def client(self) -> Optional[Redis]:
+        """
+        :return: The worker's Redis client; None if disabled or recently failed
+        """
+        if self.url is None or self._skip_until > time():
+            return None
+        if self._redis is None:
+            self._redis = Redis.from_url(
+                self.url,
+                socket_timeout=self.timeout,
+                socket_connect_timeout=self.timeout,
+            )
+        return self._redis
+
+    def failed(self, a_action: str, a_error: BaseException) -> None:
+        """
+        Skip Redis for the retry interval
+        :param a_action: What couldn't be done, for the log
+        :param a_error: Why
+        """
+        logger.warning(
+            f"{self.name} unavailable for {self.retry_interval}s, couldn't "
+            f"{a_action}: {a_error!r}"
+        )
+        self._skip_until = time() + self.retry_interval
+
+    async def execute(
+        self, a_action: str, a_queue: Callable[[Pipeline], Any]
+    ) -> Optional[list]:
+        """
+        Send commands in one round trip. The client's socket timeout bounds the wait;
+        cancelling a command could leave its connection out of step with the server.
+        :param a_action: What the commands do, for the log
+        :param a_queue: Queues the commands on a pipeline
+        :return: The commands' results; None if Redis is disabled or failed
+        """
+        l_redis: Optional[Redis] = self.client()
+        if l_redis is None:
+            return None
+        try:
+            with track_dependency("redis"):
+                async with l_redis.pipeline(transaction=False) as l_pipe:
+                    a_queue(l_pipe)
+                    return await l_pipe.execute()
+        except REDIS_ERRORS as e:
+            self.failed(a_action, e)
+            return None
+
+    async def close(self) -> None:
+        """
+        Close the worker's connections
+        """
+        if self._redis is not None:
+            await self._redis.close()
+        self._redis = None
+
+    def reset_after_fork(self) -> None:
+        """
+        Drop the connections inherited from the parent process
+        """
+        self._redis = None
+        self._skip_until = 0.0
@@ -3,15 +3,15 @@ from datetime import timedelta
 from logging import getLogger
 from typing import Optional
 
-from email_validator import EmailNotValidError
-from email_validator import validate_email
-from jose import jwt
 from webservices.core.config import core_config
 
 logger = getLogger(__name__)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    # Imported on use so importing this module for sanitize_email() doesn't load jose
+    from jose import jwt
+
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -29,6 +29,9 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 def sanitize_email(
     a_email: str, new_account: bool = False, test_environment: bool = core_config.DEBUG
 ) -> Optional[str]:
+    from email_validator import EmailNotValidError
+    from email_validator import validate_email
+
     try:
         validation = validate_email(
             a_email, check_deliverability=new_account, test_environment=test_environment
@@ -0,0 +1,66 @@
+"""
+Coalescing of identical concurrent calls.
+
+A burst of identical requests, e.g. every client logging in again after a deploy,
+would otherwise send the same call to a dependency once per request. A SingleFlight
+runs the first call and hands its outcome, result or exception, to every caller that
+asks for the same key while it's in flight. Nothing is cached: a call made after the
+first completes runs again.
+
+Calls run as tasks of their own so a caller going away (e.g. the client disconnecting)
+doesn't cancel the call for the others. Coalescing is per worker.
+"""
+import asyncio
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Generic
+from typing import Hashable
+from typing import TypeVar
+
+from webservices.core.metrics import coalesced_calls
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """
+    At most one call in flight per key, shared by everyone asking for the key meanwhile
+    """
+
+    def __init__(self, a_name: str):
+        """
+        :param a_name: What the calls are, for the coalesced_calls metric, e.g. login
+        """
+        self.name: str = a_name
+        self._calls: Dict[Hashable, "asyncio.Task[T]"] = {}
+        self._coalesced = coalesced_calls.labels(a_name)
+
+    def _forget(self, a_key: Hashable, a_task: "asyncio.Task[T]") -> None:
+        if self._calls.get(a_key) is a_task:
+            del self._calls[a_key]
+        if not a_task.cancelled():
+            # Retrieved so a failure nobody awaited anymore isn't logged as unhandled
+            a_task.exception()
+
+    async def do(self, a_key: Hashable, a_call: Callable[[], Awaitable[T]]) -> T:
+        """
+        :param a_key: Identifies the call. It must cover everything the outcome depends
+            on, e.g. the credentials, as callers with equal keys get the same outcome.
+        :param a_call: Makes the call if none with a_key is in flight
+        :return: The call's result
+        """
+        l_task = self._calls.get(a_key)
+        if l_task is None:
+            l_task = asyncio.ensure_future(a_call())
+            self._calls[a_key] = l_task
+            l_task.add_done_callback(lambda a_task: self._forget(a_key, a_task))
+        else:
+            self._coalesced.inc()
+        return await asyncio.shield(l_task)
+
+    def reset_after_fork(self) -> None:
+        """
+        Forget the calls of the parent process's event loop
+        """
+        self._calls.clear()
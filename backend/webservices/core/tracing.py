@@ -0,0 +1,553 @@
+"""
+Lightweight request tracing.
+
+TracingMiddleware opens a root span per HTTP request and code along the hot path opens
+child spans with
+    with span("auth.token_verify") as l_span:
+        l_span.set("auth.kid", l_kid)
+        ...
+Spans follow the request through awaits and into the threadpool (run_in_threadpool
+copies the context). Outside a traced request span() returns a shared no-op, so an
+untraced request only pays for a context variable lookup per span.
+
+A request is traced if the caller's W3C traceparent header says it was sampled or, for
+new traces, with probability TRACE_SAMPLE_RATE. With TRACE_SLOW_MS set every request is
+recorded and those taking longer are exported even if they weren't sampled, so slow
+requests can always be explained. Calls to Keycloak carry a traceparent header so its
+spans join the trace.
+
+Finished traces are queued and exported in batches by a background thread, as JSON
+lines to TRACE_FILE_PATH and/or as OTLP/HTTP JSON to TRACE_OTLP_ENDPOINT. A full queue
+drops traces rather than slowing requests down.
+"""
+import json
+import os
+import re
+from abc import ABC
+from abc import abstractmethod
+from contextvars import ContextVar
+from contextvars import Token
+from dataclasses import dataclass
+from dataclasses import field
+from logging import getLogger
+from queue import Empty
+from queue import Full
+from queue import Queue
+from random import getrandbits
+from random import random
+from threading import Thread
+from time import time_ns
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Type
+from typing import Union
+
+import httpx
+from starlette.types import ASGIApp
+from starlette.types import Message
+from starlette.types import Receive
+from starlette.types import Scope
+from starlette.types import Send
+from webservices.core import worker_state
+from webservices.core.config import core_config
+from webservices.core.config import CoreConfig
+from webservices.core.metrics import route_label
+
+logger = getLogger(__name__)
+
+TRACEPARENT_HEADER: str = "traceparent"
+# version-trace_id-parent_id-flags, see https://www.w3.org/TR/trace-context/
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})")
+_INVALID_TRACE_ID: str = "0" * 32
+_INVALID_SPAN_ID: str = "0" * 16
+
+SPAN_KIND_INTERNAL: str = "internal"
+SPAN_KIND_SERVER: str = "server"
+SPAN_KIND_CLIENT: str = "client"
+
+
+def _new_id(a_bits: int) -> str:
+    return f"{getrandbits(a_bits):0{a_bits // 4}x}"
+
+
+@dataclass
+class Span:
+    """
+    A timed operation within a trace
+    """
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    kind: str = SPAN_KIND_INTERNAL
+    start_ns: int = 0
+    end_ns: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def set(self, a_key: str, a_value: Any) -> None:
+        """
+        :param a_key: Attribute name, e.g. http.status_code
+        :param a_value: A str, bool, int, or float
+        """
+        self.attributes[a_key] = a_value
+
+    @property
+    def duration_ms(self) -> float:
+        """
+        :return: The span's duration in milliseconds
+        """
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        :return: The span as a JSON serializable dictionary
+        """
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """
+    Stands in for a Span, and its context manager, outside traced requests
+    """
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *a_exc_info: Any) -> None:
+        pass
+
+    def set(self, a_key: str, a_value: Any) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+@dataclass
+class _Trace:
+    """
+    The spans recorded for one request
+    """
+
+    trace_id: str
+    sampled: bool
+    spans: List[Span] = field(default_factory=list)
+
+
+_current: ContextVar[Optional[Tuple[_Trace, Span]]] = ContextVar(
+    "webservices_span", default=None
+)
+
+
+class _SpanScope:
+    """
+    Makes a span the current one while its block runs
+    """
+
+    __slots__ = ("_trace", "_span", "_token")
+
+    def __init__(self, a_trace: _Trace, a_span: Span):
+        self._trace: _Trace = a_trace
+        self._span: Span = a_span
+        self._token: Optional[Token] = None
+
+    def __enter__(self) -> Span:
+        self._span.start_ns = time_ns()
+        self._token = _current.set((self._trace, self._span))
+        return self._span
+
+    def __exit__(
+        self,
+        a_type: Optional[Type[BaseException]],
+        a_error: Optional[BaseException],
+        a_traceback: Any,
+    ) -> None:
+        self._span.end_ns = time_ns()
+        if a_error is not None:
+            self._span.error = f"{a_type.__name__}: {a_error}"
+        _current.reset(self._token)
+        self._trace.spans.append(self._span)
+
+
+def span(
+    a_name: str,
+    a_attributes: Optional[Dict[str, Any]] = None,
+    a_kind: str = SPAN_KIND_INTERNAL,
+) -> Union[_SpanScope, _NoopSpan]:
+    """
+    Time a block as a child of the current span, e.g.
+        with span("auth.token_verify") as l_span:
+            ...
+    :param a_name: Operation name, e.g. auth.token_verify
+    :param a_attributes: Initial attributes
+    :param a_kind: One of the SPAN_KIND_* values
+    :return: A context manager yielding the new span, or a no-op stand-in if the
+        request isn't traced
+    """
+    l_current: Optional[Tuple[_Trace, Span]] = _current.get()
+    if l_current is None:
+        return _NOOP_SPAN
+    l_trace, l_parent = l_current
+    return _SpanScope(
+        l_trace,
+        Span(
+            name=a_name,
+            trace_id=l_trace.trace_id,
+            span_id=_new_id(64),
+            parent_id=l_parent.span_id,
+            kind=a_kind,
+            attributes=dict(a_attributes) if a_attributes else {},
+        ),
+    )
+
+
+def traceparent() -> Optional[str]:
+    """
+    :return: The traceparent header value identifying the current span to a service
+        being called; None outside traced requests
+    """
+    l_current: Optional[Tuple[_Trace, Span]] = _current.get()
+    if l_current is None:
+        return None
+    l_trace, l_span = l_current
+    return f"00-{l_trace.trace_id}-{l_span.span_id}-{'01' if l_trace.sampled else '00'}"
+
+
+def parse_traceparent(a_header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """
+    :param a_header: A traceparent header value
+    :return: (trace_id, parent span_id, sampled) if the header is valid; else None
+    """
+    if not a_header:
+        return None
+    l_match = _TRACEPARENT.match(a_header.strip().lower())
+    if l_match is None:
+        return None
+    l_trace_id, l_parent_id, l_flags = l_match.groups()
+    if l_trace_id == _INVALID_TRACE_ID or l_parent_id == _INVALID_SPAN_ID:
+        return None
+    return l_trace_id, l_parent_id, bool(int(l_flags, 16) & 1)
+
+
+class SpanExporter(ABC):
+    """
+    Destination of finished spans. export() is only called from the export thread.
+    """
+
+    @abstractmethod
+    def export(self, a_spans: List[Span]) -> None:
+        """
+        :param a_spans: Finished spans of one or more traces
+        """
+
+
+class FileSpanExporter(SpanExporter):
+    """
+    Appends one JSON object per span to a file
+    """
+
+    def __init__(self, a_path: str):
+        """
+        :param a_path: The file to append to. Its directory is created if needed.
+        """
+        self.path: str = a_path
+
+    def export(self, a_spans: List[Span]) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a") as l_file:
+            for l_span in a_spans:
+                l_file.write(json.dumps(l_span.to_dict(), default=str) + "\n")
+
+
+class OTLPSpanExporter(SpanExporter):
+    """
+    Sends spans to an OpenTelemetry collector with the OTLP/HTTP JSON protocol
+    """
+
+    _KINDS: Dict[str, int] = {
+        SPAN_KIND_INTERNAL: 1,
+        SPAN_KIND_SERVER: 2,
+        SPAN_KIND_CLIENT: 3,
+    }
+
+    def __init__(self, a_endpoint: str, a_service_name: str, a_timeout: float = 10.0):
+        """
+        :param a_endpoint: The collector's traces URL, e.g.
+            http://otel-collector:4318/v1/traces
+        :param a_service_name: Reported as the service.name resource attribute
+        :param a_timeout: Seconds to wait for the collector
+        """
+        self.endpoint: str = a_endpoint
+        self.service_name: str = a_service_name
+        self.timeout: float = a_timeout
+        self._client: Optional[httpx.Client] = None
+
+    @staticmethod
+    def _attribute(a_key: str, a_value: Any) -> Dict[str, Any]:
+        if isinstance(a_value, bool):
+            l_value: Dict[str, Any] = {"boolValue": a_value}
+        elif isinstance(a_value, int):
+            l_value = {"intValue": str(a_value)}
+        elif isinstance(a_value, float):
+            l_value = {"doubleValue": a_value}
+        else:
+            l_value = {"stringValue": str(a_value)}
+        return {"key": a_key, "value": l_value}
+
+    def _span(self, a_span: Span) -> Dict[str, Any]:
+        l_span: Dict[str, Any] = {
+            "traceId": a_span.trace_id,
+            "spanId": a_span.span_id,
+            "name": a_span.name,
+            "kind": self._KINDS.get(a_span.kind, 1),
+            "startTimeUnixNano": str(a_span.start_ns),
+            "endTimeUnixNano": str(a_span.end_ns),
+            "attributes": [
+                self._attribute(l_key, l_value)
+                for l_key, l_value in a_span.attributes.items()
+            ],
+        }
+        if a_span.parent_id:
+            l_span["parentSpanId"] = a_span.parent_id
+        if a_span.error:
+            l_span["status"] = {"code": 2, "message": a_span.error}
+        return l_span
+
+    def export(self, a_spans: List[Span]) -> None:
+        if self._client is None:
+            self._client = httpx.Client(timeout=self.timeout)
+        l_payload: Dict[str, Any] = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            self._attribute("service.name", self.service_name)
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "webservices"},
+                            "spans": [self._span(l_span) for l_span in a_spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        self._client.post(self.endpoint, json=l_payload).raise_for_status()
+
+
+class Tracer:
+    """
+    Sampling decisions and batched export of finished traces
+    """
+
+    def __init__(
+        self,
+        a_exporters: List[SpanExporter],
+        a_sample_rate: float = 0.01,
+        a_slow_ms: float = 0.0,
+        a_max_queue: int = 1024,
+        a_batch_spans: int = 512,
+        a_flush_interval: float = 2.0,
+    ):
+        """
+        :param a_exporters: Destinations of finished spans. Tracing is off without any.
+        :param a_sample_rate: Fraction of new traces sampled
+        :param a_slow_ms: Requests taking at least this long are exported even if not
+            sampled. 0 disables.
+        :param a_max_queue: Finished traces waiting for export before new ones are
+            dropped
+        :param a_batch_spans: Spans handed to the exporters at once
+        :param a_flush_interval: Longest seconds a finished trace waits for export
+        """
+        self.exporters: List[SpanExporter] = a_exporters
+        self.sample_rate: float = a_sample_rate
+        self.slow_ms: float = a_slow_ms
+        self.max_queue: int = a_max_queue
+        self.batch_spans: int = a_batch_spans
+        self.flush_interval: float = a_flush_interval
+        self.enabled: bool = bool(a_exporters) and (a_sample_rate > 0 or a_slow_ms > 0)
+        self.dropped: int = 0
+        self._queue: "Queue[Optional[List[Span]]]" = Queue(a_max_queue)
+        self._thread: Optional[Thread] = None
+        self._thread_pid: Optional[int] = None
+
+    @classmethod
+    def from_config(cls, a_config: CoreConfig) -> "Tracer":
+        """
+        :param a_config: The app's CoreConfig
+        :return: A Tracer using the configured exporters
+        """
+        l_exporters: List[SpanExporter] = []
+        if a_config.TRACE_FILE_PATH:
+            l_exporters.append(FileSpanExporter(a_config.TRACE_FILE_PATH))
+        if a_config.TRACE_OTLP_ENDPOINT:
+            l_exporters.append(
+                OTLPSpanExporter(a_config.TRACE_OTLP_ENDPOINT, a_config.PROJECT_NAME)
+            )
+        return cls(
+            l_exporters,
+            a_sample_rate=a_config.TRACE_SAMPLE_RATE,
+            a_slow_ms=a_config.TRACE_SLOW_MS,
+        )
+
+    def start_trace(self, a_traceparent: Optional[str]) -> Optional[Tuple[_Trace, str]]:
+        """
+        :param a_traceparent: The request's traceparent header
+        :return: (trace, remote parent span_id or None) if the request is recorded;
+            None otherwise
+        """
+        if not self.enabled:
+            return None
+        l_parent: Optional[Tuple[str, str, bool]] = parse_traceparent(a_traceparent)
+        if l_parent is not None:
+            l_trace_id, l_parent_id, l_sampled = l_parent
+        else:
+            l_trace_id, l_parent_id = _new_id(128), None
+            l_sampled = random() < self.sample_rate
+        if not l_sampled and self.slow_ms <= 0:
+            return None
+        return _Trace(l_trace_id, l_sampled), l_parent_id
+
+    def finish(self, a_trace: _Trace, a_root: Span) -> None:
+        """
+        Queue a finished trace for export if it was sampled or is slow
+        :param a_trace: The request's trace
+        :param a_root: The request's root span
+        """
+        if not a_trace.sampled and a_root.duration_ms < self.slow_ms:
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(a_trace.spans)
+        except Full:
+            self.dropped += 1
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or self._thread_pid != os.getpid():
+            self._thread = Thread(target=self._run, name="span-export", daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def _export(self, a_spans: List[Span]) -> None:
+        for l_exporter in self.exporters:
+            try:
+                l_exporter.export(a_spans)
+            except Exception as e:
+                logger.warning(f"{type(l_exporter).__name__} failed: {e}")
+
+    def _run(self) -> None:
+        l_batch: List[Span] = []
+        l_stop: bool = False
+        while not l_stop:
+            try:
+                l_spans: Optional[List[Span]] = self._queue.get(
+                    timeout=self.flush_interval
+                )
+                if l_spans is None:
+                    l_stop = True
+                else:
+                    l_batch.extend(l_spans)
+                    if len(l_batch) < self.batch_spans:
+                        continue
+            except Empty:
+                pass
+            if l_batch:
+                self._export(l_batch)
+                l_batch = []
+
+    def reset_after_fork(self) -> None:
+        """
+        Drop the queue and export thread inherited from the parent process
+        """
+        self._queue = Queue(self.max_queue)
+        self._thread = None
+        self._thread_pid = None
+
+    async def shutdown(self) -> None:
+        """
+        Shutdown handler: export what's queued and stop the export thread
+        """
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join(timeout=self.flush_interval + 5)
+        self._thread = None
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening a root span per HTTP request
+    """
+
+    def __init__(self, app: ASGIApp, a_tracer: Tracer):
+        """
+        :param app: The wrapped ASGI app
+        :param a_tracer: Decides which requests are traced and exports them
+        """
+        self.app: ASGIApp = app
+        self.tracer: Tracer = a_tracer
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+        l_header: Optional[str] = None
+        for l_name, l_value in scope["headers"]:
+            if l_name == b"traceparent":
+                l_header = l_value.decode("latin-1")
+                break
+        l_started = self.tracer.start_trace(l_header)
+        if l_started is None:
+            await self.app(scope, receive, send)
+            return
+
+        l_trace, l_parent_id = l_started
+        l_root = Span(
+            name=f"{scope['method']} {scope['path']}",
+            trace_id=l_trace.trace_id,
+            span_id=_new_id(64),
+            parent_id=l_parent_id,
+            kind=SPAN_KIND_SERVER,
+            start_ns=time_ns(),
+            attributes={"http.method": scope["method"], "http.target": scope["path"]},
+        )
+
+        async def _send(a_message: Message) -> None:
+            if a_message["type"] == "http.response.start":
+                l_root.set("http.status_code", a_message["status"])
+            await send(a_message)
+
+        l_token = _current.set((l_trace, l_root))
+        try:
+            await self.app(scope, receive, _send)
+        except BaseException as e:
+            l_root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            l_root.end_ns = time_ns()
+            _current.reset(l_token)
+            l_route: str = route_label(scope)
+            l_root.name = f"{scope['method']} {l_route}"
+            l_root.set("http.route", l_route)
+            l_trace.spans.append(l_root)
+            self.tracer.finish(l_trace, l_root)
+
+
+tracer = Tracer.from_config(core_config)
+worker_state.register_after_fork("span exporter", tracer.reset_after_fork)
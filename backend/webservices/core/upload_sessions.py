@@ -0,0 +1,305 @@
+"""
+Resumable uploads assembled from independently uploaded parts.
+
+A client creates a session, uploads numbered parts (in any order, over as many
+connections as it likes, retrying any part that failed), and then completes the
+session. Each session is a directory holding an immutable session.json manifest and
+one part-<number> file per received part. Parts only appear under that name once they
+were completely received, so the directory listing is the session's state and
+concurrent part uploads never contend for a shared manifest.
+
+On completion the parts are streamed once to be framed and hashed, and each part is
+then concatenated in the kernel with os.copy_file_range (or os.sendfile where that
+isn't supported) instead of being copied through Python a second time.
+"""
+import errno
+import json
+import os
+import re
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+from pathlib import Path
+from shutil import rmtree
+from time import time
+from typing import AsyncIterator
+from typing import BinaryIO
+from typing import Dict
+from typing import List
+from typing import Optional
+from uuid import uuid4
+
+import aiofiles
+from starlette.concurrency import run_in_threadpool
+from webservices.core.config import core_config
+from webservices.core.ingest import IngestError
+
+_MANIFEST_NAME: str = "session.json"
+_PART_PREFIX: str = "part-"
+_PART_PATTERN = re.compile(rf"^{_PART_PREFIX}(\d+)$")
+
+# errno values meaning copy_file_range can't be used between these two files
+_COPY_FILE_RANGE_UNSUPPORTED = {
+    errno.ENOSYS,
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+}
+
+
+class UploadSessionNotFound(IngestError):
+    """
+    Raised when a session is completed, deleted, or expires while a part is uploaded
+    """
+
+
+@dataclass
+class UploadSession:
+    """
+    A resumable upload and the parts received for it so far
+    """
+
+    session_id: str
+    user_email: str
+    filename: str
+    created_at: float
+    expires_at: float
+    # Part number -> size in bytes, for completely received parts
+    parts: Dict[int, int] = field(default_factory=dict)
+
+    @property
+    def offset(self) -> int:
+        """
+        :return: Number of bytes received contiguously from the start of the file
+        """
+        l_offset: int = 0
+        l_number: int = 1
+        while l_number in self.parts:
+            l_offset += self.parts[l_number]
+            l_number += 1
+        return l_offset
+
+    @property
+    def byte_count(self) -> int:
+        """
+        :return: Number of bytes received in all parts
+        """
+        return sum(self.parts.values())
+
+    def missing_parts(self) -> List[int]:
+        """
+        :return: Part numbers missing below the highest received part number
+        """
+        l_last: int = max(self.parts, default=0)
+        return [n for n in range(1, l_last + 1) if n not in self.parts]
+
+
+def _copy_fd(a_src: int, a_dst: int, a_size: int) -> None:
+    """
+    Append a_size bytes from a_src to a_dst without copying them through user space
+    :param a_src: File descriptor to read from its current offset
+    :param a_dst: File descriptor to write at its current offset
+    :param a_size: Number of bytes to copy
+    """
+    l_remaining: int = a_size
+    l_use_copy_file_range: bool = hasattr(os, "copy_file_range")
+    while l_remaining > 0:
+        if l_use_copy_file_range:
+            try:
+                l_copied: int = os.copy_file_range(a_src, a_dst, l_remaining)
+            except OSError as e:
+                if e.errno not in _COPY_FILE_RANGE_UNSUPPORTED:
+                    raise
+                l_use_copy_file_range = False
+                continue
+        else:
+            l_copied = os.sendfile(a_dst, a_src, None, l_remaining)
+        if l_copied == 0:
+            raise IngestError("Upload part shrank while the upload was assembled")
+        l_remaining -= l_copied
+
+
+def _append_file(a_src: int, a_dst: int) -> None:
+    """
+    Append the whole of a_src to a_dst without copying it through user space
+    :param a_src: File descriptor of an immutable file
+    :param a_dst: File descriptor to write at its current offset
+    """
+    os.lseek(a_src, 0, os.SEEK_SET)
+    _copy_fd(a_src, a_dst, os.fstat(a_src).st_size)
+
+
+class UploadSessionStore:
+    """
+    Directory of resumable upload sessions
+    """
+
+    def __init__(self, a_root: Path, a_ttl_seconds: int, a_max_parts: int):
+        """
+        :param a_root: Directory holding one subdirectory per session
+        :param a_ttl_seconds: Seconds after creation an unfinished session is dropped
+        :param a_max_parts: Highest part number accepted
+        """
+        self.root: Path = a_root
+        self.ttl_seconds: int = a_ttl_seconds
+        self.max_parts: int = a_max_parts
+
+    def _session_dir(self, a_session_id: str) -> Path:
+        # Session IDs are generated here; refuse anything else to keep paths in root
+        if not re.match(r"^[0-9a-f]{32}$", a_session_id):
+            raise ValueError(f"Invalid upload session ID: {a_session_id}")
+        return self.root / a_session_id
+
+    def part_path(self, a_session: UploadSession, a_number: int) -> Path:
+        """
+        :param a_session: The upload session
+        :param a_number: The part number
+        :return: Location of the received part
+        """
+        return self._session_dir(a_session.session_id) / f"{_PART_PREFIX}{a_number}"
+
+    def create(self, a_user_email: str, a_filename: str) -> UploadSession:
+        """
+        Start a new upload session and drop expired ones
+        :param a_user_email: Email of the user owning the session
+        :param a_filename: Name of the file being uploaded
+        :return: The new session
+        """
+        self.purge_expired()
+        l_now: float = time()
+        l_session = UploadSession(
+            session_id=uuid4().hex,
+            user_email=a_user_email,
+            filename=a_filename,
+            created_at=l_now,
+            expires_at=l_now + self.ttl_seconds,
+        )
+        l_dir: Path = self._session_dir(l_session.session_id)
+        l_dir.mkdir(parents=True)
+        l_manifest: Dict = asdict(l_session)
+        del l_manifest["parts"]
+        with open(l_dir / _MANIFEST_NAME, "w") as l_file:
+            json.dump(l_manifest, l_file)
+        return l_session
+
+    def get(self, a_session_id: str, a_user_email: str) -> Optional[UploadSession]:
+        """
+        :param a_session_id: The session's ID
+        :param a_user_email: Email of the requesting user
+        :return: The session with its received parts, or None if it doesn't exist,
+        expired, or belongs to another user
+        """
+        try:
+            l_dir: Path = self._session_dir(a_session_id)
+            with open(l_dir / _MANIFEST_NAME, "rb") as l_file:
+                l_session = UploadSession(**json.load(l_file))
+        except (ValueError, FileNotFoundError):
+            return None
+        if l_session.user_email != a_user_email or l_session.expires_at < time():
+            return None
+        with os.scandir(l_dir) as l_entries:
+            for l_entry in l_entries:
+                l_match = _PART_PATTERN.match(l_entry.name)
+                if l_match is not None:
+                    l_session.parts[int(l_match.group(1))] = l_entry.stat().st_size
+        return l_session
+
+    async def write_part(
+        self, a_session: UploadSession, a_number: int, a_chunks: AsyncIterator[bytes]
+    ) -> int:
+        """
+        Receive one part. A part uploaded again replaces the earlier copy.
+        :param a_session: The upload session
+        :param a_number: The part number, from 1 to max_parts
+        :param a_chunks: The part's content
+        :return: The part's size in bytes
+        :raises IngestError: If the part number is out of range
+        :raises UploadSessionNotFound: If the session is gone
+        """
+        if not 1 <= a_number <= self.max_parts:
+            raise IngestError(f"Part numbers must be between 1 and {self.max_parts}")
+        l_path: Path = self.part_path(a_session, a_number)
+        # Unique per request so concurrent retries of a part don't interleave
+        l_partial: Path = l_path.with_name(f"{l_path.name}.{uuid4().hex}.tmp")
+        l_size: int = 0
+        try:
+            async with aiofiles.open(l_partial, "wb") as l_file:
+                async for l_chunk in a_chunks:
+                    await l_file.write(l_chunk)
+                    l_size += len(l_chunk)
+            os.replace(l_partial, l_path)
+        except FileNotFoundError:
+            # The session's directory was removed
+            raise UploadSessionNotFound(
+                f"Upload session {a_session.session_id} not found"
+            )
+        finally:
+            l_partial.unlink(missing_ok=True)
+        return l_size
+
+    async def read_parts(
+        self,
+        a_session: UploadSession,
+        a_chunk_size: int,
+        a_copy_to: Optional[Path] = None,
+    ) -> AsyncIterator[bytes]:
+        """
+        Stream a session's parts in order as if they were one file
+        :param a_session: The upload session; all parts from 1 to the last must exist
+        :param a_chunk_size: Maximum size of each yielded chunk
+        :param a_copy_to: File to also concatenate the parts into. Each part is copied
+            in the kernel once it was read, from the same open file, so the copy holds
+            exactly the bytes yielded even if a part is uploaded again meanwhile. It's
+            incomplete unless every chunk was consumed.
+        """
+        l_out: Optional[BinaryIO] = None
+        if a_copy_to is not None:
+            a_copy_to.parent.mkdir(parents=True, exist_ok=True)
+            l_out = open(a_copy_to, "wb")
+        try:
+            for l_number in range(1, len(a_session.parts) + 1):
+                async with aiofiles.open(
+                    self.part_path(a_session, l_number), "rb"
+                ) as l_f:
+                    while l_chunk := await l_f.read(a_chunk_size):
+                        yield l_chunk
+                    if l_out is not None:
+                        await run_in_threadpool(
+                            _append_file, l_f.fileno(), l_out.fileno()
+                        )
+        finally:
+            if l_out is not None:
+                l_out.close()
+
+    def delete(self, a_session: UploadSession) -> None:
+        """
+        :param a_session: The upload session to remove with all its parts
+        """
+        rmtree(self._session_dir(a_session.session_id), ignore_errors=True)
+
+    def purge_expired(self) -> int:
+        """
+        Remove sessions that expired without being completed
+        :return: Number of sessions removed
+        """
+        l_count: int = 0
+        l_now: float = time()
+        if not self.root.is_dir():
+            return l_count
+        for l_dir in self.root.iterdir():
+            try:
+                with open(l_dir / _MANIFEST_NAME, "rb") as l_file:
+                    l_expires_at: float = json.load(l_file)["expires_at"]
+            except (OSError, ValueError, KeyError):
+                continue
+            if l_expires_at < l_now:
+                rmtree(l_dir, ignore_errors=True)
+                l_count += 1
+        return l_count
+
+
+upload_session_store = UploadSessionStore(
+    Path(core_config.INGEST_SESSION_DIR),
+    core_config.INGEST_SESSION_TTL_SEC,
+    core_config.INGEST_SESSION_MAX_PARTS,
+)
@@ -0,0 +1,124 @@
+"""
+Per-worker cache of authenticated users keyed by the access token's subject ('sub').
+
+The first request carrying a subject validates the token claims and the email, and
+upserts the user into the users table. The resulting UserSchema is then reused for
+USER_CACHE_TTL_SEC, so repeat requests skip the claim parsing, email validation, model
+construction, and database round trip entirely. Expiry bounds how stale the cached
+user (e.g. is_superuser) can get and how often last_seen_at is refreshed.
+"""
+from asyncio import TimeoutError as AsyncTimeoutError
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from webservices.core import worker_state
+from webservices.core.cache import TTLCache
+from webservices.core.config import core_config
+from webservices.core.config import core_logger as logger
+from webservices.core.metrics import track_dependency
+from webservices.database import repository
+from webservices.database.models import User
+from webservices.schemas.users import UserSchema
+
+
+class UserCache:
+    """
+    Subject indexed cache of UserSchema instances backed by the users table
+    """
+
+    def __init__(self, a_max_size: int = 4096, a_ttl: float = 300.0):
+        """
+        :param a_max_size: Maximum number of users kept per worker
+        :param a_ttl: Seconds a resolved user is reused
+        """
+        self.cache: TTLCache[UserSchema] = TTLCache(
+            max_size=a_max_size, default_ttl=a_ttl
+        )
+
+    def get(self, a_subject: Optional[str]) -> Optional[UserSchema]:
+        """
+        NOTE: The returned UserSchema is shared with the cache and must not be mutated.
+        :param a_subject: The token's 'sub' claim
+        :return: The cached user if present and not expired; None otherwise
+        """
+        if a_subject is None:
+            return None
+        return self.cache.get(a_subject)
+
+    def invalidate(self, a_subject: str) -> None:
+        """
+        Forget a user so the next request resolves it from the database again
+        :param a_subject: The token's 'sub' claim
+        """
+        self.cache.pop(a_subject)
+
+    async def store(
+        self,
+        a_db: AsyncSession,
+        a_subject: str,
+        a_user: UserSchema,
+        a_email_verified: bool = False,
+    ) -> UserSchema:
+        """
+        Upsert a validated user and cache it. If the database can't be reached the
+        user is returned without an id and isn't cached, so the next request retries.
+        :param a_db: The request's database session
+        :param a_subject: The token's 'sub' claim
+        :param a_user: The user built from the token's claims
+        :param a_email_verified: The token's email_verified claim. Only a verified
+            email moves an existing user with that email to a new subject.
+        :return: a_user updated from its users row
+        :raises IntegrityError: If another user already has the username, or the email
+            and it isn't verified
+        """
+        try:
+            with track_dependency("database"):
+                l_row: User = await self._upsert(
+                    a_db, a_subject, a_user, a_email_verified
+                )
+                await a_db.commit()
+        except IntegrityError:
+            await a_db.rollback()
+            raise
+        except (SQLAlchemyError, OSError, AsyncTimeoutError) as e:
+            logger.error(f"Unable to record user {a_user.email}: {e}")
+            await a_db.rollback()
+            return a_user
+        a_user.id = l_row.id
+        a_user.is_active = l_row.is_active
+        a_user.is_superuser = l_row.is_superuser
+        self.cache.set(a_subject, a_user)
+        return a_user
+
+    @staticmethod
+    async def _upsert(
+        a_db: AsyncSession, a_subject: str, a_user: UserSchema, a_email_verified: bool
+    ) -> User:
+        try:
+            async with a_db.begin_nested():
+                return await repository.upsert_user(
+                    a_db, a_subject, a_user.username, a_user.email
+                )
+        except IntegrityError as e:
+            # The email may belong to a previous subject of the same person, e.g. after
+            # the account was recreated in Keycloak. Anyone can claim an unverified
+            # email, so only a verified one takes over the user and its uploads.
+            if not a_email_verified:
+                raise e
+            l_row: Optional[User] = await repository.claim_user(
+                a_db, a_subject, a_user.username, a_user.email
+            )
+            if l_row is None:
+                raise e
+            logger.warning(
+                f"Moved user {l_row.id} ({a_user.email}) to subject {a_subject}"
+            )
+            return l_row
+
+
+user_cache = UserCache(
+    a_max_size=core_config.USER_CACHE_MAX_SIZE, a_ttl=core_config.USER_CACHE_TTL_SEC
+)
+worker_state.register_after_fork("user cache", user_cache.cache.reset_after_fork)
@@ -0,0 +1,70 @@
+"""
+Hooks for running the API under gunicorn with preload_app enabled.
+
+With preload_app the master imports the app once: the parsed config, the compiled
+pydantic validators, the routes, and the realm signing keys. The workers are then
+forked from it and share those pages copy-on-write instead of each building its own
+copy. Anything bound to a process, such as connection pools, event loop objects, locks,
+and per-worker caches, must not be carried across the fork. Every module owning such a
+resource registers a hook here to drop it; the worker creates it again on first use.
+
+Modules register their hooks at import time so the registry holds exactly the
+resources of what the master preloaded. This module mustn't import the app.
+"""
+from logging import getLogger
+from typing import Callable
+from typing import List
+from typing import Tuple
+
+logger = getLogger(__name__)
+
+_preload_hooks: List[Tuple[str, Callable[[], None]]] = []
+_after_fork_hooks: List[Tuple[str, Callable[[], None]]] = []
+
+
+def register_preload(a_name: str, a_hook: Callable[[], None]) -> None:
+    """
+    Register work the gunicorn master performs once before forking workers, e.g.
+    loading data every worker needs
+    :param a_name: Name used in log messages
+    :param a_hook: Callable without arguments. Must not leave open connections behind.
+    """
+    _preload_hooks.append((a_name, a_hook))
+
+
+def register_after_fork(a_name: str, a_hook: Callable[[], None]) -> None:
+    """
+    Register a reset run in every freshly forked worker
+    :param a_name: Name used in log messages
+    :param a_hook: Callable without arguments dropping process bound state. Must not
+        close inherited connections, they still belong to the master.
+    """
+    _after_fork_hooks.append((a_name, a_hook))
+
+
+def _run(a_hooks: List[Tuple[str, Callable[[], None]]], a_stage: str) -> List[str]:
+    l_names: List[str] = []
+    for l_name, l_hook in a_hooks:
+        try:
+            l_hook()
+            l_names.append(l_name)
+        except Exception as e:
+            logger.error(f"[{a_stage}] {l_name} failed: {e}")
+    return l_names
+
+
+def preload() -> List[str]:
+    """
+    Run the preload hooks. Called by gunicorn's when_ready hook in the master. A failed
+    hook is logged and skipped; the workers then do the work themselves.
+    :return: Names of the hooks that succeeded
+    """
+    return _run(_preload_hooks, "preload")
+
+
+def reset_after_fork() -> List[str]:
+    """
+    Run the after-fork hooks. Called by gunicorn's post_fork hook in each worker.
+    :return: Names of the hooks that succeeded
+    """
+    return _run(_after_fork_hooks, "after fork")
@@ -0,0 +1,23 @@
+"""
+SQLAlchemy models and async database access.
+
+1. database.models declares the tables on the shared declarative Base below
+2. database.session owns each worker process's async engine and connection pool and
+    provides the per-request AsyncSession dependency
+3. database.repository holds the CRUD functions routes call with that session
+
+Alembic's env.py imports database.models so autogenerate sees every table.
+"""
+from sqlalchemy import MetaData
+from sqlalchemy.orm import declarative_base
+
+# Deterministic constraint names keep Alembic autogenerate diffs stable
+naming_convention: dict = {
+    "ix": "ix_%(column_0_label)s",
+    "uq": "uq_%(table_name)s_%(column_0_name)s",
+    "ck": "ck_%(table_name)s_%(constraint_name)s",
+    "fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s",
+    "pk": "pk_%(table_name)s",
+}
+
+Base = declarative_base(metadata=MetaData(naming_convention=naming_convention))
@@ -0,0 +1,464 @@
+"""
+Bulk persistence of parsed CAN frames with COPY ... FROM STDIN (FORMAT binary).
+
+Frames land in can_frames, which is partitioned by capture (one LIST partition per
+ingested file) and then by day (RANGE partitions on captured_at):
+
+    can_frames
+    └── can_frames_c<capture_id>                 FOR VALUES IN (<capture_id>)
+        ├── can_frames_c<capture_id>_<YYYYMMDD>  one per day of capture time
+        └── can_frames_c<capture_id>_default     days beyond max_days
+
+Dropping or detaching a capture is a cheap metadata operation and queries filtered by
+capture and time only touch the matching partitions.
+
+Every column of a CanFrameBatch has a fixed width, so the binary COPY tuples for a
+whole batch are laid out as one NumPy structured array and serialized with a single
+tobytes() call instead of formatting each frame in Python. Batches are copied one at a
+time, each in its own transaction, so memory use is bounded by the parser's batch size
+no matter how large the file is. The capture partition and its day partitions are
+created in short transactions of their own so the lock they need on the parent tables
+is never held while frames are copied. Partitions are created as plain tables and
+then attached: CREATE TABLE ... PARTITION OF locks the parent exclusively and would
+queue behind every running query on can_frames, while ATTACH PARTITION only conflicts
+with other DDL. Lock waits are bounded by lock_timeout.
+"""
+import io
+from dataclasses import dataclass
+from datetime import date
+from datetime import timedelta
+from time import perf_counter
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from typing import Set
+
+import numpy as np
+import psycopg2
+from pydantic import BaseSettings
+from starlette.concurrency import run_in_threadpool
+from webservices.core.candump import CandumpParser
+from webservices.core.candump import CandumpSink
+from webservices.core.candump import CanFrameBatch
+from webservices.core.candump import INTERFACE_WIDTH
+from webservices.core.config import core_logger as logger
+
+CAN_FRAMES_TABLE: str = "can_frames"
+CAN_FRAMES_COLUMNS: str = (
+    "capture_id, captured_at, interface, arbitration_id, is_extended, is_fd, "
+    "is_remote, dlc, payload"
+)
+CAN_FRAMES_FIELD_COUNT: int = 9
+
+# Binary COPY framing: signature, flags, header extension length / end of data marker
+COPY_HEADER: bytes = b"PGCOPY\n\xff\r\n\x00" + (0).to_bytes(4, "big") * 2
+COPY_TRAILER: bytes = (-1).to_bytes(2, "big", signed=True)
+
+# Postgres timestamps count microseconds from 2000-01-01 UTC
+_PG_EPOCH_OFFSET_SECONDS: float = 946684800.0
+_SECONDS_PER_DAY: int = 86400
+# Read size psycopg2 uses to pull COPY data from the stream
+_COPY_READ_SIZE: int = 1 << 20
+
+
+class FrameCopyError(RuntimeError):
+    """
+    Raised when frames can't be written to the database
+    """
+
+
+@dataclass
+class FrameCopyStats:
+    """
+    Totals for the frames persisted for a capture
+    """
+
+    capture_id: int
+    row_count: int = 0
+    # Time spent in the database creating partitions and copying rows
+    elapsed_seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        """
+        :return: Copy throughput
+        """
+        if self.elapsed_seconds <= 0.0:
+            return 0.0
+        return self.row_count / self.elapsed_seconds
+
+
+def _copy_dtype(a_payload_width: int) -> np.dtype:
+    """
+    :param a_payload_width: Payload bytes per frame
+    :return: Layout of one binary COPY tuple; every field is preceded by its length
+    """
+    return np.dtype(
+        [
+            ("field_count", ">i2"),
+            ("capture_id_size", ">i4"),
+            ("capture_id", ">i8"),
+            ("captured_at_size", ">i4"),
+            ("captured_at", ">i8"),
+            ("interface_size", ">i4"),
+            ("interface", "u1", (INTERFACE_WIDTH,)),
+            ("arbitration_id_size", ">i4"),
+            ("arbitration_id", ">i4"),
+            ("is_extended_size", ">i4"),
+            ("is_extended", "u1"),
+            ("is_fd_size", ">i4"),
+            ("is_fd", "u1"),
+            ("is_remote_size", ">i4"),
+            ("is_remote", "u1"),
+            ("dlc_size", ">i4"),
+            ("dlc", ">i2"),
+            ("payload_size", ">i4"),
+            ("payload", "u1", (a_payload_width,)),
+        ]
+    )
+
+
+def encode_copy_tuples(a_batch: CanFrameBatch, a_capture_id: int) -> bytes:
+    """
+    Serialize a batch as binary COPY tuples for CAN_FRAMES_COLUMNS
+    :param a_batch: Parsed frames
+    :param a_capture_id: Capture the frames belong to
+    :return: The tuples without COPY_HEADER and COPY_TRAILER
+    """
+    l_width: int = a_batch.payload.shape[1]
+    l_rows: np.ndarray = np.empty(len(a_batch), dtype=_copy_dtype(l_width))
+    l_rows["field_count"] = CAN_FRAMES_FIELD_COUNT
+    l_rows["capture_id_size"] = 8
+    l_rows["capture_id"] = a_capture_id
+    l_rows["captured_at_size"] = 8
+    l_rows["captured_at"] = np.rint(
+        (a_batch.timestamp - _PG_EPOCH_OFFSET_SECONDS) * 1e6
+    ).astype(np.int64)
+    # char(16): pad with spaces instead of nulls, which Postgres text can't hold
+    l_interface: np.ndarray = a_batch.interface.view(np.uint8).reshape(
+        -1, INTERFACE_WIDTH
+    )
+    l_rows["interface_size"] = INTERFACE_WIDTH
+    l_rows["interface"] = np.where(l_interface == 0, ord(" "), l_interface)
+    l_rows["arbitration_id_size"] = 4
+    l_rows["arbitration_id"] = a_batch.arbitration_id
+    l_rows["is_extended_size"] = 1
+    # Parsed from the width of the identifier, not its value
+    l_rows["is_extended"] = a_batch.is_extended_id
+    l_rows["is_fd_size"] = 1
+    l_rows["is_fd"] = a_batch.is_fd
+    l_rows["is_remote_size"] = 1
+    l_rows["is_remote"] = a_batch.is_remote
+    l_rows["dlc_size"] = 2
+    l_rows["dlc"] = a_batch.dlc
+    l_rows["payload_size"] = l_width
+    l_rows["payload"] = a_batch.payload
+    return l_rows.tobytes()
+
+
+class _ChunkStream(io.RawIOBase):
+    """
+    Readable file over an iterator of byte chunks, as consumed by copy_expert()
+    """
+
+    def __init__(self, a_chunks: Iterable[bytes]):
+        self._chunks: Iterator[bytes] = iter(a_chunks)
+        self._current: memoryview = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, a_buffer) -> int:
+        while not self._current:
+            l_next: Optional[bytes] = next(self._chunks, None)
+            if l_next is None:
+                return 0
+            self._current = memoryview(l_next)
+        l_size: int = min(len(a_buffer), len(self._current))
+        a_buffer[:l_size] = self._current[:l_size]
+        self._current = self._current[l_size:]
+        return l_size
+
+
+def capture_days(a_batch: CanFrameBatch) -> Set[date]:
+    """
+    :param a_batch: Parsed frames
+    :return: The UTC days the frames were captured on
+    """
+    l_days: np.ndarray = np.unique(
+        np.floor(a_batch.timestamp / _SECONDS_PER_DAY).astype(np.int64)
+    )
+    return {date(1970, 1, 1) + timedelta(days=int(d)) for d in l_days}
+
+
+class FrameCopyWriter:
+    """
+    Persist the frames of one capture with binary COPY. Use as a context manager or
+    call open(), write() per batch, then finish() or abort().
+    """
+
+    def __init__(
+        self,
+        a_dsn: str,
+        a_digest: Optional[str] = None,
+        a_max_days: int = 31,
+        a_connect_timeout: float = 10.0,
+        a_lock_timeout: float = 30.0,
+    ):
+        """
+        :param a_dsn: libpq connection URI, e.g. core_config.DATABASE_URI
+        :param a_digest: Content store digest of the captured file, if any
+        :param a_max_days: Day partitions created for the capture before further days
+        are collected in its default partition
+        :param a_connect_timeout: Seconds to wait for the connection
+        :param a_lock_timeout: Seconds to wait for the locks needed to create
+        partitions before giving up
+        """
+        self.dsn: str = a_dsn
+        self.digest: Optional[str] = a_digest
+        self.max_days: int = a_max_days
+        self.connect_timeout: float = a_connect_timeout
+        self.lock_timeout: float = a_lock_timeout
+        self.stats: Optional[FrameCopyStats] = None
+        self._connection = None
+        self._days: Set[date] = set()
+
+    @classmethod
+    def from_config(
+        cls, a_config: BaseSettings, a_digest: Optional[str] = None
+    ) -> "FrameCopyWriter":
+        """
+        :param a_config: Settings providing the database and INGEST_* options
+        :param a_digest: Content store digest of the captured file, if any
+        :return: A writer for a new capture
+        """
+        return cls(
+            str(a_config.DATABASE_URI),
+            a_digest=a_digest,
+            a_max_days=a_config.INGEST_MAX_PARTITION_DAYS,
+            a_connect_timeout=a_config.DATABASE_CONNECT_TIMEOUT_SEC,
+            a_lock_timeout=a_config.INGEST_PARTITION_LOCK_TIMEOUT_SEC,
+        )
+
+    @property
+    def is_open(self) -> bool:
+        """
+        :return: True between open() and finish() or abort()
+        """
+        return self._connection is not None
+
+    def _partition(self, a_day: Optional[date] = None) -> str:
+        l_name: str = f"{CAN_FRAMES_TABLE}_c{self.stats.capture_id}"
+        if a_day is None:
+            return l_name
+        return f"{l_name}_{a_day:%Y%m%d}"
+
+    def _execute(self, a_statement: str, a_params: tuple = ()) -> Optional[tuple]:
+        with self._connection.cursor() as l_cursor:
+            l_cursor.execute(a_statement, a_params)
+            l_row = l_cursor.fetchone() if l_cursor.description else None
+        self._connection.commit()
+        return l_row
+
+    def _attach(self, a_parent: str, a_table: str, a_bounds: str) -> None:
+        """
+        Create a partition and attach it in separate steps
+        :param a_parent: The partitioned table
+        :param a_table: Name of the new partition
+        :param a_bounds: Partition bound specification
+        """
+        self._execute(
+            f"CREATE TABLE {a_table} "
+            f"(LIKE {CAN_FRAMES_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+        self._execute(f"ALTER TABLE {a_parent} ATTACH PARTITION {a_table} {a_bounds}")
+
+    def open(self) -> int:
+        """
+        Register the capture and create its partition
+        :return: The new capture's ID
+        """
+        try:
+            self._connection = psycopg2.connect(
+                self.dsn,
+                connect_timeout=max(int(self.connect_timeout), 1),
+                options=f"-c lock_timeout={int(self.lock_timeout * 1000)}",
+            )
+            l_start: float = perf_counter()
+            (l_capture_id,) = self._execute(
+                "INSERT INTO captures (digest) VALUES (%s) RETURNING id", (self.digest,)
+            )
+            self.stats = FrameCopyStats(capture_id=l_capture_id)
+            self._execute(
+                f"CREATE TABLE {self._partition()} (LIKE {CAN_FRAMES_TABLE} "
+                "INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE "
+                "(captured_at)"
+            )
+            # The default partition is attached while the capture's partition isn't
+            # visible to queries yet
+            self._attach(self._partition(), f"{self._partition()}_default", "DEFAULT")
+            self._execute(
+                f"ALTER TABLE {CAN_FRAMES_TABLE} ATTACH PARTITION {self._partition()} "
+                f"FOR VALUES IN ({l_capture_id})"
+            )
+            self.stats.elapsed_seconds += perf_counter() - l_start
+        except psycopg2.Error as e:
+            self.abort()
+            raise FrameCopyError(f"Unable to register capture: {e}") from e
+        return l_capture_id
+
+    def _ensure_day_partitions(self, a_batch: CanFrameBatch) -> None:
+        for l_day in sorted(capture_days(a_batch) - self._days):
+            if len(self._days) >= self.max_days:
+                # Remaining days go to the default partition. Creating day partitions
+                # once it holds rows would need a scan of it, so stop for good.
+                return
+            l_next: date = l_day + timedelta(days=1)
+            self._attach(
+                self._partition(),
+                self._partition(l_day),
+                f"FOR VALUES FROM ('{l_day.isoformat()} 00:00:00+00') "
+                f"TO ('{l_next.isoformat()} 00:00:00+00')",
+            )
+            self._days.add(l_day)
+
+    def write(self, a_batch: CanFrameBatch) -> int:
+        """
+        Copy a batch of frames in its own transaction
+        :param a_batch: Parsed frames
+        :return: Number of rows copied
+        """
+        if not len(a_batch):
+            return 0
+        if not self.is_open:
+            self.open()
+        l_start: float = perf_counter()
+        try:
+            self._ensure_day_partitions(a_batch)
+            with self._connection.cursor() as l_cursor:
+                l_cursor.copy_expert(
+                    f"COPY {CAN_FRAMES_TABLE} ({CAN_FRAMES_COLUMNS}) "
+                    "FROM STDIN WITH (FORMAT binary)",
+                    _ChunkStream(
+                        (
+                            COPY_HEADER,
+                            encode_copy_tuples(a_batch, self.stats.capture_id),
+                            COPY_TRAILER,
+                        )
+                    ),
+                    size=_COPY_READ_SIZE,
+                )
+            self._connection.commit()
+        except psycopg2.Error as e:
+            raise FrameCopyError(f"Unable to copy frames: {e}") from e
+        self.stats.row_count += len(a_batch)
+        self.stats.elapsed_seconds += perf_counter() - l_start
+        return len(a_batch)
+
+    def copy(self, a_batches: Iterable[CanFrameBatch]) -> Optional[FrameCopyStats]:
+        """
+        Copy every batch from a generator, then finish the capture
+        :param a_batches: Parsed frames, e.g. CandumpParser.parse_chunks()
+        :return: Totals for the capture; None if there were no frames
+        """
+        try:
+            for l_batch in a_batches:
+                self.write(l_batch)
+        except BaseException:
+            self.abort()
+            raise
+        return self.finish()
+
+    def finish(self) -> Optional[FrameCopyStats]:
+        """
+        Mark the capture complete and release the connection
+        :return: Totals for the capture; None if no frames were written
+        """
+        if not self.is_open:
+            return self.stats
+        try:
+            self._execute(
+                "UPDATE captures SET frame_count = %s, rows_per_second = %s, "
+                "finished_at = now() WHERE id = %s",
+                (
+                    self.stats.row_count,
+                    self.stats.rows_per_second,
+                    self.stats.capture_id,
+                ),
+            )
+        except psycopg2.Error as e:
+            self.abort()
+            raise FrameCopyError(f"Unable to finish capture: {e}") from e
+        self._close()
+        logger.info(
+            f"Copied {self.stats.row_count} frames into capture "
+            f"{self.stats.capture_id} at {self.stats.rows_per_second:.0f} rows/s"
+        )
+        return self.stats
+
+    def abort(self) -> None:
+        """
+        Remove the capture and any frames already copied
+        """
+        if not self.is_open:
+            return
+        try:
+            self._connection.rollback()
+            if self.stats is not None:
+                # Truncating only locks the capture's own tables, so the frames are
+                # removed even while queries on can_frames hold up the DROP below
+                (l_exists,) = self._execute(
+                    "SELECT to_regclass(%s)", (self._partition(),)
+                )
+                if l_exists is not None:
+                    self._execute(f"TRUNCATE {self._partition()}")
+                self._execute(
+                    "DELETE FROM captures WHERE id = %s", (self.stats.capture_id,)
+                )
+                self._execute(
+                    f"DROP TABLE IF EXISTS {self._partition()}, "
+                    f"{self._partition()}_default"
+                )
+        except psycopg2.Error as e:
+            logger.error(f"Unable to remove aborted capture: {e}")
+        finally:
+            self._close()
+
+    def _close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+        self._connection = None
+
+    def __enter__(self) -> "FrameCopyWriter":
+        return self
+
+    def __exit__(self, a_type, a_value, a_traceback) -> None:
+        if a_type is None:
+            self.finish()
+        else:
+            self.abort()
+
+
+class FrameCopySink(CandumpSink):
+    """
+    CandumpSink that also persists every parsed batch with a FrameCopyWriter. The
+    blocking database work runs in the threadpool.
+    """
+
+    def __init__(self, a_parser: CandumpParser, a_writer: FrameCopyWriter):
+        """
+        :param a_parser: Parser turning lines into batches
+        :param a_writer: Writer for the upload's capture
+        """
+        super().__init__(a_parser)
+        self.writer: FrameCopyWriter = a_writer
+
+    async def on_batch(self, a_batch: CanFrameBatch) -> None:
+        await run_in_threadpool(self.writer.write, a_batch)
+
+    async def close(self) -> None:
+        await super().close()
+        await run_in_threadpool(self.writer.finish)
+
+    async def abort(self) -> None:
+        await run_in_threadpool(self.writer.abort)
@@ -0,0 +1,111 @@
+"""
+SQLAlchemy ORM models
+"""
+from sqlalchemy import BigInteger
+from sqlalchemy import Boolean
+from sqlalchemy import CHAR
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import Float
+from sqlalchemy import ForeignKey
+from sqlalchemy import Integer
+from sqlalchemy import LargeBinary
+from sqlalchemy import SmallInteger
+from sqlalchemy import String
+from sqlalchemy import Table
+from sqlalchemy.sql import func
+from webservices.database import Base
+
+
+class User(Base):
+    """
+    A user known to the API. Credentials live in Keycloak; this mirrors the identity
+    so other records can refer to it.
+    """
+
+    __tablename__ = "users"
+
+    id = Column(Integer, primary_key=True)
+    # Keycloak's stable subject identifier (the token's 'sub' claim)
+    subject = Column(String(64), unique=True, nullable=True)
+    username = Column(String(64), unique=True, nullable=False)
+    email = Column(String(320), unique=True, nullable=False)
+    is_active = Column(Boolean, nullable=False, default=True)
+    is_superuser = Column(Boolean, nullable=False, default=False)
+    created_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+    last_seen_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class IngestRecord(Base):
+    """
+    Metadata about an uploaded file and the outcome of ingesting it
+    """
+
+    __tablename__ = "ingest_records"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), index=True)
+    # Address of the file in the content store; None for inline ingest
+    digest = Column(String(64), index=True, nullable=True)
+    # Dedup hits refer to the job that processed the original upload
+    job_id = Column(String(36), index=True, nullable=True)
+    filename = Column(String(255), nullable=False)
+    dedup_hit = Column(Boolean, nullable=False, default=False)
+    byte_count = Column(BigInteger, nullable=False, default=0)
+    line_count = Column(BigInteger, nullable=False, default=0)
+    frame_count = Column(BigInteger, nullable=False, default=0)
+    rejected_line_count = Column(BigInteger, nullable=False, default=0)
+    elapsed_seconds = Column(Float, nullable=False, default=0.0)
+    # Frames persisted for the upload; None if they weren't or for dedup hits of
+    # uploads ingested before frames were persisted
+    capture_id = Column(
+        BigInteger, ForeignKey("captures.id", ondelete="SET NULL"), nullable=True
+    )
+    created_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+
+
+class Capture(Base):
+    """
+    A file's worth of CAN frames persisted in can_frames
+    """
+
+    __tablename__ = "captures"
+
+    id = Column(BigInteger, primary_key=True)
+    # Address of the source file in the content store; None for inline ingest
+    digest = Column(String(64), index=True, nullable=True)
+    frame_count = Column(BigInteger, nullable=False, server_default="0")
+    # COPY throughput, including partition creation
+    rows_per_second = Column(Float, nullable=False, server_default="0")
+    created_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+    # Set once every frame was copied
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+# Parsed CAN frames, written with COPY by webservices.database.frames. The table is
+# partitioned by capture and each capture's partition by day of captured_at; the
+# partitions are created during ingest. There is no primary key since frames aren't
+# unique and partitioned tables require the key to include every partition column.
+can_frames = Table(
+    "can_frames",
+    Base.metadata,
+    Column("capture_id", BigInteger, nullable=False),
+    Column("captured_at", DateTime(timezone=True), nullable=False),
+    # Interface name padded with spaces
+    Column("interface", CHAR(16), nullable=False),
+    Column("arbitration_id", Integer, nullable=False),
+    Column("is_extended", Boolean, nullable=False),
+    Column("is_fd", Boolean, nullable=False),
+    Column("is_remote", Boolean, nullable=False),
+    # Payload length in bytes. payload holds the full fixed-width (8 byte classic or
+    # 64 byte FD) buffer, zero padded beyond dlc.
+    Column("dlc", SmallInteger, nullable=False),
+    Column("payload", LargeBinary, nullable=False),
+    postgresql_partition_by="LIST (capture_id)",
+)
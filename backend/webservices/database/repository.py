@@ -0,0 +1,124 @@
+"""
+CRUD functions over the ORM models. Callers own the AsyncSession and decide when to
+commit.
+"""
+from typing import Iterable
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import func
+from webservices.core.candump import CanFrameBatch
+from webservices.core.config import core_config
+from webservices.database.frames import FrameCopyStats
+from webservices.database.frames import FrameCopyWriter
+from webservices.database.models import IngestRecord
+from webservices.database.models import User
+from webservices.schemas.files import IngestFileResponse
+
+
+async def upsert_user(
+    a_db: AsyncSession, a_subject: str, a_username: str, a_email: str
+) -> User:
+    """
+    Insert the user identified by a token subject or refresh their username, email,
+    and last_seen_at in a single statement
+    :param a_db: The request's database session
+    :param a_subject: The token's 'sub' claim
+    :param a_username: The token's preferred_username
+    :param a_email: The user's sanitized email
+    :return: The user's row
+    :raises IntegrityError: If another subject already has the username or email
+    """
+    l_statement = (
+        insert(User)
+        .values(
+            subject=a_subject,
+            username=a_username,
+            email=a_email,
+            is_active=True,
+            is_superuser=False,
+            last_seen_at=func.now(),
+        )
+        .on_conflict_do_update(
+            index_elements=[User.subject],
+            set_={"username": a_username, "email": a_email, "last_seen_at": func.now()},
+        )
+        .returning(User)
+    )
+    l_result = await a_db.execute(
+        select(User)
+        .from_statement(l_statement)
+        .execution_options(populate_existing=True)
+    )
+    return l_result.scalar_one()
+
+
+async def claim_user(
+    a_db: AsyncSession, a_subject: str, a_username: str, a_email: str
+) -> Optional[User]:
+    """
+    Attach a new token subject to the existing user with the same email, e.g. after
+    the account was recreated in Keycloak. The user's uploads and jobs go with it, so
+    only call this for a verified email.
+    :param a_db: The request's database session
+    :param a_subject: The token's 'sub' claim
+    :param a_username: The token's preferred_username
+    :param a_email: The user's sanitized email
+    :return: The user's row or None if no user has the email
+    """
+    l_statement = (
+        update(User)
+        .where(User.email == a_email)
+        .values(subject=a_subject, username=a_username, last_seen_at=func.now())
+        .returning(User)
+    )
+    l_result = await a_db.execute(
+        select(User)
+        .from_statement(l_statement)
+        .execution_options(populate_existing=True)
+    )
+    return l_result.scalar_one_or_none()
+
+
+def add_ingest_record(
+    a_db: AsyncSession, a_ingest: IngestFileResponse, a_user_id: Optional[int] = None
+) -> IngestRecord:
+    """
+    Stage a record of an upload in the session
+    :param a_db: The request's database session
+    :param a_ingest: The upload's response
+    :param a_user_id: ID of the uploading user if known
+    :return: The pending IngestRecord
+    """
+    l_record = IngestRecord(
+        user_id=a_user_id,
+        digest=a_ingest.digest,
+        job_id=a_ingest.job_id,
+        filename=a_ingest.filename,
+        dedup_hit=a_ingest.dedup_hit,
+        byte_count=a_ingest.byte_count,
+        line_count=a_ingest.line_count,
+        frame_count=a_ingest.frame_count,
+        rejected_line_count=a_ingest.rejected_line_count,
+        elapsed_seconds=a_ingest.elapsed_seconds,
+        capture_id=a_ingest.capture_id,
+    )
+    a_db.add(l_record)
+    return l_record
+
+
+def copy_can_frames(
+    a_batches: Iterable[CanFrameBatch], a_digest: Optional[str] = None
+) -> Optional[FrameCopyStats]:
+    """
+    Stream parsed frames into a new capture's can_frames partitions with COPY, one
+    batch at a time. Blocking; call from the threadpool or a worker. The capture is
+    removed again if the batches can't all be copied.
+    :param a_batches: Parsed frames, e.g. CandumpParser.parse_chunks()
+    :param a_digest: Content store digest of the source file, if any
+    :return: The capture's ID, row count, and rows/sec; None if there were no frames
+    """
+    return FrameCopyWriter.from_config(core_config, a_digest).copy(a_batches)
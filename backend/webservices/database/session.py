@@ -0,0 +1,161 @@
+"""
+Async SQLAlchemy engine, connection pool, and per-request sessions
+"""
+from os import getpid
+from typing import Any
+from typing import AsyncIterator
+from typing import Dict
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+from webservices.core import worker_state
+from webservices.core.config import core_config
+
+# SQLAlchemy dialect+driver used for async connections
+ASYNC_DRIVER_SCHEME: str = "postgresql+asyncpg"
+
+
+def async_database_uri(a_uri: str) -> str:
+    """
+    :param a_uri: A postgresql:// URI such as core_config.DATABASE_URI
+    :return: The same URI using the asyncpg driver
+    """
+    l_scheme, l_separator, l_rest = str(a_uri).partition("://")
+    return f"{ASYNC_DRIVER_SCHEME}{l_separator}{l_rest}"
+
+
+class Database:
+    """
+    Lazily created async engine with a bounded connection pool per worker process
+    """
+
+    def __init__(
+        self,
+        url: str,
+        pool_size: int = 10,
+        max_overflow: int = 10,
+        pool_timeout: float = 30.0,
+        pool_recycle: int = 1800,
+        pool_pre_ping: bool = True,
+        connect_timeout: float = 10.0,
+    ):
+        """
+        :param url: Database URI with an async driver, see async_database_uri()
+        :param pool_size: Connections kept open in the pool
+        :param max_overflow: Additional connections opened under load and closed after
+        :param pool_timeout: Seconds to wait for a free connection before failing
+        :param pool_recycle: Seconds after which a connection is replaced
+        :param pool_pre_ping: Test connections before handing them out
+        :param connect_timeout: Seconds to wait for a new connection to be established
+        """
+        self.url: str = url
+        self.pool_size: int = pool_size
+        self.max_overflow: int = max_overflow
+        self.pool_timeout: float = pool_timeout
+        self.pool_recycle: int = pool_recycle
+        self.pool_pre_ping: bool = pool_pre_ping
+        self.connect_timeout: float = connect_timeout
+        self._engine: Optional[AsyncEngine] = None
+        self._engine_pid: Optional[int] = None
+        self._session_factory: Optional[sessionmaker] = None
+
+    @property
+    def engine(self) -> AsyncEngine:
+        """
+        Lazily create the engine. Connections can't be shared across a fork so each
+        worker process gets its own pool.
+        :return: The worker's AsyncEngine
+        """
+        if self._engine is None or self._engine_pid != getpid():
+            self._engine = create_async_engine(
+                self.url,
+                pool_size=self.pool_size,
+                max_overflow=self.max_overflow,
+                pool_timeout=self.pool_timeout,
+                pool_recycle=self.pool_recycle,
+                pool_pre_ping=self.pool_pre_ping,
+                connect_args={"timeout": self.connect_timeout},
+            )
+            self._engine_pid = getpid()
+            self._session_factory = None
+        return self._engine
+
+    @property
+    def session_factory(self) -> sessionmaker:
+        """
+        :return: Factory of AsyncSession instances bound to the worker's engine
+        """
+        if self._session_factory is None or self._engine_pid != getpid():
+            self._session_factory = sessionmaker(
+                self.engine,
+                class_=AsyncSession,
+                # Keep loaded attributes usable after commit without another query
+                expire_on_commit=False,
+            )
+        return self._session_factory
+
+    async def dispose(self) -> None:
+        """
+        Close the worker's pooled connections
+        """
+        if self._engine is not None and self._engine_pid == getpid():
+            await self._engine.dispose()
+        self._engine = None
+        self._engine_pid = None
+        self._session_factory = None
+
+    def reset_after_fork(self) -> None:
+        """
+        Forget an engine inherited from the parent process without closing its
+        connections, which still belong to the parent
+        """
+        self._engine = None
+        self._engine_pid = None
+        self._session_factory = None
+
+    def pool_status(self) -> Dict[str, Any]:
+        """
+        :return: Occupancy of the worker's connection pool
+        """
+        l_status: Dict[str, Any] = {
+            "pid": getpid(),
+            "pool_size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "checked_in": 0,
+            "checked_out": 0,
+            "overflow": 0,
+        }
+        if self._engine is not None and self._engine_pid == getpid():
+            l_pool = self._engine.pool
+            l_status.update(
+                checked_in=l_pool.checkedin(),
+                checked_out=l_pool.checkedout(),
+                # Negative while the pool hasn't opened pool_size connections yet
+                overflow=max(l_pool.overflow(), 0),
+            )
+        return l_status
+
+
+database = Database(
+    async_database_uri(core_config.DATABASE_URI),
+    pool_size=core_config.DATABASE_POOL_SIZE,
+    max_overflow=core_config.DATABASE_MAX_OVERFLOW,
+    pool_timeout=core_config.DATABASE_POOL_TIMEOUT_SEC,
+    pool_recycle=core_config.DATABASE_POOL_RECYCLE_SEC,
+    pool_pre_ping=core_config.DATABASE_POOL_PRE_PING,
+    connect_timeout=core_config.DATABASE_CONNECT_TIMEOUT_SEC,
+)
+worker_state.register_after_fork("database engine", database.reset_after_fork)
+
+
+async def get_db() -> AsyncIterator[AsyncSession]:
+    """
+    Dependency providing an AsyncSession for the duration of a request. The session
+    only checks a connection out of the pool once it's first used and returns it when
+    the request finishes. Uncommitted changes are rolled back.
+    """
+    async with database.session_factory() as l_session:
+        yield l_session
@@ -4,10 +4,58 @@ This will typically be called by __main__.py's implicit instantiation or directl
 Alembic and Pytest.
 """
 from fastapi import FastAPI
+from fastapi import Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseSettings
 from webservices.api import api_router_v1
+from webservices.api.utils import FastJSONResponse
+from webservices.api.v1.routes.route_login import login_route
+from webservices.core.auth_cache import shared_auth_cache
 from webservices.core.config import core_config
+from webservices.core.discovery import discovery_document
+from webservices.core.discovery import jwks_document
+from webservices.core.hashing import hashing_pool
+from webservices.core.hashing import HashingPoolBusy
+from webservices.core.jwks import jwks_key_store
+from webservices.core.keycloak_async import keycloak_async_client
+from webservices.core.loadstats import InFlightMiddleware
+from webservices.core.loadstats import load_monitor
+from webservices.core.metrics import metrics_endpoint
+from webservices.core.metrics import MetricsMiddleware
+from webservices.core.ratelimit import rate_limited_response
+from webservices.core.ratelimit import rate_limiter
+from webservices.core.ratelimit import RateLimited
+from webservices.core.ratelimit import RateLimitMiddleware
+from webservices.core.tracing import tracer
+from webservices.core.tracing import TracingMiddleware
+from webservices.database.session import database
+
+
+async def hashing_pool_busy_handler(
+    request: Request, exc: HashingPoolBusy
+) -> JSONResponse:
+    """
+    Answer a request whose password hashing was rejected by the saturated pool
+    :param request: The rejected request
+    :param exc: The pool's rejection
+    :return: A 429 response telling the client when to retry
+    """
+    return JSONResponse(
+        {"detail": "Too many concurrent login attempts. Please retry shortly."},
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+async def rate_limited_handler(request: Request, exc: RateLimited) -> JSONResponse:
+    """
+    Answer a request rejected by a rate limit or upload admission
+    :param request: The rejected request
+    :param exc: The rejection
+    :return: A 429 response telling the client when to retry
+    """
+    return rate_limited_response(exc)
 
 
 def get_application(a_config: BaseSettings = core_config) -> FastAPI:
@@ -17,11 +65,40 @@ def get_application(a_config: BaseSettings = core_config) -> FastAPI:
     :return: An instantiated FastAPI instance
     """
 
-    _app = FastAPI(title=a_config.PROJECT_NAME, version=a_config.PROJECT_VERSION)
+    _app = FastAPI(
+        title=a_config.PROJECT_NAME,
+        version=a_config.PROJECT_VERSION,
+        default_response_class=FastJSONResponse,
+    )
     _app.include_router(api_router_v1)
+    _app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
 
-    # _app.add_event_handler("startup", some_task)
+    # Signing keys are fetched in the background so the worker serves right away
+    _app.add_event_handler("startup", jwks_key_store.start)
+    _app.add_event_handler("shutdown", jwks_key_store.stop)
+    # Documents polled by clients are fetched before the first asks for them
+    _app.add_event_handler("startup", discovery_document.start)
+    _app.add_event_handler("startup", jwks_document.start)
+    _app.add_event_handler("shutdown", discovery_document.stop)
+    _app.add_event_handler("shutdown", jwks_document.stop)
+    _app.add_event_handler("shutdown", keycloak_async_client.aclose)
+    # Tokens revoked by other workers are dropped from this worker's caches
+    _app.add_event_handler("startup", shared_auth_cache.start)
+    _app.add_event_handler("shutdown", shared_auth_cache.stop)
+    _app.add_event_handler("shutdown", database.dispose)
+    # Load reported to the gunicorn master when autoscaling
+    _app.add_event_handler("startup", load_monitor.start)
+    _app.add_event_handler("shutdown", load_monitor.stop)
+    # Export the traces still queued
+    _app.add_event_handler("shutdown", tracer.shutdown)
+    _app.add_event_handler("shutdown", hashing_pool.shutdown)
+    _app.add_exception_handler(HashingPoolBusy, hashing_pool_busy_handler)
+    _app.add_exception_handler(RateLimited, rate_limited_handler)
 
+    # Logins are limited per client IP before their form is read
+    _app.add_middleware(
+        RateLimitMiddleware, a_limiter=rate_limiter, a_paths={login_route: "login"}
+    )
     _app.add_middleware(
         CORSMiddleware,
         allow_origins=[str(origin) for origin in a_config.BACKEND_CORS_ORIGINS],
@@ -29,6 +106,10 @@ def get_application(a_config: BaseSettings = core_config) -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    _app.add_middleware(TracingMiddleware, a_tracer=tracer)
+    # Outermost so every request is counted and timed
+    _app.add_middleware(InFlightMiddleware, a_monitor=load_monitor)
+    _app.add_middleware(MetricsMiddleware)
 
     return _app
 
@@ -12,6 +12,8 @@ These schemas will generally be paired with
     Those routes will typically use these Pydantic schemas to document their input and
     output with clients and convert to and from the SQLAlchemy models.
 """
+from typing import Any
+from typing import Callable
 from typing import Optional
 
 from fastapi import HTTPException
@@ -19,6 +21,8 @@ from fastapi import status
 from pydantic import BaseModel as PydanticBaseModel
 from pydantic import conint
 from pydantic import constr
+from pydantic.json import pydantic_encoder
+from ujson import dumps as ujson_dumps
 from ujson import loads
 from webservices.core.security import sanitize_email
 
@@ -33,10 +37,36 @@ user_id_int = conint(ge=1)
 year_int = conint(gt=1900, lt=3000)
 
 
+def json_default(a_obj: Any) -> Any:
+    """
+    Convert what ujson can't encode natively (e.g. datetimes, UUIDs, enums, and nested
+    schemas) the way FastAPI's jsonable_encoder would
+    :param a_obj: An object ujson can't encode
+    :return: A JSON compatible equivalent
+    """
+    if isinstance(a_obj, PydanticBaseModel):
+        return a_obj.dict(by_alias=True)
+    return pydantic_encoder(a_obj)
+
+
+def dumps(a_obj: Any, *, default: Callable[[Any], Any] = json_default, **kwargs) -> str:
+    """
+    Encode JSON with ujson. Output matches the stdlib's compact encoding except that
+    non-ASCII characters aren't escaped, like Starlette's JSONResponse.
+    :param a_obj: The object to encode
+    :param default: Converts objects ujson can't encode
+    :param kwargs: Further ujson.dumps options
+    :return: The JSON string
+    """
+    kwargs.setdefault("ensure_ascii", False)
+    kwargs.setdefault("escape_forward_slashes", False)
+    return ujson_dumps(a_obj, default=default, **kwargs)
+
+
 class BaseModel(PydanticBaseModel):
     """
     Customized global version of the Pydantic BaseModel to leverage a more efficient
-    JSON parser.
+    JSON parser and encoder.
     """
 
     class Config:
@@ -45,8 +75,9 @@ class BaseModel(PydanticBaseModel):
         smooth conversion from SQLAlchemy ORM objects
         """
 
-        # use a more efficient JSON decoder
+        # use a more efficient JSON decoder and encoder
         json_loads = loads
+        json_dumps = dumps
         # allow .from_orm() with SQLAlchemy models
         orm_mode = True
         # Allow storing the actual value of an enumerated type instead of the Python
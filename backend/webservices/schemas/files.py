@@ -3,6 +3,7 @@ File ingest Pydantic Schemas
 """
 from datetime import datetime
 from typing import List
+from typing import Optional
 
 from pydantic.networks import EmailStr
 from webservices.schemas import BaseModel
@@ -16,11 +17,56 @@ class IngestFileResponse(BaseModel):
     timestamp: datetime
     filename: str
     user_email: EmailStr
+    # Size of the received file, number of non-blank lines, and time spent reading it
+    byte_count: int = 0
+    # Format of a compressed upload (gzip, xz, or zstd) and its size as received.
+    # byte_count and the line and frame counts are of the decompressed file.
+    content_encoding: Optional[str] = None
+    compressed_byte_count: Optional[int] = None
+    line_count: int = 0
+    elapsed_seconds: float = 0.0
+    # Parsed CAN frames and lines that weren't valid candump records. Only populated
+    # when the file was parsed inline; see job_id otherwise.
+    frame_count: int = 0
+    rejected_line_count: int = 0
+    # Background ingest job to poll at /v1/jobs/{job_id}
+    job_id: Optional[str] = None
+    # SHA-256 of the file's content and whether an identical file was already stored.
+    # Dedup hits aren't processed again; the frame counts are filled in if the job
+    # that processed the original finished. job_id refers to that job only if the same
+    # user uploaded the original, as only they can read it; others upload the file
+    # again once it's processed to get its counts.
+    digest: Optional[str] = None
+    dedup_hit: bool = False
+    # Capture holding the persisted frames in the can_frames table and the COPY
+    # throughput. Filled in like the frame counts when INGEST_PERSIST_FRAMES is set.
+    capture_id: Optional[int] = None
+    rows_per_second: Optional[float] = None
 
 
-class IngestFileRequest(IngestFileResponse):
+class UploadPartResponse(BaseModel):
     """
-    Expansion of the response to include the originating list of candump log strings
+    Response schema for a received part of a resumable upload
     """
 
-    data: List[str]
+    part_number: int
+    size: int
+
+
+class UploadSessionResponse(BaseModel):
+    """
+    Response schema for resumable upload sessions
+    """
+
+    session_id: str
+    filename: str
+    created_at: datetime
+    expires_at: datetime
+    # Bytes received contiguously from the start of the file. A client uploading parts
+    # sequentially resumes from here.
+    offset: int = 0
+    # Bytes received in all parts
+    byte_count: int = 0
+    parts: List[UploadPartResponse] = []
+    # Part numbers missing below the highest received part number
+    missing_parts: List[int] = []
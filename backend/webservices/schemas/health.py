@@ -0,0 +1,36 @@
+"""
+Service health Pydantic Schemas
+"""
+from typing import Optional
+
+from webservices.schemas import BaseModel
+
+
+class ReadinessStatus(BaseModel):
+    """
+    Response schema for the readiness of the answering worker process
+    """
+
+    pid: int
+    ready: bool
+    # Realm signing keys available to verify access tokens and their age
+    signing_key_count: int = 0
+    signing_keys_age_seconds: Optional[float] = None
+
+
+class DatabasePoolStatus(BaseModel):
+    """
+    Response schema for the database connection pool of the answering worker process
+    """
+
+    pid: int
+    reachable: bool
+    # Round trip of a trivial query including connection checkout
+    latency_ms: Optional[float] = None
+    pool_size: int
+    max_overflow: int
+    # Idle connections in the pool, connections in use, and connections opened beyond
+    # pool_size
+    checked_in: int
+    checked_out: int
+    overflow: int
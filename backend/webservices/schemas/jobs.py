@@ -0,0 +1,40 @@
+"""
+Background job Pydantic Schemas
+"""
+from typing import Dict
+from typing import Optional
+
+from pydantic.networks import EmailStr
+from webservices.schemas import BaseModel
+
+
+class IngestJobStatus(BaseModel):
+    """
+    Response schema for job status queries
+    """
+
+    job_id: str
+    # Celery task state: PENDING, STARTED, PROGRESS, SUCCESS, FAILURE, RETRY, REVOKED
+    state: str
+    ready: bool = False
+    # Running totals reported while the job is in the PROGRESS state
+    progress: Optional[Dict[str, int]] = None
+
+
+class IngestJobResult(BaseModel):
+    """
+    Response schema for a finished ingest job
+    """
+
+    job_id: str
+    digest: str
+    filename: str
+    user_email: EmailStr
+    byte_count: int
+    line_count: int
+    frame_count: int
+    rejected_line_count: int
+    elapsed_seconds: float
+    # Set when the frames were persisted in the can_frames table
+    capture_id: Optional[int] = None
+    rows_per_second: Optional[float] = None
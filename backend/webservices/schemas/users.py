@@ -1,9 +1,10 @@
 """
 User Pydantic Schemas
 """
+from typing import Optional
+
 from pydantic import EmailStr
 from pydantic import validator
-from webservices.core.hashing import Hasher
 from webservices.schemas import BaseModel
 from webservices.schemas import render_safe_email
 from webservices.schemas import username_str
@@ -15,10 +16,9 @@ class UserLoginSchema(BaseModel):
     """
 
     username: username_str
+    # Plaintext; hash it with Hasher.get_password_hash_async where it's needed
     password: str
 
-    _hash_pass = validator("password", allow_reuse=True)(Hasher.get_password_hash)
-
 
 class UserCreateUpdateSchema(UserLoginSchema):
     """
@@ -51,7 +51,8 @@ class UserSchema(BaseModel):
     Generic User schema for conveying details about users less sensitive info
     """
 
-    id: int = 1
+    # ID in the users table; None if the database couldn't be reached
+    id: Optional[int] = None
     username: username_str
     email: EmailStr
     is_active: bool = True
@@ -0,0 +1,6 @@
+"""
+Celery application and background tasks.
+
+Start a worker node with:
+    celery -A webservices.worker.celery_app worker --loglevel=INFO
+"""
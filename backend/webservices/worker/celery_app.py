@@ -0,0 +1,33 @@
+"""
+Celery application instance shared by the API (to enqueue jobs) and worker nodes (to
+execute them).
+"""
+from celery import Celery
+from webservices.core.config import core_config
+
+celery_app = Celery(
+    "webservices",
+    broker=str(core_config.CELERY_BROKER_URL),
+    backend=str(core_config.CELERY_RESULT_BACKEND),
+    include=["webservices.worker.tasks"],
+)
+
+celery_app.conf.update(
+    task_serializer="json",
+    result_serializer="json",
+    accept_content=["json"],
+    # Report STARTED so clients can tell queued jobs from running ones
+    task_track_started=True,
+    # Ingest jobs are long running; only reserve one at a time and re-deliver a job if
+    # the worker dies before finishing it
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    result_expires=core_config.CELERY_RESULT_EXPIRE_SEC,
+    # Store each task's arguments with its state so the API can tell who owns a job
+    result_extended=True,
+    # Keep the dictConfig logging set up in webservices.core.config
+    worker_hijack_root_logger=False,
+)
+if core_config.celery_concurrency_count:
+    celery_app.conf.worker_concurrency = core_config.celery_concurrency_count
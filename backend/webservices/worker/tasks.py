@@ -0,0 +1,112 @@
+"""
+Celery tasks executed on worker nodes
+"""
+from functools import partial
+from pathlib import Path
+from time import perf_counter
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+from celery import Task
+from celery.result import AsyncResult
+from webservices.core.blobstore import content_store
+from webservices.core.candump import CandumpParser
+from webservices.core.candump import CanFrameBatch
+from webservices.core.config import core_config
+from webservices.core.config import core_logger as logger
+from webservices.database import repository
+from webservices.database.frames import FrameCopyStats
+from webservices.worker.celery_app import celery_app
+
+# Report progress to the result backend at most once per this many parsed batches
+PROGRESS_BATCH_INTERVAL: int = 8
+
+
+@celery_app.task(bind=True, name="webservices.ingest_stored_file")
+def ingest_stored_file(
+    self: Task, a_digest: str, a_filename: str, a_user_email: str
+) -> Dict[str, Any]:
+    """
+    Parse a candump upload from the content store into columnar frame batches and,
+    with INGEST_PERSIST_FRAMES, copy them into the can_frames table. The result is
+    also saved in the file's content store record so later uploads of the same file
+    can report it without processing the file again.
+    :param a_digest: The file's content digest in the content store
+    :param a_filename: The file's original name
+    :param a_user_email: Email of the uploading user
+    :return: Summary of the parsed file (see schemas.jobs.IngestJobResult)
+    """
+    l_path: Path = content_store.path_for(a_digest)
+    l_parser: CandumpParser = CandumpParser.from_config(core_config)
+    l_counts: Dict[str, int] = {"frame_count": 0, "rejected_line_count": 0}
+    l_copy_stats: Optional[FrameCopyStats] = None
+
+    def _counted(a_batches: Iterable[CanFrameBatch]) -> Iterator[CanFrameBatch]:
+        for l_index, l_batch in enumerate(a_batches, start=1):
+            l_counts["frame_count"] += len(l_batch)
+            l_counts["rejected_line_count"] += l_batch.rejected
+            if l_index % PROGRESS_BATCH_INTERVAL == 0:
+                self.update_state(state="PROGRESS", meta=dict(l_counts))
+            yield l_batch
+
+    l_start: float = perf_counter()
+    try:
+        with open(l_path, "rb") as l_file:
+            l_chunks = iter(
+                partial(l_file.read, core_config.INGEST_CHUNK_SIZE_BYTES), b""
+            )
+            l_batches = _counted(l_parser.parse_chunks(l_chunks))
+            if core_config.INGEST_PERSIST_FRAMES:
+                l_copy_stats = repository.copy_can_frames(l_batches, a_digest)
+            else:
+                for _ in l_batches:
+                    pass
+    except Exception:
+        # Let the next upload of this file process it again instead of deduplicating
+        # it against a failed job
+        content_store.discard(a_digest)
+        raise
+    l_elapsed: float = perf_counter() - l_start
+    l_frame_count: int = l_counts["frame_count"]
+    l_rejected_count: int = l_counts["rejected_line_count"]
+    l_result: Dict[str, Any] = {
+        "digest": a_digest,
+        "filename": a_filename,
+        "user_email": a_user_email,
+        "byte_count": l_path.stat().st_size,
+        "line_count": l_frame_count + l_rejected_count,
+        "frame_count": l_frame_count,
+        "rejected_line_count": l_rejected_count,
+        "elapsed_seconds": l_elapsed,
+    }
+    if l_copy_stats is not None:
+        l_result["capture_id"] = l_copy_stats.capture_id
+        l_result["rows_per_second"] = l_copy_stats.rows_per_second
+    content_store.write_record(
+        a_digest,
+        {"job_id": self.request.id, "user_email": a_user_email, "result": l_result},
+    )
+    logger.info(
+        f"Ingested {a_filename} ({a_digest}) for {a_user_email}: {l_frame_count} "
+        f"frames, {l_rejected_count} rejected lines in {l_elapsed:.3f}s. "
+        f"capture_id: {l_result.get('capture_id')}"
+    )
+    return l_result
+
+
+def job_owner(a_result: AsyncResult) -> Optional[str]:
+    """
+    :param a_result: An ingest job
+    :return: Email of the user who queued the job; None if it hasn't recorded any
+        state yet (i.e. is PENDING)
+    """
+    l_args: Optional[List[Any]] = a_result.args
+    if l_args is not None and len(l_args) == 3:
+        return l_args[2]
+    # Stored before arguments were kept with the state
+    l_value: Any = a_result.result if a_result.successful() else None
+    return l_value.get("user_email") if isinstance(l_value, dict) else None
@@ -178,7 +178,6 @@ KC_HTTPS_TRUST_STORE_PASSWORD=${KC_HTTPS_TRUST_STORE_PASSWORD:-$RANDOM_STRING}
 rando_string
 KEYCLOAK_CLIENT_SECRET_KEY=${KEYCLOAK_CLIENT_SECRET_KEY:-$RANDOM_STRING}
 KEYCLOAK_LOGIN_WAIT_SEC=3
-KEYCLOAK_LOGIN_RETRY_COUNT=10
 KC_PROXY="passthrough"
 
 BACKEND_CORS_ORIGINS="[\
@@ -251,9 +250,8 @@ else
     echo "BACKEND_CORS_ORIGINS=${BACKEND_CORS_ORIGINS}";
     echo "BACKEND_CORS_ORIGINS_TRAEFIK=${BACKEND_CORS_ORIGINS_TRAEFIK}";
     echo "SECRET_KEY=${SECRET_KEY:-$RANDOM_SECRET_STR}";
-    echo "# These variables control the keycloak connection timeout and retry behavior of the /backend services";
+    echo "# Seconds between attempts to fetch the realm signing keys while keycloak is unreachable";
     echo "KEYCLOAK_LOGIN_WAIT_SEC=${KEYCLOAK_LOGIN_WAIT_SEC:-$KEYCLOAK_LOGIN_WAIT_SEC}";
-    echo "KEYCLOAK_LOGIN_RETRY_COUNT=${KEYCLOAK_LOGIN_RETRY_COUNT:-$KEYCLOAK_LOGIN_RETRY_COUNT}";
     echo "# SQLAlchemy 2.0 migration specific warning flag";
     echo "# remove once SQLAlchemy is officially updated to 2.0";
     echo "SQLALCHEMY_WARN_20=1";
@@ -355,9 +353,8 @@ else
     echo "BACKEND_CORS_ORIGINS=${BACKEND_CORS_ORIGINS}";
     echo "BACKEND_CORS_ORIGINS_TRAEFIK=${BACKEND_CORS_ORIGINS_TRAEFIK}";
     echo "SECRET_KEY=${SECRET_KEY:-$RANDOM_SECRET_STR}";
-    echo "# These variables control the keycloak connection timeout and retry behavior of the /backend services";
+    echo "# Seconds between attempts to fetch the realm signing keys while keycloak is unreachable";
     echo "KEYCLOAK_LOGIN_WAIT_SEC=${KEYCLOAK_LOGIN_WAIT_SEC:-$KEYCLOAK_LOGIN_WAIT_SEC}";
-    echo "KEYCLOAK_LOGIN_RETRY_COUNT=${KEYCLOAK_LOGIN_RETRY_COUNT:-$KEYCLOAK_LOGIN_RETRY_COUNT}";
     echo "# SQLAlchemy 2.0 migration specific warning flag";
     echo "# remove once SQLAlchemy is officially updated to 2.0";
     echo "SQLALCHEMY_WARN_20=1";